@@ -0,0 +1,71 @@
+"""
+Microbenchmark for batched LLM generation in the sampler.
+
+Compares `LLM_model.draw_batch_samples` with one `generate` call per sample (the former loop,
+`batched_generation=False`) against a single call in which each prompt is prefilled once and its
+KV cache is shared by its samples (`batched_generation=True`). No checkpoint is downloaded: the
+model is a small randomly initialized StarCoder2 on CPU with a byte-level tokenizer, and prompts are
+cut from the Deletions specification.
+
+Sampling with top_k=1 (deterministic, but through the sampling path with the shared prompt prefill)
+is run first to check that both paths return the same samples, grouping and token counts; the
+timings use the sampler's sampling parameters as in a FunSearch run.
+
+Usage:
+    python benchmarks/bench_batched_generation.py [prompts_per_batch] [max_new_tokens]
+"""
+
+import os
+import sys
+import time
+
+from bench_common import SPEC_PATH, make_llm, make_model, make_tokenizer
+
+import torch
+from transformers.utils import logging as transformers_logging
+
+
+def make_prompts(num_prompts):
+    """Prompts of different lengths (so the batch is left-padded) from the specification."""
+    with open(SPEC_PATH) as f:
+        spec = f.read()
+    return [spec[:600 + 80 * i] for i in range(num_prompts)]
+
+
+def main():
+    prompts_per_batch = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    max_new_tokens = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    torch.manual_seed(0)
+    transformers_logging.set_verbosity_error()
+    torch.set_num_threads(os.cpu_count() or 1)
+
+    tokenizer = make_tokenizer()
+    model = make_model(tokenizer)
+    prompts = make_prompts(prompts_per_batch)
+
+    # Deterministic sampling: both paths must agree exactly
+    loop = make_llm(tokenizer, model, 3, max_new_tokens, batched_generation=False)
+    batched = make_llm(tokenizer, model, 3, max_new_tokens, batched_generation=True)
+    for llm in (loop, batched):
+        llm.generate_kwargs["top_k"] = 1
+    assert loop.draw_batch_samples(prompts, temperature_period=None) == batched.draw_batch_samples(
+        prompts, temperature_period=None)
+
+    print(f"prompts_per_batch={prompts_per_batch}, max_new_tokens={max_new_tokens}, "
+          f"prompt tokens={max(len(tokenizer(p).input_ids) for p in prompts)}")
+    print(f"{'samples/prompt':>14} {'loop s/batch':>13} {'batched s/batch':>16} {'speedup':>8}")
+    for samples_per_prompt in (2, 4, 8):
+        times = {}
+        for batched_generation in (False, True):
+            llm = make_llm(tokenizer, model, samples_per_prompt, max_new_tokens, batched_generation)
+            llm.draw_batch_samples(prompts[:1], temperature_period=None)  # warm-up
+            start = time.perf_counter()
+            samples, input_counts, output_counts = llm.draw_batch_samples(prompts, temperature_period=None)
+            times[batched_generation] = time.perf_counter() - start
+            assert len(samples) == prompts_per_batch and all(len(s) == samples_per_prompt for s in samples)
+            assert [len(c) for c in output_counts] == [samples_per_prompt] * prompts_per_batch
+        print(f"{samples_per_prompt:>14} {times[False]:>13.2f} {times[True]:>16.2f} {times[False] / times[True]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Event-loop stall of checkpointing the ProgramsDatabase, full versus incremental (`checkpoint_log`).
+
+Fills `num_islands` islands with `num_programs` programs in total (registered through
+`_register_program_in_island` as the database does) and times:
+
+* `full`: what the hourly checkpoint used to do on the event loop, `serialize_checkpoint()` (every
+  program converted by `to_dict`) and pickling the result
+* `capture`: what a snapshot now does on the event loop (`_capture_checkpoint`); converting and
+  pickling run on a thread
+* `append`: writing the changes of `appended` further registrations to the checkpoint log
+  (`CheckpointLog.write`, on a thread in a run)
+* `load`: loading the snapshot and replaying its log into a new database, and whether the result
+  equals the live database
+
+Usage:
+    python benchmarks/bench_checkpoint.py [num_programs] [num_islands] [appended]
+"""
+
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bench_common import SPEC_PATH
+
+from bench_cluster_sampling import database_config
+from disfun import checkpoint_log, code_manipulation, programs_database
+
+
+def make_database(num_islands, checkpoint_file=None):
+    with open(SPEC_PATH) as f:
+        template = code_manipulation.text_to_program(f.read(), remove_classes=True)
+    config = database_config()
+    config.num_islands = num_islands
+    return programs_database.ProgramsDatabase(
+        None, None, None, None, None, config, template, "priority", checkpoint_file=checkpoint_file,
+        mode="last", start_n=[6], end_n=[7], s_values=[1],
+    )
+
+
+def register(database, rng, first, count):
+    priority = database._template.get_function("priority")
+    for k in range(first, first + count):
+        scores = {"(6, 1, 2)": float(k % 7), "(7, 1, 2)": float(rng.normal(10, 1.5))}
+        body = priority.body.rstrip() + f"\n    return {rng.random():.6f} * G.degree(node)  # program {k}\n"
+        function = code_manipulation.Function(name="priority", args=priority.args, body=body,
+                                              return_type=priority.return_type, docstring=priority.docstring)
+        database._register_program_in_island(function, k % len(database._islands), scores, hash_value=k)
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, 1e3 * (time.perf_counter() - start)
+
+
+def main():
+    args = sys.argv[1:]
+    num_programs = int(args[0]) if len(args) > 0 else 20_000
+    num_islands = int(args[1]) if len(args) > 1 else 10
+    appended = int(args[2]) if len(args) > 2 else 1_000
+    logging.getLogger('main_logger').setLevel(logging.CRITICAL)
+    rng = np.random.default_rng(0)
+
+    database = make_database(num_islands)
+    register(database, rng, 0, num_programs)
+
+    _, full_ms = timed(lambda: pickle.dumps(database.serialize_checkpoint()))
+    captured, capture_ms = timed(database._capture_checkpoint)
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_file = os.path.join(directory, "checkpoint_bench.pkl")
+        checkpoint_log.write_snapshot(snapshot_file, database._convert_checkpoint_programs(captured))
+        database._checkpoint_log = checkpoint_log.CheckpointLog(checkpoint_log.log_file_of(snapshot_file))
+        register(database, rng, num_programs, appended)
+        log = database._checkpoint_log
+        _, append_ms = timed(lambda: log.write(log.take(), database.checkpoint_state()))
+
+        loaded, load_ms = timed(lambda: make_database(num_islands, checkpoint_file=snapshot_file))
+        expected, actual = database.serialize_checkpoint(), loaded.serialize_checkpoint()
+        expected.pop("last_reset_time"), actual.pop("last_reset_time")
+        size_mb = (os.path.getsize(snapshot_file) + database._checkpoint_log.bytes_written) / 2**20
+
+    print(f"{num_programs} programs in {num_islands} islands, {appended} appended, checkpoint {size_mb:.1f} MB")
+    print(f"{'step':>8} {'ms':>10}")
+    for step, ms in (("full", full_ms), ("capture", capture_ms), ("append", append_ms), ("load", load_ms)):
+        print(f"{step:>8} {ms:>10,.1f}")
+    print(f"event-loop stall: {full_ms / capture_ms:.0f}x shorter, loaded state equal: {expected == actual}")
+
+
+if __name__ == "__main__":
+    main()
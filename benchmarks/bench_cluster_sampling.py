@@ -0,0 +1,91 @@
+"""
+Latency of prompt sampling in the ProgramsDatabase as islands grow to thousands of clusters.
+
+Fills one island with `num_clusters` clusters (distinct score signatures) of
+`programs_per_cluster` programs each, registered through `_register_program_in_island` as the
+database does, and then times per prompt (median and p99 over `num_prompts` prompts):
+
+* `sample`: choosing `functions_per_prompt` clusters by the tempered softmax of their scores and
+  one program from each (`_sample_programs_for_island`)
+* `prompt`: the same plus rendering the prompt (`_generate_prompt_for_island`)
+
+The cluster scores of an island and the program lengths of a cluster are kept as numpy arrays
+that grow on registration, so `sample` should stay roughly flat as the island grows.
+
+Usage:
+    python benchmarks/bench_cluster_sampling.py [num_prompts] [programs_per_cluster] [cluster counts, e.g. 10,100,1000,5000]
+"""
+
+import logging
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from bench_common import SPEC_PATH
+
+from disfun import code_manipulation, programs_database
+
+
+def database_config():
+    return SimpleNamespace(
+        prompts_per_batch=10,
+        num_islands=1,
+        functions_per_prompt=2,
+        reset_period=None,
+        reset_programs=10**12,
+        cluster_sampling_temperature_init=0.1,
+        cluster_sampling_temperature_period=30_000,
+        no_deduplication=False,
+        save_lineage=False,
+    )
+
+
+def make_database(num_clusters, programs_per_cluster, seed=0):
+    with open(SPEC_PATH) as f:
+        template = code_manipulation.text_to_program(f.read(), remove_classes=True)
+    database = programs_database.ProgramsDatabase(
+        None, None, None, None, None, database_config(), template, "priority",
+        mode="last", start_n=[6], end_n=[7], s_values=[1],
+    )
+    rng = np.random.default_rng(seed)
+    for cluster in range(num_clusters):
+        # Scores spread like those of a real run: most clusters close to the best ones
+        scores = {"(6, 1, 2)": float(cluster % 7), "(7, 1, 2)": float(rng.normal(10, 1.5)) + cluster * 1e-6}
+        for i in range(programs_per_cluster):
+            body = f"    degree = G.degree(node)\n    return {rng.random():.6f} * degree{' + 1' * i}\n"
+            function = code_manipulation.Function(name="priority", args="node, G", body=body)
+            database._register_program_in_island(function, 0, scores, hash_value=cluster * programs_per_cluster + i)
+    return database
+
+
+def time_calls(function, num_calls):
+    times = []
+    for _ in range(num_calls):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return 1e6 * times[len(times) // 2], 1e6 * times[int(0.99 * (len(times) - 1))]
+
+
+def main():
+    args = sys.argv[1:]
+    num_prompts = int(args[0]) if len(args) > 0 else 500
+    programs_per_cluster = int(args[1]) if len(args) > 1 else 3
+    cluster_counts = [int(count) for count in args[2].split(",")] if len(args) > 2 else [10, 100, 1000, 5000]
+    logging.getLogger('main_logger').setLevel(logging.CRITICAL)
+
+    print(f"{num_prompts} prompts per island size, {programs_per_cluster} programs per cluster")
+    print(f"{'clusters':>9} {'sample p50 us':>14} {'sample p99 us':>14} {'prompt p50 us':>14} {'prompt p99 us':>14}")
+    for num_clusters in cluster_counts:
+        database = make_database(num_clusters, programs_per_cluster)
+        island = database._islands[0]
+        sample = time_calls(lambda: database._sample_programs_for_island(island), num_prompts)
+        prompt = time_calls(lambda: database._generate_prompt_for_island(island), num_prompts)
+        print(f"{num_clusters:>9} {sample[0]:>14,.1f} {sample[1]:>14,.1f} {prompt[0]:>14,.1f} {prompt[1]:>14,.1f}")
+
+
+if __name__ == "__main__":
+    main()
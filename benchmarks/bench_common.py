@@ -0,0 +1,81 @@
+"""
+Setup shared by the benchmarks.
+
+Importing this module puts `src` on `sys.path`, so import it before `disfun`. It provides the
+Deletions specification most benchmarks build their programs and prompts from, and, for the
+sampler benchmarks, the small randomly initialized StarCoder2 on CPU with a byte-level tokenizer
+(no checkpoint is downloaded). torch and transformers are imported by the functions that need
+them, so the other benchmarks do not load them.
+"""
+
+import os
+import sys
+import threading
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+SPEC_PATH = os.path.join(SRC_DIR, "disfun", "specifications", "Deletions", "StarCoder2", "load_graph", "baseline.txt")
+
+
+def make_tokenizer():
+    """Byte-level tokenizer without merges (one token per byte) and an EOS token."""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {symbol: i for i, symbol in enumerate(pre_tokenizers.ByteLevel.alphabet())}
+    vocab["<eos>"] = len(vocab)
+    tokenizer = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<eos>", pad_token="<eos>")
+
+
+def make_model(tokenizer, logit_bias: dict = None):
+    """
+    Small randomly initialized StarCoder2 (4 layers, hidden size 256) for `tokenizer`, in eval
+    mode. `logit_bias` maps token ids to a constant added to their logits.
+    """
+    import torch
+    from transformers import Starcoder2Config, Starcoder2ForCausalLM
+
+    config = Starcoder2Config(vocab_size=len(tokenizer), hidden_size=256, intermediate_size=1024, num_hidden_layers=4,
+                              num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=4096,
+                              bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id)
+    model = Starcoder2ForCausalLM(config).eval()
+    if logit_bias:
+        bias = torch.zeros(len(tokenizer))
+        for token_id, value in logit_bias.items():
+            bias[token_id] = value
+        model.lm_head.bias = torch.nn.Parameter(bias, requires_grad=False)
+    return model
+
+
+def make_llm(tokenizer, model, samples_per_prompt, max_new_tokens, batched_generation, prefix_caching=False,
+             stop_at_function_end=False):
+    """LLM_model around the given model and tokenizer, with the sampler's default generation parameters."""
+    from disfun import sampler
+    from disfun.early_stopping import TokenTexts
+    from disfun.prefix_cache import PrefixKVCache
+
+    llm = sampler.LLM_model.__new__(sampler.LLM_model)
+    llm.gpu_time = 0.0
+    llm._samples_per_prompt = samples_per_prompt
+    llm.batched_generation = batched_generation
+    llm.temperature, llm.top_p, llm.repetition_penalty = 0.944, 0.778, 1.222
+    llm.max_new_tokens = max_new_tokens
+    llm.previous_total_registered_programs = 0
+    llm.tokenizer, llm.model = tokenizer, model
+    llm.tokenizer_lock = threading.Lock()
+    llm.prefix_cache = PrefixKVCache(model) if prefix_caching else None
+    llm.token_texts = TokenTexts(tokenizer, llm.tokenizer_lock) if stop_at_function_end else None
+    llm.stopped_sequences = llm.saved_tokens = 0
+    llm.generate_kwargs = {
+        "temperature": llm.temperature,
+        "max_new_tokens": max_new_tokens,
+        "top_p": llm.top_p,
+        "repetition_penalty": llm.repetition_penalty,
+        "do_sample": True,
+    }
+    return llm
@@ -0,0 +1,80 @@
+"""
+Benchmark of continuous batching against the static batches of the sampler.
+
+Generates `samples_per_prompt` samples for a fixed set of prompts with
+    - static: `LLM_model.draw_batch_samples` on consecutive batches of `prompts_per_batch` prompts,
+      every batch running until its longest completion is done
+    - continuous: `ContinuousBatchingEngine` with `prompts_per_batch * samples_per_prompt` rows,
+      admitting prompts as rows free up
+and reports wall time, samples/sec and tokens/sec for both, plus the GPU-idle fraction of the
+engine. Static tokens are counted as the sampler reports them (padded to the longest completion
+of each batch), continuous tokens as generated.
+
+The model is the small randomly initialized StarCoder2 of bench_common.py on CPU, with
+a bias on the EOS logit so that completion lengths vary as they do for a real model.
+
+Usage:
+    python benchmarks/bench_continuous_batching.py [num_prompts] [max_new_tokens]
+"""
+
+import os
+import sys
+import time
+
+from bench_common import make_llm, make_model, make_tokenizer
+
+import torch
+from transformers.utils import logging as transformers_logging
+
+from bench_batched_generation import make_prompts
+from disfun.continuous_batching import ContinuousBatchingEngine, GenerationRequest
+
+PROMPTS_PER_BATCH = 4
+SAMPLES_PER_PROMPT = 2
+EOS_LOGIT_BIAS = 2.0
+
+
+def main():
+    num_prompts = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    max_new_tokens = int(sys.argv[2]) if len(sys.argv) > 2 else 96
+    torch.manual_seed(0)
+    transformers_logging.set_verbosity_error()
+    torch.set_num_threads(os.cpu_count() or 1)
+
+    tokenizer = make_tokenizer()
+    model = make_model(tokenizer, logit_bias={tokenizer.eos_token_id: EOS_LOGIT_BIAS})
+    base_prompts = make_prompts(PROMPTS_PER_BATCH)
+    prompts = [base_prompts[i % len(base_prompts)][:120 + 7 * i] for i in range(num_prompts)]
+
+    # Static batches as in Sampler.consume_and_process
+    llm = make_llm(tokenizer, model, SAMPLES_PER_PROMPT, max_new_tokens, batched_generation=True)
+    llm.draw_batch_samples(prompts[:1], temperature_period=None)  # warm-up
+    start = time.perf_counter()
+    static_tokens = static_samples = 0
+    for i in range(0, num_prompts, PROMPTS_PER_BATCH):
+        samples, _, output_token_counts = llm.draw_batch_samples(prompts[i:i + PROMPTS_PER_BATCH], temperature_period=None)
+        static_samples += sum(len(s) for s in samples)
+        static_tokens += sum(sum(counts) for counts in output_token_counts)
+    static_time = time.perf_counter() - start
+
+    # Continuous batching with the same number of rows
+    engine = ContinuousBatchingEngine(model, tokenizer.eos_token_id, max_batch_size=PROMPTS_PER_BATCH * SAMPLES_PER_PROMPT,
+                                      max_new_tokens=max_new_tokens)
+    for i, prompt in enumerate(prompts):
+        engine.add_request(GenerationRequest(i, tokenizer(prompt).input_ids, SAMPLES_PER_PROMPT, llm.generate_kwargs))
+    finished = engine.run_until_complete()
+    stats = engine.stats()
+    assert len(finished) == num_prompts
+    lengths = [len(sample) for request in finished for sample in request.samples]
+
+    print(f"prompts={num_prompts}, samples_per_prompt={SAMPLES_PER_PROMPT}, prompts_per_batch={PROMPTS_PER_BATCH}, "
+          f"max_new_tokens={max_new_tokens}")
+    print(f"completion length: mean {sum(lengths) / len(lengths):.1f}, min {min(lengths)}, max {max(lengths)}")
+    print(f"{'':>11} {'wall s':>7} {'samples/s':>10} {'tokens/s':>9} {'GPU idle':>9}")
+    print(f"{'static':>11} {static_time:>7.2f} {static_samples / static_time:>10.2f} {static_tokens / static_time:>9.1f} {'-':>9}")
+    print(f"{'continuous':>11} {stats['elapsed']:>7.2f} {len(lengths) / stats['elapsed']:>10.2f} "
+          f"{stats['tokens_per_sec']:>9.1f} {stats['gpu_idle_fraction']:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Prompt throughput of the ProgramsDatabase with its islands partitioned across database shards.
+
+Starts `num_shards` ProgramsDatabase shards (`num_pdb`) in their own processes, connected through
+`LocalTransport`. The main process plays the evaluators: it publishes the initial program (to
+every shard) and then `num_results` evaluated programs with random scores for random islands,
+each routed to the queue of the shard that owns the island, and counts the prompts the shards
+publish to `sampler_queue` in response (one per result; one in ten results is a duplicate that
+is discarded but still answered with a prompt). Reports prompts/sec from the first result to the
+last prompt, for 1, 2 and 4 shards by default.
+
+Each shard registers, clusters and prompts for its own islands in its own event loop, so the
+throughput scales with the number of shards as long as there are free cores (`os.cpu_count()`
+is printed; with one core the shards only take turns).
+
+Usage:
+    python benchmarks/bench_database_shards.py [num_results] [num_islands] [shard counts, e.g. 1,2,4]
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+from bench_common import SPEC_PATH
+
+from disfun import code_manipulation, database_shards, message_codec, programs_database
+from disfun.transport import LocalTransport
+
+INPUTS = [(6, 1, 2), (7, 1, 2)]
+
+
+def database_config(num_islands):
+    return SimpleNamespace(
+        prompts_per_batch=10,
+        num_islands=num_islands,
+        functions_per_prompt=2,
+        reset_period=None,
+        reset_programs=10**12,  # Never reset during the benchmark
+        cluster_sampling_temperature_init=0.1,
+        cluster_sampling_temperature_period=30_000,
+        no_deduplication=False,
+        save_lineage=False,
+    )
+
+
+def load_template():
+    with open(SPEC_PATH) as f:
+        return code_manipulation.text_to_program(f.read(), remove_classes=True)
+
+
+async def run_shard(transport, shard_id, num_shards, num_islands, ready):
+    connection = await transport.connect()
+    channel = await connection.channel()
+    queues = {name: await transport.declare_queue(channel, name)
+              for name in (database_shards.shard_queue_name(shard_id, num_shards), "sampler_queue", "evaluator_queue")}
+    database = programs_database.ProgramsDatabase(
+        connection, channel, queues[database_shards.shard_queue_name(shard_id, num_shards)],
+        queues["sampler_queue"], queues["evaluator_queue"], database_config(num_islands), load_template(), "priority",
+        mode="last", start_n=[INPUTS[0][0]], end_n=[INPUTS[-1][0]], s_values=[1], shard_id=shard_id, num_shards=num_shards,
+    )
+    ready.set()
+    await database.consume_and_process()
+
+
+def shard_process(transport, shard_id, num_shards, num_islands, ready):
+    logging.getLogger('main_logger').setLevel(logging.CRITICAL)
+    asyncio.run(run_shard(transport, shard_id, num_shards, num_islands, ready))
+
+
+def make_results(template, num_results, num_islands, seed=0):
+    rng = random.Random(seed)
+    body = template.get_function("priority").body
+    initial = {"new_function": code_manipulation.Function(name="priority", args="node, G", body=body).serialize(),
+               "island_id": None, "scores_per_test": {str(key): 1.0 for key in INPUTS}, "expected_version": 0,
+               "hash_value": 0, "parent_ids": []}
+    results = []
+    for i in range(num_results):
+        function = code_manipulation.Function(
+            name="priority", args="node, G", body=f"    return {rng.random():.6f} * len(G)  # {i}\n")
+        results.append({
+            "new_function": function.serialize(),
+            "island_id": rng.randrange(num_islands),
+            "scores_per_test": {str(key): float(rng.randint(1, 12)) for key in INPUTS},
+            "expected_version": 0,
+            # One in ten results repeats the output of an earlier program and is discarded as duplicate
+            "hash_value": rng.randrange(i) if i and rng.random() < 0.1 else i + 1,
+            "parent_ids": [],
+        })
+    return initial, results
+
+
+async def measure(num_shards, num_results, num_islands):
+    transport = LocalTransport(queue_names=("sampler_queue", "evaluator_queue")
+                               + database_shards.database_queue_names(num_shards))
+    codec = message_codec.MessageCodec()
+    ctx = multiprocessing.get_context("spawn")
+    events, procs = [], []
+    for shard_id in range(num_shards):
+        ready = ctx.Event()
+        proc = ctx.Process(target=shard_process, args=(transport, shard_id, num_shards, num_islands, ready))
+        proc.start()
+        events.append(ready)
+        procs.append(proc)
+    for ready in events:
+        await asyncio.to_thread(ready.wait)
+
+    connection = await transport.connect()
+    channel = await connection.channel()
+    sampler_queue = await transport.declare_queue(channel, "sampler_queue")
+    initial, results = make_results(load_template(), num_results, num_islands)
+
+    async def publish(result):
+        for routing_key in database_shards.routing_keys(result["island_id"], num_shards):
+            await channel.default_exchange.publish(codec.message(result), routing_key=routing_key)
+
+    async with sampler_queue.iterator() as stream:
+        prompts = stream.__aiter__()
+        await publish(initial)
+        for _ in range(num_shards):
+            async with (await prompts.__anext__()).process():
+                pass
+
+        start = time.perf_counter()
+        for result in results:
+            await publish(result)
+        for _ in range(num_results):
+            async with (await prompts.__anext__()).process():
+                pass
+        elapsed = time.perf_counter() - start
+
+    for proc in procs:
+        proc.terminate()
+        await asyncio.to_thread(proc.join, 10)
+    await connection.close()
+    return num_results / elapsed
+
+
+def main():
+    args = sys.argv[1:]
+    num_results = int(args[0]) if len(args) > 0 else 3000
+    num_islands = int(args[1]) if len(args) > 1 else 8
+    shard_counts = [int(count) for count in args[2].split(",")] if len(args) > 2 else [1, 2, 4]
+
+    print(f"{num_results} results over {num_islands} islands, {os.cpu_count()} CPU core(s)")
+    print(f"{'shards':>7} {'prompts/sec':>12} {'speedup':>8}")
+    baseline = None
+    for num_shards in shard_counts:
+        rate = asyncio.run(measure(num_shards, num_results, num_islands))
+        baseline = baseline or rate
+        print(f"{num_shards:>7} {rate:>12,.0f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark of stopping generation at the end of the evolved function body.
+
+1. Completions: for every function of the specifications, the text after its `def` line up to the
+   end of the file stands in for a completion that writes the body and then goes on with more
+   top-level code. It is fed token by token to `FunctionBodyEnd`, and the text up to the stop must
+   give the same `evaluator._trim_function_body` result as the full completion. Reports the tokens
+   generated with and without stopping (capped at max_new_tokens).
+2. Model: `LLM_model.draw_batch_samples` with and without `stop_at_function_end` on the small
+   random StarCoder2 of bench_common.py, with a bias towards spaces and newlines.
+   Sampling uses the same seed for both runs (stopped rows keep drawing tokens, which are replaced
+   by padding), so stopped samples must be prefixes of the full ones. The random samples are not
+   code, so their trimmed bodies are not compared. Reports wall time and the saved-tokens metric.
+
+Usage:
+    python benchmarks/bench_early_stopping.py [max_new_tokens]
+"""
+
+import glob
+import os
+import re
+import sys
+import time
+
+from bench_common import SRC_DIR, make_llm, make_model, make_tokenizer
+
+import torch
+from transformers.utils import logging as transformers_logging
+
+from bench_prefix_cache import make_prompts
+from disfun.early_stopping import FunctionBodyEnd, TokenTexts
+from disfun.evaluator import _trim_function_body
+
+# Byte-level symbols of " " and "\n"
+WHITESPACE_LOGIT_BIAS = {"\u0120": 3.0, "\u010a": 1.5}
+SPEC_GLOB = os.path.join(SRC_DIR, "disfun", "specifications", "*", "*", "*", "*.txt")
+
+
+def make_completions():
+    completions = []
+    for path in sorted(glob.glob(SPEC_GLOB)):
+        with open(path) as f:
+            spec = f.read()
+        for match in re.finditer(r"^def .*:\n", spec, flags=re.MULTILINE):
+            completions.append(spec[match.end():])
+    return completions
+
+
+def stop_position(token_ids, token_texts):
+    """Number of tokens generated until FunctionBodyEnd fires (all of them if it does not)."""
+    detector = FunctionBodyEnd()
+    for i, token_id in enumerate(token_ids):
+        if detector.feed(token_texts(token_id)):
+            return i + 1
+    return len(token_ids)
+
+
+def main():
+    max_new_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 246
+    torch.manual_seed(0)
+    transformers_logging.set_verbosity_error()
+    torch.set_num_threads(os.cpu_count() or 1)
+    tokenizer = make_tokenizer()
+    token_texts = TokenTexts(tokenizer)
+
+    # 1. Completions written from the specifications
+    full_tokens = stopped_tokens = 0
+    completions = make_completions()
+    for completion in completions:
+        token_ids = tokenizer(completion).input_ids[:max_new_tokens]
+        stop = stop_position(token_ids, token_texts)
+        assert _trim_function_body(tokenizer.decode(token_ids[:stop])) == _trim_function_body(
+            tokenizer.decode(token_ids)), completion[:200]
+        full_tokens += len(token_ids)
+        stopped_tokens += stop
+    print(f"{len(completions)} completions from the specifications, max_new_tokens={max_new_tokens}: "
+          f"trimmed bodies identical")
+    print(f"  tokens per completion: {full_tokens / len(completions):.1f} without stopping, "
+          f"{stopped_tokens / len(completions):.1f} with stopping "
+          f"({1 - stopped_tokens / full_tokens:.0%} saved)")
+
+    # 2. Generation with the model
+    # Favor spaces and newlines so that samples consist of indented lines of varying length
+    model = make_model(tokenizer, logit_bias={tokenizer.convert_tokens_to_ids(symbol): value
+                                              for symbol, value in WHITESPACE_LOGIT_BIAS.items()})
+    prompts = make_prompts(4)
+    results = {}
+    for stop_at_function_end in (False, True):
+        llm = make_llm(tokenizer, model, 2, max_new_tokens, batched_generation=True,
+                       stop_at_function_end=stop_at_function_end)
+        torch.manual_seed(1)
+        start = time.perf_counter()
+        samples, _, output_token_counts = llm.draw_batch_samples(prompts, temperature_period=None)
+        results[stop_at_function_end] = (samples, output_token_counts, time.perf_counter() - start, llm)
+    (full, full_counts, full_time, _), (stopped, stopped_counts, stopped_time, llm) = results[False], results[True]
+    for full_samples, stopped_samples in zip(full, stopped):
+        for full_sample, stopped_sample in zip(full_samples, stopped_samples):
+            # A sample cut inside a multi-byte character decodes it as U+FFFD
+            assert full_sample.startswith(stopped_sample.rstrip("\ufffd"))
+    print(f"model, {len(prompts)} prompts x 2 samples, sampling: stopped samples are prefixes of the full ones")
+    print(f"  without stopping: {full_time:.2f} s, {sum(map(sum, full_counts))} output tokens")
+    print(f"  with stopping:    {stopped_time:.2f} s, {sum(map(sum, stopped_counts))} output tokens, "
+          f"{llm.stopped_sequences} sequences stopped, saved_tokens={llm.saved_tokens}")
+
+
+if __name__ == "__main__":
+    main()
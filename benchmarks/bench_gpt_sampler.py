@@ -0,0 +1,142 @@
+"""
+Throughput of the GPT sampler against a simulated Azure OpenAI deployment.
+
+Runs `gpt.Sampler.consume_and_process` over a fixed number of prompt messages, with the async client
+replaced by an endpoint that answers after a fixed latency and enforces a requests-per-minute quota
+over one-second sliding windows (quota / 60 requests per second), rejecting requests beyond it with
+a 429 and a retry-after header, as Azure does. The client-side limiter uses the same one-second
+window. No network or API key is needed.
+
+For each `gpt_max_concurrent_requests` setting it reports prompts/sec, the 429s seen and the time
+requests spent waiting in the client-side rate limiter (summed over requests). Throughput should grow with the concurrency
+window until the quota is reached and then stay at the quota. A last run without client-side limits
+shows the sampler relying on 429 backoff alone.
+
+Usage:
+    python benchmarks/bench_gpt_sampler.py [num_prompts] [latency_s] [requests_per_minute]
+"""
+
+import asyncio
+import collections
+import contextlib
+import json
+import logging
+import sys
+import time
+from types import SimpleNamespace
+
+import bench_common  # noqa: F401, puts src on sys.path
+
+import httpx
+import openai
+
+from disfun import gpt, programs_database
+from disfun.rate_limit import RateLimiter
+
+SAMPLES_PER_PROMPT = 2
+
+
+class SimulatedEndpoint:
+    """Stands in for `AsyncAzureOpenAI`: `chat.completions.create` with latency and an RPM quota."""
+
+    def __init__(self, latency, requests_per_minute):
+        self.latency = latency
+        self.requests_per_minute = requests_per_minute
+        self.accepted = collections.deque()
+        self.rejected = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, max_tokens, n):
+        now = time.monotonic()
+        while self.accepted and now - self.accepted[0] >= 1:
+            self.accepted.popleft()
+        if len(self.accepted) >= self.requests_per_minute / 60:
+            self.rejected += 1
+            retry_after = 1 - (now - self.accepted[0])
+            request = httpx.Request("POST", "https://example.openai.azure.com/chat/completions")
+            response = httpx.Response(429, headers={"retry-after-ms": str(int(retry_after * 1000))}, request=request)
+            raise openai.RateLimitError("Rate limit exceeded", response=response, body=None)
+        self.accepted.append(now)
+        await asyncio.sleep(self.latency)
+        prompt_tokens = len(messages[-1]["content"]) // 4
+        return SimpleNamespace(
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=n * 40, total_tokens=prompt_tokens + n * 40),
+            choices=[SimpleNamespace(message=SimpleNamespace(content="    return 0.0\n")) for _ in range(n)],
+        )
+
+
+class Message:
+    def __init__(self, body):
+        self.body = body
+
+    @contextlib.asynccontextmanager
+    async def process(self):
+        yield
+
+
+class Queue:
+    def __init__(self, messages):
+        self.messages = messages
+
+    @contextlib.asynccontextmanager
+    async def iterator(self):
+        async def stream():
+            for message in self.messages:
+                yield message
+        yield stream()
+
+
+class Channel:
+    def __init__(self):
+        self.published = 0
+        self.default_exchange = SimpleNamespace(publish=self.publish)
+
+    async def set_qos(self, prefetch_count):
+        pass
+
+    async def publish(self, message, routing_key):
+        self.published += 1
+
+
+def make_messages(num_prompts):
+    messages = []
+    for i in range(num_prompts):
+        prompt = programs_database.Prompt(f"def priority_v1(node, G, n, s):\n    return {i}\n" * 20, 1, i % 4, 0)
+        body = json.dumps({"prompt": prompt.serialize(), "total_registered_programs": i, "parent_ids": []})
+        messages.append(Message(body.encode()))
+    return messages
+
+
+async def run(num_prompts, latency, quota, concurrency, client_limit):
+    config = SimpleNamespace(samples_per_prompt=SAMPLES_PER_PROMPT, gpt_max_concurrent_requests=concurrency,
+                             gpt_requests_per_minute=quota if client_limit else None, gpt_tokens_per_minute=None,
+                             gpt_max_retries=8)
+    channel = Channel()
+    sampler = gpt.Sampler(None, channel, Queue(make_messages(num_prompts)), None, config)
+    endpoint = SimulatedEndpoint(latency, quota)
+    sampler._llm.async_client = endpoint
+    sampler._llm.rate_limiter = RateLimiter(config.gpt_requests_per_minute, window=1.0)
+    start = time.perf_counter()
+    await sampler.consume_and_process()
+    elapsed = time.perf_counter() - start
+    assert channel.published == num_prompts * SAMPLES_PER_PROMPT
+    return elapsed, endpoint.rejected, sampler._llm.rate_limiter.wait_time
+
+
+def main():
+    num_prompts = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    quota = int(sys.argv[3]) if len(sys.argv) > 3 else 1200
+    # Client construction without credentials and 429 warnings are expected here
+    logging.getLogger('main_logger').setLevel(logging.CRITICAL)
+
+    print(f"prompts={num_prompts}, latency={latency}s, quota={quota} requests/min ({quota / 60:.0f}/s)")
+    print(f"{'concurrency':>11} {'client limit':>12} {'wall s':>7} {'prompts/s':>10} {'429s':>5} {'limiter wait s':>15}")
+    for concurrency, client_limit in ((1, True), (4, True), (16, True), (64, True), (64, False)):
+        elapsed, rejected, wait_time = asyncio.run(run(num_prompts, latency, quota, concurrency, client_limit))
+        print(f"{concurrency:>11} {'yes' if client_limit else 'no':>12} {elapsed:>7.2f} {num_prompts / elapsed:>10.2f} "
+              f"{rejected:>5} {wait_time:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Size and encode/decode time of the queue messages with each `MessageCodec` setting.
+
+Messages are built as the components build them: prompts as published by
+`ProgramsDatabase.get_prompt` (specification preface, two versioned `priority` functions and the
+next header, from bench_prefix_cache.py), samples as published by `Sampler.publish_samples` and
+evaluation results as published by `Evaluator.publish_to_database`. For each codec it reports the
+mean body size per message type, the bytes sent to the broker per prompt round trip (one prompt,
+`samples_per_prompt` samples and as many results) and encode and decode time per message,
+decoding with the receiving side's codec as the components do. Every decoded message is checked
+against the original.
+
+Codecs whose package is not installed (msgpack, zstandard) are reported as skipped.
+
+Usage:
+    python benchmarks/bench_message_codec.py [num_prompts] [samples_per_prompt]
+"""
+
+import sys
+import time
+
+import bench_common  # noqa: F401, puts src on sys.path
+
+from bench_prefix_cache import make_prompts
+from disfun import code_manipulation, message_codec, programs_database
+from disfun.llm_backends import MockBackend
+
+SETTINGS = [
+    ("json", None),
+    ("json", "zlib"),
+    ("json", "zstd"),
+    ("msgpack", None),
+    ("msgpack", "zlib"),
+    ("msgpack", "zstd"),
+]
+
+
+def make_messages(num_prompts, samples_per_prompt):
+    """(prompt Prompts with metadata, sample dicts, result dicts) as the components publish them."""
+    mock = MockBackend(samples_per_prompt, latency=0)
+    prompts, samples, results = [], [], []
+    for i, code in enumerate(make_prompts(num_prompts)):
+        prompt = programs_database.Prompt(code, 2, i % 10, 3)
+        prompts.append((prompt, {"total_registered_programs": 1000 + i, "flag": False, "parent_ids": [i, i + 1]}))
+        for j, sample in enumerate(mock.draw_sample(code)):
+            samples.append({
+                "sample": sample, "island_id": i % 10, "version_generated": 2, "expected_version": 3,
+                "gpu_time": 0.41, "input_tokens": len(code) // 4, "output_tokens": 96, "parent_ids": [i, i + 1],
+            })
+            function = code_manipulation.Function(name="priority", args="node, G, n, s", body=sample,
+                                                  docstring="Returns the priority with which we want to add `node`.",
+                                                  hash_value=f"{i:064x}")
+            results.append({
+                "new_function": function.serialize(), "island_id": i % 10,
+                "scores_per_test": {str((n, 1, 2)): 10 * n + j for n in range(6, 12)},
+                "expected_version": 3, "hash_value": f"{i:064x}", "cpu_time": 1.7, "gpu_time": 0.41,
+                "input_tokens": len(code) // 4, "output_tokens": 96, "found_optimal_solution": False,
+                "parent_ids": [i, i + 1],
+            })
+    return prompts, samples, results
+
+
+def measure(codec, receiver, messages):
+    """Mean body bytes, encode and decode microseconds per message; checks the round trip."""
+    encoded = []
+    start = time.perf_counter()
+    for data in messages:
+        encoded.append(codec.message(data))
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = [receiver.decode(message) for message in encoded]
+    decode_time = time.perf_counter() - start
+    assert decoded == messages
+    size = sum(len(message.body) for message in encoded) / len(messages)
+    return size, 1e6 * encode_time / len(messages), 1e6 * decode_time / len(messages)
+
+
+def main():
+    num_prompts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    samples_per_prompt = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    prompts, samples, results = make_messages(num_prompts, samples_per_prompt)
+    receiver = message_codec.MessageCodec()
+
+    print(f"{num_prompts} prompts of {sum(len(p.code) for p, _ in prompts) // num_prompts} characters, "
+          f"{samples_per_prompt} samples per prompt")
+    print(f"{'codec':>16} {'prompt B':>9} {'sample B':>9} {'result B':>9} {'B/round trip':>13} "
+          f"{'encode us':>10} {'decode us':>10}")
+    baseline = None
+    for name, compression in SETTINGS:
+        if (name == "msgpack" and not message_codec.MSGPACK_AVAILABLE) or (
+                compression == "zstd" and not message_codec.ZSTD_AVAILABLE):
+            print(f"{name + ('+' + compression if compression else ''):>16} skipped, package not installed")
+            continue
+        codec = message_codec.MessageCodec(name, compression)
+        prompt_messages = [{"prompt": codec.prompt_field(prompt), **meta} for prompt, meta in prompts]
+        sizes, encode_times, decode_times = [], [], []
+        for messages in (prompt_messages, samples, results):
+            size, encode_us, decode_us = measure(codec, receiver, messages)
+            sizes.append(size)
+            encode_times.append(encode_us * len(messages))
+            decode_times.append(decode_us * len(messages))
+        # The nested prompt JSON of the JSON codec is decoded by the sampler as well
+        for message in prompt_messages:
+            programs_database.Prompt.deserialize(message["prompt"])
+        round_trip = sizes[0] + samples_per_prompt * (sizes[1] + sizes[2])
+        baseline = baseline or round_trip
+        count = len(prompt_messages) + len(samples) + len(results)
+        print(f"{name + ('+' + compression if compression else ''):>16} {sizes[0]:>9,.0f} {sizes[1]:>9,.0f} "
+              f"{sizes[2]:>9,.0f} {round_trip:>9,.0f} {round_trip / baseline:>3.0%} "
+              f"{sum(encode_times) / count:>10.1f} {sum(decode_times) / count:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+End-to-end throughput of sampler -> evaluator -> database without a GPU, credentials or RabbitMQ.
+
+Runs a ProgramsDatabase, samplers with the mock LLM backend (`llm_backend="mock"`, replayed or
+mutated bodies of the prompt's `priority` versions after `latency` seconds per batch) and
+evaluators with warm sandboxes in one event loop, connected through `LocalBroker`, an in-process
+stand-in for RabbitMQ with the same queues, prefetch limits and acks. The initial program of the
+load_graph Deletions specification is published to the evaluator queue as in a real run, and the
+pipeline runs for `duration` seconds.
+
+After a warm-up of `duration / 4` seconds it reports prompts/sec (published by the database),
+samples/sec (published by the samplers), evaluations/sec (results published by the evaluators)
+and programs registered, and samples the depth of each queue every 0.5 s (mean and maximum). A
+queue that keeps growing sits in front of the slowest stage. With `--gpt` the samplers are
+`gpt.Sampler` instances (one mock request per prompt, `gpt_max_concurrent_requests` in flight),
+which needs the openai package but no API key. `--codec=msgpack+zstd` (or any `MessageCodec`
+setting, e.g. `json+zlib`) sets the message encoding of all components; the bytes published per
+queue are reported as well. Requires the prebuilt graphs in `src/graphs`.
+
+Usage:
+    python benchmarks/bench_pipeline.py [duration_s] [num_evaluators] [latency_s] [num_samplers] [--gpt]
+                                        [--codec=CODEC[+COMPRESSION]]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from bench_common import SRC_DIR, SPEC_PATH
+
+import aio_pika
+
+from disfun import code_manipulation, evaluator, message_codec, process_utils, programs_database, sampler
+from disfun.local_broker import LocalBroker
+
+QUEUES = ("sampler_queue", "evaluator_queue", "database_queue")
+INPUTS = [(6, 1, 2), (7, 1, 2)]
+
+
+def load_specification():
+    with open(SPEC_PATH) as f:
+        return f.read().replace("n == start_n", f"n == {INPUTS[0][0]}")
+
+
+def database_config():
+    return SimpleNamespace(
+        prompts_per_batch=10,
+        num_islands=4,
+        functions_per_prompt=2,
+        reset_period=None,
+        reset_programs=10**12,  # Never reset during the benchmark
+        cluster_sampling_temperature_init=0.1,
+        cluster_sampling_temperature_period=30_000,
+        no_deduplication=False,
+        save_lineage=False,
+    )
+
+
+def sampler_config(latency, gpt_mode):
+    return SimpleNamespace(
+        prompts_per_batch=10,
+        samples_per_prompt=2,
+        temperature_period=None,
+        temperature=0.9,
+        top_p=0.8,
+        repetition_penalty=1.2,
+        max_new_tokens=246,
+        gpt=gpt_mode,
+        gpt_max_concurrent_requests=8,
+        llm_backend="mock",
+        mock_latency=latency,
+        mock_mutation_rate=0.5,
+        mock_seed=0,
+    )
+
+
+async def connect(broker):
+    connection = broker.connect()
+    channel = await connection.channel()
+    queues = {name: await process_utils.declare_standard_queue(channel, name) for name in QUEUES}
+    return connection, channel, queues
+
+
+def make_codec(setting):
+    name, _, compression = setting.partition("+")
+    return message_codec.MessageCodec(name, compression or None)
+
+
+async def run(duration, num_evaluators, latency, num_samplers, gpt_mode, codec_setting, sandbox_base_path):
+    specification = load_specification()
+    template = code_manipulation.text_to_program(specification)
+    broker = LocalBroker()
+
+    connection, channel, queues = await connect(broker)
+    database = programs_database.ProgramsDatabase(
+        connection, channel, queues["database_queue"], queues["sampler_queue"], queues["evaluator_queue"],
+        database_config(), code_manipulation.text_to_program(specification, remove_classes=True), "priority",
+        mode="last", start_n=[INPUTS[0][0]], end_n=[INPUTS[-1][0]], s_values=[1], codec=make_codec(codec_setting),
+    )
+    components = [database]
+
+    for _ in range(num_samplers):
+        connection, channel, queues = await connect(broker)
+        config = sampler_config(latency, gpt_mode)
+        if gpt_mode:
+            from disfun import gpt
+            components.append(gpt.Sampler(connection, channel, queues["sampler_queue"], queues["evaluator_queue"], config,
+                                          codec=make_codec(codec_setting)))
+        else:
+            components.append(sampler.Sampler(connection, channel, queues["sampler_queue"], queues["evaluator_queue"],
+                                              config, "cpu", codec=make_codec(codec_setting)))
+
+    evaluators = []
+    for i in range(num_evaluators):
+        connection, channel, queues = await connect(broker)
+        evaluators.append(evaluator.Evaluator(
+            connection, channel, queues["evaluator_queue"], queues["database_queue"], template, "priority", "evaluate",
+            INPUTS, sandbox_base_path, 30, local_id=i, target_signatures=None, max_workers=2,
+            max_samples_in_flight=2, sandbox_mode="warm", graph_cache_mb=256, codec=make_codec(codec_setting)))
+    components += evaluators
+
+    tasks = [asyncio.create_task(component.consume_and_process()) for component in components]
+    initial_program = json.dumps({
+        "sample": template.get_function("priority").body,
+        "island_id": None,
+        "version_generated": None,
+        "expected_version": 0,
+    })
+    await channel.default_exchange.publish(aio_pika.Message(body=initial_program.encode()), routing_key="evaluator_queue")
+
+    # Warm-up: workers start, graphs are loaded and the islands fill up
+    await asyncio.sleep(duration / 4)
+    start_stats, start_time, start_stored = broker.stats(), time.perf_counter(), database.total_stored_programs
+    depths = {name: [] for name in QUEUES}
+    while time.perf_counter() - start_time < duration:
+        await asyncio.sleep(0.5)
+        for name in QUEUES:
+            depths[name].append(broker.depth(name))
+    end_stats, elapsed = broker.stats(), time.perf_counter() - start_time
+    stored = database.total_stored_programs - start_stored
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for component in components:
+        if hasattr(component, "cleanup"):
+            component.cleanup()
+
+    def rate(name, key="published"):
+        return (end_stats[name][key] - start_stats[name][key]) / elapsed
+
+    bandwidth = {name: rate(name, "published_bytes") for name in QUEUES}
+    return rate("sampler_queue"), rate("evaluator_queue"), rate("database_queue"), stored / elapsed, depths, bandwidth
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    gpt_mode = "--gpt" in sys.argv
+    codec_setting = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--codec=")), "json")
+    duration = float(args[0]) if len(args) > 0 else 20.0
+    num_evaluators = int(args[1]) if len(args) > 1 else 2
+    latency = float(args[2]) if len(args) > 2 else 0.5
+    num_samplers = int(args[3]) if len(args) > 3 else 1
+    logging.getLogger('main_logger').setLevel(logging.CRITICAL)
+    # container_main resolves the graphs as <cwd>/../../graphs, as when run from an experiment folder
+    os.chdir(os.path.join(SRC_DIR, "experiments", "experiment1"))
+
+    with tempfile.TemporaryDirectory() as sandbox_base_path:
+        prompts, samples, evaluations, registered, depths, bandwidth = asyncio.run(
+            run(duration, num_evaluators, latency, num_samplers, gpt_mode, codec_setting, sandbox_base_path))
+
+    print(f"{num_samplers} {'GPT ' if gpt_mode else ''}sampler(s) with mock latency {latency}s, "
+          f"{num_evaluators} evaluator(s), inputs {INPUTS}, {codec_setting} messages, "
+          f"measured for {duration:.0f}s after warm-up")
+    print(f"  prompts/sec {prompts:.2f}, samples/sec {samples:.2f}, evaluations/sec {evaluations:.2f}, "
+          f"programs registered/sec {registered:.2f}")
+    print(f"{'queue':>16} {'mean depth':>11} {'max depth':>10} {'final':>6} {'KB/sec':>8}")
+    for name in QUEUES:
+        print(f"{name:>16} {statistics.mean(depths[name]):>11.1f} {max(depths[name]):>10} {depths[name][-1]:>6} "
+              f"{bandwidth[name] / 1024:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
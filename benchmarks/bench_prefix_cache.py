@@ -0,0 +1,128 @@
+"""
+Benchmark of the shared-prefix KV cache of the sampler.
+
+Prompts are built like `ProgramsDatabase._generate_prompt` output: the Deletions specification up
+to the evolved function (the preface shared by every prompt), followed by two versioned
+`priority_v*` functions that differ between prompts and the header of the next version.
+
+First checks, with greedy decoding, that `LLM_model.draw_batch_samples` and the
+`ContinuousBatchingEngine` return identical samples and token counts with and without
+`PrefixKVCache`. Then measures time-to-first-token (generation with max_new_tokens=1, i.e. prefill
+plus one token) per batch with and without the cache; the first batch fills the cache and is not
+timed.
+
+Uses the small randomly initialized StarCoder2 of bench_common.py on CPU.
+
+Usage:
+    python benchmarks/bench_prefix_cache.py [prompts_per_batch] [num_batches]
+"""
+
+import os
+import sys
+import time
+
+from bench_common import SPEC_PATH, make_llm, make_model, make_tokenizer
+
+import torch
+from transformers.utils import logging as transformers_logging
+
+from disfun.continuous_batching import ContinuousBatchingEngine, GenerationRequest
+from disfun.prefix_cache import PrefixKVCache
+
+SAMPLES_PER_PROMPT = 2
+EXPRESSIONS = [
+    "0.0", "len(G[node])", "-len(G[node])", "node.count('0')", "sum(map(int, node))",
+    "-G.degree(node) + node.count('1')", "len(set(node))", "float(node[::-1] < node)",
+    "-sum(1 for neighbor in G[node] if neighbor < node)", "abs(node.count('0') - node.count('1'))",
+]
+
+
+def make_prompts(num_prompts):
+    """Specification preface plus two versions of `priority` and the header of the next one."""
+    with open(SPEC_PATH) as f:
+        spec = f.read()
+    preface = spec[:spec.index("def priority(")]
+    prompts = []
+    for i in range(num_prompts):
+        first, second = EXPRESSIONS[i % len(EXPRESSIONS)], EXPRESSIONS[(3 * i + 1) % len(EXPRESSIONS)]
+        prompts.append(
+            f'{preface}def priority_v0(node, G, n, s):\n'
+            f'    """Returns the priority with which we want to add `node` to the independent set."""\n'
+            f'    return {first}\n\n\n'
+            f'def priority_v1(node, G, n, s):\n'
+            f'    """Improved version of `priority_v0`."""\n'
+            f'    score = {second}\n'
+            f'    return score * {i + 1}\n\n\n'
+            f'def priority_v2(node, G, n, s):\n'
+            f'    """Improved version of `priority_v1`."""\n'
+        )
+    return prompts
+
+
+def greedy(llm):
+    llm.generate_kwargs["do_sample"] = False
+    for name in ("temperature", "top_p"):
+        llm.generate_kwargs.pop(name, None)
+    return llm
+
+
+def run_engine(model, tokenizer, prompts, generate_kwargs, prefix_cache, max_batch_size):
+    engine = ContinuousBatchingEngine(model, tokenizer.eos_token_id, max_batch_size=max_batch_size,
+                                      max_new_tokens=generate_kwargs["max_new_tokens"], prefix_cache=prefix_cache)
+    for i, prompt in enumerate(prompts):
+        engine.add_request(GenerationRequest(i, tokenizer(prompt).input_ids, SAMPLES_PER_PROMPT, generate_kwargs))
+    return sorted((request.request_id, request.samples) for request in engine.run_until_complete())
+
+
+def main():
+    prompts_per_batch = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    num_batches = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    if prompts_per_batch < 1 or num_batches < 1:
+        sys.exit("prompts_per_batch and num_batches must be at least 1")
+    torch.manual_seed(0)
+    transformers_logging.set_verbosity_error()
+    torch.set_num_threads(os.cpu_count() or 1)
+
+    tokenizer = make_tokenizer()
+    model = make_model(tokenizer)
+    prompts = make_prompts(prompts_per_batch * (num_batches + 1))
+    batches = [prompts[i:i + prompts_per_batch] for i in range(0, len(prompts), prompts_per_batch)]
+
+    # Greedy decoding: identical outputs with and without the prefix cache
+    uncached = greedy(make_llm(tokenizer, model, SAMPLES_PER_PROMPT, 32, batched_generation=True))
+    cached = greedy(make_llm(tokenizer, model, SAMPLES_PER_PROMPT, 32, batched_generation=True, prefix_caching=True))
+    # Up to three full batches and a smaller one
+    num_checked = min(3, len(batches) - 1)
+    for batch in batches[:num_checked] + [batches[num_checked][:1]]:
+        assert uncached.draw_batch_samples(batch, temperature_period=None) == cached.draw_batch_samples(
+            batch, temperature_period=None)
+    engine_prompts = prompts[:3 * prompts_per_batch]
+    rows = prompts_per_batch * SAMPLES_PER_PROMPT
+    assert run_engine(model, tokenizer, engine_prompts, uncached.generate_kwargs, None, rows) == run_engine(
+        model, tokenizer, engine_prompts, uncached.generate_kwargs, PrefixKVCache(model), rows)
+    print("greedy outputs identical with and without prefix cache")
+
+    # Time to first token
+    prompt_tokens = [len(tokenizer(p).input_ids) for p in prompts]
+    times = {}
+    for prefix_caching in (False, True):
+        llm = make_llm(tokenizer, model, SAMPLES_PER_PROMPT, 1, batched_generation=True, prefix_caching=prefix_caching)
+        llm.draw_batch_samples(batches[0], temperature_period=None)  # warm-up, fills the cache
+        start = time.perf_counter()
+        for batch in batches[1:]:
+            llm.draw_batch_samples(batch, temperature_period=None)
+        times[prefix_caching] = (time.perf_counter() - start) / num_batches
+        if prefix_caching:
+            stats = llm.prefix_cache.stats()
+
+    print(f"prompts_per_batch={prompts_per_batch}, batches={num_batches}, samples_per_prompt={SAMPLES_PER_PROMPT}, "
+          f"prompt tokens {min(prompt_tokens)}-{max(prompt_tokens)}, cached prefix "
+          f"{stats['reused_tokens'] // (stats['hits'] * prompts_per_batch)} tokens, hit rate {stats['hit_rate']:.0%}")
+    print(f"{'':>14} {'TTFT s/batch':>13} {'ms/prompt':>10}")
+    for prefix_caching, label in ((False, "no cache"), (True, "prefix cache")):
+        print(f"{label:>14} {times[prefix_caching]:>13.3f} {1000 * times[prefix_caching] / prompts_per_batch:>10.1f}")
+    print(f"speedup {times[False] / times[True]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Prompts/sec of rendering the prompts of the ProgramsDatabase, with and without the render caches.
+
+Fills one island with `num_clusters` clusters of `programs_per_cluster` programs each (bodies
+derived from the `priority` function of the load_graph Deletions specification, some calling
+`priority` recursively) and generates `num_prompts` prompts (`_generate_prompt_for_island`) with
+the same random seed in three modes:
+
+* `parsed`: every sampled program is renamed by tokenizing its text and parsed back with
+  `text_to_function` for every prompt (`PromptRenderer` with `max_cached_functions=0`)
+* `cached`: the cleaned preface and the tokenized programs are cached by the `PromptRenderer`
+  (default), so a program is parsed at its first prompt only
+* `prompts`: as `cached`, and whole prompts are cached by the ids of their programs
+  (`PromptCache`, `prompt_cache_size`); its hit rate is printed. With few clusters the same
+  programs are sampled together again and again.
+
+All modes must produce the same prompts; the benchmark reports whether they do. With
+`--scores` the prompts show the scores of the programs (`show_eval_scores`).
+
+Usage:
+    python benchmarks/bench_prompt_rendering.py [num_prompts] [num_clusters] [programs_per_cluster] [--scores]
+"""
+
+import logging
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from bench_common import SPEC_PATH
+
+from disfun import code_manipulation, programs_database
+
+
+def database_config():
+    return SimpleNamespace(
+        prompts_per_batch=10,
+        num_islands=1,
+        functions_per_prompt=2,
+        reset_period=None,
+        reset_programs=10**12,
+        cluster_sampling_temperature_init=0.1,
+        cluster_sampling_temperature_period=30_000,
+        no_deduplication=False,
+        save_lineage=False,
+    )
+
+
+def make_database(num_clusters, programs_per_cluster, show_eval_scores, seed=0):
+    with open(SPEC_PATH) as f:
+        template = code_manipulation.text_to_program(f.read(), remove_classes=True)
+    priority = template.get_function("priority")
+    database = programs_database.ProgramsDatabase(
+        None, None, None, None, None, database_config(), template, "priority",
+        mode="last", start_n=[6], end_n=[7], s_values=[1], show_eval_scores=show_eval_scores,
+    )
+    rng = np.random.default_rng(seed)
+    for cluster in range(num_clusters):
+        scores = {"(6, 1, 2)": float(cluster % 7), "(7, 1, 2)": float(rng.normal(10, 1.5)) + cluster * 1e-6}
+        for i in range(programs_per_cluster):
+            body = priority.body.rstrip() + f"\n    weight = {rng.random():.6f} * G.degree(node)  # variant {i}\n"
+            if i % 2:
+                body += "    if weight > 1:\n        return priority(node, G) - weight\n"
+            body += "    return weight\n"
+            function = code_manipulation.Function(name="priority", args=priority.args, body=body,
+                                                  return_type=priority.return_type, docstring=priority.docstring)
+            database._register_program_in_island(function, 0, scores, hash_value=cluster * programs_per_cluster + i)
+    return database
+
+
+def generate(database, num_prompts, seed=0):
+    island = database._islands[0]
+    np.random.seed(seed)
+    start = time.perf_counter()
+    prompts = [database._generate_prompt_for_island(island)[0] for _ in range(num_prompts)]
+    return prompts, num_prompts / (time.perf_counter() - start)
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    num_prompts = int(args[0]) if len(args) > 0 else 2000
+    num_clusters = int(args[1]) if len(args) > 1 else 100
+    programs_per_cluster = int(args[2]) if len(args) > 2 else 3
+    show_eval_scores = "--scores" in sys.argv
+    logging.getLogger('main_logger').setLevel(logging.CRITICAL)
+
+    results = {}
+    for mode, max_cached_functions, prompt_cache_size in (("parsed", 0, 0), ("cached", 10_000, 0),
+                                                          ("prompts", 10_000, 10_000)):
+        database = make_database(num_clusters, programs_per_cluster, show_eval_scores)
+        database._renderer.max_cached_functions = max_cached_functions
+        database._prompt_cache.max_size = prompt_cache_size
+        results[mode] = generate(database, num_prompts)
+    hit_rate = database._prompt_cache.hit_rate
+
+    print(f"{num_prompts} prompts, {num_clusters} clusters x {programs_per_cluster} programs, "
+          f"scores shown: {show_eval_scores}")
+    print(f"{'mode':>7} {'prompts/sec':>12}")
+    for mode, (_, rate) in results.items():
+        print(f"{mode:>7} {rate:>12,.0f}")
+    print(f"speedup: {results['cached'][1] / results['parsed'][1]:.1f}x (cached), "
+          f"{results['prompts'][1] / results['parsed'][1]:.1f}x (prompts, hit rate {hit_rate:.0%}), "
+          f"identical prompts: {results['cached'][0] == results['parsed'][0] == results['prompts'][0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Publishing samples one confirmed message at a time vs. through `process_utils.BufferedPublisher`.
+
+A producer publishes `num_messages` sample messages (as `Sampler.publish_samples` builds them) one
+after another, awaiting each publish call, as the samplers and evaluators do. Modes:
+
+* `direct`: `channel.default_exchange.publish` per message, one publisher confirm round trip each
+  (the previous behaviour of the samplers and evaluators)
+* `buffered/N`: `BufferedPublisher` with `max_batch_size=N`, closed at the end as on shutdown
+
+Reports messages/sec, the mean time a publish call blocks the producer, the number of broker
+round trips (batches) and checks that every message reached the queue after `close()`.
+
+By default the broker is `LocalBroker` with `confirm_delay` seconds per round trip (default 1 ms,
+a broker on another node). `--amqp=URL` runs against a real RabbitMQ server instead (the queue
+`bench_publisher_queue` is declared and purged); watch the broker CPU in the management UI.
+
+Usage:
+    python benchmarks/bench_publisher.py [num_messages] [confirm_delay_s] [--amqp=URL]
+"""
+
+import asyncio
+import sys
+import time
+
+import bench_common  # noqa: F401, puts src on sys.path
+
+import aio_pika
+
+from disfun import message_codec, process_utils
+from disfun.local_broker import LocalBroker
+
+QUEUE = "bench_publisher_queue"
+BATCH_SIZES = [1, 10, 100]
+SAMPLE = "    degree = G.degree(node)\n    return 1.0 / (1 + degree) + 0.1 * len(list(G.neighbors(node)))\n"
+
+
+def make_message(codec, i):
+    return codec.message({
+        "sample": SAMPLE, "island_id": i % 10, "version_generated": 2, "expected_version": 3,
+        "gpu_time": 0.41, "input_tokens": 750, "output_tokens": 40, "parent_ids": [i, i + 1],
+    })
+
+
+async def run_mode(channel, mode, num_messages):
+    codec = message_codec.MessageCodec()
+    queue = await channel.declare_queue(QUEUE, durable=False, auto_delete=False)
+    await queue.purge()
+    publisher = None if mode == "direct" else process_utils.BufferedPublisher(channel, max_batch_size=mode)
+
+    blocked = 0.0
+    start = time.perf_counter()
+    for i in range(num_messages):
+        message = make_message(codec, i)
+        call_start = time.perf_counter()
+        if publisher is None:
+            await channel.default_exchange.publish(message, routing_key=QUEUE)
+        else:
+            await publisher.publish(message, routing_key=QUEUE)
+        blocked += time.perf_counter() - call_start
+    if publisher is not None:
+        await publisher.close()
+    elapsed = time.perf_counter() - start
+
+    delivered = (await channel.declare_queue(QUEUE, passive=True)).declaration_result.message_count
+    await queue.purge()
+    round_trips = num_messages if publisher is None else publisher.batches
+    return num_messages / elapsed, 1e6 * blocked / num_messages, round_trips, delivered
+
+
+async def run(num_messages, confirm_delay, amqp_url):
+    if amqp_url:
+        connection = await aio_pika.connect_robust(amqp_url)
+    else:
+        connection = LocalBroker(confirm_delay=confirm_delay).connect()
+    async with connection:
+        channel = await connection.channel()
+        results = []
+        for mode in ["direct"] + BATCH_SIZES:
+            results.append((mode, *await run_mode(channel, mode, num_messages)))
+        if amqp_url:
+            await channel.queue_delete(QUEUE)
+    return results
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    amqp_url = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--amqp=")), None)
+    num_messages = int(args[0]) if len(args) > 0 else 2000
+    confirm_delay = float(args[1]) if len(args) > 1 else 0.001
+
+    results = asyncio.run(run(num_messages, confirm_delay, amqp_url))
+    broker = amqp_url or f"LocalBroker with {1e3 * confirm_delay:.1f} ms confirm round trip"
+    print(f"{num_messages} sample messages, {broker}")
+    print(f"{'mode':>12} {'msgs/sec':>10} {'blocked us/msg':>15} {'round trips':>12} {'delivered':>10}")
+    for mode, rate, blocked_us, round_trips, delivered in results:
+        name = mode if mode == "direct" else f"buffered/{mode}"
+        print(f"{name:>12} {rate:>10,.0f} {blocked_us:>15,.1f} {round_trips:>12} {delivered:>10}")
+
+
+if __name__ == "__main__":
+    main()
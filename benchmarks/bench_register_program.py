@@ -0,0 +1,94 @@
+"""
+Microbenchmark for `ProgramsDatabase.register_program`.
+
+Measures registration throughput (programs/sec) as a function of island size.
+Each round pre-populates a single island with `island_size` programs and then times
+`num_registrations` further registrations, half of which are duplicates of stored
+programs. With the per-island hash index the throughput should stay flat as the
+island grows; the `scan` column replays the previous linear dedup scan over all
+clusters for reference.
+
+Usage:
+    python benchmarks/bench_register_program.py
+"""
+
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+
+import bench_common  # noqa: F401, puts src on sys.path
+
+from disfun import code_manipulation, programs_database
+
+
+def make_database(num_islands=1):
+    config = SimpleNamespace(
+        prompts_per_batch=10,
+        num_islands=num_islands,
+        functions_per_prompt=2,
+        reset_period=None,
+        reset_programs=10**12,  # Never reset during the benchmark
+        cluster_sampling_temperature_init=0.1,
+        cluster_sampling_temperature_period=30_000,
+        no_deduplication=False,
+        save_lineage=False,
+    )
+    template = code_manipulation.Program(preface="", functions=[])
+    return programs_database.ProgramsDatabase(
+        None, None, None, None, None, config, template, "priority",
+        mode="last", start_n=[6], end_n=[7], s_values=[1],
+    )
+
+
+def make_program(i):
+    program = code_manipulation.Function(name="priority", args="node, G, n, s", body=f"    return {i}")
+    # 50 distinct signatures to spread programs over clusters as in a real run
+    scores_per_test = {(6, 1, 2): i % 50, (7, 1, 2): 1}
+    return program, scores_per_test, f"hash{i}"
+
+
+def scan_exists(clusters, hash_value):
+    """The previous O(island size) deduplication check."""
+    for cluster in clusters.values():
+        for program in cluster['programs']:
+            if program.hash_value == hash_value:
+                return True
+    return False
+
+
+async def bench(island_size, num_registrations):
+    database = make_database()
+    for i in range(island_size):
+        program, scores, hash_value = make_program(i)
+        database._register_program_in_island(program, 0, scores, hash_value, [])
+
+    island = database._islands[0]
+    start = time.perf_counter()
+    for i in range(num_registrations):
+        # Every second registration is a duplicate of an already stored program
+        idx = i // 2 if i % 2 else island_size + i
+        program, scores, hash_value = make_program(idx)
+        await database.register_program(program, 0, scores, None, hash_value, [])
+    indexed = num_registrations / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(num_registrations):
+        scan_exists(island['clusters'], f"hash{i}")
+    scan = num_registrations / (time.perf_counter() - start)
+    return indexed, scan
+
+
+def main():
+    logging.getLogger('main_logger').setLevel(logging.ERROR)
+    island_sizes = [100, 1_000, 5_000, 20_000]
+    num_registrations = 2_000
+
+    print(f"{'island size':>12} {'indexed reg/s':>15} {'scan checks/s':>15}")
+    for island_size in island_sizes:
+        indexed, scan = asyncio.run(bench(island_size, num_registrations))
+        print(f"{island_size:>12,} {indexed:>15,.0f} {scan:>15,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Microbenchmark for the sandboxes used by the Evaluator.
+
+Measures sandbox calls/sec of `ExternalProcessSandbox` (one interpreter per call) against
+`WarmProcessSandbox` (persistent pre-imported worker), without and with its graph cache, by
+running the `evaluate` function of the load_graph Deletions specification on the prebuilt graphs
+in `src/graphs`. Small n is where interpreter startup and imports dominate, which is what the
+warm worker removes; at larger n the LMDB decode dominates, which is what the graph cache removes.
+
+Usage:
+    python benchmarks/bench_sandbox.py [num_calls]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from bench_common import SRC_DIR, SPEC_PATH
+
+from disfun import sandbox
+
+
+def load_program(start_n):
+    with open(SPEC_PATH) as f:
+        return f.read().replace("n == start_n", f"n == {start_n}")
+
+
+def bench(sandbox_obj, program, test_input, num_calls):
+    # Warm-up call, so the warm sandbox is measured in steady state
+    _, ok, *_ = sandbox_obj.run(program, "evaluate", test_input, sandbox_obj.timeout_secs, 0)
+    assert ok, f"{type(sandbox_obj).__name__} failed on {test_input}"
+
+    start = time.perf_counter()
+    for count in range(1, num_calls + 1):
+        sandbox_obj.run(program, "evaluate", test_input, sandbox_obj.timeout_secs, count)
+    return num_calls / (time.perf_counter() - start)
+
+
+def main():
+    num_calls = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    # container_main resolves the graphs as <cwd>/../../graphs, as when run from an experiment folder
+    os.chdir(os.path.join(SRC_DIR, "experiments", "experiment1"))
+    program = load_program(start_n=6)
+
+    with tempfile.TemporaryDirectory() as base_path:
+        subprocess_sandbox = sandbox.ExternalProcessSandbox(base_path, 30, sys.executable, local_id="subprocess")
+        warm_sandbox = sandbox.WarmProcessSandbox(base_path, 30, sys.executable, local_id="warm",
+                                                  max_calls_per_worker=10 * num_calls)
+        cached_sandbox = sandbox.WarmProcessSandbox(base_path, 30, sys.executable, local_id="cached",
+                                                    max_calls_per_worker=10 * num_calls, graph_cache_mb=512)
+
+        print(f"{'input (n,s,q)':>14} {'subprocess calls/s':>19} {'warm calls/s':>13} {'cached calls/s':>15}")
+        for test_input in [(6, 1, 2), (7, 1, 2), (8, 1, 2), (9, 1, 2), (10, 1, 2), (11, 1, 2)]:
+            cold = bench(subprocess_sandbox, program, test_input, num_calls)
+            warm = bench(warm_sandbox, program, test_input, num_calls)
+            cached = bench(cached_sandbox, program, test_input, num_calls)
+            print(f"{str(test_input):>14} {cold:>19,.1f} {warm:>13,.1f} {cached:>15,.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Per-message latency and throughput of the message transports between processes.
+
+An echo process consumes `sampler_queue` and publishes every message back to `evaluator_queue`
+(as a sampler forwards work to the evaluators). The main process measures:
+
+* round-trip latency: publish one prompt-sized message (about 3.5 KB, as published by the
+  database) and wait for it to come back, `num_round_trips` times (mean, p50, p99)
+* throughput: publish `num_messages` messages at once and receive them all back (msgs/sec)
+
+Two hops per message, through `LocalTransport` (multiprocessing queues, `transport="local"`) and,
+with `--amqp=URL`, through a RabbitMQ server (`transport="amqp"`).
+
+Usage:
+    python benchmarks/bench_transport.py [num_round_trips] [num_messages] [--amqp=URL]
+"""
+
+import asyncio
+import multiprocessing
+import statistics
+import sys
+import time
+
+import bench_common  # noqa: F401, puts src on sys.path
+
+import aio_pika
+
+from disfun import process_utils
+from disfun.transport import LocalTransport
+
+PAYLOAD = b"x" * 3500
+
+
+async def connect(transport, amqp_url):
+    if transport is not None:
+        connection = await transport.connect()
+    else:
+        connection = await aio_pika.connect_robust(amqp_url)
+    channel = await connection.channel()
+    queues = {name: await process_utils.declare_standard_queue(channel, name)
+              for name in ("sampler_queue", "evaluator_queue")}
+    return connection, channel, queues
+
+
+async def echo(transport, amqp_url, ready):
+    connection, channel, queues = await connect(transport, amqp_url)
+    await channel.set_qos(prefetch_count=100)
+    ready.set()
+    async with queues["sampler_queue"].iterator() as stream:
+        async for message in stream:
+            async with message.process():
+                if message.body == b"stop":
+                    break
+                await channel.default_exchange.publish(aio_pika.Message(body=message.body), routing_key="evaluator_queue")
+    await connection.close()
+
+
+def echo_process(transport, amqp_url, ready):
+    asyncio.run(echo(transport, amqp_url, ready))
+
+
+async def measure(transport, amqp_url, num_round_trips, num_messages):
+    connection, channel, queues = await connect(transport, amqp_url)
+    await channel.set_qos(prefetch_count=100)
+    for queue in queues.values():
+        await queue.purge()
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Event()
+    proc = ctx.Process(target=echo_process, args=(transport, amqp_url, ready))
+    proc.start()
+    await asyncio.to_thread(ready.wait)
+
+    round_trips = []
+    async with queues["evaluator_queue"].iterator() as stream:
+        replies = stream.__aiter__()
+        for _ in range(num_round_trips):
+            start = time.perf_counter()
+            await channel.default_exchange.publish(aio_pika.Message(body=PAYLOAD), routing_key="sampler_queue")
+            message = await replies.__anext__()
+            async with message.process():
+                round_trips.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(num_messages):
+            await channel.default_exchange.publish(aio_pika.Message(body=PAYLOAD), routing_key="sampler_queue")
+        for _ in range(num_messages):
+            message = await replies.__anext__()
+            async with message.process():
+                pass
+        throughput = num_messages / (time.perf_counter() - start)
+
+    await channel.default_exchange.publish(aio_pika.Message(body=b"stop"), routing_key="sampler_queue")
+    await asyncio.to_thread(proc.join, 10)
+    await connection.close()
+    round_trips.sort()
+    return (1e3 * statistics.mean(round_trips), 1e3 * round_trips[len(round_trips) // 2],
+            1e3 * round_trips[int(0.99 * (len(round_trips) - 1))], throughput)
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    amqp_url = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--amqp=")), None)
+    num_round_trips = int(args[0]) if len(args) > 0 else 500
+    num_messages = int(args[1]) if len(args) > 1 else 5000
+
+    results = [("local", asyncio.run(measure(LocalTransport(), None, num_round_trips, num_messages)))]
+    if amqp_url:
+        results.append(("amqp", asyncio.run(measure(None, amqp_url, num_round_trips, num_messages))))
+
+    print(f"{len(PAYLOAD)} byte messages, {num_round_trips} round trips, {num_messages} messages for throughput")
+    print(f"{'transport':>10} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'msgs/sec':>10}")
+    for name, (mean, p50, p99, throughput) in results:
+        print(f"{name:>10} {mean:>8.3f} {p50:>8.3f} {p99:>8.3f} {throughput:>10,.0f}")
+
+
+if __name__ == "__main__":
+    main()
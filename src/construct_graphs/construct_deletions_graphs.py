@@ -12,6 +12,8 @@ Usage:
 
 The script will construct graphs for the (n, s, q) tuples specified in the __main__ block
 and save them to LMDB databases in the format: graph_d_s{s}_n{n}_q{q}.lmdb
+Set `output_format` in the __main__ block to "csr" or "both" to write the memory-mappable CSR
+format graph_d_s{s}_n{n}_q{q}.csr instead of or in addition to LMDB (see disfun/graph_csr.py).
 
 Parallelization Strategy:
     To avoid creating a massive list of all sequence pairs in memory (which would require
@@ -32,6 +34,25 @@ Parallelization Strategy:
         Cumulative pairs from i=0 to i=k-1: k*N - k*(k+1)/2
         Target for worker w: (w+1) * (total_pairs / num_workers)
         Solve: k*N - k*(k+1)/2 = target
+
+Edge test methods (`method` argument of generate_deletion_graph):
+    - "vectorized" (default): bit-parallel LCS (Hyyrö) evaluated with NumPy for sequence i against
+      a block of sequences j at once. The match masks of sequence i are n-bit integers, so each
+      pair costs n word operations instead of the n*n cells of the DP.
+    - "dp": the reference dynamic programming test `has_common_subsequence`, one pair at a time.
+    - "deletion_ball": no all-pairs comparison. Two strings are adjacent exactly when their sets of
+      length-(n-s) subsequences intersect, so every node is bucketed under each of its
+      (n-s)-subsequences and the neighbors of a node are the members of its buckets. The cost is
+      roughly q^n * C(n, s) * bucket size instead of q^(2n) / 2, which makes larger n feasible on
+      one node. Runs in the main process with NumPy; `max_workers` is not used.
+    All methods produce exactly the same adjacency (same edges in the same order).
+
+Streaming (`streaming` in the __main__ block):
+    The in-memory path collects every edge as a pair of strings and builds the full adjacency dict
+    before saving, which dominates memory for large graphs. With streaming, workers write their
+    edges as sorted runs of integer keys to a temporary directory next to the output, and an
+    external merge writes the neighbors of one node at a time to LMDB and/or CSR
+    (see edge_stream.py). The output is identical to the in-memory path.
 """
 
 import itertools
@@ -39,9 +60,24 @@ import json
 import os
 import math
 import lmdb
+import numpy as np
+import sys
+import tempfile
 from tqdm import tqdm
 from multiprocessing import Pool, cpu_count
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from disfun.graph_csr import save_graph_to_csr
+from edge_stream import EdgeRunWriter, save_graph_stream
+
+
+def _iter_row_edges(start_i, end_i, sequences, n, s):
+    """Yields (i, [j > i adjacent to i]) for i in [start_i, end_i) with `has_common_subsequence`."""
+    n_sequences = len(sequences)
+    for i in range(start_i, end_i):
+        seq1 = sequences[i]
+        yield i, [j for j in range(i + 1, n_sequences) if has_common_subsequence(seq1, sequences[j], n, s)]
+
 
 def _compute_edges_chunk(args):
     """
@@ -56,7 +92,6 @@ def _compute_edges_chunk(args):
     """
     worker_id, start_i, end_i, sequences, n, s = args
     edges = []
-    n_sequences = len(sequences)
 
     # Create progress bar for this worker at a specific vertical position
     pbar = tqdm(
@@ -67,12 +102,98 @@ def _compute_edges_chunk(args):
         unit="idx"
     )
 
+    for i, neighbors in _iter_row_edges(start_i, end_i, sequences, n, s):
+        for j in neighbors:
+            edges.append((sequences[i], sequences[j]))
+
+        pbar.update(1)
+
+    pbar.close()
+    return edges
+
+
+# Number of j sequences compared with one i at once by the vectorized method (bounds worker memory)
+VECTORIZED_BLOCK_SIZE = 1 << 16
+
+
+def encode_sequences(sequences, n):
+    """Returns the sequences as an (N, n) uint8 array of symbols 0..q-1."""
+    return (np.frombuffer(''.join(sequences).encode('ascii'), dtype=np.uint8).reshape(-1, n) - ord('0'))
+
+
+def _popcount(values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    # NumPy < 2.0: count bits byte by byte
+    table = np.array([bin(b).count("1") for b in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+def lcs_lengths_bitparallel(codes_i, codes_j, q):
+    """
+    LCS lengths between one sequence and a block of sequences with the bit-parallel algorithm
+    of Hyyrö (2004), vectorized over the block.
+
+    Bit k of the match mask PM[c] is set when codes_i[k] == c. V starts with all n bits set and
+    is updated once per symbol of the other sequence; the LCS length is the number of cleared bits.
+
+    Args:
+        codes_i: (n,) uint8 array, the sequence whose match masks are precomputed (n <= 63)
+        codes_j: (B, n) uint8 array of sequences compared against codes_i
+        q: Alphabet size
+
+    Returns:
+        (B,) array of LCS lengths
+    """
+    n = len(codes_i)
+    mask = np.uint64((1 << n) - 1)
+    bits = np.uint64(1) << np.arange(n, dtype=np.uint64)
+    match_masks = np.array([np.bitwise_or.reduce(bits[codes_i == c]) if np.any(codes_i == c) else 0
+                            for c in range(q)], dtype=np.uint64)
+
+    V = np.full(len(codes_j), mask, dtype=np.uint64)
+    for k in range(codes_j.shape[1]):
+        U = V & match_masks[codes_j[:, k]]
+        V = ((V + U) | (V - U)) & mask
+    return n - _popcount(V).astype(np.int64)
+
+
+def _iter_row_edges_vectorized(start_i, end_i, sequences, n, s):
+    """
+    Vectorized counterpart of `_iter_row_edges`: for each i in [start_i, end_i), compares
+    sequence i with all j > i in blocks of VECTORIZED_BLOCK_SIZE using `lcs_lengths_bitparallel`.
+    """
+    n_sequences = len(sequences)
+    threshold = n - s
+    codes = encode_sequences(sequences, n)
+    q = int(codes.max()) + 1 if n_sequences else 2
+
     for i in range(start_i, end_i):
-        for j in range(i + 1, n_sequences):
-            seq1, seq2 = sequences[i], sequences[j]
+        neighbors = []
+        for block_start in range(i + 1, n_sequences, VECTORIZED_BLOCK_SIZE):
+            block_end = min(block_start + VECTORIZED_BLOCK_SIZE, n_sequences)
+            lcs = lcs_lengths_bitparallel(codes[i], codes[block_start:block_end], q)
+            neighbors.append(block_start + np.flatnonzero(lcs >= threshold))
+        yield i, np.concatenate(neighbors) if neighbors else np.empty(0, dtype=np.int64)
 
-            if has_common_subsequence(seq1, seq2, n, s):
-                edges.append((seq1, seq2))
+
+def _compute_edges_chunk_vectorized(args):
+    """Vectorized counterpart of `_compute_edges_chunk` with the same arguments and result."""
+    worker_id, start_i, end_i, sequences, n, s = args
+    edges = []
+
+    pbar = tqdm(
+        total=end_i - start_i,
+        desc=f"  Worker {worker_id:2d}",
+        position=worker_id,
+        leave=True,
+        unit="idx"
+    )
+
+    for i, neighbors in _iter_row_edges_vectorized(start_i, end_i, sequences, n, s):
+        seq1 = sequences[i]
+        for j in neighbors.tolist():
+            edges.append((seq1, sequences[j]))
 
         pbar.update(1)
 
@@ -80,6 +201,36 @@ def _compute_edges_chunk(args):
     return edges
 
 
+def _compute_edges_chunk_to_runs(args):
+    """
+    Streaming counterpart of the chunk workers: instead of returning the edges, writes them as
+    sorted runs into `run_dir` (see edge_stream.py).
+
+    Args:
+        args: Tuple of (worker_id, start_i, end_i, sequences, n, s, iter_row_edges, run_dir)
+
+    Returns:
+        (run_paths, num_edges)
+    """
+    worker_id, start_i, end_i, sequences, n, s, iter_row_edges, run_dir = args
+    writer = EdgeRunWriter(run_dir, len(sequences), f"worker{worker_id}")
+
+    pbar = tqdm(
+        total=end_i - start_i,
+        desc=f"  Worker {worker_id:2d}",
+        position=worker_id,
+        leave=True,
+        unit="idx"
+    )
+
+    for i, neighbors in iter_row_edges(start_i, end_i, sequences, n, s):
+        writer.add(i, neighbors)
+        pbar.update(1)
+
+    pbar.close()
+    return writer.close()
+
+
 def has_common_subsequence(seq1, seq2, n, s):
     """
     Check if two sequences share a common subsequence of length >= n-s.
@@ -116,7 +267,106 @@ def has_common_subsequence(seq1, seq2, n, s):
     return False  # No LCS of adequate length was found
 
 
-def generate_deletion_graph(n, s, q=2, max_workers=None):
+# Bucket members gathered at once by the deletion_ball method, bounds its working memory
+DELETION_BALL_MAX_ENTRIES = 20_000_000
+
+
+def iter_deletion_ball_pairs(n, s, q, max_entries=DELETION_BALL_MAX_ENTRIES):
+    """
+    Yields all pairs of q-ary strings of length n that share a subsequence of length n - s.
+
+    Strings are identified by their index in `itertools.product` order (their base-q value).
+    A bucket index maps every length-(n-s) subsequence, encoded as a base-q integer, to the
+    strings containing it (q^n * C(n, s) entries). Neighbors of a block of source strings are
+    the members of their buckets, gathered at most about `max_entries` at a time.
+
+    Args:
+        n: Length of strings
+        s: Number of deleted symbols
+        q: Alphabet size
+        max_entries: Bound on bucket members gathered per block
+
+    Yields:
+        (u, v): int64 arrays with u < v, sorted by (u, v). Blocks follow each other in order of
+        u, so the concatenation of all blocks is sorted and contains every pair once.
+    """
+    n_sequences = q ** n
+    if q ** (2 * n) >= 2 ** 63:
+        raise ValueError(f"q^(2n) must fit into int64 for the deletion_ball method (n={n}, q={q})")
+
+    kept_length = n - s
+    if kept_length <= 0:
+        # Every pair shares the empty subsequence
+        for u in range(n_sequences - 1):
+            yield np.full(n_sequences - u - 1, u, dtype=np.int64), np.arange(u + 1, n_sequences, dtype=np.int64)
+        return
+
+    node_ids = np.arange(n_sequences, dtype=np.int64)
+    codes = (node_ids[:, None] // (q ** np.arange(n - 1, -1, -1, dtype=np.int64))) % q
+    weights = q ** np.arange(kept_length - 1, -1, -1, dtype=np.int64)
+    kept_positions = [[k for k in range(n) if k not in deleted]
+                      for deleted in itertools.combinations(range(n), s)]
+    num_patterns = len(kept_positions)
+    index_dtype = np.int32 if max(q ** kept_length, n_sequences) < 2 ** 31 else np.int64
+
+    # subsequences[x, p]: code of the subsequence of x that keeps kept_positions[p]
+    subsequences = np.empty((n_sequences, num_patterns), dtype=index_dtype)
+    for pattern, kept in enumerate(kept_positions):
+        subsequences[:, pattern] = codes[:, kept] @ weights
+    del codes
+
+    # Bucket index in CSR form; a stable sort keeps the members of a bucket in ascending order
+    order = np.argsort(subsequences, axis=None, kind="stable")
+    bucket_members = (order // num_patterns).astype(index_dtype)
+    del order
+    bucket_ptr = np.zeros(q ** kept_length + 1, dtype=np.int64)
+    np.cumsum(np.bincount(subsequences.ravel(), minlength=q ** kept_length), out=bucket_ptr[1:])
+
+    average_gathered = num_patterns * len(bucket_members) / (q ** kept_length)
+    block_size = max(1, int(max_entries // max(average_gathered, 1)))
+    for block_start in range(0, n_sequences, block_size):
+        sources = node_ids[block_start:block_start + block_size]
+        buckets = subsequences[sources].ravel()
+        starts, lengths = bucket_ptr[buckets], bucket_ptr[buckets + 1] - bucket_ptr[buckets]
+
+        # Gather the members of all buckets of the block in one pass
+        owners = np.repeat(np.repeat(sources, num_patterns), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+        members = bucket_members[offsets].astype(np.int64)
+        keep = members > owners
+        keys = np.unique(owners[keep] * n_sequences + members[keep])
+        yield np.divmod(keys, n_sequences)
+
+
+def deletion_ball_pairs(n, s, q, max_entries=DELETION_BALL_MAX_ENTRIES):
+    """All pairs of `iter_deletion_ball_pairs` as two int64 arrays (u, v) sorted by (u, v)."""
+    blocks = list(iter_deletion_ball_pairs(n, s, q, max_entries))
+    if not blocks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate([u for u, _ in blocks]), np.concatenate([v for _, v in blocks])
+
+
+def pairs_to_adjacency(u, v, sequences):
+    """
+    Adjacency dict {node: [neighbors]} from index pairs, with neighbors in ascending index order
+    as produced by the all-pairs construction.
+    """
+    adjacency = {seq: [] for seq in sequences}
+    if len(u) == 0:
+        return adjacency
+    sources = np.concatenate([u, v])
+    targets = np.concatenate([v, u])
+    order = np.lexsort((targets, sources))
+    sources, targets = sources[order], targets[order]
+    row_starts = np.flatnonzero(np.r_[True, sources[1:] != sources[:-1]])
+    row_ends = np.r_[row_starts[1:], len(sources)]
+    targets = targets.tolist()
+    for node, start, end in zip(sources[row_starts].tolist(), row_starts.tolist(), row_ends.tolist()):
+        adjacency[sequences[node]] = [sequences[t] for t in targets[start:end]]
+    return adjacency
+
+
+def generate_deletion_graph(n, s, q=2, max_workers=None, method="vectorized", run_dir=None):
     """
     Generate a graph where nodes are q-ary strings of length n.
     Two nodes are connected if they share a common subsequence of length >= n-s.
@@ -126,23 +376,45 @@ def generate_deletion_graph(n, s, q=2, max_workers=None):
         s: Number of deletions to correct
         q: Alphabet size (default: 2 for binary, 4 for DNA)
         max_workers: Number of parallel workers (default: cpu_count())
+        method: Edge test, "vectorized" (bit-parallel LCS with NumPy), "dp" or "deletion_ball"
+                (bucketing by shared subsequence instead of all pairs) (default: "vectorized")
+        run_dir: If given, edges are written as sorted runs into this directory instead of being
+                 collected in memory (see edge_stream.py)
 
     Returns:
-        dict: Adjacency list representation {node: [list of neighbors]}
+        dict: Adjacency list representation {node: [list of neighbors]}, or (run_paths, num_edges)
+        if run_dir is given
     """
     if max_workers is None:
         max_workers = cpu_count()
 
-    print(f"Generating graph for n={n}, s={s}, q={q} (LCS threshold: {n-s})")
-    print(f"  Using {max_workers} workers for parallel computation")
+    if method == "vectorized":
+        compute_edges_chunk, iter_row_edges = _compute_edges_chunk_vectorized, _iter_row_edges_vectorized
+    elif method == "dp":
+        compute_edges_chunk, iter_row_edges = _compute_edges_chunk, _iter_row_edges
+    elif method != "deletion_ball":
+        raise ValueError(f"Unknown method: {method}")
+
+    print(f"Generating graph for n={n}, s={s}, q={q} (LCS threshold: {n-s}, method: {method})")
 
     # Generate q-ary alphabet: '0', '1', ..., 'q-1'
     alphabet = ''.join(str(i) for i in range(q))
     sequences = [''.join(seq) for seq in itertools.product(alphabet, repeat=n)]
     print(f"  Total nodes: {len(sequences)}")
 
-    # Build adjacency list
-    adjacency = {seq: [] for seq in sequences}
+    if method == "deletion_ball":
+        print(f"  Bucketing nodes by their {math.comb(n, s)} deletion patterns...")
+        if run_dir is not None:
+            writer = EdgeRunWriter(run_dir, len(sequences), "deletion_ball")
+            for u, v in iter_deletion_ball_pairs(n, s, q):
+                writer.add(u, v)
+            print(f"  Total edges: {writer.num_edges}")
+            return writer.close()
+        u, v = deletion_ball_pairs(n, s, q)
+        print(f"  Total edges: {len(u)}")
+        return pairs_to_adjacency(u, v, sequences)
+
+    print(f"  Using {max_workers} workers for parallel computation")
 
     # Split sequence indices into ranges for workers with balanced workload
     # Each worker processes a range of 'i' values and all corresponding j > i
@@ -184,16 +456,30 @@ def generate_deletion_graph(n, s, q=2, max_workers=None):
                 end_i = n_sequences
 
         if start_i < n_sequences:
-            worker_args.append((worker_id, start_i, end_i, sequences, n, s))
+            if run_dir is not None:
+                worker_args.append((worker_id, start_i, end_i, sequences, n, s, iter_row_edges, run_dir))
+            else:
+                worker_args.append((worker_id, start_i, end_i, sequences, n, s))
 
         current_i = end_i
 
     # Process in parallel
     print(f"  Computing common subsequences in parallel...")
     print(f"  Each worker will show its own progress bar below:\n")
+    if run_dir is not None:
+        compute_edges_chunk = _compute_edges_chunk_to_runs
     with Pool(max_workers) as pool:
         # Use imap without outer tqdm - each worker has its own progress bar
-        results = list(pool.imap(_compute_edges_chunk, worker_args))
+        results = list(pool.imap(compute_edges_chunk, worker_args))
+
+    if run_dir is not None:
+        run_paths = [path for paths, _ in results for path in paths]
+        edge_count = sum(num_edges for _, num_edges in results)
+        print(f"  Total edges: {edge_count}")
+        return run_paths, edge_count
+
+    # Build adjacency list
+    adjacency = {seq: [] for seq in sequences}
 
     # Combine results into adjacency list
     edge_count = 0
@@ -253,9 +539,10 @@ def save_graph_to_lmdb(adjacency, output_path):
     print(f"  Graph saved successfully!")
 
 
-def construct_and_save_graph(n, s, q, output_dir, max_workers=None):
+def construct_and_save_graph(n, s, q, output_dir, max_workers=None, output_format="lmdb", method="vectorized",
+                             streaming=False):
     """
-    Construct a deletion-correcting code graph and save it to LMDB.
+    Construct a deletion-correcting code graph and save it to LMDB and/or CSR.
 
     Args:
         n: Length of strings
@@ -263,16 +550,33 @@ def construct_and_save_graph(n, s, q, output_dir, max_workers=None):
         q: Alphabet size (2 for binary, 4 for DNA)
         output_dir: Directory to save the graph
         max_workers: Number of parallel workers (default: cpu_count())
+        output_format: "lmdb", "csr" or "both" (default: "lmdb")
+        method: Edge test passed to generate_deletion_graph (default: "vectorized")
+        streaming: Write edges to sorted runs in a temporary directory under output_dir and merge
+                   them into the output instead of building the adjacency in memory (default: False)
     """
-    # Generate graph
-    adjacency = generate_deletion_graph(n, s, q, max_workers=max_workers)
-
     # Create output path
-    graph_name = f"graph_d_s{s}_n{n}_q{q}.lmdb"
-    output_path = os.path.join(output_dir, graph_name)
+    graph_name = f"graph_d_s{s}_n{n}_q{q}"
+
+    if streaming:
+        with tempfile.TemporaryDirectory(prefix=graph_name + "_runs_", dir=output_dir) as run_dir:
+            run_paths, num_edges = generate_deletion_graph(n, s, q, max_workers=max_workers, method=method,
+                                                           run_dir=run_dir)
+            save_graph_stream(
+                run_paths, num_edges, n, q,
+                lmdb_path=os.path.join(output_dir, graph_name + ".lmdb") if output_format in ("lmdb", "both") else None,
+                csr_path=os.path.join(output_dir, graph_name + ".csr") if output_format in ("csr", "both") else None,
+            )
+        print()
+        return
+
+    # Generate graph
+    adjacency = generate_deletion_graph(n, s, q, max_workers=max_workers, method=method)
 
-    # Save to LMDB
-    save_graph_to_lmdb(adjacency, output_path)
+    if output_format in ("lmdb", "both"):
+        save_graph_to_lmdb(adjacency, os.path.join(output_dir, graph_name + ".lmdb"))
+    if output_format in ("csr", "both"):
+        save_graph_to_csr(adjacency, os.path.join(output_dir, graph_name + ".csr"), n, q)
     print()
 
 
@@ -290,6 +594,15 @@ if __name__ == "__main__":
     # Alphabet size: 2 for binary, 4 for DNA (quaternary)
     q = 4
 
+    # Output format: "lmdb" (JSON neighbor lists), "csr" (memory-mappable NumPy arrays) or "both"
+    output_format = "lmdb"
+
+    # Edge computation: "vectorized", "dp" or "deletion_ball" (see module docstring)
+    method = "vectorized"
+
+    # Stream edges through sorted runs on disk instead of building the adjacency in memory
+    streaming = False
+
     # Number of parallel workers (set to None to use all available CPU cores)
     max_workers = 16
 
@@ -315,7 +628,8 @@ if __name__ == "__main__":
     ]
 
     for n, s in tqdm(params, desc="Overall progress", unit="graph"):
-        construct_and_save_graph(n, s, q, OUTPUT_DIR, max_workers=max_workers)
+        construct_and_save_graph(n, s, q, OUTPUT_DIR, max_workers=max_workers, output_format=output_format, method=method,
+                                 streaming=streaming)
 
     print("=" * 70)
     print("All graphs constructed successfully!")
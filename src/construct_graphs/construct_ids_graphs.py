@@ -12,6 +12,8 @@ Usage:
 
 The script will construct graphs for the (n, s, q) tuples specified in the __main__ block
 and save them to LMDB databases in the format: graph_ids_s{s}_n{n}_q{q}.lmdb
+Set `output_format` in the __main__ block to "csr" or "both" to write the memory-mappable CSR
+format graph_ids_s{s}_n{n}_q{q}.csr instead of or in addition to LMDB (see disfun/graph_csr.py).
 
 Parallelization Strategy:
     To avoid creating a massive list of all sequence pairs in memory (which would require
@@ -33,6 +35,19 @@ Parallelization Strategy:
         Target for worker w: (w+1) * (total_pairs / num_workers)
         We want to choose boundaries k_0=0, k_1, k_2, …, k_W=N such that f(k_w) \approx \frac{w}{W} T where T is total pairs and W is number of workers and w is the worker index.
         Solve: k*N - k*(k+1)/2 = target
+
+Radius-based construction (`method="radius"` of generate_ids_graph):
+    If edit_distance(x, y) <= 2s for two strings of length n, an optimal alignment deletes at most
+    2s symbols from each and the matched symbols form a common subsequence of length >= n - 2s.
+    Candidate pairs are therefore the pairs sharing a subsequence of length n - 2s, enumerated
+    from the deletion balls of radius 2s (see iter_deletion_ball_pairs in
+    construct_deletions_graphs.py), and the workers verify each candidate with Levenshtein.distance.
+    The result is the same adjacency as the all-pairs comparison at a fraction of the pairs.
+
+Streaming (`streaming` in the __main__ block):
+    Instead of building the adjacency dict in memory, edges are written as sorted runs to a
+    temporary directory next to the output and merged node by node into LMDB and/or CSR
+    (see edge_stream.py). The output is identical to the in-memory path.
 """
 
 import itertools
@@ -40,7 +55,10 @@ import json
 import os
 import math
 import lmdb
+import sys
+import tempfile
 import Levenshtein
+import numpy as np
 import tracemalloc
 import psutil
 import threading
@@ -48,6 +66,11 @@ import time
 from tqdm import tqdm
 from multiprocessing import Pool, cpu_count
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from disfun.graph_csr import save_graph_to_csr
+from construct_deletions_graphs import iter_deletion_ball_pairs
+from edge_stream import EdgeRunWriter, save_graph_stream
+
 
 class MemoryMonitor:
     """Monitor memory usage of process and all children."""
@@ -167,6 +190,14 @@ def estimate_memory_usage(n, s, q, max_workers):
     }
 
 
+def _iter_row_edges(start_i, end_i, sequences, threshold):
+    """Yields (i, [j > i with edit distance < threshold]) for i in [start_i, end_i)."""
+    n_sequences = len(sequences)
+    for i in range(start_i, end_i):
+        seq1 = sequences[i]
+        yield i, [j for j in range(i + 1, n_sequences) if Levenshtein.distance(seq1, sequences[j]) < threshold]
+
+
 def _compute_edges_chunk(args):
     """
     Worker function to compute edges for a chunk of sequence pairs.
@@ -180,7 +211,6 @@ def _compute_edges_chunk(args):
     """
     worker_id, start_i, end_i, sequences, threshold = args
     edges = []
-    n_sequences = len(sequences)
 
     # Create progress bar for this worker at a specific vertical position
     # position=worker_id places each worker's bar at a different line
@@ -192,13 +222,9 @@ def _compute_edges_chunk(args):
         unit="idx"
     )
 
-    for i in range(start_i, end_i):
-        for j in range(i + 1, n_sequences):
-            seq1, seq2 = sequences[i], sequences[j]
-            edit_dist = Levenshtein.distance(seq1, seq2)
-
-            if edit_dist < threshold:
-                edges.append((seq1, seq2))
+    for i, neighbors in _iter_row_edges(start_i, end_i, sequences, threshold):
+        for j in neighbors:
+            edges.append((sequences[i], sequences[j]))
 
         pbar.update(1)
 
@@ -206,7 +232,65 @@ def _compute_edges_chunk(args):
     return edges
 
 
-def generate_ids_graph(n, s, q=2, max_workers=None):
+def _compute_edges_chunk_to_runs(args):
+    """
+    Streaming counterpart of `_compute_edges_chunk`: writes the edges as sorted runs into
+    `run_dir` (see edge_stream.py) instead of returning them.
+
+    Args:
+        args: Tuple of (worker_id, start_i, end_i, sequences, threshold, run_dir)
+
+    Returns:
+        (run_paths, num_edges)
+    """
+    worker_id, start_i, end_i, sequences, threshold, run_dir = args
+    writer = EdgeRunWriter(run_dir, len(sequences), f"worker{worker_id}")
+
+    pbar = tqdm(
+        total=end_i - start_i,
+        desc=f"  Worker {worker_id:2d}",
+        position=worker_id,
+        leave=True,
+        unit="idx"
+    )
+
+    for i, neighbors in _iter_row_edges(start_i, end_i, sequences, threshold):
+        writer.add(i, neighbors)
+        pbar.update(1)
+
+    pbar.close()
+    return writer.close()
+
+
+# Sequences and edge threshold of the radius method, set once per worker by _init_radius_worker
+_radius_sequences = None
+_radius_threshold = None
+
+
+def _init_radius_worker(sequences, threshold):
+    global _radius_sequences, _radius_threshold
+    _radius_sequences = sequences
+    _radius_threshold = threshold
+
+
+def _verify_candidate_pairs(pairs):
+    """
+    Worker function of the radius method: keeps the candidate pairs with edit distance < threshold.
+
+    Args:
+        pairs: Tuple (u, v) of index arrays of candidate pairs
+
+    Returns:
+        Tuple (u, v) of the index arrays of the pairs that should be connected
+    """
+    u, v = pairs
+    sequences = _radius_sequences
+    keep = np.fromiter((Levenshtein.distance(sequences[i], sequences[j]) < _radius_threshold
+                        for i, j in zip(u.tolist(), v.tolist())), dtype=bool, count=len(u))
+    return u[keep], v[keep]
+
+
+def generate_ids_graph(n, s, q=2, max_workers=None, method="all_pairs", run_dir=None):
     """
     Generate a graph where nodes are q-ary strings of length n.
     Two nodes are connected if edit_distance(node1, node2) < 2s + 1.
@@ -216,18 +300,25 @@ def generate_ids_graph(n, s, q=2, max_workers=None):
         s: Number of errors to correct (requires min distance 2s + 1)
         q: Alphabet size (default: 2 for binary, 4 for DNA)
         max_workers: Number of parallel workers (default: cpu_count())
+        method: "all_pairs" (compare every pair) or "radius" (verify only pairs sharing a
+                subsequence of length n - 2s) (default: "all_pairs")
+        run_dir: If given, edges are written as sorted runs into this directory instead of being
+                 collected in memory (see edge_stream.py)
 
     Returns:
-        dict: Adjacency list representation {node: [list of neighbors]}
+        dict: Adjacency list representation {node: [list of neighbors]}, or (run_paths, num_edges)
+        if run_dir is given
     """
     if max_workers is None:
         max_workers = cpu_count()
+    if method not in ("all_pairs", "radius"):
+        raise ValueError(f"Unknown method: {method}")
 
     # Start memory monitoring (tracks main process + all worker processes)
     memory_monitor = MemoryMonitor(interval=2.0)
     memory_monitor.start()
 
-    print(f"Generating graph for n={n}, s={s}, q={q} (min required distance: {2*s + 1})")
+    print(f"Generating graph for n={n}, s={s}, q={q} (min required distance: {2*s + 1}, method: {method})")
     print(f"  Using {max_workers} workers for parallel computation")
     print(f"  Monitoring memory usage (sampling every 2s)...")
 
@@ -257,69 +348,93 @@ def generate_ids_graph(n, s, q=2, max_workers=None):
     sequences = [''.join(seq) for seq in itertools.product(alphabet, repeat=n)]
     print(f"  Total nodes: {len(sequences)}")
 
-    # Build adjacency list
-    adjacency = {seq: [] for seq in sequences}
-
     threshold = 2 * s + 1
 
-    # Split sequence indices into ranges for workers with balanced workload
-    # Each worker processes a range of 'i' values and all corresponding j > i
-    # This avoids creating massive pair lists in memory
-    n_sequences = len(sequences)
-    total_pairs = n_sequences * (n_sequences - 1) // 2
-    pairs_per_worker = total_pairs / max_workers
-
-    def cumulative_pairs_at_index(k):
-        """Calculate total pairs from i=0 to i=k-1"""
-        return k * n_sequences - k * (k + 1) // 2
-
-    worker_args = []
-    current_i = 0
-
-    for worker_id in range(max_workers):
-        start_i = current_i
-        target_cumulative = int((worker_id + 1) * pairs_per_worker)
-
-        if worker_id == max_workers - 1:
-            # Last worker gets all remaining indices
-            end_i = n_sequences
-        else:
-            # Use closed-form solution to find end_i
-            # Solve: k*n_sequences - k*(k+1)/2 = target
-            # Rearranging: k^2 + k - 2*k*n_sequences + 2*target = 0
-            # k^2 - k*(2*n_sequences - 1) + 2*target = 0
-            a = 1
-            b = -(2 * n_sequences - 1)
-            c = 2 * target_cumulative
-            discriminant = b * b - 4 * a * c
-
-            if discriminant >= 0:
-                k = (-b - math.sqrt(discriminant)) / (2 * a)
-                end_i = int(math.ceil(k))
-                # Clamp to valid range
-                end_i = max(start_i + 1, min(end_i, n_sequences))
+    if method == "radius":
+        # Edit distance <= 2s implies a common subsequence of length n - 2s (see module docstring)
+        print(f"  Verifying pairs that share a subsequence of length {max(n - 2*s, 0)} in parallel...")
+        candidates = iter_deletion_ball_pairs(n, min(2 * s, n), q)
+        with Pool(max_workers, initializer=_init_radius_worker, initargs=(sequences, threshold)) as pool:
+            # imap keeps the candidate order, so edges arrive sorted as in the all-pairs method
+            if run_dir is not None:
+                writer = EdgeRunWriter(run_dir, len(sequences), "radius")
+                for u, v in pool.imap(_verify_candidate_pairs, candidates):
+                    writer.add(u, v)
+                results = [writer.close()]
             else:
+                results = [[(sequences[i], sequences[j]) for i, j in zip(u.tolist(), v.tolist())]
+                           for u, v in pool.imap(_verify_candidate_pairs, candidates)]
+    else:
+        # Split sequence indices into ranges for workers with balanced workload
+        # Each worker processes a range of 'i' values and all corresponding j > i
+        # This avoids creating massive pair lists in memory
+        n_sequences = len(sequences)
+        total_pairs = n_sequences * (n_sequences - 1) // 2
+        pairs_per_worker = total_pairs / max_workers
+
+        def cumulative_pairs_at_index(k):
+            """Calculate total pairs from i=0 to i=k-1"""
+            return k * n_sequences - k * (k + 1) // 2
+
+        worker_args = []
+        current_i = 0
+
+        for worker_id in range(max_workers):
+            start_i = current_i
+            target_cumulative = int((worker_id + 1) * pairs_per_worker)
+
+            if worker_id == max_workers - 1:
+                # Last worker gets all remaining indices
                 end_i = n_sequences
-
-        if start_i < n_sequences:
-            worker_args.append((worker_id, start_i, end_i, sequences, threshold))
-
-        current_i = end_i
-
-    # Process in parallel
-    print(f"  Computing edit distances in parallel...")
-    print(f"  Each worker will show its own progress bar below:\n")
-    with Pool(max_workers) as pool:
-        # Use imap without outer tqdm - each worker has its own progress bar
-        results = list(pool.imap(_compute_edges_chunk, worker_args))
-
-    # Combine results into adjacency list
-    edge_count = 0
-    for edges in results:
-        for seq1, seq2 in edges:
-            adjacency[seq1].append(seq2)
-            adjacency[seq2].append(seq1)
-            edge_count += 1
+            else:
+                # Use closed-form solution to find end_i
+                # Solve: k*n_sequences - k*(k+1)/2 = target
+                # Rearranging: k^2 + k - 2*k*n_sequences + 2*target = 0
+                # k^2 - k*(2*n_sequences - 1) + 2*target = 0
+                a = 1
+                b = -(2 * n_sequences - 1)
+                c = 2 * target_cumulative
+                discriminant = b * b - 4 * a * c
+
+                if discriminant >= 0:
+                    k = (-b - math.sqrt(discriminant)) / (2 * a)
+                    end_i = int(math.ceil(k))
+                    # Clamp to valid range
+                    end_i = max(start_i + 1, min(end_i, n_sequences))
+                else:
+                    end_i = n_sequences
+
+            if start_i < n_sequences:
+                if run_dir is not None:
+                    worker_args.append((worker_id, start_i, end_i, sequences, threshold, run_dir))
+                else:
+                    worker_args.append((worker_id, start_i, end_i, sequences, threshold))
+
+            current_i = end_i
+
+        # Process in parallel
+        print(f"  Computing edit distances in parallel...")
+        print(f"  Each worker will show its own progress bar below:\n")
+        compute_edges_chunk = _compute_edges_chunk_to_runs if run_dir is not None else _compute_edges_chunk
+        with Pool(max_workers) as pool:
+            # Use imap without outer tqdm - each worker has its own progress bar
+            results = list(pool.imap(compute_edges_chunk, worker_args))
+
+    if run_dir is not None:
+        # Results are (run_paths, num_edges) per writer
+        run_paths = [path for paths, _ in results for path in paths]
+        edge_count = sum(num_edges for _, num_edges in results)
+        result = (run_paths, edge_count)
+    else:
+        # Combine results into adjacency list
+        adjacency = {seq: [] for seq in sequences}
+        edge_count = 0
+        for edges in results:
+            for seq1, seq2 in edges:
+                adjacency[seq1].append(seq2)
+                adjacency[seq2].append(seq1)
+                edge_count += 1
+        result = adjacency
 
     print(f"  Total edges: {edge_count}")
 
@@ -333,7 +448,7 @@ def generate_ids_graph(n, s, q=2, max_workers=None):
     else:
         print(f"    WARNING: Exceeded estimate by {peak_memory_gb - mem_estimate['total']:.2f} GB")
 
-    return adjacency
+    return result
 
 
 def save_graph_to_lmdb(adjacency, output_path):
@@ -382,9 +497,10 @@ def save_graph_to_lmdb(adjacency, output_path):
     print(f"  Graph saved successfully!")
 
 
-def construct_and_save_graph(n, s, q, output_dir, max_workers=None):
+def construct_and_save_graph(n, s, q, output_dir, max_workers=None, output_format="lmdb", method="all_pairs",
+                             streaming=False):
     """
-    Construct an IDS graph and save it to LMDB.
+    Construct an IDS graph and save it to LMDB and/or CSR.
 
     Args:
         n: Length of strings
@@ -392,16 +508,33 @@ def construct_and_save_graph(n, s, q, output_dir, max_workers=None):
         q: Alphabet size (2 for binary, 4 for DNA)
         output_dir: Directory to save the graph
         max_workers: Number of parallel workers (default: cpu_count())
+        output_format: "lmdb", "csr" or "both" (default: "lmdb")
+        method: "all_pairs" or "radius", passed to generate_ids_graph (default: "all_pairs")
+        streaming: Write edges to sorted runs in a temporary directory under output_dir and merge
+                   them into the output instead of building the adjacency in memory (default: False)
     """
-    # Generate graph
-    adjacency = generate_ids_graph(n, s, q, max_workers=max_workers)
-
     # Create output path
-    graph_name = f"graph_ids_s{s}_n{n}_q{q}.lmdb"
-    output_path = os.path.join(output_dir, graph_name)
+    graph_name = f"graph_ids_s{s}_n{n}_q{q}"
+
+    if streaming:
+        with tempfile.TemporaryDirectory(prefix=graph_name + "_runs_", dir=output_dir) as run_dir:
+            run_paths, num_edges = generate_ids_graph(n, s, q, max_workers=max_workers, method=method,
+                                                      run_dir=run_dir)
+            save_graph_stream(
+                run_paths, num_edges, n, q,
+                lmdb_path=os.path.join(output_dir, graph_name + ".lmdb") if output_format in ("lmdb", "both") else None,
+                csr_path=os.path.join(output_dir, graph_name + ".csr") if output_format in ("csr", "both") else None,
+            )
+        print()
+        return
+
+    # Generate graph
+    adjacency = generate_ids_graph(n, s, q, max_workers=max_workers, method=method)
 
-    # Save to LMDB
-    save_graph_to_lmdb(adjacency, output_path)
+    if output_format in ("lmdb", "both"):
+        save_graph_to_lmdb(adjacency, os.path.join(output_dir, graph_name + ".lmdb"))
+    if output_format in ("csr", "both"):
+        save_graph_to_csr(adjacency, os.path.join(output_dir, graph_name + ".csr"), n, q)
     print()
 
 
@@ -419,6 +552,15 @@ if __name__ == "__main__":
     # Alphabet size: 2 for binary, 4 for DNA (quaternary)
     q = 4
 
+    # Output format: "lmdb" (JSON neighbor lists), "csr" (memory-mappable NumPy arrays) or "both"
+    output_format = "lmdb"
+
+    # Edge computation: "all_pairs" or "radius" (see module docstring)
+    method = "all_pairs"
+
+    # Stream edges through sorted runs on disk instead of building the adjacency in memory
+    streaming = False
+
     # Number of parallel workers (set to None to use all available CPU cores)
     max_workers = 15
 
@@ -444,7 +586,8 @@ if __name__ == "__main__":
     ]
 
     for n, s in tqdm(params, desc="Overall progress", unit="graph"):
-        construct_and_save_graph(n, s, q, OUTPUT_DIR, max_workers=max_workers)
+        construct_and_save_graph(n, s, q, OUTPUT_DIR, max_workers=max_workers, output_format=output_format, method=method,
+                                 streaming=streaming)
 
     print("=" * 70)
     print("All graphs constructed successfully!")
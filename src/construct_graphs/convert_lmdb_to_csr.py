@@ -0,0 +1,52 @@
+"""
+Standalone script to convert existing LMDB graphs to the CSR format of disfun/graph_csr.py.
+
+Each graph_*_s{s}_n{n}_q{q}.lmdb is written next to itself as graph_*_s{s}_n{n}_q{q}.csr, with
+n and q taken from the graph name. Graphs that already have a .csr counterpart are skipped.
+
+Usage:
+    python convert_lmdb_to_csr.py                 # converts every graph in src/graphs
+    python convert_lmdb_to_csr.py PATH [PATH ...] # converts the given .lmdb graphs or directories
+"""
+
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from disfun import graph_csr
+
+
+def find_lmdb_graphs(paths):
+    graphs = []
+    for path in paths:
+        path = os.path.normpath(path)
+        if path.endswith(".lmdb"):
+            graphs.append(path)
+        else:
+            graphs.extend(sorted(glob.glob(os.path.join(path, "*.lmdb"))))
+    return graphs
+
+
+def convert_graph(lmdb_path):
+    output_path = lmdb_path[:-len(".lmdb")] + ".csr"
+    if os.path.exists(os.path.join(output_path, "meta.json")):
+        print(f"Skipping {lmdb_path} ({output_path} exists)")
+        return
+    if not os.path.exists(os.path.join(lmdb_path, "data.mdb")):
+        print(f"Skipping {lmdb_path} (empty LMDB directory)")
+        return
+
+    start = time.time()
+    graph = graph_csr.convert_lmdb_to_csr(lmdb_path, output_path)
+    print(f"Converted {lmdb_path} -> {output_path}: {graph.num_nodes:,} nodes, "
+          f"{graph.num_edges:,} edges in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    paths = sys.argv[1:] or [os.path.join(SCRIPT_DIR, "../graphs")]
+
+    for lmdb_path in find_lmdb_graphs(paths):
+        convert_graph(lmdb_path)
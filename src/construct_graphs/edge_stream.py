@@ -0,0 +1,207 @@
+"""
+Streaming edge pipeline for graph construction with bounded memory.
+
+Instead of collecting all edges as tuples of strings and building an adjacency dict, workers write
+edges into sorted runs on disk and an external merge emits the neighbors of one node at a time
+straight to the output store:
+
+    1. EdgeRunWriter: each edge (u, v) is stored in both directions as an int64 key
+       u * N + v (N = q^n nodes, node ids are base-q values). Keys are buffered up to
+       RUN_MAX_KEYS, sorted and written to a binary run file.
+    2. merge_runs: k-way merge of the runs, memory-mapped and consumed in chunks, yields the keys
+       in ascending order.
+    3. iter_neighbor_blocks: groups the merged keys by node, yields (node, neighbor ids) for every
+       node in order, including nodes without neighbors.
+    4. save_graph_stream: writes the blocks to LMDB and/or CSR while they are produced.
+
+Memory is bounded by the run buffer, the merge chunks and per-node arrays (node labels, CSR
+indptr), independent of the number of edges. Neighbors come out in ascending order, which is the
+same order the in-memory construction produces.
+"""
+
+import json
+import os
+import sys
+
+import lmdb
+import numpy as np
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from disfun import graph_csr
+
+# Keys buffered by a run writer before a run is sorted and written (8 bytes per key)
+RUN_MAX_KEYS = 1 << 23
+
+# Keys held by the merge across all runs at once
+MERGE_MAX_KEYS = 1 << 23
+
+# Nodes written per LMDB write transaction, bounds LMDB's dirty pages
+LMDB_NODES_PER_TXN = 100_000
+
+
+class EdgeRunWriter:
+    """Buffers edges as int64 keys and writes them as sorted runs into `run_dir`."""
+
+    def __init__(self, run_dir, n_sequences, name, max_keys=RUN_MAX_KEYS):
+        self.run_dir = run_dir
+        self.n_sequences = n_sequences
+        self.name = name
+        self.max_keys = max_keys
+        self.buffer = []
+        self.buffered = 0
+        self.run_paths = []
+        self.num_edges = 0
+
+    def add(self, u, v):
+        """Adds the edges between u and v (scalars or equally long index arrays) in both directions."""
+        u = np.asarray(u, dtype=np.int64)
+        v = np.atleast_1d(np.asarray(v, dtype=np.int64))
+        if v.size == 0:
+            return
+        u = np.broadcast_to(u, v.shape)
+        self.buffer.append(u * self.n_sequences + v)
+        self.buffer.append(v * self.n_sequences + u)
+        self.buffered += 2 * v.size
+        self.num_edges += v.size
+        if self.buffered >= self.max_keys:
+            self.flush()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        keys = np.concatenate(self.buffer)
+        keys.sort()
+        path = os.path.join(self.run_dir, f"{self.name}_run{len(self.run_paths)}.bin")
+        keys.tofile(path)
+        self.run_paths.append(path)
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self):
+        """Writes the remaining keys. Returns (run_paths, num_edges)."""
+        self.flush()
+        return self.run_paths, self.num_edges
+
+
+def merge_runs(run_paths, max_keys=MERGE_MAX_KEYS):
+    """Yields the keys of all sorted runs as ascending int64 chunks."""
+    runs = [np.memmap(path, dtype=np.int64, mode="r") for path in run_paths if os.path.getsize(path) > 0]
+    positions = [0] * len(runs)
+    chunk_size = max(1 << 12, max_keys // max(len(runs), 1))
+
+    while True:
+        active = [r for r in range(len(runs)) if positions[r] < len(runs[r])]
+        if not active:
+            return
+        chunks = {r: runs[r][positions[r]:positions[r] + chunk_size] for r in active}
+        # Everything up to the smallest last key of a run that continues beyond its chunk is final
+        continuing = [chunks[r][-1] for r in active if positions[r] + len(chunks[r]) < len(runs[r])]
+        bound = min(continuing) if continuing else None
+
+        parts = []
+        for r in active:
+            chunk = chunks[r]
+            count = len(chunk) if bound is None else int(np.searchsorted(chunk, bound, side="right"))
+            parts.append(np.asarray(chunk[:count]))
+            positions[r] += count
+        merged = np.concatenate(parts)
+        merged.sort()
+        yield merged
+
+
+def iter_neighbor_blocks(key_chunks, n_sequences):
+    """Yields (node, neighbor id array) for nodes 0..n_sequences-1 from ascending key chunks."""
+    empty = np.empty(0, dtype=np.int64)
+    next_node = 0
+    pending_node, pending = None, []
+
+    for keys in key_chunks:
+        if len(keys) == 0:
+            continue
+        sources, targets = np.divmod(keys, n_sequences)
+        starts = np.flatnonzero(np.r_[True, sources[1:] != sources[:-1]])
+        ends = np.r_[starts[1:], len(keys)]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            node = int(sources[start])
+            if node == pending_node:
+                pending.append(targets[start:end])
+                continue
+            if pending_node is not None:
+                yield pending_node, np.concatenate(pending)
+                next_node = pending_node + 1
+            while next_node < node:
+                yield next_node, empty
+                next_node += 1
+            pending_node, pending = node, [targets[start:end]]
+
+    if pending_node is not None:
+        yield pending_node, np.concatenate(pending)
+        next_node = pending_node + 1
+    while next_node < n_sequences:
+        yield next_node, empty
+        next_node += 1
+
+
+def _lmdb_map_size(num_nodes, num_edges):
+    """LMDB map size with the estimate of save_graph_to_lmdb."""
+    avg_neighbors = 2 * num_edges / num_nodes if num_nodes > 0 else 0
+    estimated_total_bytes = num_nodes * (100 + avg_neighbors * 20)
+    map_size_gb = max(10, int(estimated_total_bytes * 1.5) // (1024**3) + 1)
+    return map_size_gb * 1024 * 1024 * 1024
+
+
+def save_graph_stream(run_paths, num_edges, n, q, lmdb_path=None, csr_path=None):
+    """
+    Merges edge runs and writes the graph to LMDB and/or CSR in a single pass.
+
+    Args:
+        run_paths: Sorted run files written by EdgeRunWriter
+        num_edges: Number of undirected edges in the runs
+        n: Length of node strings
+        q: Alphabet size
+        lmdb_path: Output LMDB directory (same layout as save_graph_to_lmdb), or None
+        csr_path: Output CSR directory (same layout as graph_csr.write_csr), or None
+    """
+    n_sequences = q ** n
+    sequences = graph_csr.node_labels(n, q) if lmdb_path else None
+
+    env = txn = None
+    if lmdb_path:
+        print(f"Saving graph to {lmdb_path}")
+        env = lmdb.open(lmdb_path, map_size=_lmdb_map_size(n_sequences, num_edges))
+        txn = env.begin(write=True)
+
+    indptr = indices = None
+    if csr_path:
+        print(f"Saving graph to {csr_path}")
+        os.makedirs(csr_path, exist_ok=True)
+        indptr = np.zeros(n_sequences + 1, dtype=np.int64)
+        indices = np.lib.format.open_memmap(os.path.join(csr_path, "indices.npy"), mode="w+",
+                                            dtype=graph_csr.index_dtype(n_sequences), shape=(2 * num_edges,))
+
+    offset = 0
+    blocks = iter_neighbor_blocks(merge_runs(run_paths), n_sequences)
+    for node, neighbors in tqdm(blocks, total=n_sequences, desc="  Writing graph", unit="nodes"):
+        if txn is not None:
+            neighbor_labels = [sequences[v] for v in neighbors.tolist()]
+            txn.put(sequences[node].encode('utf-8'), json.dumps(neighbor_labels).encode('utf-8'))
+            if (node + 1) % LMDB_NODES_PER_TXN == 0:
+                txn.commit()
+                txn = env.begin(write=True)
+        if indices is not None:
+            indices[offset:offset + len(neighbors)] = neighbors
+            offset += len(neighbors)
+            indptr[node + 1] = offset
+
+    if txn is not None:
+        txn.commit()
+        env.close()
+    if indices is not None:
+        indices.flush()
+        del indices
+        np.save(os.path.join(csr_path, "indptr.npy"), indptr)
+        meta = {"n": n, "q": q, "num_nodes": n_sequences, "num_edges": num_edges}
+        with open(os.path.join(csr_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+    print(f"  Graph saved successfully!")
@@ -46,15 +46,20 @@ import GPUtil
 import pynvml
 
 from disfun import (
+    checkpoint_log,
     programs_database,
     sampler,
     code_manipulation,
+    database_shards,
     evaluator,
     gpt,
+    llm_backends,
+    message_codec,
     process_utils,
+    transport,
 )
 from disfun.scaling_utils import ResourceManager
-from disfun.process_entry import sampler_process_entry, evaluator_process_entry
+from disfun.process_entry import sampler_process_entry, evaluator_process_entry, database_process_entry, programs_database_kwargs
 import importlib.util
 
 # Disable multi-threaded tokenization.
@@ -174,13 +179,16 @@ class TaskManager:
         self.database_connection = None
         self.sampler_channel = None
         self.database_channel = None
-        if self.config.sampler.gpt:
-            # if inference over API execution over cpus only
+        if not llm_backends.uses_gpu(self.config.sampler):
+            # if inference over API (or mock backend) execution over cpus only
             self.resource_manager = ResourceManager(log_dir=log_dir, cpu_only=True, scaling_config=self.config.scaling)
         else:
             self.resource_manager = ResourceManager(log_dir=log_dir, scaling_config=self.config.scaling)
         self.process_to_device_map = {}
         self.target_signatures = target_signatures
+        self.transport = transport.create_transport(config)
+        # Started processes get the queues of a LocalTransport; with AMQP they connect themselves
+        self.child_transport = self.transport if self.transport.is_local else None
 
     def initialize_logger(self, log_dir):
         logger = logging.getLogger('main_logger')
@@ -205,16 +213,11 @@ class TaskManager:
         attempt = 0
         while attempt < max_retries:
             try:
-                sampler_connection = await process_utils.create_rabbitmq_connection(
-                    self.config, timeout=300
-                )
+                sampler_connection = await self.transport.connect(timeout=300)
                 sampler_channel = await sampler_connection.channel()
 
                 # Ensure the evaluator_queue is declared
-                await sampler_channel.declare_queue(
-                    "evaluator_queue", durable=False, auto_delete=False,
-                    arguments={'x-consumer-timeout': 360000000}
-                )
+                await self.transport.declare_queue(sampler_channel, "evaluator_queue")
 
                 await sampler_channel.default_exchange.publish(
                     aio_pika.Message(body=initial_program_data.encode()),
@@ -273,7 +276,7 @@ class TaskManager:
             else:
                 # Option 2: Load run name from checkpoint file
                 try:
-                    with open(checkpoint_file, 'rb') as f:
+                    with open(checkpoint_log.snapshot_file_of(checkpoint_file), 'rb') as f:
                         checkpoint_data = pickle.load(f)
                         run_name = checkpoint_data.get('wandb_run_name', None)
                         if run_name:
@@ -296,9 +299,7 @@ class TaskManager:
         self.logger.info(f"Checkpoints will be saved to: {save_checkpoints_path}")
 
         try:
-            connection = await process_utils.create_rabbitmq_connection(
-                self.config, timeout=300
-            )
+            connection = await self.transport.connect(timeout=300)
         except Exception as e:
             self.logger.error(f"Cannot connect to RabbitMQ: {e}")
             self.logger.info("Cannot connect to rabbitmq. Change config file.")
@@ -320,32 +321,29 @@ class TaskManager:
 
         try:
             # Create connections and declare queues
-            self.sampler_connection = await process_utils.create_rabbitmq_connection(
-                self.config, timeout=300
-            )
+            self.sampler_connection = await self.transport.connect(timeout=300)
             self.sampler_channel = await self.sampler_connection.channel()
 
-            self.database_connection = await process_utils.create_rabbitmq_connection(
-                self.config, timeout=300
-            )
+            self.database_connection = await self.transport.connect(timeout=300)
             self.database_channel = await self.database_connection.channel()
 
-            evaluator_queue = await process_utils.declare_standard_queue(self.sampler_channel, "evaluator_queue")
-            sampler_queue = await process_utils.declare_standard_queue(self.sampler_channel, "sampler_queue")
-            database_queue = await process_utils.declare_standard_queue(self.database_channel, "database_queue")
+            evaluator_queue = await self.transport.declare_queue(self.sampler_channel, "evaluator_queue")
+            sampler_queue = await self.transport.declare_queue(self.sampler_channel, "sampler_queue")
+            # Declare the queues of all database shards before evaluators publish to them
+            num_shards = getattr(self.config, 'num_pdb', 1)
+            database_queues = [await self.transport.declare_queue(self.database_channel, name)
+                               for name in database_shards.database_queue_names(num_shards)]
+            database_queue = database_queues[0]
             try:
-                # Now create the database instance
+                # Now create the database instance (shard 0 if the islands are sharded)
                 database = programs_database.ProgramsDatabase(
                     self.database_connection, self.database_channel, database_queue,
                     sampler_queue, evaluator_queue, self.config.programs_database,
-                    self.template_pdb, function_to_evolve, checkpoint_file, save_checkpoints_path,
-                    mode=self.config.evaluator.mode, eval_code=self.config.evaluator.eval_code, include_nx=self.config.evaluator.include_nx,
-                    start_n=self.config.evaluator.start_n, end_n=self.config.evaluator.end_n, s_values=self.config.evaluator.s_values, no_deduplication=self.config.programs_database.no_deduplication, prompt_limit=self.config.termination.prompt_limit if hasattr(self.config, 'termination') and self.config.termination else 400_000_000, optimal_solution_programs=self.config.termination.optimal_solution_programs if hasattr(self.config, 'termination') and self.config.termination else 200_000, target_signatures=self.target_signatures,
-                    show_eval_scores=self.config.prompt.show_eval_scores, display_mode=self.config.prompt.display_mode, best_known_solutions=self.config.prompt.best_known_solutions, absolute_label=self.config.prompt.absolute_label, relative_label=self.config.prompt.relative_label, q=self.config.evaluator.q,
-                    wandb_config=self.config.wandb,
-                    sampler_config=self.config.sampler,
-                    evaluator_config=self.config.evaluator,
-                    run_name=run_name
+                    self.template_pdb, function_to_evolve,
+                    database_shards.shard_checkpoint_file(checkpoint_file, 0, num_shards),
+                    database_shards.shard_checkpoints_path(save_checkpoints_path, 0, num_shards),
+                    publisher=process_utils.create_publisher(self.database_channel, self.config),
+                    **programs_database_kwargs(self.config, self.target_signatures, run_name, shard_id=0)
                 )
                 database_task = asyncio.create_task(database.consume_and_process())
             except Exception as e:
@@ -353,6 +351,10 @@ class TaskManager:
 
             checkpoint_task = asyncio.create_task(database.periodic_checkpoint())
             wandb_logging_task = asyncio.create_task(database.periodic_wandb_logging())
+            shard_tasks = []
+            if num_shards > 1:
+                shard_tasks = await self.start_database_shards(database, sampler_queue, evaluator_queue,
+                                                               checkpoint_file, save_checkpoints_path, run_name)
 
             # Start consumers before publishing
             try:
@@ -382,7 +384,7 @@ class TaskManager:
             # Start resource logging
             resource_logging_task = asyncio.create_task(self.resource_manager.log_resource_stats_periodically(interval=60))
 
-            self.tasks = [database_task, checkpoint_task, wandb_logging_task, resource_logging_task]
+            self.tasks = [database_task, checkpoint_task, wandb_logging_task, resource_logging_task] + shard_tasks
 
             if enable_scaling:
                 try:
@@ -404,6 +406,7 @@ class TaskManager:
                             max_samplers=self.config.scaling.max_samplers if hasattr(self.config, 'scaling') and self.config.scaling else 1000,
                             check_interval=self.config.scaling.check_interval if hasattr(self.config, 'scaling') and self.config.scaling else 120,
                             log_filename=self.log_filename,
+                            transport=self.child_transport,
                         )
                     )
                     self.tasks.append(scaling_task)
@@ -411,7 +414,7 @@ class TaskManager:
                     self.logger.error(f"Error enabling scaling {e}")
 
             self.channels = [self.database_channel, self.sampler_channel]
-            self.queues = ["database_queue", "sampler_queue", "evaluator_queue"]
+            self.queues = list(database_shards.database_queue_names(num_shards)) + ["sampler_queue", "evaluator_queue"]
 
             # Run all tasks concurrently
             await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -420,17 +423,53 @@ class TaskManager:
             self.logger.error(f"Exception occurred in main_task: {e}")
 
 
+    async def start_database_shards(self, database, sampler_queue, evaluator_queue, checkpoint_file, save_checkpoints_path, run_name):
+        """
+        Starts database shards 1..num_pdb-1 in their own processes and, in this process, the
+        coordinator of all shards and the reports of shard 0. Returns the tasks of this process.
+        """
+        num_shards = self.config.num_pdb
+        self.logger.info(f"Database islands are partitioned across {num_shards} shards; shard 0 owns islands {database._owned_island_ids}.")
+        coordinator_channel = await self.database_connection.channel()
+        coordinator_queue = await self.transport.declare_queue(coordinator_channel, database_shards.COORDINATOR_QUEUE)
+        coordinator = database_shards.DatabaseCoordinator(
+            self.database_connection, coordinator_channel, coordinator_queue, sampler_queue, evaluator_queue,
+            self.config.programs_database, num_shards, codec=message_codec.from_config(self.config.rabbitmq))
+
+        ctx = mp.get_context('spawn')
+        for shard_id in range(1, num_shards):
+            proc = ctx.Process(
+                target=database_process_entry,
+                args=(self.config_path, self.template_pdb, self.target_signatures, self.log_dir, self.log_filename, shard_id,
+                      database_shards.shard_checkpoint_file(checkpoint_file, shard_id, num_shards),
+                      database_shards.shard_checkpoints_path(save_checkpoints_path, shard_id, num_shards),
+                      run_name),
+                kwargs={"transport": self.child_transport},
+                name=f"Database-{shard_id}"
+            )
+            proc.start()
+            self.logger.info(f"Started Database shard {shard_id} with PID: {proc.pid}")
+            self.database_processes.append(proc)
+
+        report_interval = getattr(self.config.programs_database, 'shard_report_interval', 5.0)
+        return [
+            asyncio.create_task(coordinator.consume_and_process()),
+            asyncio.create_task(coordinator.periodic_logging()),
+            asyncio.create_task(database.periodic_shard_report(report_interval)),
+        ]
+
     def start_initial_processes(self, function_to_evolve, checkpoint_file):
 
-        # If self.config.sampler.gpt is True, just start samplers without GPU device assignment
-        if self.config.sampler.gpt:
-            self.logger.info("GPT mode enabled. Starting sampler processes without GPU device assignment.")
+        # In GPT mode or with the mock backend, just start samplers without GPU device assignment
+        if not llm_backends.uses_gpu(self.config.sampler):
+            self.logger.info("GPT mode or mock backend enabled. Starting sampler processes without GPU device assignment.")
             ctx = mp.get_context('spawn')  # Use spawn to avoid fork+threading deadlocks
             for i in range(self.config.num_samplers):
                 device = None
                 try:
                     # Pass log filename so child processes write to same file
-                    proc = ctx.Process(target=sampler_process_entry, args=(self.config_path, device, self.log_dir, self.log_filename), name=f"Sampler-{i}")
+                    proc = ctx.Process(target=sampler_process_entry, args=(self.config_path, device, self.log_dir, self.log_filename),
+                                       kwargs={"transport": self.child_transport}, name=f"Sampler-{i}")
                     proc.start()
                     self.logger.info(f"Started Sampler Process {i} (GPT mode) with PID: {proc.pid}")
                     self.sampler_processes.append(proc)
@@ -461,7 +500,8 @@ class TaskManager:
                 self.logger.info(f"Assigning sampler {i} to GPU {device} (host GPU: {host_gpu})")
                 try:
                     # Pass log filename so child processes write to same file
-                    proc = ctx.Process(target=sampler_process_entry, args=(self.config_path, device, self.log_dir, self.log_filename), name=f"Sampler-{i}")
+                    proc = ctx.Process(target=sampler_process_entry, args=(self.config_path, device, self.log_dir, self.log_filename),
+                                       kwargs={"transport": self.child_transport}, name=f"Sampler-{i}")
                     proc.start()
                     self.logger.info(f"Started Sampler Process {i} with PID: {proc.pid} on GPU {device}")
                     self.sampler_processes.append(proc)
@@ -482,6 +522,7 @@ class TaskManager:
                 target=evaluator_process_entry,
                 # Pass log filename so child processes write to same file
                 args=(self.config_path, self.template, self.inputs, self.target_signatures, self.log_dir, self.sandbox_base_path, self.log_filename),
+                kwargs={"transport": self.child_transport},
                 name=f"Evaluator-{i}"
             )
             proc.start()
@@ -549,29 +590,31 @@ class TaskManager:
             nonlocal connection, channel, sampler_task, sampler_instance, cleanup_done
             try:
                 self.logger.info(f"Sampler {local_id}: Starting connection to RabbitMQ on device {device}...")
-                connection = await process_utils.create_rabbitmq_connection(
-                    self.config, timeout=300
-                )
+                connection = await self.transport.connect(timeout=300)
                 self.logger.info(f"Sampler {local_id}: Connected to RabbitMQ successfully.")
                 channel = await connection.channel()
                 self.logger.info(f"Sampler {local_id}: Channel established.")
 
-                sampler_queue = await process_utils.declare_standard_queue(channel, "sampler_queue")
+                sampler_queue = await self.transport.declare_queue(channel, "sampler_queue")
                 self.logger.info(f"Sampler {local_id}: Declared sampler_queue.")
 
-                evaluator_queue = await process_utils.declare_standard_queue(channel, "evaluator_queue")
+                evaluator_queue = await self.transport.declare_queue(channel, "evaluator_queue")
                 self.logger.info(f"Sampler {local_id}: Declared evaluator_queue.")
 
                 try:
                     if self.config.sampler.gpt:
                         self.logger.info(f"Sampler {local_id}: Initializing GPT sampler...")
                         sampler_instance = gpt.Sampler(
-                            connection, channel, sampler_queue, evaluator_queue, self.config.sampler)
+                            connection, channel, sampler_queue, evaluator_queue, self.config.sampler,
+                            codec=message_codec.from_config(self.config.rabbitmq),
+                            publisher=process_utils.create_publisher(channel, self.config))
                         self.logger.info(f"Sampler {local_id}: GPT Sampler instance initialized successfully.")
                     else:
                         self.logger.info(f"Sampler {local_id}: Initializing LLM sampler on device {device}...")
                         sampler_instance = sampler.Sampler(
-                            connection, channel, sampler_queue, evaluator_queue, self.config.sampler, device)
+                            connection, channel, sampler_queue, evaluator_queue, self.config.sampler, device,
+                            codec=message_codec.from_config(self.config.rabbitmq),
+                            publisher=process_utils.create_publisher(channel, self.config))
                         self.logger.info(f"Sampler {local_id}: LLM Sampler instance initialized successfully on device {device}.")
                 except Exception as e:
                     self.logger.error(f"Sampler {local_id}: Could not start Sampler instance - {e}", exc_info=True)
@@ -675,13 +718,12 @@ class TaskManager:
             nonlocal connection, channel, evaluator_task, evaluator_instance, cleanup_done
 
             try:
-                connection = await process_utils.create_rabbitmq_connection(
-                    self.config, timeout=300
-                )
+                connection = await self.transport.connect(timeout=300)
                 channel = await connection.channel()
 
-                evaluator_queue = await process_utils.declare_standard_queue(channel, "evaluator_queue")
-                database_queue = await process_utils.declare_standard_queue(channel, "database_queue")
+                evaluator_queue = await self.transport.declare_queue(channel, "evaluator_queue")
+                database_queue = await self.transport.declare_queue(
+                    channel, database_shards.shard_queue_name(0, getattr(self.config, 'num_pdb', 1)))
 
                 evaluator_instance = evaluator.Evaluator(
                     connection, channel, evaluator_queue, database_queue,
@@ -689,7 +731,14 @@ class TaskManager:
                     timeout_seconds=self.config.evaluator.timeout,
                     local_id=local_id,
                     target_signatures=self.target_signatures,
-                    max_workers=self.config.evaluator.max_workers
+                    max_workers=self.config.evaluator.max_workers,
+                    max_samples_in_flight=getattr(self.config.evaluator, 'max_samples_in_flight', 2),
+                    sandbox_mode=getattr(self.config.evaluator, 'sandbox_mode', 'subprocess'),
+                    warm_worker_max_calls=getattr(self.config.evaluator, 'warm_worker_max_calls', 100),
+                    graph_cache_mb=getattr(self.config.evaluator, 'graph_cache_mb', 0),
+                    codec=message_codec.from_config(self.config.rabbitmq),
+                    publisher=process_utils.create_publisher(channel, self.config),
+                    num_database_shards=getattr(self.config, 'num_pdb', 1)
                 )
 
                 # Create the evaluator task.
@@ -1044,32 +1093,36 @@ if __name__ == "__main__":
             print(f"Error closing main connection: {e}")
 
         # Explicitly delete queues to ensure cleanup even if consumers didn't disconnect cleanly
-        print("Attempting to delete RabbitMQ queues...")
-        try:
-            cleanup_connection = await process_utils.create_rabbitmq_connection(
-                main.task_manager.config, timeout=5
-            )
-            cleanup_channel = await cleanup_connection.channel()
-
-            for queue_name in ['evaluator_queue', 'sampler_queue', 'database_queue']:
-                try:
-                    # Declare the queue first (passive=False) so we can delete it
-                    queue = await cleanup_channel.declare_queue(
-                        queue_name,
-                        durable=False,
-                        auto_delete=False,
-                        passive=False  # Create if doesn't exist, get if exists
-                    )
-                    await queue.delete(if_unused=False, if_empty=False)
-                    print(f"Deleted queue: {queue_name}")
-                except Exception as e:
-                    print(f"Could not delete queue {queue_name}: {e}")
-
-            await cleanup_channel.close()
-            await cleanup_connection.close()
-            print("Queue cleanup completed.")
-        except Exception as e:
-            print(f"Warning: Could not perform queue cleanup: {e}")
+        # (the queues of a local transport go away with the processes)
+        if not main.task_manager.transport.is_local:
+            print("Attempting to delete RabbitMQ queues...")
+            try:
+                cleanup_connection = await process_utils.create_rabbitmq_connection(
+                    main.task_manager.config, timeout=5
+                )
+                cleanup_channel = await cleanup_connection.channel()
+
+                queue_names = ['evaluator_queue', 'sampler_queue'] + list(
+                    database_shards.database_queue_names(getattr(main.task_manager.config, 'num_pdb', 1)))
+                for queue_name in queue_names:
+                    try:
+                        # Declare the queue first (passive=False) so we can delete it
+                        queue = await cleanup_channel.declare_queue(
+                            queue_name,
+                            durable=False,
+                            auto_delete=False,
+                            passive=False  # Create if doesn't exist, get if exists
+                        )
+                        await queue.delete(if_unused=False, if_empty=False)
+                        print(f"Deleted queue: {queue_name}")
+                    except Exception as e:
+                        print(f"Could not delete queue {queue_name}: {e}")
+
+                await cleanup_channel.close()
+                await cleanup_connection.close()
+                print("Queue cleanup completed.")
+            except Exception as e:
+                print(f"Warning: Could not perform queue cleanup: {e}")
 
         # Wait for RabbitMQ internal tasks to complete
         await asyncio.sleep(2.0)
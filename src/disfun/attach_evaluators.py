@@ -66,6 +66,9 @@ class TaskManager:
 
         pid = os.getpid()
         self.logger.info(f"Main_task is running in process with PID: {pid}.")
+        if getattr(self.config, 'transport', 'amqp') == 'local':
+            self.logger.warning("transport='local' only connects the processes of the main node; "
+                                "attached evaluators connect to RabbitMQ.")
         try:
             self.template = code_manipulation.text_to_program(self.specification)
             function_to_evolve = 'priority'
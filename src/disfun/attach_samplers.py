@@ -15,6 +15,7 @@ from disfun import process_utils
 from disfun.process_entry import sampler_process_entry, load_config
 import socket
 from disfun import gpt
+from disfun import llm_backends
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -35,7 +36,7 @@ class TaskManager:
         self.logger = self.initialize_logger(log_dir)
         self.sampler_processes = []
         self.tasks = []
-        if self.config.sampler.gpt:
+        if not llm_backends.uses_gpu(self.config.sampler):
             self.resource_manager = ResourceManager(log_dir=log_dir, cpu_only=True, scaling_config=self.config.scaling)
         else:
             self.resource_manager = ResourceManager(log_dir=log_dir, scaling_config=self.config.scaling)
@@ -66,6 +67,9 @@ class TaskManager:
 
         pid = os.getpid()
         self.logger.info(f"main_task is running in process PID: {pid}")
+        if getattr(self.config, 'transport', 'amqp') == 'local':
+            self.logger.warning("transport='local' only connects the processes of the main node; "
+                                "attached samplers connect to RabbitMQ.")
 
         try:
             # Start initial sampler processes
@@ -112,9 +116,9 @@ class TaskManager:
             self.logger.error(f"Exception in main_task: {e}")
 
     def start_initial_processes(self):
-        # If self.config.sampler.gpt is True, just start samplers without GPU device assignment
-        if self.config.sampler.gpt:
-            self.logger.info("GPT mode enabled. Starting sampler processes without GPU device assignment.")
+        # In GPT mode or with the mock backend, just start samplers without GPU device assignment
+        if not llm_backends.uses_gpu(self.config.sampler):
+            self.logger.info("GPT mode or mock backend enabled. Starting sampler processes without GPU device assignment.")
             ctx = mp.get_context('spawn')
             for i in range(self.config.num_samplers):
                 device = None
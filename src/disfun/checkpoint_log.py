@@ -0,0 +1,112 @@
+"""Incremental checkpoints of the ProgramsDatabase.
+
+A checkpoint directory holds compacted snapshots, `checkpoint_<time>.pkl` (the whole state, as
+returned by `ProgramsDatabase.serialize_checkpoint`), each followed by an append-only log of the
+changes made after it, `checkpoint_<time>.log`. The database records every program it registers
+and every island it resets. `periodic_checkpoint` appends the recorded changes to the log every
+`checkpoint_interval` seconds, and writes a new snapshot (starting a new log) every
+`snapshot_interval` seconds. Loading a snapshot replays its log, so a crash loses at most the
+last `checkpoint_interval` seconds of work.
+
+Only the records are built on the event loop. Programs are converted and pickled on a thread,
+which is safe because a program never changes after registration.
+
+The log is a sequence of pickled records:
+
+* `("register", island_id, program, scores_per_test)`: a program stored in an island, as
+  `Function.to_dict()` with its id and lineage
+* `("reset", island_id)`: all programs of the island removed and its version bumped; the
+  founder follows as a registration
+* `("state", counters)`: the counters of the database (`ProgramsDatabase.checkpoint_state`) when
+  the records before it were written
+
+A record cut off by a crash ends the replay.
+"""
+
+import logging
+import os
+import pickle
+from typing import Iterator
+
+logger = logging.getLogger('main_logger')
+
+
+def log_file_of(snapshot_file: str) -> str:
+    """Log of the changes after a snapshot."""
+    return os.path.splitext(snapshot_file)[0] + ".log"
+
+
+def snapshot_file_of(checkpoint_file: str) -> str:
+    """Snapshot a checkpoint file belongs to (the file itself unless it is a log)."""
+    stem, extension = os.path.splitext(checkpoint_file)
+    return stem + ".pkl" if extension == ".log" else checkpoint_file
+
+
+def write_snapshot(snapshot_file: str, checkpoint_data: dict):
+    """Pickles a snapshot; written to a temporary file first so that no partial snapshot remains."""
+    temporary_file = snapshot_file + ".tmp"
+    with open(temporary_file, "wb") as f:
+        pickle.dump(checkpoint_data, f)
+    os.replace(temporary_file, snapshot_file)
+
+
+def read_records(log_file: str) -> Iterator[tuple]:
+    """Records of a log, up to the first incomplete one."""
+    if not os.path.exists(log_file):
+        return
+    with open(log_file, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+            except Exception as e:
+                logger.warning(f"Checkpoint log {log_file} ends with an incomplete record ({e}), "
+                               f"replaying the records before it.")
+                return
+
+
+class CheckpointLog:
+    """
+    Changes recorded by the database on its event loop. `take` them there together with the
+    counters, then `write` them (on a thread); writes of one log must not overlap.
+    """
+
+    def __init__(self, log_file: str):
+        self.log_file = log_file
+        self._records = []
+        self.records_written = 0
+        self.bytes_written = 0
+
+    def record(self, record: tuple):
+        self._records.append(record)
+
+    def take(self) -> list:
+        """Records since the last call, to be written with `write`."""
+        records, self._records = self._records, []
+        return records
+
+    def write(self, records: list, state: dict = None):
+        """Appends `records` and then `state` to the log in one write and syncs it to disk."""
+        data = [pickle.dumps(self._encode(record)) for record in records]
+        if state is not None:
+            data.append(pickle.dumps(("state", state)))
+        if not data:
+            return
+        data = b"".join(data)
+        with open(self.log_file, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.records_written += len(records)
+        self.bytes_written += len(data)
+
+    @staticmethod
+    def _encode(record: tuple) -> tuple:
+        if record[0] == "register":
+            kind, island_id, program, scores_per_test = record
+            return kind, island_id, program.to_dict(), scores_per_test
+        return record
+
+    def __len__(self):
+        return len(self._records)
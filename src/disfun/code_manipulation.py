@@ -84,7 +84,11 @@ class Function:
             "body": self.body,
             "return_type": self.return_type,
             "docstring": self.docstring, 
-            "hash_value": self.hash_value
+            "hash_value": self.hash_value,
+            "program_id": self.program_id,
+            "parent_ids": self.parent_ids,
+            "generation": self.generation,
+            "timestamp": self.timestamp,
         }
 
     @staticmethod
@@ -95,7 +99,11 @@ class Function:
             body=data["body"],
             return_type=data.get("return_type", None),
             docstring=data.get("docstring", None), 
-            hash_value=data.get("hash_value", None) 
+            hash_value=data.get("hash_value", None),
+            program_id=data.get("program_id", None),
+            parent_ids=data.get("parent_ids", None),
+            generation=data.get("generation", 0),
+            timestamp=data.get("timestamp", None),
         )
 
     @staticmethod
@@ -334,6 +342,21 @@ def rename_function_calls(code: str, source_name: str, target_name: str) -> str:
   return _untokenize(modified_tokens)
 
 
+# Stands in for the renamed calls in `split_at_function_calls` (and marks them in prompt_rendering);
+# cannot occur in Python source
+CALL_PLACEHOLDER = '\x00'
+
+
+def split_at_function_calls(code: str, source_name: str) -> list[str]:
+  """Splits `code` at the calls of `source_name`.
+
+  `target_name.join(parts)` is the code `rename_function_calls(code, source_name, target_name)`
+  returns when it renames (that is, when `source_name` occurs in `code`), so code can be
+  tokenized once and renamed to many targets.
+  """
+  return rename_function_calls(code, source_name, CALL_PLACEHOLDER).split(CALL_PLACEHOLDER)
+
+
 def get_functions_called(code: str) -> MutableSet[str]:
   """Returns the set of all functions called in `code`."""
   return set(token.string for token, is_call in
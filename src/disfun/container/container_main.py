@@ -5,6 +5,7 @@ import traceback
 import time
 import os
 import pathlib
+import struct
 
 
 # Use the current working directory
@@ -14,6 +15,14 @@ CWD = os.path.abspath(os.getcwd())
 SRC_DIR = os.path.abspath(os.path.join(CWD, "..", ".."))
 GRAPH_DIR = os.path.join(SRC_DIR, "graphs")
 
+# Modules commonly used by specifications. Warm workers import them once at startup
+# so that individual calls do not pay the import cost.
+PREIMPORT_MODULES = ("numpy", "networkx", "lmdb", "json", "hashlib", "itertools")
+
+# Length prefix of a frame sent between the sandbox and a warm worker
+FRAME_HEADER = struct.Struct("!Q")
+
+
 def main(prog_file: str, input_file: str, output_file: str):
     """Executes a deserialized function with input and writes output to file."""
     try:
@@ -40,7 +49,98 @@ def main(prog_file: str, input_file: str, output_file: str):
         traceback.print_exc(file=sys.stderr)
         sys.exit(1)  # Exit with error code 1 to indicate failure
 
+
+def read_frame(fd: int):
+    """Reads one length-prefixed frame from `fd`. Returns None on EOF."""
+    header = _read_exact(fd, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    return _read_exact(fd, length)
+
+
+def write_frame(fd: int, payload: bytes):
+    """Writes one length-prefixed frame to `fd`."""
+    data = memoryview(FRAME_HEADER.pack(len(payload)) + payload)
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def _read_exact(fd: int, size: int):
+    chunks = []
+    while size > 0:
+        chunk = os.read(fd, min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def worker(request_fd: int, response_fd: int, graph_cache_mb: int = 0):
+    """Serves calls from a warm sandbox until the request pipe is closed.
+
+    Each request is a pickled dict with the cloudpickled function (`prog`), the pickled
+    input (`input`) and the path of the call's stderr log (`error_file`). stdout and
+    stderr of the call are redirected to that log. The response is a pickled dict with
+    `ok`, `result` and `cpu_time`.
+
+    With `graph_cache_mb` > 0, graphs loaded through the specification's `load_graph`
+    are decoded once and kept in an LRU cache of that size for later calls.
+    """
+    for module in PREIMPORT_MODULES:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+    graph_cache = None
+    if graph_cache_mb > 0:
+        from graph_cache import GraphCache  # Sibling module, the worker runs as a script
+        graph_cache = GraphCache(graph_cache_mb * 1024 * 1024)
+
+    # Keep stray prints of evolved code away from the protocol pipes
+    saved_stdout, saved_stderr = os.dup(1), os.dup(2)
+
+    while True:
+        request = read_frame(request_fd)
+        if request is None:
+            break  # Sandbox closed the pipe or died
+        request = pickle.loads(request)
+
+        response = {"ok": False, "result": None, "cpu_time": 0.0}
+        with open(request["error_file"], "wb") as error_f:
+            os.dup2(error_f.fileno(), 1)
+            os.dup2(error_f.fileno(), 2)
+            try:
+                func = pickle.loads(request["prog"])
+                if graph_cache is not None:
+                    graph_cache.install(func)
+                input_data = pickle.loads(request["input"])
+
+                start_cpu_time = time.process_time()
+                ret = func(input_data, GRAPH_DIR)
+                end_cpu_time = time.process_time()
+
+                payload = pickle.dumps({"ok": True, "result": ret, "cpu_time": end_cpu_time - start_cpu_time})
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+                payload = pickle.dumps(response)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os.dup2(saved_stdout, 1)
+                os.dup2(saved_stderr, 2)
+
+        write_frame(response_fd, payload)
+
+
 if __name__ == '__main__':
+    if len(sys.argv) in (4, 5) and sys.argv[1] == "--worker":
+        worker(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]) if len(sys.argv) == 5 else 0)
+        sys.exit(0)
+
     if len(sys.argv) != 4:
         print("Incorrect number of arguments. Expected 3 arguments.", file=sys.stderr)
         sys.exit(-1)
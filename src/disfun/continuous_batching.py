@@ -0,0 +1,408 @@
+"""Continuous batching for the local HF sampler.
+
+The static sampler pads a batch of prompts to the longest prompt and generates until the longest
+completion is done, so finished sequences keep occupying the batch and new prompts wait for the
+whole batch. `ContinuousBatchingEngine` instead keeps a set of active sequences that changes at
+every decoding step:
+
+* Admission: waiting requests are admitted while there are free rows (`max_batch_size`). Their
+  prompts are prefilled together, once per prompt, and the KV cache of each prompt is repeated for
+  its `num_samples` sequences. With a `PrefixKVCache`, a prefix the prompts share with earlier ones
+  is copied from the cache instead of being prefilled. The new cache rows are left-padded to the
+  length of the running cache (or the other way round) and concatenated along the batch dimension.
+* Decoding: one forward pass over the last token of every active sequence, with per-row position
+  ids and an attention mask that hides the padding.
+* Failures: if the prefill of admitted prompts fails (e.g. out of memory on a long prompt), these
+  requests fail and the running batch is unchanged. If a decoding step fails, the KV cache may be
+  partly updated, so all active requests fail and the batch is cleared. Failed requests are
+  returned by `step` with `error` set.
+* Eviction: sequences that produced EOS or `max_new_tokens` tokens (or, with `token_texts`, completed
+  the function body, see `early_stopping`) leave the batch at once, and columns that are padding in
+  every remaining row are cropped from the cache.
+
+Sampling follows `generate` (repetition penalty, temperature, top-k, top-p), with the parameters
+taken per request so that temperature changes apply to newly admitted prompts only.
+
+The engine counts generated tokens and the time spent in forward passes and sampling ("busy").
+`tokens_per_sec` is generated tokens per wall-clock second since the engine started and
+`gpu_idle_fraction` is the fraction of that time in which the model was not running, including
+time without any request.
+
+The engine is not thread-safe; the sampler drives it from its inference thread.
+"""
+
+import collections
+import logging
+import time
+from typing import List
+
+import torch
+from transformers import DynamicCache
+
+from disfun.early_stopping import FunctionBodyEnd, TokenTexts
+from disfun.prefix_cache import PrefixKVCache, build_cache, move_padding_after_prefix
+
+logger = logging.getLogger('main_logger')
+
+
+class GenerationRequest:
+    """A prompt and the sequences sampled for it."""
+
+    def __init__(self, request_id, input_ids: List[int], num_samples: int, generate_kwargs: dict, payload=None):
+        self.request_id = request_id
+        self.input_ids = list(input_ids)
+        self.num_samples = num_samples
+        self.generate_kwargs = dict(generate_kwargs)
+        self.payload = payload
+        self.samples = [[] for _ in range(num_samples)]
+        self.gpu_time = 0.0
+        self.unfinished = num_samples
+        self.body_ends = None
+        self.error = None  # exception of the forward pass that failed the request
+
+
+class ContinuousBatchingEngine:
+    """Token-level scheduler around a causal LM that admits and evicts sequences at every step."""
+
+    def __init__(self, model, eos_token_id: int, max_batch_size: int = 20, max_new_tokens: int = 246,
+                 prefix_cache: PrefixKVCache = None, token_texts: TokenTexts = None):
+        self.model = model
+        self.prefix_cache = prefix_cache
+        self.token_texts = token_texts
+        self.eos_token_id = eos_token_id
+        self.max_batch_size = max_batch_size
+        self.max_new_tokens = max_new_tokens
+        self.device = model.device
+        self.default_top_k = getattr(getattr(model, "generation_config", None), "top_k", None) or 0
+
+        self.waiting = collections.deque()
+        self._rows = []              # (request, sample index) per active row
+        self._cache = None
+        self._attention_mask = None  # (rows, cached positions + 1), the last column is the pending token
+        self._positions = None       # position id of the pending token per row
+        self._pending = None         # sampled token per row that still has to be fed to the model
+        self._seen = None            # (rows, vocab) tokens of prompt and completion, for the repetition penalty
+        self._params = None          # per-row sampling parameters
+
+        self.generated_tokens = 0
+        self.prompt_tokens = 0
+        self.stopped_sequences = 0
+        self.saved_tokens = 0
+        self.busy_time = 0.0
+        self.started_at = time.perf_counter()
+
+    @property
+    def num_active(self) -> int:
+        return len(self._rows)
+
+    def has_work(self) -> bool:
+        return bool(self.waiting or self._rows)
+
+    def add_request(self, request: GenerationRequest):
+        if request.num_samples > self.max_batch_size:
+            raise ValueError(f"Request needs {request.num_samples} rows, engine has {self.max_batch_size}")
+        self.waiting.append(request)
+
+    def stats(self) -> dict:
+        elapsed = time.perf_counter() - self.started_at
+        return {
+            "generated_tokens": self.generated_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "stopped_sequences": self.stopped_sequences,
+            "saved_tokens": self.saved_tokens,
+            "elapsed": elapsed,
+            "busy_time": self.busy_time,
+            "tokens_per_sec": self.generated_tokens / elapsed if elapsed > 0 else 0.0,
+            "gpu_idle_fraction": max(0.0, 1.0 - self.busy_time / elapsed) if elapsed > 0 else 0.0,
+            "active_sequences": self.num_active,
+            "waiting_requests": len(self.waiting),
+        }
+
+    def step(self) -> List[GenerationRequest]:
+        """
+        Admits waiting requests, decodes one token for every active sequence and returns the
+        finished requests, including failed ones (with `error` set).
+        """
+        finished = []
+        start = time.perf_counter()
+        with torch.no_grad():
+            finished += self._admit()
+            finished += self._evict()
+            if self._rows:
+                try:
+                    self._decode()
+                except Exception as e:
+                    logger.error(f"Continuous batching: decoding step failed, dropping {self.num_active} sequences: {e}")
+                    finished += self.abort(e)
+                else:
+                    finished += self._evict()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        self.busy_time += time.perf_counter() - start
+        return finished
+
+    def run_until_complete(self) -> List[GenerationRequest]:
+        finished = []
+        while self.has_work():
+            finished += self.step()
+        return finished
+
+    def abort(self, error: Exception) -> List[GenerationRequest]:
+        """Fails all active requests and clears the batch; waiting requests stay queued."""
+        failed = list(dict.fromkeys(request for request, _ in self._rows))
+        self._clear_rows()
+        return _fail(failed, error)
+
+    def _clear_rows(self):
+        self._rows, self._cache, self._attention_mask = [], None, None
+        self._positions = self._pending = self._seen = self._params = None
+
+    # Admission
+
+    def _admit(self) -> List[GenerationRequest]:
+        """Admits waiting requests into the batch; returns those whose prefill failed."""
+        admitted = []
+        free = self.max_batch_size - len(self._rows)
+        while self.waiting and self.waiting[0].num_samples <= free:
+            request = self.waiting.popleft()
+            admitted.append(request)
+            free -= request.num_samples
+            if self.token_texts is not None:
+                request.body_ends = [FunctionBodyEnd() for _ in range(request.num_samples)]
+        if not admitted:
+            return []
+
+        step_start = time.perf_counter()
+        num_active = self.num_active
+        try:
+            rows = self._prefill(admitted)
+        except Exception as e:
+            if self.num_active != num_active:
+                # Failed after the rows joined the batch, whose state is then inconsistent
+                logger.error(f"Continuous batching: admission failed, dropping {self.num_active} sequences: {e}")
+                return self.abort(e)
+            logger.error(f"Continuous batching: prefill of {len(admitted)} prompts failed, dropping them: {e}")
+            return _fail(admitted, e)
+
+        # Prefill time is attributed to the admitted requests
+        prefill_time = time.perf_counter() - step_start
+        for request in admitted:
+            request.gpu_time += prefill_time * request.num_samples / len(rows)
+        return []
+
+    def _prefill(self, admitted):
+        """Prefills the admitted prompts and adds their rows to the batch, which is unchanged if this fails."""
+        prompt_length = max(len(r.input_ids) for r in admitted)
+        input_ids = torch.full((len(admitted), prompt_length), self.eos_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(admitted), prompt_length), dtype=torch.long)
+        for i, request in enumerate(admitted):
+            input_ids[i, prompt_length - len(request.input_ids):] = torch.tensor(request.input_ids)
+            attention_mask[i, prompt_length - len(request.input_ids):] = 1
+            self.prompt_tokens += len(request.input_ids)
+        input_ids, attention_mask = input_ids.to(self.device), attention_mask.to(self.device)
+        prefix_length, prefix = 0, None
+        if self.prefix_cache is not None:
+            prefix_length, prefix = self.prefix_cache.lookup([r.input_ids for r in admitted])
+            if prefix is not None:
+                input_ids, attention_mask = move_padding_after_prefix(input_ids, attention_mask, prefix_length)
+        position_ids = (attention_mask.cumsum(-1) - 1).masked_fill_(attention_mask == 0, 1)
+
+        outputs = self.model(input_ids=input_ids[:, prefix_length:], attention_mask=attention_mask,
+                             position_ids=position_ids[:, prefix_length:],
+                             past_key_values=build_cache(prefix, len(admitted)) if prefix is not None else None,
+                             use_cache=True)
+        repeats = torch.tensor([r.num_samples for r in admitted], device=self.device)
+        cache = outputs.past_key_values
+        layers = [(layer.keys.repeat_interleave(repeats, dim=0), layer.values.repeat_interleave(repeats, dim=0))
+                  for layer in cache.layers]
+        logits = outputs.logits[:, -1, :].float().repeat_interleave(repeats, dim=0)
+        attention_mask = attention_mask.repeat_interleave(repeats, dim=0)
+        positions = attention_mask.sum(-1)
+
+        rows = [(request, j) for request in admitted for j in range(request.num_samples)]
+        # Padding goes to an extra column that is dropped
+        vocab_size = logits.shape[-1]
+        prompt_ids = input_ids.repeat_interleave(repeats, dim=0).masked_fill(attention_mask == 0, vocab_size)
+        seen = torch.zeros((len(rows), vocab_size + 1), dtype=torch.bool, device=self.device)
+        seen = seen.scatter_(1, prompt_ids, True)[:, :vocab_size]
+        params = self._row_params(rows)
+
+        tokens = self._sample(logits, seen, params)
+
+        self._merge(rows, layers, attention_mask, positions, seen, params)
+        first = slice(len(self._rows) - len(rows), len(self._rows))
+        self._append_tokens(first, tokens)
+        return rows
+
+    def _row_params(self, rows):
+        temperature, top_p, top_k, do_sample, repetition_penalty = [], [], [], [], []
+        for request, _ in rows:
+            kwargs = request.generate_kwargs
+            do_sample.append(bool(kwargs.get("do_sample", False)))
+            temperature.append(float(kwargs.get("temperature") or 1.0))
+            top_p.append(float(kwargs.get("top_p") or 1.0))
+            top_k.append(int(kwargs.get("top_k", self.default_top_k) or 0))
+            repetition_penalty.append(float(kwargs.get("repetition_penalty") or 1.0))
+        as_tensor = lambda values, dtype: torch.tensor(values, dtype=dtype, device=self.device)
+        return {
+            "temperature": as_tensor(temperature, torch.float32),
+            "top_p": as_tensor(top_p, torch.float32),
+            "top_k": as_tensor(top_k, torch.long),
+            "do_sample": as_tensor(do_sample, torch.bool),
+            "repetition_penalty": as_tensor(repetition_penalty, torch.float32),
+        }
+
+    def _params_slice(self, index):
+        return {name: value[index] for name, value in self._params.items()}
+
+    def _merge(self, rows, layers, attention_mask, positions, seen, params):
+        """Appends new rows to the running batch, left-padding whichever cache is shorter."""
+        if not self._rows:
+            self._rows = rows
+            self._cache = DynamicCache(ddp_cache_data=layers)
+            # Column for the pending (first sampled) token
+            self._attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(rows), 1))], dim=1)
+            self._positions = positions
+            self._seen = seen
+            self._params = params
+            return
+
+        cached = self._attention_mask.shape[1] - 1
+        new_length = attention_mask.shape[1]
+        length = max(cached, new_length)
+        old_layers = [(layer.keys, layer.values) for layer in self._cache.layers]
+        merged = []
+        for (old_k, old_v), (new_k, new_v) in zip(old_layers, layers):
+            merged.append((torch.cat([_left_pad(old_k, length, dim=2), _left_pad(new_k, length, dim=2)]),
+                           torch.cat([_left_pad(old_v, length, dim=2), _left_pad(new_v, length, dim=2)])))
+        old_mask = _left_pad(self._attention_mask[:, :-1], length, dim=1)
+        new_mask = _left_pad(attention_mask, length, dim=1)
+        pending_column = torch.cat([self._attention_mask[:, -1:], attention_mask.new_ones((len(rows), 1))])
+        merged_mask = torch.cat([torch.cat([old_mask, new_mask]), pending_column], dim=1)
+        merged_positions = torch.cat([self._positions, positions])
+        merged_seen = torch.cat([self._seen, seen])
+        merged_params = {name: torch.cat([self._params[name], params[name]]) for name in params}
+
+        # Assigned only once everything is allocated, so that a failed merge leaves the batch as it was
+        self._rows = self._rows + rows
+        self._cache = DynamicCache(ddp_cache_data=merged)
+        self._attention_mask = merged_mask
+        self._positions = merged_positions
+        self._seen = merged_seen
+        self._params = merged_params
+
+    # Decoding
+
+    def _decode(self):
+        step_start = time.perf_counter()
+        outputs = self.model(
+            input_ids=self._pending.unsqueeze(1),
+            attention_mask=self._attention_mask,
+            position_ids=self._positions.unsqueeze(1),
+            past_key_values=self._cache,
+            use_cache=True,
+        )
+        self._cache = outputs.past_key_values
+        self._positions = self._positions + 1
+        self._attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((len(self._rows), 1))], dim=1)
+        logits = outputs.logits[:, -1, :].float()
+        self._append_tokens(slice(0, len(self._rows)), self._sample(logits, self._seen, self._params))
+
+        step_time = (time.perf_counter() - step_start) / len(self._rows)
+        for request, _ in self._rows:
+            request.gpu_time += step_time
+
+    def _sample(self, logits, seen, params):
+        """Next token per row: repetition penalty, then greedy or temperature / top-k / top-p sampling."""
+        penalty = params["repetition_penalty"].unsqueeze(1)
+        penalized = torch.where(logits > 0, logits / penalty, logits * penalty)
+        logits = torch.where(seen, penalized, logits)
+        greedy = logits.argmax(dim=-1)
+        if not bool(params["do_sample"].any()):
+            return greedy
+
+        logits = logits / params["temperature"].unsqueeze(1)
+        top_k = params["top_k"]
+        if bool((top_k > 0).any()):
+            k = torch.where(top_k > 0, top_k, torch.full_like(top_k, logits.shape[-1])).clamp(max=logits.shape[-1])
+            kth = logits.topk(int(k.max()), dim=-1).values.gather(1, (k - 1).unsqueeze(1))
+            logits = logits.masked_fill(logits < kth, float("-inf"))
+        sorted_logits, sorted_indices = logits.sort(dim=-1, descending=True)
+        sorted_probs = sorted_logits.softmax(dim=-1)
+        # Keep the smallest prefix whose probability reaches top_p (at least one token)
+        remove = (sorted_probs.cumsum(dim=-1) - sorted_probs) >= params["top_p"].unsqueeze(1)
+        sorted_logits = sorted_logits.masked_fill(remove, float("-inf"))
+        logits = torch.full_like(logits, float("-inf")).scatter(1, sorted_indices, sorted_logits)
+        sampled = torch.multinomial(logits.softmax(dim=-1), num_samples=1).squeeze(1)
+        return torch.where(params["do_sample"], sampled, greedy)
+
+    def _append_tokens(self, index, tokens):
+        if self._pending is None or self._pending.shape[0] != len(self._rows):
+            pending = torch.full((len(self._rows),), self.eos_token_id, dtype=torch.long, device=self.device)
+            if self._pending is not None:
+                pending[:self._pending.shape[0]] = self._pending
+            self._pending = pending
+        self._pending[index] = tokens
+        self._seen[index] = self._seen[index].scatter(1, tokens.unsqueeze(1), True)
+        row_ids = range(len(self._rows))[index]
+        for row, token in zip(row_ids, tokens.tolist()):
+            request, j = self._rows[row]
+            request.samples[j].append(token)
+            if request.body_ends is not None:
+                request.body_ends[j].feed(self.token_texts(token))
+        self.generated_tokens += len(row_ids)
+
+    # Eviction
+
+    def _evict(self) -> List[GenerationRequest]:
+        if not self._rows:
+            return []
+        keep, finished = [], []
+        for row, (request, j) in enumerate(self._rows):
+            sample = request.samples[j]
+            body_end = request.body_ends is not None and request.body_ends[j].done
+            if sample and (sample[-1] == self.eos_token_id or len(sample) >= self.max_new_tokens or body_end):
+                if body_end and sample[-1] != self.eos_token_id:
+                    self.stopped_sequences += 1
+                    self.saved_tokens += max(0, self.max_new_tokens - len(sample))
+                request.unfinished -= 1
+                if request.unfinished == 0:
+                    finished.append(request)
+            else:
+                keep.append(row)
+        if len(keep) == len(self._rows):
+            return finished
+        if not keep:
+            self._clear_rows()
+            return finished
+
+        index = torch.tensor(keep, device=self.device)
+        self._rows = [self._rows[row] for row in keep]
+        self._attention_mask = self._attention_mask[index]
+        # Drop leading columns that are padding in every remaining row
+        first_used = int(self._attention_mask.any(dim=0).int().argmax())
+        self._attention_mask = self._attention_mask[:, first_used:]
+        layers = [(layer.keys[index, :, first_used:], layer.values[index, :, first_used:]) for layer in self._cache.layers]
+        self._cache = DynamicCache(ddp_cache_data=layers)
+        self._positions = self._positions[index]
+        self._pending = self._pending[index]
+        self._seen = self._seen[index]
+        self._params = {name: value[index] for name, value in self._params.items()}
+        return finished
+
+
+def _fail(requests, error) -> List[GenerationRequest]:
+    for request in requests:
+        request.error = error
+    return list(requests)
+
+
+def _left_pad(tensor, length, dim):
+    """Left-pads `tensor` with zeros along `dim` to `length`."""
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
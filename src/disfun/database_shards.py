@@ -0,0 +1,265 @@
+"""Islands of the ProgramsDatabase partitioned across several database shards (`num_pdb > 1`).
+
+Shard `k` of `N` owns the islands `k, k + N, k + 2N, ...` and consumes its own queue,
+`database_queue.<k>` (with one shard this is `database_queue`, as before). The evaluators publish
+each result with the routing key of the shard that owns its island; results without an island
+(the initial program) go to every shard. A shard registers programs, deduplicates, generates
+prompts for and checkpoints only its own islands, so the database work of a run is spread over
+`N` event loops (shard 0 in the main process, the others in database processes).
+
+Decisions that need all islands are taken by the `DatabaseCoordinator` in the main process. Every
+shard reports the population, version and best program of its islands to
+`database_coordinator_queue` every `shard_report_interval` seconds. The coordinator tracks the
+global best score, resets the weakest half of all islands when the reset conditions of the
+`programs_database` config hold across shards (founders are sent to the shards that own the reset
+islands), and forwards `found_optimal_solution` to every shard.
+
+Control messages to a shard are ordinary messages on its queue with a `command` field:
+
+* `{"command": "reset_islands", "islands": [{"island_id", "founder", "scores_per_test"}, ...]}`
+* `{"command": "found_optimal_solution"}`
+"""
+
+import asyncio
+import glob
+import logging
+import os
+import re
+import time
+
+import numpy as np
+
+from disfun import message_codec
+
+# Wandb import (optional)
+try:
+    import wandb
+    WANDB_AVAILABLE = True
+except ImportError:
+    WANDB_AVAILABLE = False
+    wandb = None
+
+logger = logging.getLogger('main_logger')
+
+COORDINATOR_QUEUE = "database_coordinator_queue"
+
+
+def shard_queue_name(shard_id: int, num_shards: int) -> str:
+    """Queue (routing key) of a database shard."""
+    if num_shards <= 1:
+        return "database_queue"
+    return f"database_queue.{shard_id}"
+
+
+def database_queue_names(num_shards: int) -> tuple:
+    """Queues the database shards and the coordinator consume."""
+    names = tuple(shard_queue_name(shard_id, num_shards) for shard_id in range(max(num_shards, 1)))
+    if num_shards > 1:
+        names += (COORDINATOR_QUEUE,)
+    return names
+
+
+def shard_of_island(island_id: int, num_shards: int) -> int:
+    return island_id % num_shards if num_shards > 1 else 0
+
+
+def shard_islands(shard_id: int, num_shards: int, num_islands: int) -> list:
+    """Islands owned by a shard."""
+    return list(range(shard_id, num_islands, max(num_shards, 1)))
+
+
+def routing_keys(island_id, num_shards: int) -> list:
+    """Queues a result for `island_id` is published to; None (all islands) goes to every shard."""
+    if island_id is None:
+        return [shard_queue_name(shard_id, num_shards) for shard_id in range(max(num_shards, 1))]
+    return [shard_queue_name(shard_of_island(island_id, num_shards), num_shards)]
+
+
+def shard_checkpoints_path(save_checkpoints_path, shard_id: int, num_shards: int):
+    """Each shard of a sharded run saves its checkpoints in a `shard_<k>` subdirectory."""
+    if save_checkpoints_path is None or num_shards <= 1:
+        return save_checkpoints_path
+    return os.path.join(save_checkpoints_path, f"shard_{shard_id}")
+
+
+def shard_checkpoint_file(checkpoint_file, shard_id: int, num_shards: int):
+    """
+    Checkpoint a shard resumes from. `checkpoint_file` is a checkpoint of one shard of the run
+    (`.../shard_<j>/checkpoint_*.pkl`); the other shards load the latest checkpoint in their own
+    `shard_<k>` directory next to it.
+    """
+    if checkpoint_file is None or num_shards <= 1:
+        return checkpoint_file
+    shard_dir = os.path.dirname(os.path.abspath(checkpoint_file))
+    if not re.fullmatch(r"shard_\d+", os.path.basename(shard_dir)):
+        raise ValueError(f"num_pdb={num_shards} resumes from the checkpoint of a database shard "
+                         f"(.../shard_<k>/checkpoint_*.pkl), got {checkpoint_file}")
+    if os.path.basename(shard_dir) == f"shard_{shard_id}":
+        return checkpoint_file
+    candidates = sorted(glob.glob(os.path.join(os.path.dirname(shard_dir), f"shard_{shard_id}", "checkpoint_*.pkl")))
+    if not candidates:
+        raise FileNotFoundError(f"No checkpoint of database shard {shard_id} next to {checkpoint_file}")
+    return candidates[-1]
+
+
+def select_islands_to_reset(best_score_per_island, num_islands_to_reset: int) -> dict:
+    """
+    Maps each of the `num_islands_to_reset` islands with the lowest best score to a randomly
+    chosen surviving island whose best program becomes its founder.
+    """
+    indices_sorted_by_score = np.argsort(best_score_per_island)
+    reset_islands_ids = indices_sorted_by_score[:num_islands_to_reset]
+    keep_islands_ids = indices_sorted_by_score[num_islands_to_reset:]
+    return {int(island_id): int(np.random.choice(keep_islands_ids)) for island_id in reset_islands_ids}
+
+
+class DatabaseCoordinator:
+    """
+    Global view of the islands of all database shards, built from their periodic reports.
+    Runs `reset_islands` across shards and tracks the global best score.
+    """
+
+    def __init__(self, connection, channel, coordinator_queue, sampler_queue, evaluator_queue, config,
+                 num_shards: int, codec=None):
+        self.connection = connection
+        self.channel = channel
+        self.coordinator_queue = coordinator_queue
+        self.sampler_queue = sampler_queue
+        self.evaluator_queue = evaluator_queue
+        self.codec = codec or message_codec.MessageCodec()
+        self._config = config
+        self.num_shards = num_shards
+        self._islands = [
+            {"version": 0, "num_programs": 0, "best_score": -float('inf'),
+             "best_program": None, "best_scores_per_test": None}
+            for _ in range(config.num_islands)
+        ]
+        self._shard_stats = {}
+        self._last_reset_time = time.time()
+        self.best_score = -float('inf')
+        self.best_island_id = None
+        self.resets = 0
+        self.found_optimal_solution = False
+
+    async def consume_and_process(self) -> None:
+        """Consumes the reports of the shards."""
+        from disfun import process_utils
+
+        async def _consume_loop():
+            await self.channel.set_qos(prefetch_count=2 * self.num_shards)
+            async with self.coordinator_queue.iterator() as stream:
+                async for message in stream:
+                    async with message.process():
+                        try:
+                            await self.process_report(self.codec.decode(message))
+                        except Exception as e:
+                            logger.error(f"DatabaseCoordinator: Error processing shard report: {e}")
+
+        await process_utils.with_reconnection(_consume_loop, logger, component_name="DatabaseCoordinator")
+
+    async def process_report(self, report: dict):
+        shard_id = report["shard_id"]
+        self._shard_stats[shard_id] = {key: value for key, value in report.items() if key not in ("command", "islands")}
+
+        for island_report in report["islands"]:
+            island_id = island_report["island_id"]
+            island = self._islands[island_id]
+            # Reports sent before a reset reached the shard describe the island before the reset
+            if island_report["version"] < island["version"]:
+                continue
+            island.update({key: value for key, value in island_report.items() if key != "island_id"})
+            if island["best_score"] > self.best_score:
+                self.best_score = island["best_score"]
+                self.best_island_id = island_id
+                logger.info(f"Global best score increased to {self.best_score} on island {island_id} "
+                            f"(database shard {shard_id}) with scores {island['best_scores_per_test']}")
+
+        if report.get("found_optimal_solution") and not self.found_optimal_solution:
+            self.found_optimal_solution = True
+            logger.info(f"Database shard {shard_id} found an optimal solution, notifying all shards.")
+            await self._send_to_shards({shard: {"command": "found_optimal_solution"} for shard in range(self.num_shards)})
+
+        if self._reset_due():
+            self._last_reset_time = time.time()
+            try:
+                await self.reset_islands()
+            except Exception as e:
+                logger.error(f"Error in reset islands: {e}")
+
+    def _reset_due(self) -> bool:
+        # Decide only once every shard has reported its islands
+        if len(self._shard_stats) < self.num_shards:
+            return False
+        all_islands_sufficiently_populated = all(
+            island['num_programs'] >= self._config.reset_programs for island in self._islands)
+        if self._config.reset_period is not None and time.time() - self._last_reset_time <= self._config.reset_period:
+            return False
+        return all_islands_sufficiently_populated
+
+    async def reset_islands(self):
+        """Resets the weakest half of all islands with founders from the best islands of any shard."""
+        try:
+            await self.sampler_queue.purge()
+            await self.evaluator_queue.purge()
+        except Exception as e:
+            logger.error(f"Could not remove all messages from the queue: {e}")
+
+        reset_plan = select_islands_to_reset([island["best_score"] for island in self._islands],
+                                             self._config.num_islands // 2)
+        if not reset_plan:
+            logger.warning("No islands to reset. Skipping reset.")
+            return
+
+        commands = {shard_id: {"command": "reset_islands", "islands": []} for shard_id in range(self.num_shards)}
+        for island_id, founder_island_id in reset_plan.items():
+            founder_island = self._islands[founder_island_id]
+            commands[shard_of_island(island_id, self.num_shards)]["islands"].append({
+                "island_id": island_id,
+                "founder": founder_island["best_program"],
+                "scores_per_test": founder_island["best_scores_per_test"],
+            })
+            self._islands[island_id].update(
+                version=self._islands[island_id]["version"] + 1, num_programs=1,
+                best_score=founder_island["best_score"], best_program=founder_island["best_program"],
+                best_scores_per_test=founder_island["best_scores_per_test"])
+
+        # Every shard gets the command: the purge also removed the work in flight for its islands
+        await self._send_to_shards(commands)
+        self.resets += 1
+        logger.info(f"Reset islands {sorted(reset_plan)} across {self.num_shards} database shards.")
+
+    async def _send_to_shards(self, commands: dict):
+        for shard_id, command in commands.items():
+            try:
+                await self.channel.default_exchange.publish(
+                    self.codec.message(command), routing_key=shard_queue_name(shard_id, self.num_shards))
+            except Exception as e:
+                logger.error(f"DatabaseCoordinator: Could not send {command['command']} to shard {shard_id}: {e}")
+
+    def global_metrics(self) -> dict:
+        metrics = {
+            "global/best_score": self.best_score,
+            "global/island_resets": self.resets,
+            "global/shards_reporting": len(self._shard_stats),
+        }
+        for key in ("total_prompts", "total_stored_programs", "duplicates_discarded",
+                    "version_mismatch_discarded", "execution_failed"):
+            metrics[f"global/{key}"] = sum(stats.get(key, 0) for stats in self._shard_stats.values())
+        for shard_id, stats in self._shard_stats.items():
+            metrics[f"shard_{shard_id}/total_prompts"] = stats.get("total_prompts", 0)
+        return metrics
+
+    async def periodic_logging(self, interval: float = 60):
+        """Logs the global metrics, also to the W&B run of the main process if there is one."""
+        while True:
+            await asyncio.sleep(interval)
+            metrics = self.global_metrics()
+            logger.info(f"DatabaseCoordinator: best score {self.best_score} (island {self.best_island_id}), "
+                        f"{metrics['global/total_stored_programs']} programs stored and "
+                        f"{metrics['global/total_prompts']} results processed by {metrics['global/shards_reporting']} shards, "
+                        f"{self.resets} resets")
+            if WANDB_AVAILABLE and wandb.run is not None:
+                try:
+                    wandb.log(metrics)
+                except Exception as e:
+                    logger.error(f"Error logging to W&B: {e}")
@@ -0,0 +1,147 @@
+"""Stops generation once the body of the evolved function is complete.
+
+The sampler's prompts end with the header and docstring of the next version of the evolved
+function, so the model continues with its body. The evaluator keeps only that body
+(`evaluator._trim_function_body` drops everything after the first complete function), but
+`generate` would go on until EOS or `max_new_tokens`. `FunctionBodyEnd` follows the generated text
+of one sequence and detects the end of the body: the first line that starts with code at column 0,
+i.e. a dedent out of the function such as a new top-level `def`. Blank lines, indented lines
+(including nested `def`s), comments at column 0 and lines continuing an expression (open brackets,
+backslash) do not end the body, and neither does text inside string literals.
+
+`FunctionEndCriteria` applies it to every row of a `generate` call and counts the stopped
+sequences and the tokens saved with respect to `max_new_tokens`. Token texts are decoded one token
+at a time (`TokenTexts`), which is exact for byte-level BPE tokenizers such as StarCoder2's.
+"""
+
+import threading
+
+import torch
+from transformers import StoppingCriteria
+
+
+class FunctionBodyEnd:
+    """Incremental detector of the end of a function body in generated text."""
+
+    def __init__(self):
+        self.done = False
+        self._at_line_start = True  # the generated body starts on a new line
+        self._depth = 0             # open brackets
+        self._string = None         # delimiter of the open string literal
+        self._closing = 0           # consecutive delimiter characters seen in a triple-quoted string
+        self._quotes = None         # (quote, count) of quotes in code not yet resolved into a string
+        self._comment = False
+        self._escape = False        # backslash in a string or at the end of a code line
+
+    def feed(self, text: str) -> bool:
+        """Consumes the next piece of generated text and returns True once the body has ended."""
+        if not self.done:
+            for char in text:
+                if self._step(char):
+                    self.done = True
+                    break
+        return self.done
+
+    def _step(self, char) -> bool:
+        if self._quotes is not None:
+            quote, count = self._quotes
+            if char == quote:
+                if count == 2:
+                    self._quotes = None
+                    self._string, self._closing = quote * 3, 0
+                else:
+                    self._quotes = (quote, 2)
+                return False
+            self._quotes = None
+            if count == 1:
+                self._string = quote
+            # Two quotes are an empty string and `char` is code again
+        if self._string is not None and self._string_char(char):
+            return False
+
+        if self._at_line_start and char not in '\r\n':
+            self._at_line_start = False
+            if char not in ' \t#':
+                return True
+        if self._comment:
+            if char != '\n':
+                return False
+            self._comment = False
+        if self._escape:
+            # Explicit line continuation
+            self._escape = False
+            return False
+        if char == '\n':
+            self._at_line_start = self._depth == 0
+        elif char == '#':
+            self._comment = True
+        elif char == '\\':
+            self._escape = True
+        elif char in '([{':
+            self._depth += 1
+        elif char in ')]}':
+            self._depth = max(0, self._depth - 1)
+        elif char in '"\'':
+            self._quotes = (char, 1)
+        return False
+
+    def _string_char(self, char) -> bool:
+        """Advances the open string literal; returns False if `char` has to be handled as code."""
+        if self._escape:
+            self._escape = False
+            self._closing = 0
+        elif char == '\\':
+            self._escape = True
+        elif len(self._string) == 1:
+            if char == '\n':
+                # Unterminated single-quoted string: the line ends anyway
+                self._string = None
+                return False
+            if char == self._string:
+                self._string = None
+        elif char == self._string[0]:
+            self._closing += 1
+            if self._closing == 3:
+                self._string = None
+        else:
+            self._closing = 0
+        return True
+
+
+class TokenTexts:
+    """Memoized text of single token ids, decoded without special tokens."""
+
+    def __init__(self, tokenizer, lock: threading.Lock = None):
+        self.tokenizer = tokenizer
+        self.lock = lock or threading.Lock()
+        self._texts = {}
+
+    def __call__(self, token_id: int) -> str:
+        text = self._texts.get(token_id)
+        if text is None:
+            with self.lock:
+                text = self.tokenizer.decode([token_id], skip_special_tokens=True)
+            self._texts[token_id] = text
+        return text
+
+
+class FunctionEndCriteria(StoppingCriteria):
+    """Stops each row of a `generate` call at the end of its function body."""
+
+    def __init__(self, token_texts: TokenTexts, max_new_tokens: int):
+        self.token_texts = token_texts
+        self.max_new_tokens = max_new_tokens
+        self.detectors = None
+        self.generated = 0
+        self.stopped_sequences = 0
+        self.saved_tokens = 0
+
+    def __call__(self, input_ids: torch.LongTensor, scores, **kwargs) -> torch.BoolTensor:
+        if self.detectors is None:
+            self.detectors = [FunctionBodyEnd() for _ in range(input_ids.shape[0])]
+        self.generated += 1
+        for detector, token_id in zip(self.detectors, input_ids[:, -1].tolist()):
+            if not detector.done and detector.feed(self.token_texts(token_id)):
+                self.stopped_sequences += 1
+                self.saved_tokens += max(0, self.max_new_tokens - self.generated)
+        return torch.tensor([detector.done for detector in self.detectors], dtype=torch.bool, device=input_ids.device)
@@ -19,13 +19,21 @@
 Differences from the original DeepMind FunSearch version
 
 * Evaluates samples using a sandboxed execution environment that runs each
-  generated program on test inputs in isolated subprocesses.
+  generated program on test inputs in isolated subprocesses. With `sandbox_mode="warm"`
+  the subprocesses are persistent, pre-imported workers instead of one interpreter per call.
 * Uses multiprocessing with CPU parallelism (via `ProcessPoolExecutor`) to evaluate
   multiple inputs in parallel.
+* Keeps up to `max_samples_in_flight` samples in evaluation at once. Sandbox runs are
+  awaited through `loop.run_in_executor`, so the event loop keeps consuming and publishing
+  while earlier samples are still running.
+* Results are published through a `process_utils.BufferedPublisher` (batches with one round of
+  publisher confirms each); a sample is acked once its result is buffered, and the buffer is
+  flushed before the channel closes.
 * Tracks and publishes per-sample CPU time, along with GPU time and token counts
   received from the sampler.
 * Publishes results back to the database queue with functional scores, hashed outputs,
-  and a flag indicating whether an optimal solution was found.
+  and a flag indicating whether an optimal solution was found. With `num_database_shards > 1`
+  each result goes to the queue of the database shard that owns its island.
 * Logs full outputs for prompts with structurally identical few-shot examples,
   allowing downstream deduplication and analysis.
 * Parses LLM output by extracting only the first valid function body from generated code.
@@ -40,6 +48,9 @@ from typing import Any
 import copy
 import logging
 from disfun import code_manipulation
+from disfun import database_shards
+from disfun import message_codec
+from disfun import process_utils
 from disfun import sandbox
 from pathlib import Path
 import json
@@ -47,7 +58,7 @@ import aio_pika
 import sys
 import asyncio
 import concurrent.futures  
-from concurrent.futures import ProcessPoolExecutor, as_completed 
+from concurrent.futures import ProcessPoolExecutor
 from torch.multiprocessing import Manager # starts its own process on a cpu core 
 import gc
 import psutil
@@ -172,11 +183,14 @@ class Evaluator:
     (e.g., sandbox/sandbox<PID>/stderr_N.log). The stderr files are automatically cleaned up
     after evaluation completes.
     """
-    def __init__(self, connection, channel, evaluator_queue, database_queue, template, function_to_evolve, function_to_run, inputs, sandbox_base_path, timeout_seconds, local_id, target_signatures, max_workers=2):
+    def __init__(self, connection, channel, evaluator_queue, database_queue, template, function_to_evolve, function_to_run, inputs, sandbox_base_path, timeout_seconds, local_id, target_signatures, max_workers=2, max_samples_in_flight=2, sandbox_mode="subprocess", warm_worker_max_calls=100, graph_cache_mb=0, codec=None, publisher=None, num_database_shards=1):
         self.connection = connection
         self.channel = channel
         self.evaluator_queue = evaluator_queue
         self.database_queue = database_queue
+        self.num_database_shards = num_database_shards
+        self.codec = codec or message_codec.MessageCodec()
+        self.publisher = publisher or process_utils.BufferedPublisher(channel)
         self.template = template
         self.function_to_evolve = function_to_evolve
         self.function_to_run = function_to_run
@@ -186,26 +200,20 @@ class Evaluator:
         self.manager = Manager()
         self.call_count = self.manager.Value('i', 0)
         self.call_count_lock = self.manager.Lock()
-        self.sandbox = sandbox.ExternalProcessSandbox(
-            base_path=sandbox_base_path, timeout_secs=timeout_seconds, python_path=sys.executable, local_id=self.local_id)
+        if sandbox_mode == "warm":
+            self.sandbox = sandbox.WarmProcessSandbox(
+                base_path=sandbox_base_path, timeout_secs=timeout_seconds, python_path=sys.executable, local_id=self.local_id,
+                max_calls_per_worker=warm_worker_max_calls, graph_cache_mb=graph_cache_mb)
+        else:
+            if sandbox_mode != "subprocess":
+                logger.warning(f"Unknown sandbox_mode '{sandbox_mode}', falling back to 'subprocess'")
+            self.sandbox = sandbox.ExternalProcessSandbox(
+                base_path=sandbox_base_path, timeout_secs=timeout_seconds, python_path=sys.executable, local_id=self.local_id)
         self.executor = ProcessPoolExecutor(max_workers=max_workers)
-        self.cumulative_cpu_time = 0.0  # Track total CPU time
-        self.cpu_time_lock = self.manager.Lock()  # Lock to protect updates to cumulative CPU time
+        self.max_samples_in_flight = max(1, max_samples_in_flight)
+        self.cumulative_cpu_time = 0.0  # Total sandbox CPU time over the evaluator's lifetime
         self.target_signatures = target_signatures # Example {(6,1): 10, (7,1): 16, (8,1): 30, (9,1): 52, (10,1): 94, (11,1): 172}
 
-    def _track_cpu_time(self):
-        """
-        Tracks CPU time for all child processes and adds to the cumulative total.
-        """
-        parent = psutil.Process()
-        with self.cpu_time_lock:
-            for child in parent.children(recursive=True):
-                try:
-                    cpu_times = child.cpu_times()
-                    self.cumulative_cpu_time += cpu_times.user + cpu_times.system
-                except psutil.NoSuchProcess:
-                    pass  # Skip if the process no longer exists
-
     async def shutdown(self):
         logger.info(f"Evaluator {self.local_id}: Initiating shutdown process.")
         try:
@@ -262,36 +270,43 @@ class Evaluator:
 
 
     async def consume_and_process(self):
-        from disfun import process_utils
-
         async def _consume_loop():
             """Inner consume loop - will be wrapped with reconnection logic."""
             async with self.channel:
-                await self.channel.set_qos(prefetch_count=1)
+                # One unacknowledged message per sample slot, so the broker never hands us more than we evaluate
+                await self.channel.set_qos(prefetch_count=self.max_samples_in_flight)
+                slots = asyncio.Semaphore(self.max_samples_in_flight)
+                in_flight = set()
 
                 async with self.evaluator_queue.iterator() as stream:
                     message_count = 0
-                    async for message in stream:
-                        fetch_start_time = time.perf_counter()
-
-                        async with message.process():
-                            fetch_end_time = time.perf_counter()
-                            fetch_duration = fetch_end_time - fetch_start_time
-                            logger.debug(f"Time to fetch message from queue: {fetch_duration:.6f} seconds")
-
-                            try:
-                                await asyncio.wait_for(self.process_message(message), timeout=300)
-                            except asyncio.TimeoutError:
-                                logger.warning("Processing message timed out.")
-                            except Exception as e:
-                                logger.error(f"Evaluator: Error while processing message: {e}")
-
-                        # Periodically clean up orphaned sandbox processes
-                        message_count += 1
-                        if message_count % 10 == 0:
-                            killed = sandbox.cleanup_orphaned_sandbox_processes(logger)
-                            if killed > 0:
-                                logger.info(f"Cleaned up {killed} orphaned sandbox processes")
+                    try:
+                        async for message in stream:
+                            # Wait for a free slot; earlier samples keep running in the background
+                            await slots.acquire()
+                            task = asyncio.create_task(self._process_and_ack(message, slots))
+                            in_flight.add(task)
+                            task.add_done_callback(in_flight.discard)
+
+                            # Periodically clean up orphaned sandbox processes
+                            message_count += 1
+                            if message_count % 10 == 0:
+                                killed = sandbox.cleanup_orphaned_sandbox_processes(logger)
+                                if killed > 0:
+                                    logger.info(f"Cleaned up {killed} orphaned sandbox processes")
+                    except asyncio.CancelledError:
+                        logger.info(f"Evaluator {self.local_id}: Cancelling {len(in_flight)} in-flight samples.")
+                        for task in in_flight:
+                            task.cancel()
+                        raise
+                    finally:
+                        if in_flight:
+                            await asyncio.gather(*in_flight, return_exceptions=True)
+                        # Results still buffered go out before `async with self.channel` closes it
+                        try:
+                            await self.publisher.flush()
+                        except Exception as e:
+                            logger.error(f"Evaluator {self.local_id}: Error flushing publisher: {e}")
 
         # Wrap consume loop with automatic reconnection
         await process_utils.with_reconnection(
@@ -301,6 +316,11 @@ class Evaluator:
         )
 
         # Cleanup after loop exits
+        try:
+            await self.publisher.close()
+            logger.info(f"Evaluator {self.local_id}: publisher {self.publisher.stats()}")
+        except Exception as e:
+            logger.error(f"Evaluator {self.local_id}: Error flushing publisher: {e}")
         try:
             await asyncio.wait_for(self.shutdown(), timeout=100)
         except asyncio.TimeoutError:
@@ -309,16 +329,38 @@ class Evaluator:
             logger.error(f"Error during shutdown: {e}")
 
 
+    async def _process_and_ack(self, message: aio_pika.IncomingMessage, slots: asyncio.Semaphore):
+        """
+        Evaluates one message and acknowledges it, then frees its in-flight slot. A sample that
+        times out keeps its slot until its sandbox runs have ended, so that no more than
+        `max_samples_in_flight` samples occupy the executor.
+        """
+        jobs = []  # executor jobs of the sample
+        try:
+            async with message.process():
+                try:
+                    await asyncio.wait_for(self.process_message(message, jobs), timeout=300)
+                except asyncio.TimeoutError:
+                    # Jobs that have not started are cancelled; running ones end with their sandbox timeout
+                    running = [job for job in jobs if not job.cancel() and not job.done()]
+                    logger.warning(f"Processing message timed out, waiting for {len(running)} running sandbox jobs.")
+                    if running:
+                        await asyncio.to_thread(concurrent.futures.wait, running)
+                except Exception as e:
+                    logger.error(f"Evaluator: Error while processing message: {e}")
+        finally:
+            slots.release()
+
     #async_time_execution
     #@async_track_memory
-    async def process_message(self, message: aio_pika.IncomingMessage):
+    async def process_message(self, message: aio_pika.IncomingMessage, jobs: list = None):
+        """Evaluates a sample and publishes its result; the executor jobs it submits are added to `jobs`."""
         call_folders_to_cleanup = []  # List to track created folders
-        call_files_to_cleanup = []  # List to track created folders
+        call_files_to_cleanup = []  # List to track created stderr files
         hash_value=None
-        call_data_folder=None
+        sample_cpu_time = 0.0  # CPU time of this sample's sandbox runs
         try:
-            raw_data = message.body.decode()
-            data = json.loads(raw_data)
+            data = self.codec.decode(message)
             logger.debug(f"Data is {data}")
             logger.debug(f"Evaluator: Starts to analyze generated continuation of def priority: {data['sample']}")
 
@@ -335,47 +377,48 @@ class Evaluator:
             # Process the new function from the generated code
             new_function, program = _sample_to_program(data["sample"], data.get("version_generated"), self.template, self.function_to_evolve)
 
-            tasks = {}
-
-            if new_function.body not in [None, '']:
-                # Submit each test input as a task for multiprocessing
-                logger.debug(f"Evaluator: Submitting {len(self.inputs)} evaluation tasks with inputs: {self.inputs}")
-                tasks = {self.executor.submit(run_evaluation, self.sandbox, program, self.function_to_run, input, self.timeout_seconds, self.call_count, self.call_count_lock): input for input in self.inputs}
-            else:
+            if new_function.body in [None, '']:
                 logger.info("New function body is None or empty. Skipping execution but publishing 'return'.")
-                result = ("return", data['island_id'], {}, data['expected_version'], self.cumulative_cpu_time, gpu_time, input_tokens, output_tokens, False, parent_ids)
+                result = ("return", data['island_id'], {}, data['expected_version'], sample_cpu_time, gpu_time, input_tokens, output_tokens, False, parent_ids)
                 await self.publish_to_database(result, hash_value)  # Publish "return" result
                 return  # Early return after publishing
 
+            # Submit each test input to the process pool without blocking the event loop
+            logger.debug(f"Evaluator: Submitting {len(self.inputs)} evaluation tasks with inputs: {self.inputs}")
+            sample_jobs = [
+                self.executor.submit(run_evaluation, self.sandbox, program, self.function_to_run, input, self.timeout_seconds, self.call_count, self.call_count_lock)
+                for input in self.inputs
+            ]
+            if jobs is not None:
+                jobs.extend(sample_jobs)
+            tasks = [asyncio.wrap_future(job) for job in sample_jobs]
+
             scores_per_test = {}
             # Waiting for results from all test inputs
-            for future in as_completed(tasks):
-                input = tasks[future]
-                try:
-                    test_output, runs_ok, cpu_time,  call_data_folder, input_path, error_file= future.result(timeout=self.timeout_seconds)
-                    call_folders_to_cleanup.append(call_data_folder)
-                    call_files_to_cleanup.append(input_path)
-                    call_files_to_cleanup.append(error_file)
-
-                    # Accumulate CPU time
-                    with self.cpu_time_lock:
-                        self.cumulative_cpu_time += cpu_time
-
-                    if runs_ok and test_output[0] is not None:
-                        # Extract score, key, and hash using the extraction function
-                        score_key, score_value, extracted_hash = extract_evaluation_result(test_output, input)
-                        scores_per_test[score_key] = score_value
-                        if extracted_hash is not None:
-                            hash_value = extracted_hash
-                        logger.debug(f"Evaluator: scores_per_test {scores_per_test}")
-                except concurrent.futures.TimeoutError:
-                    logger.warning(f"Task for input {input} timed out.")
-                except concurrent.futures.CancelledError:
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+            for input, outcome in zip(self.inputs, outcomes):
+                if isinstance(outcome, asyncio.CancelledError):
                     logger.warning(f"Task for input {input} was cancelled.")
-                except Exception as e:
-                    # Catch any other exceptions
-                    logger.error(f"Error during task execution for input {input}: {e}")
-            
+                    continue
+                if isinstance(outcome, Exception):
+                    logger.error(f"Error during task execution for input {input}: {outcome}")
+                    continue
+
+                test_output, runs_ok, cpu_time, call_data_folder, input_path, error_file = outcome
+                call_folders_to_cleanup.append(call_data_folder)
+                call_files_to_cleanup.append(error_file)
+
+                # Accumulate CPU time
+                sample_cpu_time += cpu_time
+                self.cumulative_cpu_time += cpu_time
+
+                if runs_ok and test_output[0] is not None:
+                    # Extract score, key, and hash using the extraction function
+                    score_key, score_value, extracted_hash = extract_evaluation_result(test_output, input)
+                    scores_per_test[score_key] = score_value
+                    if extracted_hash is not None:
+                        hash_value = extracted_hash
+                    logger.debug(f"Evaluator: scores_per_test {scores_per_test}")
 
 
             if self.target_signatures:
@@ -387,26 +430,25 @@ class Evaluator:
 
             # Prepare the result for publishing
             if len(scores_per_test) == len(self.inputs) and any(score != 0 for score in scores_per_test.values()):
-                result = (new_function, data['island_id'], scores_per_test, data['expected_version'], self.cumulative_cpu_time, gpu_time, input_tokens, output_tokens, found_optimal_solution, parent_ids)
+                result = (new_function, data['island_id'], scores_per_test, data['expected_version'], sample_cpu_time, gpu_time, input_tokens, output_tokens, found_optimal_solution, parent_ids)
                 logger.debug(f"Scores are {scores_per_test}")
             else:
-                result = ("return", data['island_id'], {}, data['expected_version'], self.cumulative_cpu_time, gpu_time, input_tokens, output_tokens, False, parent_ids)
+                result = ("return", data['island_id'], {}, data['expected_version'], sample_cpu_time, gpu_time, input_tokens, output_tokens, False, parent_ids)
 
             # Publish the result
             await self.publish_to_database(result, hash_value)
 
-            # Reset cumulative CPU time after publishing
-            with self.cpu_time_lock:
-                self.cumulative_cpu_time = 0.0
-
         except Exception as e:
             logger.error(f"Error in process_message: {e}")
         
         finally:
-            # Cleanup: Delete the call_data_folder after a delay
-            await asyncio.sleep(1)  # Optional delay, adjust if needed
-            if call_data_folder and call_data_folder.exists():
-                shutil.rmtree(call_data_folder)
+            # Cleanup: only this sample's call folders and stderr files, other samples may still be running
+            for call_data_folder in call_folders_to_cleanup:
+                if call_data_folder and call_data_folder.exists():
+                    shutil.rmtree(call_data_folder, ignore_errors=True)
+            for call_file in call_files_to_cleanup:
+                if call_file and call_file.exists():
+                    call_file.unlink(missing_ok=True)
 
 
     async def publish_to_database(self, result, hash_value):
@@ -428,16 +470,14 @@ class Evaluator:
                 "parent_ids": parent_ids  # Include parent IDs for lineage tracking
             }
 
-            message_body = json.dumps(serialized_result)
+            message = self.codec.message(serialized_result)
         
             # Start timing before publishing
             publish_start_time = time.perf_counter()
 
-            # Publishing the serialized result to the database queue
-            await self.channel.default_exchange.publish(
-                aio_pika.Message(body=message_body.encode()), 
-                routing_key='database_queue'
-            )
+            # Publishing the serialized result to the database queue (of the shard owning the island)
+            for routing_key in database_shards.routing_keys(island_id, self.num_database_shards):
+                await self.publisher.publish(message, routing_key=routing_key)
 
             # End timing after publishing
             publish_end_time = time.perf_counter()
@@ -8,20 +8,25 @@ import logging
 import aio_pika
 import asyncio
 import json
-from disfun import programs_database
+from disfun import message_codec, process_utils, programs_database
 from typing import List
 from disfun.profiling import sync_time_execution, sync_track_memory, async_track_memory, async_time_execution
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI, RateLimitError
+from disfun.llm_backends import LLMBackend, create_backend
+from disfun.rate_limit import RateLimiter, backoff_delay
 import os
 import logging
 
 logger = logging.getLogger('main_logger')
 
 
-class LLM_model:
-    def __init__(self, samples_per_prompt: int, model="gpt-4o-mini"):
+class LLM_model(LLMBackend):
+    def __init__(self, samples_per_prompt: int, model="gpt-4o-mini", requests_per_minute=None,
+                 tokens_per_minute=None, max_retries=6, max_tokens=150):
         self.samples_per_prompt = samples_per_prompt
         self.model = model
+        self.max_tokens = max_tokens
+        self.max_retries = max_retries
         logger.debug("In LLM")
 
         # Initialize the Azure OpenAI client
@@ -34,12 +39,26 @@ class LLM_model:
         except Exception as e: 
             logger.error(f"Failed to initialize Azure OpenAI client: {e}")
 
+        # Async client for the concurrent sampler. Retries on 429 are done by draw_sample_async,
+        # which shares the backoff with all in-flight requests through the rate limiter.
+        try:
+            self.async_client = AsyncAzureOpenAI(
+                api_version=os.getenv('AZURE_OPENAI_API_VERSION', '2023-07-01-preview'),
+                azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),
+                api_key=os.getenv('AZURE_OPENAI_API_KEY'),
+                max_retries=0
+            )
+        except Exception as e:
+            logger.error(f"Failed to initialize async Azure OpenAI client: {e}")
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
         # Initialize counters for tracking usage
         self.total_requests = 0
         self.total_prompt_tokens = 0
         self.total_completion_tokens = 0
         self.total_tokens = 0
         self.total_cost = 0.0  # Track total cost
+        self.rate_limited_requests = 0  # 429 responses
 
     def calculate_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
         """
@@ -57,6 +76,49 @@ class LLM_model:
         # Return total cost
         return prompt_cost + completion_cost
 
+    def _messages(self, prompt: str) -> list:
+        return [
+            {"role": "system", "content": "You are a helpful assistant specializing in Python programming."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def estimate_tokens(self, prompt: str) -> int:
+        """
+        Upper estimate of the tokens a request counts against the tokens-per-minute quota: the prompt
+        (about 4 characters per token) plus max_tokens for each of the n choices.
+        """
+        return len(prompt) // 4 + self.max_tokens * self.samples_per_prompt
+
+    def _record_response(self, response) -> list:
+        """Updates the usage counters and returns the generated texts of a completion response."""
+        # Log the entire response
+        logger.debug(f"Full response: {response}")
+
+        # Extract usage details from the response
+        usage = response.usage # contains information on token usage for the completion request to compute cost
+        self.total_requests += 1
+        self.total_prompt_tokens += usage.prompt_tokens
+        self.total_completion_tokens += usage.completion_tokens
+        self.total_tokens += usage.total_tokens
+
+        # Calculate the cost for this request
+        cost = self.calculate_cost(usage.prompt_tokens, usage.completion_tokens)
+        self.total_cost += cost
+
+        # Log the response, tokens, and cost
+        logger.debug(f"Tokens used in this request: prompt={usage.prompt_tokens}, completion={usage.completion_tokens}, total={usage.total_tokens}")
+        logger.debug(f"Cost for this request: ${cost:.6f}")
+        logger.debug(f"Total cost so far: ${self.total_cost:.6f}")
+        logger.debug(f"Total requests so far: {self.total_requests}")
+        logger.debug(f"Total tokens used so far: prompt={self.total_prompt_tokens}, completion={self.total_completion_tokens}, total={self.total_tokens}")
+
+        # Retrieve the generated text from the response
+        generated_responses = [choice.message.content for choice in response.choices]
+        logger.debug(f"Generated response from gpt mini is {generated_responses}")
+
+        # Return the list of message content (the generated text)
+        return generated_responses
+
     def draw_sample(self, prompt: str) -> list:
         """
         Generate a sample response from the LLM based on the provided prompt.
@@ -65,94 +127,111 @@ class LLM_model:
             # Using the updated client for Azure OpenAI with `model`
             response = self.client.chat.completions.create(
                 model=self.model,  
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant specializing in Python programming."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=150,
+                messages=self._messages(prompt),
+                max_tokens=self.max_tokens,
                 n= self.samples_per_prompt
             )
-
-            # Log the entire response
-            logger.debug(f"Full response: {response}")
-
-            # Extract usage details from the response
-            usage = response.usage # contains information on token usage for the completion request to compute cost
-            self.total_requests += 1
-            self.total_prompt_tokens += usage.prompt_tokens
-            self.total_completion_tokens += usage.completion_tokens
-            self.total_tokens += usage.total_tokens
-
-            # Calculate the cost for this request
-            cost = self.calculate_cost(usage.prompt_tokens, usage.completion_tokens)
-            self.total_cost += cost
-
-            # Log the response, tokens, and cost
-            logger.debug(f"Tokens used in this request: prompt={usage.prompt_tokens}, completion={usage.completion_tokens}, total={usage.total_tokens}")
-            logger.debug(f"Cost for this request: ${cost:.6f}")
-            logger.debug(f"Total cost so far: ${self.total_cost:.6f}")
-            logger.debug(f"Total requests so far: {self.total_requests}")
-            logger.debug(f"Total tokens used so far: prompt={self.total_prompt_tokens}, completion={self.total_completion_tokens}, total={self.total_tokens}")
-
-            # Retrieve the generated text from the response
-            generated_responses = [choice.message.content for choice in response.choices]
-            logger.debug(f"Generated response from gpt mini is {generated_responses}")
-        
-            # Return the list of message content (the generated text)
-            return generated_responses
+            return self._record_response(response)
 
         except Exception as e:
             logger.error(f"Unexpected error during draw_sample: {str(e)}")
             return []
 
+    async def draw_sample_async(self, prompt: str) -> list:
+        """
+        Async version of `draw_sample` for concurrent requests. Waits for the requests-per-minute and
+        tokens-per-minute budget before sending, and retries a 429 with exponential backoff, during
+        which the other requests of the sampler are held back as well.
+        """
+        estimated_tokens = self.estimate_tokens(prompt)
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire(estimated_tokens)
+            try:
+                response = await self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=self._messages(prompt),
+                    max_tokens=self.max_tokens,
+                    n=self.samples_per_prompt
+                )
+            except RateLimitError as e:
+                # Rejected requests do not count against the quota
+                self.rate_limiter.settle(estimated_tokens, 0)
+                self.rate_limited_requests += 1
+                delay = backoff_delay(attempt, retry_after=_retry_after(e))
+                self.rate_limiter.pause(delay)
+                logger.warning(f"Rate limited (attempt {attempt + 1}/{self.max_retries + 1}), backing off {delay:.1f}s")
+                continue
+            except Exception as e:
+                self.rate_limiter.settle(estimated_tokens, 0)
+                logger.error(f"Unexpected error during draw_sample_async: {str(e)}")
+                return []
+
+            try:
+                self.rate_limiter.settle(estimated_tokens, response.usage.total_tokens)
+                return self._record_response(response)
+            except Exception as e:
+                logger.error(f"Unexpected error during draw_sample_async: {str(e)}")
+                return []
+
+        logger.error(f"Giving up on prompt after {self.max_retries + 1} rate-limited attempts")
+        return []
+
+
+def _retry_after(error) -> float | None:
+    """Seconds from the retry-after-ms / retry-after headers of a 429 response, if present."""
+    try:
+        headers = error.response.headers
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return None
+
 
 class Sampler:
-    def __init__(self, connection, channel, sampler_queue, evaluator_queue, config):
+    """
+    Consumes prompts and sends them to Azure OpenAI with up to `gpt_max_concurrent_requests`
+    requests in flight. Each message is acked once its samples are handed to the publisher, which
+    sends the samples of concurrent prompts in batches (`BufferedPublisher`); the rate limiter of
+    the LLM keeps the process below `gpt_requests_per_minute` and `gpt_tokens_per_minute`.
+    """
+    def __init__(self, connection, channel, sampler_queue, evaluator_queue, config, codec=None, publisher=None):
         self.connection = connection
         self.channel = channel
         self.sampler_queue = sampler_queue
         self.evaluator_queue = evaluator_queue
+        self.codec = codec or message_codec.MessageCodec()
+        self.publisher = publisher or process_utils.BufferedPublisher(channel)
         self.config = config
-        self._llm = LLM_model(samples_per_prompt=self.config.samples_per_prompt)
-        self.prefetch_count = 10
+        self._llm = create_backend(self.config, lambda: LLM_model(
+            samples_per_prompt=self.config.samples_per_prompt,
+            requests_per_minute=getattr(self.config, 'gpt_requests_per_minute', None),
+            tokens_per_minute=getattr(self.config, 'gpt_tokens_per_minute', None),
+            max_retries=getattr(self.config, 'gpt_max_retries', 6),
+        ))
+        self.max_concurrent_requests = max(1, getattr(self.config, 'gpt_max_concurrent_requests', 8))
+        # Enough unacked messages to keep the concurrency window full
+        self.prefetch_count = max(10, 2 * self.max_concurrent_requests)
 
     async def consume_and_process(self):
-        from disfun import process_utils
-
         async def _consume_loop():
             """Inner consume loop - will be wrapped with reconnection logic."""
             await self.channel.set_qos(prefetch_count=self.prefetch_count)
+            slots = asyncio.Semaphore(self.max_concurrent_requests)
+            in_flight = set()
 
-            async with self.sampler_queue.iterator() as stream:
-                async for message in stream:
-                    async with message.process():
-                        try:
-                            gpu_time = 0
-                            data = json.loads(message.body.decode())
-                            prompt_data = data["prompt"]
-                            prompt = programs_database.Prompt.deserialize(prompt_data)
-                            total_registered_programs = data.get("total_registered_programs", 0)
-                            parent_ids = data.get("parent_ids", [])
-                            responses = self._llm.draw_sample(prompt.code)
-                            logger.debug(f"responses is {responses}")
-
-                            for response in responses:
-                                message_data = {
-                                    "sample": response,
-                                    "island_id": prompt.island_id,
-                                    "version_generated": prompt.version_generated,
-                                    "expected_version": prompt.expected_version,
-                                    "gpu_time": gpu_time,
-                                    "parent_ids": parent_ids,
-                                }
-                                serialized_message = json.dumps(message_data)
-                                await self.channel.default_exchange.publish(
-                                    aio_pika.Message(body=serialized_message.encode()),
-                                    routing_key='evaluator_queue'
-                                )
-                                logger.debug("Successfully published prompt to evaluator_queue")
-                        except Exception as e:
-                            logger.error(f"Error processing and sending message: {str(e)}")
+            try:
+                async with self.sampler_queue.iterator() as stream:
+                    async for message in stream:
+                        await slots.acquire()
+                        task = asyncio.create_task(self._process_message(message, slots))
+                        in_flight.add(task)
+                        task.add_done_callback(in_flight.discard)
+            finally:
+                if in_flight:
+                    await asyncio.gather(*in_flight, return_exceptions=True)
 
         # Wrap consume loop with automatic reconnection
         await process_utils.with_reconnection(
@@ -160,6 +239,43 @@ class Sampler:
             logger,
             component_name="GPT Sampler"
         )
+        try:
+            await self.publisher.close()
+            logger.info(f"GPT Sampler: publisher {self.publisher.stats()}")
+        except Exception as e:
+            logger.error(f"GPT Sampler: Error flushing publisher: {e}")
+
+    async def _process_message(self, message: aio_pika.IncomingMessage, slots: asyncio.Semaphore):
+        """Samples one prompt and publishes the responses; frees its concurrency slot when done."""
+        try:
+            async with message.process():
+                try:
+                    gpu_time = 0
+                    data = self.codec.decode(message)
+                    prompt_data = data["prompt"]
+                    prompt = programs_database.Prompt.deserialize(prompt_data)
+                    total_registered_programs = data.get("total_registered_programs", 0)
+                    parent_ids = data.get("parent_ids", [])
+                    responses = await self._llm.draw_sample_async(prompt.code)
+                    logger.debug(f"responses is {responses}")
+
+                    for response in responses:
+                        message_data = {
+                            "sample": response,
+                            "island_id": prompt.island_id,
+                            "version_generated": prompt.version_generated,
+                            "expected_version": prompt.expected_version,
+                            "gpu_time": gpu_time,
+                            "parent_ids": parent_ids,
+                        }
+                        await self.publisher.publish(self.codec.message(message_data), routing_key='evaluator_queue')
+                        logger.debug("Successfully published prompt to evaluator_queue")
+                except Exception as e:
+                    logger.error(f"Error processing and sending message: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error acknowledging message: {str(e)}")
+        finally:
+            slots.release()
 
 if __name__ == "__main__":
     pass
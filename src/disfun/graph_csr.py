@@ -0,0 +1,187 @@
+"""
+Compact CSR storage for the code graphs.
+
+The LMDB graphs store every node as a UTF-8 key with a JSON list of neighbor strings, so loading a
+graph means decoding every list. This module stores the same graph as two NumPy arrays that can be
+memory-mapped without any parsing:
+
+    graph_d_s{s}_n{n}_q{q}.csr/
+        indptr.npy   int64, length q**n + 1
+        indices.npy  int32 (int64 if q**n > 2**31), neighbors of node i are indices[indptr[i]:indptr[i+1]]
+        meta.json    {"n": ..., "q": ..., "num_nodes": ..., "num_edges": ...}
+
+Node ids are the base-q value of the node string, so node "0110" with q=2 has id 6 and ids follow
+the lexicographic order of `itertools.product`. Every undirected edge is stored in both rows, and
+each row keeps the neighbor order of the source adjacency list, so a graph converted from LMDB
+iterates exactly like the LMDB graph.
+
+Specifications can use `load_csr` and `neighbors` directly on the arrays, or `load_graph` as a
+drop-in replacement of the LMDB `load_graph` that returns a networkx graph with string nodes.
+"""
+
+import itertools
+import json
+import os
+import re
+from typing import NamedTuple
+
+import numpy as np
+
+
+class CSRGraph(NamedTuple):
+    """Graph over all q-ary strings of length n in CSR form."""
+    indptr: np.ndarray
+    indices: np.ndarray
+    n: int
+    q: int
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices) // 2
+
+
+def node_to_id(node: str, q: int) -> int:
+    """Base-q value of a node string."""
+    return int(node, q)
+
+
+def id_to_node(node_id: int, n: int, q: int) -> str:
+    """Node string of length n with base-q value `node_id`."""
+    digits = []
+    for _ in range(n):
+        node_id, digit = divmod(node_id, q)
+        digits.append(str(digit))
+    return ''.join(reversed(digits))
+
+
+def node_labels(n: int, q: int) -> list:
+    """All node strings in id order."""
+    alphabet = ''.join(str(i) for i in range(q))
+    return [''.join(seq) for seq in itertools.product(alphabet, repeat=n)]
+
+
+def index_dtype(num_nodes: int):
+    """Smallest integer dtype for node ids of a graph with `num_nodes` nodes."""
+    return np.int32 if num_nodes < 2**31 else np.int64
+
+
+def adjacency_to_csr(adjacency, n: int, q: int) -> CSRGraph:
+    """Converts an adjacency dict {node: [neighbor strings]} to a CSRGraph."""
+    num_nodes = q ** n
+    dtype = index_dtype(num_nodes)
+    degrees = np.zeros(num_nodes + 1, dtype=np.int64)
+    for node, neighbors in adjacency.items():
+        degrees[node_to_id(node, q) + 1] = len(neighbors)
+    indptr = np.cumsum(degrees)
+
+    indices = np.empty(indptr[-1], dtype=dtype)
+    for node, neighbors in adjacency.items():
+        i = node_to_id(node, q)
+        indices[indptr[i]:indptr[i + 1]] = np.fromiter(
+            (node_to_id(neighbor, q) for neighbor in neighbors), dtype=dtype, count=len(neighbors))
+    return CSRGraph(indptr, indices, n, q)
+
+
+def write_csr(graph: CSRGraph, output_path):
+    """Writes a CSRGraph to the directory `output_path`."""
+    os.makedirs(output_path, exist_ok=True)
+    np.save(os.path.join(output_path, "indptr.npy"), graph.indptr)
+    np.save(os.path.join(output_path, "indices.npy"), graph.indices)
+    meta = {"n": graph.n, "q": graph.q, "num_nodes": graph.num_nodes, "num_edges": graph.num_edges}
+    with open(os.path.join(output_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+
+def save_graph_to_csr(adjacency, output_path, n: int, q: int):
+    """
+    Save graph adjacency list in CSR format.
+
+    Args:
+        adjacency: dict mapping node to list of neighbors
+        output_path: Path to the .csr output directory
+        n: Length of node strings
+        q: Alphabet size
+    """
+    print(f"Saving graph to {output_path}")
+    graph = adjacency_to_csr(adjacency, n, q)
+    write_csr(graph, output_path)
+    size_mb = (graph.indptr.nbytes + graph.indices.nbytes) / (1024**2)
+    print(f"  Nodes: {graph.num_nodes:,}, edges: {graph.num_edges:,}, size: {size_mb:.1f} MB")
+    print(f"  Graph saved successfully!")
+
+
+def load_csr(path, mmap: bool = True) -> CSRGraph:
+    """Loads a CSRGraph; with `mmap` the arrays are memory-mapped read-only instead of read."""
+    mmap_mode = "r" if mmap else None
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode=mmap_mode)
+    indices = np.load(os.path.join(path, "indices.npy"), mmap_mode=mmap_mode)
+    return CSRGraph(indptr, indices, meta["n"], meta["q"])
+
+
+def neighbors(graph: CSRGraph, node_id: int) -> np.ndarray:
+    """Neighbor ids of `node_id`."""
+    return graph.indices[graph.indptr[node_id]:graph.indptr[node_id + 1]]
+
+
+def csr_to_networkx(graph: CSRGraph):
+    """
+    Builds a networkx graph with string nodes.
+
+    Edges are added row by row in id order, like the LMDB `load_graph` of the specifications, so
+    node and neighbor iteration order match a graph loaded from LMDB. Isolated nodes are kept.
+    """
+    import networkx as nx
+
+    labels = node_labels(graph.n, graph.q)
+    rows = np.repeat(np.arange(graph.num_nodes), np.diff(graph.indptr))
+    G = nx.Graph()
+    G.add_edges_from(zip(map(labels.__getitem__, rows.tolist()), map(labels.__getitem__, graph.indices.tolist())))
+    G.add_nodes_from(labels)
+    return G
+
+
+def load_graph(path):
+    """Drop-in replacement of the LMDB `load_graph`: loads a .csr graph as a networkx graph."""
+    return csr_to_networkx(load_csr(path))
+
+
+def parse_graph_name(path):
+    """Returns (n, q) from a graph name like graph_d_s1_n8_q2.lmdb."""
+    match = re.search(r"_n(\d+)_q(\d+)", os.path.basename(os.path.normpath(path)))
+    if match is None:
+        raise ValueError(f"Cannot infer n and q from graph name: {path}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def convert_lmdb_to_csr(lmdb_path, output_path=None, n: int = None, q: int = None) -> CSRGraph:
+    """
+    Converts an LMDB graph to CSR format.
+
+    Args:
+        lmdb_path: Path to the .lmdb graph
+        output_path: Output directory (default: lmdb_path with the .lmdb suffix replaced by .csr)
+        n, q: Node length and alphabet size (default: parsed from the graph name)
+    """
+    import lmdb
+
+    if n is None or q is None:
+        n, q = parse_graph_name(lmdb_path)
+    if output_path is None:
+        output_path = re.sub(r"\.lmdb/?$", "", lmdb_path.rstrip("/")) + ".csr"
+
+    adjacency = {}
+    env = lmdb.open(lmdb_path, readonly=True, lock=False)
+    with env.begin() as txn:
+        for key, value in txn.cursor():
+            adjacency[key.decode()] = json.loads(value.decode())
+    env.close()
+
+    graph = adjacency_to_csr(adjacency, n, q)
+    write_csr(graph, output_path)
+    return graph
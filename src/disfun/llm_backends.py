@@ -0,0 +1,232 @@
+"""Pluggable language model backends of the samplers.
+
+`sampler.Sampler` and `gpt.Sampler` draw samples through the `LLMBackend` interface:
+
+* `encode_prompts(prompts)` and `generate_samples(inputs, input_token_counts, ...)` draw
+  `samples_per_prompt` samples for each prompt of a batch and set `gpu_time` to the time the batch
+  took (static `sampler.Sampler`, called on its inference thread).
+* `draw_sample_async(prompt)` draws the samples of one prompt without blocking the event loop
+  (`gpt.Sampler`, which keeps several prompts in flight).
+
+`sampler.LLM_model` (local StarCoder2) and `gpt.LLM_model` (Azure OpenAI) implement it, and the
+base class derives the methods a backend does not implement from the ones it does.
+
+`MockBackend` needs neither a GPU nor credentials: it answers each prompt after a fixed latency
+with the bodies of the versioned functions stored in the prompt, replayed or mutated (a constant
+or an operator changed). The samples depend only on the prompt and the seed, so runs are
+reproducible. `sampler_config.llm_backend = "mock"` selects it in both samplers (see
+`create_backend`), e.g. to measure the throughput of the whole pipeline
+(benchmarks/bench_pipeline.py).
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+import random
+import time
+import tokenize
+from typing import Callable, List, Optional
+
+from disfun import code_manipulation
+
+logger = logging.getLogger('main_logger')
+
+
+def approximate_tokens(text: str) -> int:
+    """Token count of a text for backends without a tokenizer (about 4 characters per token)."""
+    return len(text) // 4
+
+
+class LLMBackend:
+    """
+    Interface of the language models of the samplers. A backend implements `generate_samples`
+    (batched) or `draw_sample` (one prompt), or both.
+    """
+
+    samples_per_prompt = 1
+    gpu_time = 0.0
+
+    def adjust_temperature(self, total_registered_programs: int, temperature_period: int):
+        """Updates the sampling temperature; backends without one ignore it."""
+
+    def encode_prompts(self, prompts: List[str]):
+        """
+        Prepares a batch of prompts for `generate_samples`.
+
+        Returns:
+            (inputs, input_token_counts)
+        """
+        return list(prompts), [approximate_tokens(prompt) for prompt in prompts]
+
+    def generate_samples(self, inputs, input_token_counts: List[int], total_registered_programs: int = 0,
+                         temperature_period: int = None):
+        """
+        Draws samples_per_prompt samples for each prompt of a batch prepared by `encode_prompts`.
+
+        Returns:
+            (samples per prompt, input_token_counts, output token counts per prompt)
+        """
+        self._require_override(type(self).draw_sample is LLMBackend.draw_sample)
+        if temperature_period is not None:
+            self.adjust_temperature(total_registered_programs, temperature_period)
+        start = time.perf_counter()
+        samples_list = [self.draw_sample(prompt) for prompt in inputs]
+        self.gpu_time = time.perf_counter() - start
+        output_token_counts = [[approximate_tokens(sample) for sample in samples] for samples in samples_list]
+        return samples_list, input_token_counts, output_token_counts
+
+    def draw_sample(self, prompt: str) -> list:
+        """Returns samples_per_prompt samples for one prompt."""
+        self._require_override(type(self).generate_samples is LLMBackend.generate_samples)
+        inputs, input_token_counts = self.encode_prompts([prompt])
+        samples_list, _, _ = self.generate_samples(inputs, input_token_counts)
+        return samples_list[0] if samples_list else []
+
+    async def draw_sample_async(self, prompt: str) -> list:
+        """`draw_sample` on a worker thread."""
+        return await asyncio.to_thread(self.draw_sample, prompt)
+
+    def cleanup(self):
+        """Releases the resources of the backend."""
+
+    def _require_override(self, missing: bool):
+        # Each default is implemented by the other one
+        if missing:
+            raise NotImplementedError(
+                f"{type(self).__name__} must implement generate_samples or draw_sample")
+
+
+class MockBackend(LLMBackend):
+    """
+    Deterministic stand-in for a language model. Each sample is the body of one of the versioned
+    functions (`<function_name>_v<i>`) of the prompt, the later versions being more likely, mutated
+    with probability `mutation_rate`. Prompts without versioned functions get one of `bodies`.
+    Every call (a batch in `generate_samples`, a prompt in `draw_sample(_async)`) takes `latency`
+    seconds.
+    """
+
+    def __init__(self, samples_per_prompt: int, latency: float = 0.5, mutation_rate: float = 0.5, seed: int = 0,
+                 function_name: str = "priority", bodies: Optional[List[str]] = None):
+        self.samples_per_prompt = samples_per_prompt
+        self.latency = latency
+        self.mutation_rate = mutation_rate
+        self.seed = seed
+        self.function_name = function_name
+        self.bodies = bodies or ["    return 0.0\n"]
+        self.calls = 0
+        self.samples = 0
+
+    def generate_samples(self, inputs, input_token_counts: List[int], total_registered_programs: int = 0,
+                         temperature_period: int = None):
+        start = time.perf_counter()
+        time.sleep(self.latency)
+        samples_list = [self._samples(prompt) for prompt in inputs]
+        self.gpu_time = time.perf_counter() - start
+        output_token_counts = [[approximate_tokens(sample) for sample in samples] for samples in samples_list]
+        return samples_list, input_token_counts, output_token_counts
+
+    def draw_sample(self, prompt: str) -> list:
+        time.sleep(self.latency)
+        return self._samples(prompt)
+
+    async def draw_sample_async(self, prompt: str) -> list:
+        await asyncio.sleep(self.latency)
+        return self._samples(prompt)
+
+    def _samples(self, prompt: str) -> list:
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode()).digest()
+        rng = random.Random(int.from_bytes(digest[:8], "little"))
+        bodies = self._stored_bodies(prompt) or self.bodies
+        samples = []
+        for _ in range(self.samples_per_prompt):
+            # Later versions are the better programs of the prompt
+            body = rng.choices(bodies, weights=range(1, len(bodies) + 1))[0]
+            if rng.random() < self.mutation_rate:
+                body = mutate_body(body, rng)
+            samples.append(body)
+        self.calls += 1
+        self.samples += len(samples)
+        return samples
+
+    def _stored_bodies(self, prompt: str) -> List[str]:
+        """Non-empty bodies of the versioned functions of the prompt, in version order."""
+        try:
+            program = code_manipulation.text_to_program(prompt)
+        except Exception as e:
+            logger.debug(f"MockBackend: could not parse prompt: {e}")
+            return []
+        prefix = f"{self.function_name}_v"
+        return [f"{function.body.rstrip()}\n" for function in program.functions
+                if function.name.startswith(prefix) and function.body.strip()]
+
+
+_SWAPPED_OPERATORS = {
+    "+": "-", "-": "+", "*": "/", "/": "*", "<": ">", ">": "<", "<=": ">=", ">=": "<=", "max": "min", "min": "max",
+}
+
+
+def mutate_body(body: str, rng: random.Random) -> str:
+    """Changes one number (shifted, or scaled and shifted) or one operator of a function body."""
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(body).readline))
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return body
+    candidates = [token for token in tokens
+                  if token.type == tokenize.NUMBER or token.string in _SWAPPED_OPERATORS]
+    if not candidates:
+        return body
+    token = rng.choice(candidates)
+    if token.type == tokenize.NUMBER:
+        try:
+            value = int(token.string)
+            replacement = str(max(0, value + rng.choice((-1, 1))))
+        except ValueError:
+            try:
+                replacement = repr(round(float(token.string) * rng.uniform(0.5, 1.5) + rng.uniform(-1, 1), 3))
+            except ValueError:
+                return body
+    else:
+        replacement = _SWAPPED_OPERATORS[token.string]
+    lines = body.splitlines(keepends=True)
+    (row, start), (_, end) = token.start, token.end
+    line = lines[row - 1]
+    lines[row - 1] = line[:start] + replacement + line[end:]
+    return "".join(lines)
+
+
+def _mock_backend(config) -> MockBackend:
+    return MockBackend(
+        samples_per_prompt=config.samples_per_prompt,
+        latency=getattr(config, 'mock_latency', 0.5),
+        mutation_rate=getattr(config, 'mock_mutation_rate', 0.5),
+        seed=getattr(config, 'mock_seed', 0),
+    )
+
+
+# Backends selectable with `llm_backend`, built from the sampler config
+BACKENDS = {"mock": _mock_backend}
+
+
+def register_backend(name: str, factory: Callable):
+    """Makes `factory(sampler_config)` selectable as `llm_backend=name`."""
+    BACKENDS[name] = factory
+
+
+def uses_gpu(config) -> bool:
+    """Whether samplers with this config need a GPU (not for GPT mode and the mock backend)."""
+    return not getattr(config, 'gpt', False) and getattr(config, 'llm_backend', 'default') != 'mock'
+
+
+def create_backend(config, default: Callable[[], LLMBackend]) -> LLMBackend:
+    """
+    Returns the backend selected by `config.llm_backend`. "default" (or no setting) calls
+    `default()`, which builds the sampler's own model.
+    """
+    name = getattr(config, 'llm_backend', 'default') or 'default'
+    if name != 'default':
+        if name in BACKENDS:
+            logger.info(f"Using LLM backend '{name}'.")
+            return BACKENDS[name](config)
+        logger.warning(f"Unknown llm_backend '{name}', using the default model.")
+    return default()
@@ -0,0 +1,206 @@
+"""In-process stand-in for the RabbitMQ broker.
+
+`LocalBroker` implements the part of the aio_pika API that the components use, so that a
+ProgramsDatabase, samplers and evaluators can run in one event loop without a RabbitMQ server
+(benchmarks/bench_pipeline.py):
+
+* `broker.connect()` returns a connection, `await connection.channel()` a channel.
+* `channel.declare_queue(name, ...)`, `channel.set_qos(prefetch_count=...)`,
+  `channel.default_exchange.publish(message, routing_key=name)`, `async with channel`.
+* `async with queue.iterator() as stream: async for message in stream`, `queue.purge()` and
+  `queue.declaration_result.message_count / consumer_count`.
+* `async with message.process()` acknowledges the message on exit, `message.body`,
+  `message.content_type`, `message.content_encoding` and `message.headers`.
+
+As with RabbitMQ, queues are shared by name, every consumer gets at most `prefetch_count`
+unacknowledged messages (set on its channel before the iterator is opened, 0 for no limit), and
+messages are delivered in publishing order. `stats()` returns the depth (ready messages), unacked
+messages, the published messages and bytes and the acknowledged messages of every queue.
+`confirm_delay` delays each publish by a broker round trip (the publisher confirm of RabbitMQ);
+concurrent publishes wait for it together, as pipelined publishes do.
+"""
+
+import asyncio
+import collections
+import contextlib
+from types import SimpleNamespace
+
+
+class _QueueState:
+    """Messages of one queue, shared by all channels that declare it."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.messages = asyncio.Queue()
+        self.consumers = 0
+        self.published = 0
+        self.published_bytes = 0
+        self.acked = 0
+        self.unacked = 0
+
+
+class LocalMessage:
+    """Delivered message (`aio_pika.IncomingMessage`)."""
+
+    def __init__(self, published, state: _QueueState, slots: asyncio.Semaphore = None):
+        self.body = published.body
+        self.content_type = getattr(published, "content_type", None)
+        self.content_encoding = getattr(published, "content_encoding", None)
+        self.headers = getattr(published, "headers", None) or {}
+        self._state = state
+        self._slots = slots
+        self._settled = False
+
+    def ack(self):
+        if self._settled:
+            return
+        self._settled = True
+        self._state.acked += 1
+        self._state.unacked -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    @contextlib.asynccontextmanager
+    async def process(self):
+        """Acknowledges the message when the block exits (also on errors, which RabbitMQ would reject)."""
+        try:
+            yield self
+        finally:
+            self.ack()
+
+
+class _Consumer:
+    def __init__(self, state: _QueueState, prefetch_count: int):
+        self._state = state
+        self._slots = asyncio.Semaphore(prefetch_count) if prefetch_count else None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> LocalMessage:
+        if self._slots is not None:
+            await self._slots.acquire()
+        try:
+            published = await self._state.messages.get()
+        except BaseException:
+            if self._slots is not None:
+                self._slots.release()
+            raise
+        self._state.unacked += 1
+        return LocalMessage(published, self._state, self._slots)
+
+
+class LocalQueue:
+    """Queue declared on a channel (`aio_pika.Queue`)."""
+
+    def __init__(self, state: _QueueState, channel: "LocalChannel"):
+        self._state = state
+        self._channel = channel
+        self.name = state.name
+
+    @property
+    def declaration_result(self):
+        return SimpleNamespace(message_count=self._state.messages.qsize(), consumer_count=self._state.consumers)
+
+    @contextlib.asynccontextmanager
+    async def iterator(self):
+        self._state.consumers += 1
+        try:
+            yield _Consumer(self._state, self._channel.prefetch_count)
+        finally:
+            self._state.consumers -= 1
+
+    async def purge(self):
+        while not self._state.messages.empty():
+            self._state.messages.get_nowait()
+
+
+class _Exchange:
+    def __init__(self, broker: "LocalBroker"):
+        self._broker = broker
+
+    async def publish(self, message, routing_key: str):
+        if self._broker.confirm_delay:
+            await asyncio.sleep(self._broker.confirm_delay)
+        state = self._broker._queue(routing_key)
+        state.published += 1
+        state.published_bytes += len(message.body)
+        state.messages.put_nowait(message)
+
+
+class LocalChannel:
+    """Channel of a `LocalConnection` (`aio_pika.Channel`)."""
+
+    def __init__(self, broker: "LocalBroker"):
+        self._broker = broker
+        self.default_exchange = _Exchange(broker)
+        self.prefetch_count = 0
+        self.is_closed = False
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    async def declare_queue(self, name: str, **kwargs) -> LocalQueue:
+        return LocalQueue(self._broker._queue(name), self)
+
+    async def close(self):
+        self.is_closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class LocalConnection:
+    """Connection to a `LocalBroker` (`aio_pika.RobustConnection`)."""
+
+    def __init__(self, broker: "LocalBroker"):
+        self._broker = broker
+        self.is_closed = False
+
+    async def channel(self) -> LocalChannel:
+        return LocalChannel(self._broker)
+
+    async def close(self):
+        self.is_closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class LocalBroker:
+    """Named queues in the current event loop, reached through `connect()`."""
+
+    def __init__(self, confirm_delay: float = 0.0):
+        self.confirm_delay = confirm_delay
+        self._queues = collections.OrderedDict()
+
+    def _queue(self, name: str) -> _QueueState:
+        if name not in self._queues:
+            self._queues[name] = _QueueState(name)
+        return self._queues[name]
+
+    def connect(self) -> LocalConnection:
+        return LocalConnection(self)
+
+    def depth(self, name: str) -> int:
+        """Messages of a queue waiting for a consumer."""
+        return self._queue(name).messages.qsize()
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "depth": state.messages.qsize(),
+                "unacked": state.unacked,
+                "published": state.published,
+                "published_bytes": state.published_bytes,
+                "acked": state.acked,
+                "consumers": state.consumers,
+            }
+            for name, state in self._queues.items()
+        }
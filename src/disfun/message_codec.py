@@ -0,0 +1,163 @@
+"""Encoding of the messages exchanged over RabbitMQ.
+
+Prompts, samples and evaluation results are dicts. `MessageCodec` encodes them as JSON (the
+original format) or msgpack, optionally compressed with zstd or zlib once the encoded body reaches
+`compression_min_bytes`; the code text is most of every message and compresses well. The format
+is announced in the standard AMQP message properties:
+
+* `content_type`: "application/json" or "application/msgpack"
+* `content_encoding`: "zstd", "deflate" (zlib) or unset
+
+`decode` reads every format, and messages without a content type (published by workers that
+predate the codec) are JSON, so old and new workers can share the queues: a consumer decodes
+whatever a message announces, and publishers keep JSON until `message_codec` is switched once all
+consumers understand the new format.
+
+In JSON messages the prompt stays a JSON string nested inside the message, as old samplers
+expect; binary codecs carry it as a map (see `prompt_field`). msgpack and zstandard are optional
+(the `codec` extra, `pip install 'disfun[codec]'`): a codec that is not installed falls back to JSON (or to no compression) with a warning.
+"""
+
+import json
+import logging
+import time
+import zlib
+
+import aio_pika
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+    msgpack = None
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+    zstandard = None
+
+logger = logging.getLogger('main_logger')
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+CONTENT_TYPES = {"json": JSON_CONTENT_TYPE, "msgpack": MSGPACK_CONTENT_TYPE}
+# content_encoding of each compression
+COMPRESSIONS = {"zstd": "zstd", "zlib": "deflate"}
+
+
+class MessageCodec:
+    """Encodes the dicts published to the queues and decodes received messages of any format."""
+
+    def __init__(self, codec: str = "json", compression: str = None, compression_min_bytes: int = 512,
+                 compression_level: int = 3):
+        if codec not in CONTENT_TYPES:
+            logger.warning(f"Unknown message_codec '{codec}', using 'json'.")
+            codec = "json"
+        if codec == "msgpack" and not MSGPACK_AVAILABLE:
+            logger.warning("message_codec 'msgpack' requires the msgpack package (pip install 'disfun[codec]'), using 'json'.")
+            codec = "json"
+        if compression is not None and compression not in COMPRESSIONS:
+            logger.warning(f"Unknown message_compression '{compression}', messages are not compressed.")
+            compression = None
+        if compression == "zstd" and not ZSTD_AVAILABLE:
+            logger.warning("message_compression 'zstd' requires the zstandard package (pip install 'disfun[codec]'), "
+                           "messages are not compressed.")
+            compression = None
+        self.codec = codec
+        self.compression = compression
+        self.compression_min_bytes = compression_min_bytes
+        self.compression_level = compression_level
+        self.content_type = CONTENT_TYPES[codec]
+        self._compressor = zstandard.ZstdCompressor(level=compression_level) if compression == "zstd" else None
+        self._decompressor = zstandard.ZstdDecompressor() if ZSTD_AVAILABLE else None
+        self.encoded_messages = 0
+        self.encoded_bytes = 0
+        self.encode_time = 0.0
+        self.decoded_messages = 0
+        self.decoded_bytes = 0
+        self.decode_time = 0.0
+
+    @property
+    def nests_json(self) -> bool:
+        """Whether nested payloads (the prompt) are sent as JSON strings, as in the original format."""
+        return self.codec == "json"
+
+    def prompt_field(self, prompt) -> object:
+        """The `prompt` entry of a sampler message: the serialized Prompt for JSON, a map otherwise."""
+        return prompt.serialize() if self.nests_json else prompt.to_dict()
+
+    def encode(self, data: dict):
+        """
+        Returns:
+            (body, content_encoding) of the message; content_encoding is None when not compressed
+        """
+        start = time.perf_counter()
+        if self.codec == "msgpack":
+            body = msgpack.packb(data, use_bin_type=True)
+        else:
+            body = json.dumps(data).encode()
+        content_encoding = None
+        if self.compression is not None and len(body) >= self.compression_min_bytes:
+            if self.compression == "zstd":
+                body = self._compressor.compress(body)
+            else:
+                body = zlib.compress(body, self.compression_level)
+            content_encoding = COMPRESSIONS[self.compression]
+        self.encode_time += time.perf_counter() - start
+        self.encoded_messages += 1
+        self.encoded_bytes += len(body)
+        return body, content_encoding
+
+    def message(self, data: dict) -> aio_pika.Message:
+        """Encodes `data` into a message that announces its format."""
+        body, content_encoding = self.encode(data)
+        return aio_pika.Message(body=body, content_type=self.content_type, content_encoding=content_encoding)
+
+    def decode(self, message) -> dict:
+        """Decodes a received message in the format announced by its properties (JSON if none)."""
+        return self.decode_body(message.body, getattr(message, "content_type", None),
+                                getattr(message, "content_encoding", None))
+
+    def decode_body(self, body: bytes, content_type: str = None, content_encoding: str = None) -> dict:
+        start = time.perf_counter()
+        self.decoded_bytes += len(body)
+        if content_encoding == "zstd":
+            if self._decompressor is None:
+                raise ValueError("Received a zstd-compressed message but the zstandard package is not installed "
+                                 "(pip install 'disfun[codec]')")
+            body = self._decompressor.decompress(body)
+        elif content_encoding == "deflate":
+            body = zlib.decompress(body)
+        if content_type == MSGPACK_CONTENT_TYPE:
+            if not MSGPACK_AVAILABLE:
+                raise ValueError("Received a msgpack message but the msgpack package is not installed (pip install 'disfun[codec]')")
+            data = msgpack.unpackb(body, raw=False)
+        else:
+            data = json.loads(body)
+        self.decode_time += time.perf_counter() - start
+        self.decoded_messages += 1
+        return data
+
+    def stats(self) -> dict:
+        return {
+            "codec": self.codec,
+            "compression": self.compression,
+            "encoded_messages": self.encoded_messages,
+            "encoded_bytes": self.encoded_bytes,
+            "encode_time": self.encode_time,
+            "decoded_messages": self.decoded_messages,
+            "decoded_bytes": self.decoded_bytes,
+            "decode_time": self.decode_time,
+        }
+
+
+def from_config(rabbitmq_config) -> MessageCodec:
+    """Codec set by the `message_codec` and `message_compression` fields of the RabbitMQ config."""
+    return MessageCodec(
+        codec=getattr(rabbitmq_config, 'message_codec', 'json'),
+        compression=getattr(rabbitmq_config, 'message_compression', None),
+        compression_min_bytes=getattr(rabbitmq_config, 'compression_min_bytes', 512),
+    )
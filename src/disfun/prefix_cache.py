@@ -0,0 +1,139 @@
+"""KV cache of the prompt prefix shared by the sampler's prompts.
+
+Every prompt of a run starts with the same specification preface (imports, helper functions,
+evaluation code) and only the versioned functions at the end differ. `PrefixKVCache` keeps the KV
+state of such shared token prefixes, so the sampler only prefills the prompt-specific suffix:
+
+* Lookup: the stored prefix sharing the most tokens with all prompts of a batch is used if the
+  shared part has at least `min_prefix_tokens` tokens. The entry is shortened (by slicing its
+  tensors) when the prompts diverge from it earlier.
+* Insertion: otherwise the longest common token prefix of the batch is prefilled once and stored.
+  For a single prompt this is the whole prompt but its last token; it shrinks to the actual preface
+  when the next prompt differs.
+* At most `max_entries` prefixes are kept, the least recently used is dropped first.
+
+Prefixes are matched on token ids of the tokenized prompts, so cached and uncached prefill see the
+same tokens. The batch is re-laid out as [prefix][padding][suffix] (`move_padding_after_prefix`);
+the attention mask hides the padding and positions continue over it, as with left padding.
+
+Stored tensors are never modified: `build_cache` copies them into a new `DynamicCache` per batch.
+"""
+
+import collections
+import logging
+from typing import List, Sequence
+
+import torch
+from transformers import DynamicCache
+
+logger = logging.getLogger('main_logger')
+
+
+class PrefixKVCache:
+    """LRU cache of prefix token ids -> per-layer (keys, values) of batch size 1."""
+
+    def __init__(self, model, max_entries: int = 4, min_prefix_tokens: int = 64):
+        self.model = model
+        self.max_entries = max_entries
+        self.min_prefix_tokens = min_prefix_tokens
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "reused_tokens": self.reused_tokens,
+            "prefilled_tokens": self.prefilled_tokens,
+        }
+
+    def lookup(self, sequences: Sequence[Sequence[int]]):
+        """
+        Returns (prefix_length, layers) for a prefix shared by all sequences, prefilling and storing
+        it if no stored prefix matches, or (0, None) if the sequences share less than
+        `min_prefix_tokens` tokens. At least the last token of every sequence is left outside the prefix.
+        """
+        if not sequences:
+            return 0, None
+        limit = min(len(sequence) for sequence in sequences) - 1
+
+        best_key, best_length = None, 0
+        for key in self._entries:
+            length = min(_common_prefix_length(key, sequence, limit) for sequence in sequences)
+            if length > best_length:
+                best_key, best_length = key, length
+        if best_length >= self.min_prefix_tokens:
+            layers = self._entries.pop(best_key)
+            if best_length < len(best_key):
+                # Prompts diverge inside the stored prefix: keep only the shared part
+                layers = [(k[:, :, :best_length].clone(), v[:, :, :best_length].clone()) for k, v in layers]
+                best_key = best_key[:best_length]
+                self._entries.pop(best_key, None)
+            self._entries[best_key] = layers
+            self.hits += 1
+            self.reused_tokens += best_length * len(sequences)
+            return best_length, layers
+
+        self.misses += 1
+        length = min(_common_prefix_length(sequences[0], sequence, limit) for sequence in sequences)
+        if length < self.min_prefix_tokens:
+            return 0, None
+        key = tuple(sequences[0][:length])
+        layers = self._prefill(key)
+        self._entries[key] = layers
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self.prefilled_tokens += length
+        logger.debug(f"PrefixKVCache: stored prefix of {length} tokens ({len(self._entries)} entries).")
+        return length, layers
+
+    def _prefill(self, prefix_ids):
+        input_ids = torch.tensor([prefix_ids], dtype=torch.long, device=self.model.device)
+        with torch.no_grad():
+            outputs = self.model(input_ids=input_ids, use_cache=True)
+        return [(layer.keys, layer.values) for layer in outputs.past_key_values.layers]
+
+
+def build_cache(layers, rows: int) -> DynamicCache:
+    """New `DynamicCache` holding the prefix `layers` for `rows` sequences."""
+    return DynamicCache(ddp_cache_data=[(k.repeat(rows, 1, 1, 1), v.repeat(rows, 1, 1, 1)) for k, v in layers])
+
+
+def move_padding_after_prefix(input_ids: torch.Tensor, attention_mask: torch.Tensor, prefix_length: int):
+    """
+    Turns left-padded rows [padding][prefix][suffix] into [prefix][padding][suffix], so the cached
+    prefix occupies the first `prefix_length` columns of every row. The width is unchanged.
+    """
+    input_ids, attention_mask = input_ids.clone(), attention_mask.clone()
+    for row in range(input_ids.shape[0]):
+        padding = int((attention_mask[row] == 0).sum())
+        if padding == 0:
+            continue
+        order = torch.cat([torch.arange(padding, padding + prefix_length), torch.arange(padding),
+                           torch.arange(padding + prefix_length, input_ids.shape[1])]).to(input_ids.device)
+        input_ids[row] = input_ids[row, order]
+        attention_mask[row] = attention_mask[row, order]
+    return input_ids, attention_mask
+
+
+def unpadded_sequences(input_ids: torch.Tensor, attention_mask: torch.Tensor) -> List[List[int]]:
+    """Token ids of each row without padding."""
+    return [ids[mask.bool()].tolist() for ids, mask in zip(input_ids.cpu(), attention_mask.cpu())]
+
+
+def _common_prefix_length(a, b, limit):
+    length = 0
+    for x, y in zip(a, b):
+        if length >= limit or x != y:
+            break
+        length += 1
+    return length
@@ -1,5 +1,5 @@
 """
-Entry point functions for spawned sampler and evaluator processes.
+Entry point functions for spawned sampler, evaluator and database shard processes.
 
 These functions must be in a separate module (not __main__) to be pickle-able
 when using multiprocessing with spawn context.
@@ -49,14 +49,19 @@ def initialize_process_logger(log_dir, log_filename):
     return logger
 
 
-def sampler_process_entry(config_path, device, log_dir, log_filename):
-    """Standalone sampler process entry point (spawn-compatible)."""
-    from disfun import sampler, gpt, process_utils
+def sampler_process_entry(config_path, device, log_dir, log_filename, transport=None):
+    """
+    Standalone sampler process entry point (spawn-compatible). `transport` is the LocalTransport
+    of the main process, or None to connect to RabbitMQ.
+    """
+    from disfun import sampler, gpt, message_codec, process_utils
+    from disfun import transport as transport_module
 
     # Reload config and logger in child process
     config = load_config(config_path)
     logger = initialize_process_logger(log_dir, log_filename)
 
+    transport = transport or transport_module.AMQPTransport(config)
     local_id = current_process().pid
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -110,30 +115,32 @@ def sampler_process_entry(config_path, device, log_dir, log_filename):
     async def run_sampler():
         nonlocal connection, channel, sampler_task, sampler_instance, cleanup_done
         try:
-            logger.info(f"Sampler {local_id}: Starting connection to RabbitMQ on device {device}...")
-            connection = await process_utils.create_rabbitmq_connection(
-                config, timeout=300
-            )
-            logger.info(f"Sampler {local_id}: Connected to RabbitMQ successfully.")
+            logger.info(f"Sampler {local_id}: Starting connection ({type(transport).__name__}) on device {device}...")
+            connection = await transport.connect(timeout=300)
+            logger.info(f"Sampler {local_id}: Connected successfully.")
             channel = await connection.channel()
             logger.info(f"Sampler {local_id}: Channel established.")
 
-            sampler_queue = await process_utils.declare_standard_queue(channel, "sampler_queue")
+            sampler_queue = await transport.declare_queue(channel, "sampler_queue")
             logger.info(f"Sampler {local_id}: Declared sampler_queue.")
 
-            evaluator_queue = await process_utils.declare_standard_queue(channel, "evaluator_queue")
+            evaluator_queue = await transport.declare_queue(channel, "evaluator_queue")
             logger.info(f"Sampler {local_id}: Declared evaluator_queue.")
 
             try:
                 if config.sampler.gpt:
                     logger.info(f"Sampler {local_id}: Initializing GPT sampler...")
                     sampler_instance = gpt.Sampler(
-                        connection, channel, sampler_queue, evaluator_queue, config.sampler)
+                        connection, channel, sampler_queue, evaluator_queue, config.sampler,
+                        codec=message_codec.from_config(config.rabbitmq),
+                        publisher=process_utils.create_publisher(channel, config))
                     logger.info(f"Sampler {local_id}: GPT Sampler instance initialized successfully.")
                 else:
                     logger.info(f"Sampler {local_id}: Initializing LLM sampler on device {device}...")
                     sampler_instance = sampler.Sampler(
-                        connection, channel, sampler_queue, evaluator_queue, config.sampler, device)
+                        connection, channel, sampler_queue, evaluator_queue, config.sampler, device,
+                        codec=message_codec.from_config(config.rabbitmq),
+                        publisher=process_utils.create_publisher(channel, config))
                     logger.info(f"Sampler {local_id}: LLM Sampler instance initialized successfully on device {device}.")
             except Exception as e:
                 logger.error(f"Sampler {local_id}: Could not start Sampler instance - {e}", exc_info=True)
@@ -170,15 +177,22 @@ def sampler_process_entry(config_path, device, log_dir, log_filename):
         sys.exit(0)
 
 
-def evaluator_process_entry(config_path, template, inputs, target_signatures, log_dir, sandbox_base_path, log_filename):
-    """Standalone evaluator process entry point (spawn-compatible)."""
+def evaluator_process_entry(config_path, template, inputs, target_signatures, log_dir, sandbox_base_path, log_filename,
+                            transport=None):
+    """
+    Standalone evaluator process entry point (spawn-compatible). `transport` is the LocalTransport
+    of the main process, or None to connect to RabbitMQ.
+    """
     import disfun.evaluator as evaluator_module
-    from disfun import process_utils
+    from disfun import database_shards, message_codec, process_utils
+    from disfun import transport as transport_module
 
     # Reload config and logger in child process
     config = load_config(config_path)
     logger = initialize_process_logger(log_dir, log_filename)
 
+    transport = transport or transport_module.AMQPTransport(config)
+    num_database_shards = getattr(config, 'num_pdb', 1)
     local_id = current_process().pid
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -232,13 +246,13 @@ def evaluator_process_entry(config_path, template, inputs, target_signatures, lo
         nonlocal connection, channel, evaluator_task, evaluator_instance, cleanup_done
 
         try:
-            connection = await process_utils.create_rabbitmq_connection(
-                config, timeout=300
-            )
+            connection = await transport.connect(timeout=300)
             channel = await connection.channel()
 
-            evaluator_queue = await process_utils.declare_standard_queue(channel, "evaluator_queue")
-            database_queue = await process_utils.declare_standard_queue(channel, "database_queue")
+            evaluator_queue = await transport.declare_queue(channel, "evaluator_queue")
+            database_queues = [await transport.declare_queue(channel, database_shards.shard_queue_name(shard_id, num_database_shards))
+                               for shard_id in range(num_database_shards)]
+            database_queue = database_queues[0]
 
             evaluator_instance = evaluator_module.Evaluator(
                 connection, channel, evaluator_queue, database_queue,
@@ -246,7 +260,14 @@ def evaluator_process_entry(config_path, template, inputs, target_signatures, lo
                 timeout_seconds=config.evaluator.timeout,
                 local_id=local_id,
                 target_signatures=target_signatures,
-                max_workers=config.evaluator.max_workers
+                max_workers=config.evaluator.max_workers,
+                max_samples_in_flight=getattr(config.evaluator, 'max_samples_in_flight', 2),
+                sandbox_mode=getattr(config.evaluator, 'sandbox_mode', 'subprocess'),
+                warm_worker_max_calls=getattr(config.evaluator, 'warm_worker_max_calls', 100),
+                graph_cache_mb=getattr(config.evaluator, 'graph_cache_mb', 0),
+                codec=message_codec.from_config(config.rabbitmq),
+                publisher=process_utils.create_publisher(channel, config),
+                num_database_shards=num_database_shards
             )
 
             evaluator_task = asyncio.create_task(evaluator_instance.consume_and_process())
@@ -276,3 +297,148 @@ def evaluator_process_entry(config_path, template, inputs, target_signatures, lo
         loop.close()
         logger.info(f"Evaluator {local_id}: Event loop closed.")
         sys.exit(0)
+
+
+def programs_database_kwargs(config, target_signatures, run_name=None, shard_id=0):
+    """
+    Keyword arguments of the ProgramsDatabase of an experiment, or of its database shard
+    `shard_id` when `config.num_pdb > 1`. The prompt limits are split between the shards, and only
+    shard 0 (in the main process) logs to W&B.
+    """
+    import math
+    from disfun import message_codec
+
+    num_shards = getattr(config, 'num_pdb', 1)
+    termination = config.termination if hasattr(config, 'termination') and config.termination else None
+    prompt_limit = termination.prompt_limit if termination else 400_000_000
+    optimal_solution_programs = termination.optimal_solution_programs if termination else 200_000
+    return dict(
+        mode=config.evaluator.mode, eval_code=config.evaluator.eval_code, include_nx=config.evaluator.include_nx,
+        start_n=config.evaluator.start_n, end_n=config.evaluator.end_n, s_values=config.evaluator.s_values,
+        no_deduplication=config.programs_database.no_deduplication,
+        prompt_limit=math.ceil(prompt_limit / num_shards),
+        optimal_solution_programs=math.ceil(optimal_solution_programs / num_shards),
+        target_signatures=target_signatures,
+        show_eval_scores=config.prompt.show_eval_scores, display_mode=config.prompt.display_mode,
+        best_known_solutions=config.prompt.best_known_solutions, absolute_label=config.prompt.absolute_label,
+        relative_label=config.prompt.relative_label, q=config.evaluator.q,
+        wandb_config=config.wandb if shard_id == 0 else None,
+        sampler_config=config.sampler,
+        evaluator_config=config.evaluator,
+        run_name=run_name,
+        codec=message_codec.from_config(config.rabbitmq),
+        shard_id=shard_id,
+        num_shards=num_shards,
+    )
+
+
+def database_process_entry(config_path, template, target_signatures, log_dir, log_filename, shard_id,
+                           checkpoint_file=None, save_checkpoints_path=None, run_name=None, transport=None):
+    """
+    Standalone database shard process entry point (spawn-compatible), for shards 1..num_pdb-1;
+    shard 0 runs in the main process. `checkpoint_file` and `save_checkpoints_path` are those of
+    the shard. `transport` is the LocalTransport of the main process, or None to connect to RabbitMQ.
+    """
+    from disfun import database_shards, process_utils, programs_database
+    from disfun import transport as transport_module
+
+    # Reload config and logger in child process
+    config = load_config(config_path)
+    logger = initialize_process_logger(log_dir, log_filename)
+
+    transport = transport or transport_module.AMQPTransport(config)
+    num_shards = getattr(config, 'num_pdb', 1)
+    local_id = current_process().pid
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    connection = None
+    channel = None
+    database_tasks = []
+    cleanup_done = False
+
+    async def graceful_shutdown(loop, connection, channel, database_tasks):
+        nonlocal cleanup_done
+        if cleanup_done:
+            return
+
+        logger.info(f"Database shard {shard_id} ({local_id}): Initiating graceful shutdown...")
+
+        for task in database_tasks:
+            if not task.done():
+                task.cancel()
+        try:
+            await asyncio.wait_for(asyncio.gather(*database_tasks, return_exceptions=True), timeout=2)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+
+        if channel:
+            try:
+                await channel.close()
+            except Exception as e:
+                logger.info(f"Database shard {shard_id}: Channel already closed during shutdown")
+
+        if connection:
+            try:
+                await connection.close()
+            except Exception as e:
+                logger.info(f"Database shard {shard_id}: Connection already closed during shutdown")
+
+        cleanup_done = True
+        logger.info(f"Database shard {shard_id}: Graceful shutdown complete.")
+        loop.stop()
+
+    async def run_database():
+        nonlocal connection, channel, database_tasks
+
+        try:
+            connection = await transport.connect(timeout=300)
+            channel = await connection.channel()
+
+            database_queue = await transport.declare_queue(channel, database_shards.shard_queue_name(shard_id, num_shards))
+            sampler_queue = await transport.declare_queue(channel, "sampler_queue")
+            evaluator_queue = await transport.declare_queue(channel, "evaluator_queue")
+            await transport.declare_queue(channel, database_shards.COORDINATOR_QUEUE)
+
+            database = programs_database.ProgramsDatabase(
+                connection, channel, database_queue, sampler_queue, evaluator_queue, config.programs_database,
+                template, 'priority', checkpoint_file, save_checkpoints_path,
+                publisher=process_utils.create_publisher(channel, config),
+                **programs_database_kwargs(config, target_signatures, run_name, shard_id=shard_id)
+            )
+            logger.info(f"Database shard {shard_id} ({local_id}): Owns islands {database._owned_island_ids}.")
+
+            database_tasks = [
+                asyncio.create_task(database.consume_and_process()),
+                asyncio.create_task(database.periodic_checkpoint()),
+                asyncio.create_task(database.periodic_shard_report(
+                    getattr(config.programs_database, 'shard_report_interval', 5.0))),
+            ]
+            if checkpoint_file is not None:
+                # Resume the work of this shard's islands
+                await database.get_prompt()
+            await asyncio.gather(*database_tasks)
+
+        except asyncio.CancelledError:
+            logger.info(f"Database shard {shard_id}: Process was cancelled.")
+        except Exception as e:
+            logger.error(f"Database shard {shard_id}: Error occurred: {e}")
+        finally:
+            if not cleanup_done:
+                if channel:
+                    await channel.close()
+                if connection:
+                    await connection.close()
+                logger.debug(f"Database shard {shard_id}: Connection/Channel closed.")
+
+    # Set up signal handlers
+    process_utils.setup_signal_handlers(
+        loop, "Database", local_id, logger,
+        lambda: graceful_shutdown(loop, connection, channel, database_tasks)
+    )
+
+    try:
+        loop.run_until_complete(run_database())
+    finally:
+        loop.close()
+        logger.info(f"Database shard {shard_id}: Event loop closed.")
+        sys.exit(0)
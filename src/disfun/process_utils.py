@@ -8,6 +8,7 @@ the DistributedFunSearch codebase.
 import asyncio
 import signal
 import logging
+import time
 import torch.multiprocessing as mp
 from yarl import URL
 import aio_pika
@@ -64,6 +65,133 @@ async def declare_standard_queue(channel, queue_name: str):
     )
 
 
+class BufferedPublisher:
+    """
+    Publishes messages to the default exchange in batches.
+
+    `publish` buffers a message and returns; the buffer is sent once it holds `max_batch_size`
+    messages or `max_delay` seconds after its first message, whichever comes first. The messages
+    of a batch are published together and their publisher confirms (on by default on aio_pika
+    channels) are awaited together, so a batch costs one broker round trip instead of one per
+    message.
+
+    The inputs that produce these messages are acknowledged before the messages are published, so
+    a message the broker does not confirm is retried, `retry_delay` seconds later and then with
+    doubling delays up to `max_retry_delay`, until the robust connection has recovered. Meanwhile
+    `publish` blocks once the buffer is full, which stops the caller from consuming more inputs.
+    Only with `max_attempts` set are messages dropped after that many failed attempts.
+
+    `flush()` sends the buffer and waits for its confirms; `close()` flushes and sends every later
+    message immediately. Call it before the channel is closed so that no buffered message is lost
+    on shutdown. `max_batch_size=1` publishes every message immediately, as without a buffer.
+    """
+
+    def __init__(self, channel, max_batch_size: int = 100, max_delay: float = 0.02,
+                 max_attempts: Optional[int] = None, retry_delay: float = 0.5, max_retry_delay: float = 30.0):
+        self.channel = channel
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_delay = max_delay
+        self.max_attempts = max(1, max_attempts) if max_attempts is not None else None
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.logger = logging.getLogger('main_logger')
+        self._buffer = []  # (message, routing_key, attempts)
+        self._flush_lock = asyncio.Lock()
+        self._timer = None
+        self._closed = False
+        self.published = 0
+        self.batches = 0
+        self.failed_attempts = 0
+        self.dropped = 0
+        self.confirm_time = 0.0
+
+    async def publish(self, message: aio_pika.Message, routing_key: str):
+        """Buffers a message for `routing_key`; waits only when the buffer is full."""
+        self._buffer.append((message, routing_key, 0))
+        if len(self._buffer) >= self.max_batch_size or self._closed:
+            # Shielded: a cancelled caller must not abort a batch that is half published
+            await asyncio.shield(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        try:
+            await asyncio.shield(self.flush())
+        except Exception as e:
+            self.logger.error(f"BufferedPublisher: Error flushing messages: {e}")
+
+    async def flush(self):
+        """Publishes all buffered messages and waits until the broker has confirmed them."""
+        async with self._flush_lock:
+            retry_delay = self.retry_delay
+            while self._buffer:
+                batch = self._buffer[:self.max_batch_size]
+                del self._buffer[:self.max_batch_size]
+                start = time.perf_counter()
+                results = await asyncio.gather(
+                    *(self.channel.default_exchange.publish(message, routing_key=routing_key)
+                      for message, routing_key, _ in batch),
+                    return_exceptions=True,
+                )
+                self.confirm_time += time.perf_counter() - start
+                self.batches += 1
+
+                retry = []
+                for (message, routing_key, attempts), result in zip(batch, results):
+                    if not isinstance(result, BaseException):
+                        self.published += 1
+                        continue
+                    self.failed_attempts += 1
+                    if self.max_attempts is None or attempts + 1 < self.max_attempts:
+                        retry.append((message, routing_key, attempts + 1))
+                    else:
+                        self.dropped += 1
+                        self.logger.error(
+                            f"BufferedPublisher: Dropping message to {routing_key} after {self.max_attempts} "
+                            f"failed attempts: {result!r}")
+                if retry:
+                    self.logger.warning(f"BufferedPublisher: {len(retry)} of {len(batch)} messages were not "
+                                        f"confirmed, retrying in {retry_delay}s.")
+                    # Retried messages keep their place before the later ones
+                    self._buffer[:0] = retry
+                    await asyncio.sleep(retry_delay)
+                    retry_delay = min(2 * retry_delay, self.max_retry_delay)
+                else:
+                    retry_delay = self.retry_delay
+
+    async def close(self):
+        """Flushes the buffer; later messages are published immediately."""
+        self._closed = True
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "published": self.published,
+            "pending": len(self._buffer),
+            "batches": self.batches,
+            "mean_batch_size": (self.published + self.failed_attempts) / self.batches if self.batches else 0.0,
+            "mean_confirm_time": self.confirm_time / self.batches if self.batches else 0.0,
+            "failed_attempts": self.failed_attempts,
+            "dropped": self.dropped,
+        }
+
+
+def create_publisher(channel, config) -> BufferedPublisher:
+    """
+    BufferedPublisher on `channel` with the `publish_batch_size` and `publish_max_delay` of the
+    RabbitMQ config.
+    """
+    return BufferedPublisher(
+        channel,
+        max_batch_size=getattr(config.rabbitmq, 'publish_batch_size', 100),
+        max_delay=getattr(config.rabbitmq, 'publish_max_delay', 0.02),
+    )
+
+
 def setup_signal_handlers(loop, process_type: str, local_id: int, logger: logging.Logger,
                           graceful_shutdown_func: Callable):
     """
@@ -20,15 +20,29 @@ Differences from the original DeepMind FunSearch version
 
 * Works inside an async RabbitMQ loop (`consume_and_process`, `get_prompt`).
 * Logs cumulative evaluator CPU, sampler GPU, and I/O token counts.
-* Saves and resumes from checkpoint.
-* Enforces deduplication (hash-based) and version-mismatch checks.
+* Saves and resumes from checkpoint: periodic snapshots, each followed by an append-only log of
+  the registrations and resets after it (`checkpoint_log`), replayed on load.
+* Enforces deduplication (hash-based, via a per-island hash index) and version-mismatch checks.
 * Stops early after an optimal solution or a prompt/solution quota.
 * Implements different evaluation scoring (last, average, weighted, relative difference to a traget solution)
+* Messages are encoded by a `MessageCodec` (JSON by default, msgpack/compression optional), and
+  received messages are decoded in whatever format they announce.
+* Samples prompt clusters from per-island numpy arrays of cluster scores and per-cluster
+  program lengths that are extended on registration, instead of rebuilding them per prompt.
+* Answers each batch of evaluator results with one batch of prompts (`get_prompts`): the results
+  are registered first, then the prompts are sampled per island in one vectorized step and
+  published together through a `process_utils.BufferedPublisher`.
+* Renders prompts with a `prompt_rendering.PromptRenderer`: the cleaned template preface and the
+  tokenized sampled programs are cached, instead of deep-copying and re-parsing them per prompt.
+  Rendered prompts are kept in a `prompt_rendering.PromptCache` keyed by the ids of their
+  programs (`prompt_cache_size`), and dropped when an island reset removes the programs.
+* Can run as one of `num_shards` database shards that each own a subset of the islands, with
+  island resets across shards run by a `database_shards.DatabaseCoordinator`.
 """
 
-import copy
 import dataclasses
 import time
+import weakref
 import logging
 import numpy as np
 import scipy
@@ -39,10 +53,9 @@ import gc
 import os
 import multiprocessing
 from typing import Mapping, Any, List, Sequence, Optional
-from disfun import code_manipulation
+from disfun import checkpoint_log, code_manipulation, database_shards, message_codec, process_utils, prompt_rendering
 import json
 import aio_pika
-import re
 from logging.handlers import RotatingFileHandler
 import psutil
 from logging import FileHandler
@@ -79,6 +92,33 @@ def _softmax(logits: np.ndarray, temperature: float) -> np.ndarray:
 
 import json
 
+
+class _GrowableArray:
+    """Append-only float array with amortized O(1) appends; `values` is a view of the filled part."""
+
+    __slots__ = ("_data", "_size")
+
+    def __init__(self, capacity: int = 8):
+        self._data = np.empty(capacity, dtype=np.float64)
+        self._size = 0
+
+    def append(self, value: float) -> None:
+        if self._size == len(self._data):
+            self._data = np.concatenate([self._data, np.empty(len(self._data), dtype=np.float64)])
+        self._data[self._size] = value
+        self._size += 1
+
+    def clear(self) -> None:
+        self._size = 0
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    def __len__(self) -> int:
+        return self._size
+
+
 def _reduce_score(scores_per_test: dict, mode: str = "last", start_n: list = [6], end_n: list = [11], s_values: list = [1], target_signatures=None) -> float:
     """
     Reduces per-test scores into a single score based on the specified mode.
@@ -228,17 +268,20 @@ class Prompt:
 
     def serialize(self):
         """Serializes the object to a JSON string."""
-        return json.dumps({
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
+        return {
             "code": self.code,
             "version_generated": self.version_generated,
             "island_id": self.island_id,
             "expected_version": self.expected_version,
-        })
+        }
 
     @staticmethod
-    def deserialize(serialized_str: str):
-        """Deserializes the JSON string back to a Prompt object."""
-        data = json.loads(serialized_str)
+    def deserialize(serialized):
+        """Deserializes the JSON string (or the dict of a binary-encoded message) back to a Prompt object."""
+        data = json.loads(serialized) if isinstance(serialized, (str, bytes)) else serialized
         return Prompt(**data)
 
 
@@ -299,7 +342,11 @@ class ProgramsDatabase:
         wandb_config=None,
         sampler_config=None,
         evaluator_config=None,
-        run_name=None
+        run_name=None,
+        codec=None,
+        shard_id=0,
+        num_shards=1,
+        publisher=None
     ):
         self._islands = [] 
         self.connection = connection
@@ -307,7 +354,14 @@ class ProgramsDatabase:
         self.database_queue = database_queue
         self.sampler_queue = sampler_queue
         self.evaluator_queue = evaluator_queue
+        self.codec = codec or message_codec.MessageCodec()
+        # Prompts are buffered and published in one batch per processed batch of results
+        self.publisher = publisher or process_utils.BufferedPublisher(channel)
         self._config = config
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        # With several shards this database only stores, prompts for and resets its own islands
+        self._owned_island_ids = database_shards.shard_islands(shard_id, num_shards, config.num_islands)
         self._template = template
         self.samples_per_batch = config.prompts_per_batch
         self._function_to_evolve = function_to_evolve
@@ -335,6 +389,9 @@ class ProgramsDatabase:
         self.absolute_label = absolute_label
         self.relative_label = relative_label
         self.q = q
+        self._renderer = prompt_rendering.PromptRenderer(function_to_evolve, _get_q_description(q), include_nx)
+        self._prompt_cache = prompt_rendering.PromptCache(getattr(config, 'prompt_cache_size', 10_000))
+        self._eval_code_prefix = None
 
         if self.display_mode == "relative" and not self.best_known_solutions:
             logger.warning("display_mode='relative' requires best_known_solutions, falling back to 'absolute'")
@@ -355,8 +412,16 @@ class ProgramsDatabase:
 
         # Evolutionary lineage tracking (optional, can be disabled via config)
         self.save_lineage = config.save_lineage if hasattr(config, 'save_lineage') else False
-        self.next_program_id = 1  # Counter for assigning unique program IDs
+        # Counter for assigning unique program IDs; shards draw from disjoint residues modulo num_shards
+        self.next_program_id = shard_id + 1
         self.lineage_log = [] if self.save_lineage else None  # Only initialize if enabled
+        self._lineage_by_id = {}  # program_id -> lineage_log entry
+        # program_id -> program for all programs stored in any island. Weak references let
+        # programs dropped from the islands disappear from the index without a full scan.
+        self._programs_by_id = weakref.WeakValueDictionary()
+        # Changes since the last write of the checkpoint log, opened by periodic_checkpoint
+        self._checkpoint_log = None
+        self._checkpoint_write = None  # task writing the latest checkpoint records on a thread
         self._prompt_to_parents = {} if self.save_lineage else None
 
         # Lazy initialization of locks (will be created on first access)
@@ -366,6 +431,11 @@ class ProgramsDatabase:
         for _ in range(config.num_islands):
             island = {}
             island['clusters'] = {}
+            # Cluster signatures in creation order and their scores, kept in step with 'clusters'
+            # so that prompt sampling works on one numpy array instead of rebuilding it per prompt
+            island['signatures'] = []
+            island['cluster_scores'] = _GrowableArray()
+            island['hashes'] = set()  # hash_value index of stored programs for O(1) deduplication
             island['version'] = 0
             island['num_programs'] = 0
             self._islands.append(island)
@@ -412,6 +482,9 @@ class ProgramsDatabase:
             self.wandb_init_config.update({
                 "timeout": evaluator_config.timeout,
                 "max_workers": evaluator_config.max_workers,
+                "max_samples_in_flight": getattr(evaluator_config, 'max_samples_in_flight', 2),
+                "sandbox_mode": getattr(evaluator_config, 'sandbox_mode', 'subprocess'),
+                "graph_cache_mb": getattr(evaluator_config, 'graph_cache_mb', 0),
             })
 
         # Add sampler config if provided
@@ -438,12 +511,65 @@ class ProgramsDatabase:
 
     def load_checkpoint(self, checkpoint_file: str) -> None:
         """
-        Loads the state from a checkpoint file.
+        Loads the state from a checkpoint: a snapshot (`checkpoint_*.pkl`) and then the log of the
+        changes after it (`checkpoint_*.log`, see `checkpoint_log`) if there is one. Either file
+        of a checkpoint can be given.
         """
-        with open(checkpoint_file, 'rb') as f:
+        snapshot_file = checkpoint_log.snapshot_file_of(checkpoint_file)
+        with open(snapshot_file, 'rb') as f:
             checkpoint_data = pickle.load(f)
 
+        checkpoint_shards = checkpoint_data.get("num_shards", 1)
+        if checkpoint_shards != self.num_shards:
+            raise ValueError(f"Checkpoint {checkpoint_file} was written by {checkpoint_shards} database shard(s), "
+                             f"the run has num_pdb={self.num_shards}")
+
+        self._restore_checkpoint_state(checkpoint_data)
+
+        for i, score in enumerate(checkpoint_data["best_score_per_island"]):
+            self._best_score_per_island[i] = score
+
+        self._best_program_per_island = [
+            code_manipulation.Function.from_dict(program) if program else None
+            for program in checkpoint_data["best_program_per_island"]
+        ]
+
+        self._best_scores_per_test_per_island = checkpoint_data["best_scores_per_test_per_island"]
+
+        # Restore islands
+        self._programs_by_id.clear()
+        for island_id, island_state in enumerate(checkpoint_data["islands_state"]):
+            logger.debug(f"Loading state for island id {island_id}")
+            island = self._islands[island_id]
+            self._load_island_state(island, island_state)
+
+        replayed = self._replay_checkpoint_log(checkpoint_log.log_file_of(snapshot_file))
+
+        # Continue numbering after the restored programs (older checkpoints do not store the counter)
+        self.next_program_id = max(self.next_program_id, max(self._programs_by_id.keys(), default=0) + 1)
+        self.next_program_id += (self.shard_id + 1 - self.next_program_id) % self.num_shards
+        logger.info(f"Checkpoint loaded successfully ({replayed} changes replayed from the checkpoint log).")
+
+    def _replay_checkpoint_log(self, log_file: str) -> int:
+        """Applies the changes recorded after a snapshot; returns the number of records replayed."""
+        replayed = 0
+        for record in checkpoint_log.read_records(log_file):
+            kind = record[0]
+            if kind == "register":
+                _, island_id, program, scores_per_test = record
+                self._store_program_in_island(code_manipulation.Function.from_dict(program), island_id, scores_per_test)
+            elif kind == "reset":
+                self._clear_island(record[1])
+            elif kind == "state":
+                self._restore_checkpoint_state(record[1])
+            else:
+                logger.warning(f"Unknown record '{kind}' in checkpoint log {log_file}")
+                continue
+            replayed += 1
+        return replayed
 
+    def _restore_checkpoint_state(self, checkpoint_data: dict):
+        """Restores the counters stored by `checkpoint_state` (snapshots and the checkpoint log)."""
         self.cumulative_evaluator_cpu_time = checkpoint_data.get("cumulative_evaluator_cpu_time", 0.0)
         self.cumulative_sampler_gpu_time = checkpoint_data.get("cumulative_sampler_gpu_time", 0.0)
 
@@ -474,58 +600,43 @@ class ProgramsDatabase:
             self.wandb_run_name = checkpoint_run_name
             logger.info(f"Restored run name from checkpoint: {checkpoint_run_name}")
 
-        for i, score in enumerate(checkpoint_data["best_score_per_island"]):
-            self._best_score_per_island[i] = score
-
-        self._best_program_per_island = [
-            code_manipulation.Function.from_dict(program) if program else None
-            for program in checkpoint_data["best_program_per_island"]
-        ]
-
-        self._best_scores_per_test_per_island = checkpoint_data["best_scores_per_test_per_island"]
-        self._last_reset_time = checkpoint_data["last_reset_time"]
-
-        # Restore islands
-        for island_id, island_state in enumerate(checkpoint_data["islands_state"]):
-            logger.debug(f"Loading state for island id {island_id}")
-            island = self._islands[island_id]
-            self._load_island_state(island, island_state)
-        logger.info("Checkpoint loaded successfully.")
+        self._last_reset_time = checkpoint_data.get("last_reset_time", self._last_reset_time)
+        self.next_program_id = checkpoint_data.get("next_program_id", self.next_program_id)
 
     def _load_island_state(self, island, island_state):
         """
         Loads the state of a single island.
         """
-        island['clusters'].clear()  # clear current clusters in the island if any
+        self._clear_island_clusters(island)  # clear current clusters in the island if any
+        island['hashes'].clear()
         for signature_str, cluster_state in island_state["clusters"].items():
             signature = eval(signature_str)
             if isinstance(signature, list):
                 signature = tuple(signature)
-            cluster_data = {}
-            cluster_data['score'] = cluster_state['score']
-            cluster_data['scores_per_test'] = cluster_state.get('scores_per_test', {})
-            cluster_data['programs'] = [
-                code_manipulation.Function.from_dict(prog_dict)
-                for prog_dict in cluster_state['programs']
-            ]
-            island['clusters'][signature] = cluster_data
+            cluster_data = self._new_cluster(cluster_state['score'], cluster_state.get('scores_per_test', {}))
+            for prog_dict in cluster_state['programs']:
+                self._add_program_to_cluster(cluster_data, code_manipulation.Function.from_dict(prog_dict))
+            self._add_cluster(island, signature, cluster_data)
+            for program in cluster_data['programs']:
+                if program.program_id is not None:
+                    self._programs_by_id[program.program_id] = program
+            # Rebuild the deduplication index from the restored programs
+            island['hashes'].update(
+                program.hash_value for program in cluster_data['programs']
+                if program.hash_value is not None
+            )
 
         island['version'] = island_state['version']
         island['num_programs'] = island_state['num_programs']
 
 
-    def serialize_checkpoint(self) -> dict:
-        """
-        Serializes the necessary state of the database for checkpointing.
-        """
-        checkpoint_data = {
+    def checkpoint_state(self) -> dict:
+        """Counters of the database as stored in checkpoints, without the islands and best programs."""
+        return {
             "cumulative_evaluator_cpu_time": self.cumulative_evaluator_cpu_time,
             "cumulative_sampler_gpu_time": self.cumulative_sampler_gpu_time,
             "cumulative_input_tokens":  self.cumulative_input_tokens,
             "cumulative_output_tokens": self.cumulative_output_tokens,
-            "best_score_per_island": list(self._best_score_per_island),
-            "best_program_per_island": [program.to_dict() if program else None for program in self._best_program_per_island],
-            "best_scores_per_test_per_island": list(self._best_scores_per_test_per_island),
             "last_reset_time": self._last_reset_time,
             "total_prompts": self.total_prompts,
             "dublicate_prompts": self.dublicate_prompts,
@@ -536,16 +647,42 @@ class ProgramsDatabase:
             "duplicates_discarded": self.duplicates_discarded,
             "found_optimal_solution": self.found_optimal_solution,
             "prompts_since_optimal":self.prompts_since_optimal,
+            "next_program_id": self.next_program_id,
             "wandb_run_id": self.wandb_run_id,  # Save W&B run ID for resumption
             "wandb_run_name": self.wandb_run_name,  # Save run name for checkpoint directory continuity
-            "islands_state": []
+            "shard_id": self.shard_id,
+            "num_shards": self.num_shards,
         }
 
+    def serialize_checkpoint(self) -> dict:
+        """
+        Serializes the necessary state of the database for checkpointing.
+        """
+        return self._convert_checkpoint_programs(self._capture_checkpoint())
 
-        for island_id, island in enumerate(self._islands):
-            island_state = self._serialize_island_state(island)
-            checkpoint_data["islands_state"].append(island_state)
+    def _capture_checkpoint(self) -> dict:
+        """
+        The checkpoint with its programs still as `Function` objects, in new lists. Cheap enough
+        for the event loop; since programs do not change after registration,
+        `_convert_checkpoint_programs` can run on another thread.
+        """
+        checkpoint_data = self.checkpoint_state()
+        checkpoint_data.update({
+            "best_score_per_island": list(self._best_score_per_island),
+            "best_program_per_island": list(self._best_program_per_island),
+            "best_scores_per_test_per_island": list(self._best_scores_per_test_per_island),
+            "islands_state": [self._serialize_island_state(island) for island in self._islands],
+        })
+        return checkpoint_data
 
+    @staticmethod
+    def _convert_checkpoint_programs(checkpoint_data: dict) -> dict:
+        """Converts the programs of a captured checkpoint to dicts, in place."""
+        checkpoint_data["best_program_per_island"] = [
+            program.to_dict() if program else None for program in checkpoint_data["best_program_per_island"]]
+        for island_state in checkpoint_data["islands_state"]:
+            for cluster_state in island_state["clusters"].values():
+                cluster_state["programs"] = [program.to_dict() for program in cluster_state["programs"]]
         return checkpoint_data
 
     def _serialize_island_state(self, island):
@@ -568,32 +705,89 @@ class ProgramsDatabase:
         """
         Serializes the state of a single cluster.
         """
-        programs_serialized = [program.to_dict() for program in cluster_data['programs']]
         cluster_state = {
             "score": cluster_data['score'],
-            "programs": programs_serialized,
+            "programs": list(cluster_data['programs']),  # converted by _convert_checkpoint_programs
             "scores_per_test": cluster_data.get('scores_per_test', {}),
         }
         return cluster_state
 
 
     async def periodic_checkpoint(self):
-        checkpoint_interval = 3600 
-        while True:
-            await asyncio.sleep(checkpoint_interval) 
-            try: 
-                current_pid = os.getpid()
-                timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                checkpoint_dir = os.path.join(os.getcwd(), self.save_checkpoints_path)
-                if not os.path.exists(checkpoint_dir):
-                    os.makedirs(checkpoint_dir)
-                filepath = os.path.join(checkpoint_dir, f"checkpoint_{timestamp}.pkl")
-                data = self.serialize_checkpoint()
-                with open(filepath, "wb") as f:
-                    pickle.dump(data, f)
-                logger.info("Checkpoint has been saved.")
-            except Exception as e:
-                logger.error(f"Error in saving checkpoint file {e}")
+        """
+        Checkpoints the database incrementally (see `checkpoint_log`): a snapshot at the start and
+        every `snapshot_interval` seconds, and the changes since the last snapshot appended to its
+        log every `checkpoint_interval` seconds.
+        """
+        if self.save_checkpoints_path is None:
+            logger.warning("No checkpoint path given, the database is not checkpointed.")
+            return
+        checkpoint_interval = getattr(self._config, 'checkpoint_interval', 10.0)
+        # Snapshots are named by the second they are taken
+        snapshot_interval = max(getattr(self._config, 'snapshot_interval', 3600), 1.0)
+        checkpoint_dir = os.path.join(os.getcwd(), self.save_checkpoints_path)
+        last_snapshot_time = None
+        try:
+            while True:
+                try:
+                    if last_snapshot_time is None or time.time() - last_snapshot_time >= snapshot_interval:
+                        last_snapshot_time = time.time()
+                        await self.save_snapshot(checkpoint_dir)
+                    else:
+                        await self.append_checkpoint_log()
+                except Exception as e:
+                    logger.error(f"Error in saving checkpoint file {e}")
+                await asyncio.sleep(checkpoint_interval)
+        except asyncio.CancelledError:
+            # Shutdown: the changes since the last write still go to the log, after the running write
+            if self._checkpoint_log is not None:
+                try:
+                    if self._checkpoint_write is not None:
+                        await self._checkpoint_write
+                    self._checkpoint_log.write(self._checkpoint_log.take(), self.checkpoint_state())
+                except Exception as e:
+                    logger.error(f"Error in saving checkpoint log {e}")
+            raise
+
+    async def _write_checkpoint(self, write):
+        """
+        Runs `write` on a thread. Shielded: cancelled at shutdown, the write still completes, and
+        `periodic_checkpoint` waits for it before writing the remaining records.
+        """
+        self._checkpoint_write = asyncio.ensure_future(asyncio.to_thread(write))
+        await asyncio.shield(self._checkpoint_write)
+
+    async def save_snapshot(self, checkpoint_dir: str) -> str:
+        """Writes a snapshot and starts its log; the programs are converted and pickled on a thread."""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        filepath = os.path.join(checkpoint_dir, f"checkpoint_{timestamp}.pkl")
+
+        # Captured and switched to the new log at once: later changes belong to the new snapshot
+        checkpoint_data = self._capture_checkpoint()
+        state = self.checkpoint_state()
+        previous_log = self._checkpoint_log
+        pending = previous_log.take() if previous_log is not None else []
+        self._checkpoint_log = checkpoint_log.CheckpointLog(checkpoint_log.log_file_of(filepath))
+
+        def write():
+            if previous_log is not None:
+                # The previous snapshot and its log stay a complete checkpoint up to this snapshot
+                previous_log.write(pending, state)
+            checkpoint_log.write_snapshot(filepath, self._convert_checkpoint_programs(checkpoint_data))
+
+        await self._write_checkpoint(write)
+        logger.info(f"Checkpoint has been saved: {filepath}")
+        return filepath
+
+    async def append_checkpoint_log(self):
+        """Appends the changes since the last write to the log of the current snapshot."""
+        if self._checkpoint_log is None:
+            return
+        # Records and counters are taken together, so that the counters match the records before them
+        log, records, state = self._checkpoint_log, self._checkpoint_log.take(), self.checkpoint_state()
+        await self._write_checkpoint(lambda: log.write(records, state))
+        logger.debug(f"Appended {len(records)} changes to checkpoint log {log.log_file}")
 
 
     def _compute_wandb_metrics(self) -> dict:
@@ -601,7 +795,8 @@ class ProgramsDatabase:
         metrics = {}
 
         # 1. Best score per island (overall and detailed per test input)
-        for island_id, score in enumerate(self._best_score_per_island):
+        for island_id in self._owned_island_ids:
+            score = self._best_score_per_island[island_id]
             metrics[f"island_{island_id}/best_score"] = score
 
             # Log detailed scores for each evaluation input (n, s)
@@ -616,10 +811,10 @@ class ProgramsDatabase:
                         metrics[f"island_{island_id}/score_{test_key}"] = test_score
 
         # 2. Overall best score across all islands
-        metrics["overall/best_score"] = max(self._best_score_per_island)
+        best_island_id = max(self._owned_island_ids, key=lambda island_id: self._best_score_per_island[island_id])
+        metrics["overall/best_score"] = self._best_score_per_island[best_island_id]
 
         # Log overall best detailed scores
-        best_island_id = np.argmax(self._best_score_per_island)
         best_scores_per_test = self._best_scores_per_test_per_island[best_island_id]
         if best_scores_per_test is not None:
             for test_key, test_score in best_scores_per_test.items():
@@ -639,7 +834,8 @@ class ProgramsDatabase:
 
         # 5. Number of clusters per island and cluster sizes
         cluster_sizes_all = []
-        for island_id, island in enumerate(self._islands):
+        for island_id in self._owned_island_ids:
+            island = self._islands[island_id]
             num_clusters = len(island['clusters'])
             metrics[f"island_{island_id}/num_clusters"] = num_clusters
             metrics[f"island_{island_id}/num_programs"] = island['num_programs']
@@ -670,6 +866,10 @@ class ProgramsDatabase:
         # 8. Prompt statistics
         metrics["prompts/total"] = self.total_prompts
         metrics["prompts/duplicate"] = self.dublicate_prompts
+        metrics["prompts/cache_hit_rate"] = self._prompt_cache.hit_rate
+        metrics["prompts/cache_hits"] = self._prompt_cache.hits
+        metrics["prompts/cache_size"] = len(self._prompt_cache)
+        metrics["prompts/cache_invalidated"] = self._prompt_cache.invalidated
 
         # 9. Optimal solution tracking
         if self.found_optimal_solution:
@@ -710,12 +910,7 @@ class ProgramsDatabase:
 
     def _get_program_by_id(self, program_id: int):
         """Find a program by its ID across all islands."""
-        for island in self._islands:
-            for cluster in island['clusters'].values():
-                for program in cluster.get('programs', []):
-                    if program.program_id == program_id:
-                        return program
-        return None
+        return self._programs_by_id.get(program_id)
 
     def _trace_lineage(self, program_id: int, max_depth: int = 100):
         """Trace the full evolutionary lineage of a program.
@@ -741,29 +936,21 @@ class ProgramsDatabase:
 
                 # Find the program
                 program = self._get_program_by_id(pid)
+                program_entry = self._lineage_by_id.get(pid)
                 if program is None:
-                    # Try to find in lineage_log
-                    for entry in self.lineage_log:
-                        if entry['program_id'] == pid:
-                            lineage.append({
-                                'program_id': pid,
-                                'program': None,  # Program no longer in memory
-                                'generation': entry['generation'],
-                                'score': entry['score'],
-                                'parent_ids': entry['parent_ids'],
-                                'timestamp': entry.get('timestamp'),
-                            })
-                            next_ids.extend(entry['parent_ids'])
-                            break
+                    # Fall back to lineage_log
+                    if program_entry:
+                        lineage.append({
+                            'program_id': pid,
+                            'program': None,  # Program no longer in memory
+                            'generation': program_entry['generation'],
+                            'score': program_entry['score'],
+                            'parent_ids': program_entry['parent_ids'],
+                            'timestamp': program_entry.get('timestamp'),
+                        })
+                        next_ids.extend(program_entry['parent_ids'])
                     continue
 
-                # Find the program's scores from lineage_log
-                program_entry = None
-                for entry in self.lineage_log:
-                    if entry['program_id'] == pid:
-                        program_entry = entry
-                        break
-
                 if program_entry:
                     lineage.append({
                         'program_id': pid,
@@ -974,7 +1161,7 @@ class ProgramsDatabase:
 
         table_data = []
 
-        for island_id in range(len(self._islands)):
+        for island_id in self._owned_island_ids:
             program = self._best_program_per_island[island_id]
             if program is None or program.program_id is None:
                 continue
@@ -1233,8 +1420,6 @@ class ProgramsDatabase:
 
     async def consume_and_process(self) -> None:
         """ Continuously consumes messages in batches from the database queue and processes them. """
-        from disfun import process_utils
-
         batch_size = 10
         batch_timeout = 0.01
 
@@ -1244,54 +1429,91 @@ class ProgramsDatabase:
             """Inner consume loop - will be wrapped with reconnection logic."""
             await self.channel.set_qos(prefetch_count=batch_size)
 
-            async with self.database_queue.iterator() as stream:
-                batch = []
-                batch_start_time = time.time()
+            batch = []
+            flush_task = None
+
+            def take_batch():
+                nonlocal batch
+                current, batch = batch, []
+                return current
+
+            async def flush_later():
+                # A partial batch is processed after batch_timeout even if no further message arrives
+                await asyncio.sleep(batch_timeout)
+                if batch:
+                    await self.process_batch(take_batch())
 
+            async with self.database_queue.iterator() as stream:
                 try:
                     async for message in stream:
-                        logger.debug(f"Received message: {message.body.decode()}")
+                        logger.debug(f"Received message of {len(message.body)} bytes")
                         batch.append(message)
-                        current_time = time.time()
 
                         # Check if the batch should be processed
-                        if len(batch) >= batch_size or (current_time - batch_start_time) >= batch_timeout:
-                            await self.process_batch(batch)
-                            batch.clear()
-                            batch_start_time = current_time
+                        if len(batch) >= batch_size:
+                            await self.process_batch(take_batch())
+                        elif flush_task is None or flush_task.done():
+                            flush_task = asyncio.create_task(flush_later())
 
                 except asyncio.CancelledError:
                     logger.info("Database task was canceled. Processing any remaining batch.")
+                    if flush_task is not None:
+                        flush_task.cancel()
                     if batch:
-                        await self.process_batch(batch)
+                        await self.process_batch(take_batch())
                     raise  # Re-raise to ensure proper cancellation
 
-        # Wrap consume loop with automatic reconnection
-        await process_utils.with_reconnection(
-            _consume_loop,
-            logger,
-            component_name="ProgramsDatabase"
-        )
+        try:
+            # Wrap consume loop with automatic reconnection
+            await process_utils.with_reconnection(
+                _consume_loop,
+                logger,
+                component_name="ProgramsDatabase"
+            )
+        finally:
+            await self._close_publisher()
+
+    async def _close_publisher(self):
+        """Sends the prompts still buffered in the publisher before the channel closes."""
+        try:
+            await self.publisher.close()
+            logger.info(f"Database: publisher {self.publisher.stats()}")
+        except Exception as e:
+            logger.error(f"Database: Error flushing publisher: {e}")
 
 
     #@async_time_execution
     async def process_batch(self, batch: List[aio_pika.IncomingMessage]):
+        """Registers the results of a batch, then answers them with one batch of prompts."""
         try:
             tasks = [self.process_message(message) for message in batch]
             results = await asyncio.gather(*tasks, return_exceptions=True)
+            prompts_requested = 0
             for result in results:
                 if isinstance(result, Exception):
                     logger.error(f"Database: Error processing message: {result}")
+                else:
+                    prompts_requested += result
+            if prompts_requested:
+                await self.get_prompts(prompts_requested)
         except asyncio.CancelledError:
             logger.info("Process batch was cancelled.")
         except Exception as e:
             logger.error(f"Error in process_batch: {e}")
 
-    async def process_message(self, message: aio_pika.IncomingMessage):
+    async def process_message(self, message: aio_pika.IncomingMessage) -> int:
+        """
+        Handles one message of the database queue and returns the number of prompts it asks for:
+        one per evaluator result (also for failed programs, which are not registered), none for
+        commands. `process_batch` publishes the prompts of a whole batch together.
+        """
         try:
-            self.total_prompts += 1
             async with message.process():
-                data = json.loads(message.body.decode())
+                data = self.codec.decode(message)
+                if "command" in data:
+                    await self.process_command(data)
+                    return 0
+                self.total_prompts += 1
 
                 # Update cumulative evaluator CPU and GPU times
                 evaluator_cpu_time = data.get("cpu_time", 0.0)
@@ -1314,10 +1536,9 @@ class ProgramsDatabase:
                 logger.debug(f"Updated cumulative GPU time: {self.cumulative_sampler_gpu_time:.2f} seconds")
 
                 if data["new_function"] == "return":
-                    await self.get_prompt()
                     self.execution_failed += 1
                     logger.debug("Received 'return' for new_function. Skipping registration.")
-                    return
+                    return 1
 
                 try:
                     if isinstance(data["new_function"], dict):
@@ -1326,21 +1547,24 @@ class ProgramsDatabase:
                         program = code_manipulation.Function.deserialize(data["new_function"])
                 except Exception as e:
                     logger.error(f"Failed to convert program to Function instance: {e}")
-                    await self.get_prompt()
+                    return 1
 
                 island_id = data.get("island_id")
                 parent_ids = data.get("parent_ids", [])  # Extract parent IDs for lineage tracking
 
 
                 if island_id is None:
-                    # Register the program to all islands
-                    for i in range(len(self._islands)):
-                        await self.register_program(program, i, data["scores_per_test"], data.get("expected_version", None), data.get("hash_value", None), parent_ids)
+                    # Register the program to all islands (of this shard)
+                    for i in self._owned_island_ids:
+                        # Each island stores its own copy so that program IDs stay unique per object
+                        await self.register_program(dataclasses.replace(program), i, data["scores_per_test"], data.get("expected_version", None), data.get("hash_value", None), parent_ids)
+                elif island_id not in self._owned_island_ids:
+                    logger.warning(f"Database shard {self.shard_id}: Discarding result for island {island_id} of another shard.")
                 else:
                     # Register the program to the specific island
                     await self.register_program(program, island_id, data["scores_per_test"], data.get("expected_version", None), data.get("hash_value", None), parent_ids)
 
-                await self.get_prompt()
+                return 1
 
         except asyncio.CancelledError:
             logger.info("Process message was cancelled.")
@@ -1359,6 +1583,32 @@ class ProgramsDatabase:
         # Ensure locks are initialized before use
         self._ensure_locks_initialized()
 
+        # With several shards the DatabaseCoordinator decides on resets across all islands
+        if self.num_shards == 1:
+            await self._maybe_reset_islands()
+
+        # Acquire lock for this island to prevent race conditions during deduplication check and registration
+        async with self._island_locks[island_id]:
+            # Proceed with program registration logic
+            island = self._islands[island_id]
+
+            if not self.no_deduplication and self.function_body_exists(island, hash_value):
+                self.duplicates_discarded += 1
+                logger.debug(f"Program with identical body already exists in island. Skipping registration.")
+                return
+
+            if expected_version is not None:
+                current_version = island['version']
+                if current_version != expected_version:
+                    logger.warning(f"Island {island_id} version mismatch. Expected: {expected_version}, Actual: {current_version}")
+                    self.version_mismatch_discarded += 1
+                    return
+
+            self._register_program_in_island(program, island_id, scores_per_test, hash_value, parent_ids)
+
+
+    async def _maybe_reset_islands(self):
+        """Resets the islands if the reset period has passed (if defined) and all islands are populated."""
         # Check if reset period is defined
         if self._config.reset_period is not None:
             # Only check the timing if reset_period is not None
@@ -1386,26 +1636,6 @@ class ProgramsDatabase:
             else:
                 logger.debug("Reset period not defined, but not all islands have enough programs. Skipping reset for now.")
 
-        # Acquire lock for this island to prevent race conditions during deduplication check and registration
-        async with self._island_locks[island_id]:
-            # Proceed with program registration logic
-            island = self._islands[island_id]
-
-            if not self.no_deduplication and self.function_body_exists(island['clusters'], hash_value):
-                self.duplicates_discarded += 1
-                logger.debug(f"Program with identical body already exists in island. Skipping registration.")
-                return
-
-            if expected_version is not None:
-                current_version = island['version']
-                if current_version != expected_version:
-                    logger.warning(f"Island {island_id} version mismatch. Expected: {expected_version}, Actual: {current_version}")
-                    self.version_mismatch_discarded += 1
-                    return
-
-            self._register_program_in_island(program, island_id, scores_per_test, hash_value, parent_ids)
-
-
     def _register_program_in_island(self, program: code_manipulation.Function, island_id: int, scores_per_test: ScoresPerTest, hash_value: int = None, parent_ids: list[int] = None):
         """Register a program in an island and assign evolutionary lineage.
 
@@ -1427,9 +1657,6 @@ class ProgramsDatabase:
         The lineage information is logged to self.lineage_log for tracking evolutionary trajectories.
         """
         self.total_stored_programs += 1
-        island = self._islands[island_id]
-        clusters = island['clusters']
-        signature = self._get_signature(scores_per_test)
         program.hash_value = hash_value
 
         # Assign lineage tracking information
@@ -1437,42 +1664,55 @@ class ProgramsDatabase:
             parent_ids = []
 
         program.program_id = self.next_program_id
-        self.next_program_id += 1
+        self.next_program_id += self.num_shards
         program.parent_ids = parent_ids
 
         # Calculate generation: max of parent generations + 1, or 0 if no parents
         if parent_ids:
             # Find maximum generation among parents
             max_parent_generation = 0
-            for cluster in clusters.values():
-                for p in cluster.get('programs', []):
-                    if p.program_id in parent_ids and p.generation is not None:
-                        max_parent_generation = max(max_parent_generation, p.generation)
+            for parent_id in parent_ids:
+                p = self._programs_by_id.get(parent_id)
+                if p is not None and p.generation is not None:
+                    max_parent_generation = max(max_parent_generation, p.generation)
             program.generation = max_parent_generation + 1
         else:
             program.generation = 0
 
         program.timestamp = time.time()
+        self._store_program_in_island(program, island_id, scores_per_test)
+
+    def _store_program_in_island(self, program: code_manipulation.Function, island_id: int, scores_per_test: ScoresPerTest):
+        """Adds a program with its id and lineage assigned to an island and records it for the checkpoint log.
+
+        Also replays the registrations of a checkpoint log (see `checkpoint_log`).
+        """
+        island = self._islands[island_id]
+        clusters = island['clusters']
+        signature = self._get_signature(scores_per_test)
+        hash_value = program.hash_value
 
         try:
             if signature not in clusters:
                 logger.info(f"Creating new cluster with signature {scores_per_test}")
-                cluster_data = {}
-                cluster_data['score'] = _reduce_score(scores_per_test, self.mode, self.start_n, self.end_n, self.s_values, self.target_signatures)
-                cluster_data['scores_per_test'] = scores_per_test
-                cluster_data['programs'] = [program]
-                clusters[signature] = cluster_data
+                cluster_data = self._new_cluster(
+                    _reduce_score(scores_per_test, self.mode, self.start_n, self.end_n, self.s_values, self.target_signatures),
+                    scores_per_test)
+                self._add_program_to_cluster(cluster_data, program)
+                self._add_cluster(island, signature, cluster_data)
             else:
                 logger.info(f"Registering on cluster with signature {scores_per_test}")
-                cluster_data = clusters[signature]
-                cluster_data['programs'].append(program)
+                self._add_program_to_cluster(clusters[signature], program)
         
             island['num_programs'] += 1
+            if hash_value is not None:
+                island['hashes'].add(hash_value)
+            self._programs_by_id[program.program_id] = program
 
             # Log lineage information for this program (only if enabled)
             if self.save_lineage:
                 score = _reduce_score(scores_per_test, self.mode, self.start_n, self.end_n, self.s_values, self.target_signatures)
-                self.lineage_log.append({
+                lineage_entry = {
                     'program_id': program.program_id,
                     'parent_ids': program.parent_ids,
                     'generation': program.generation,
@@ -1480,7 +1720,9 @@ class ProgramsDatabase:
                     'island_id': island_id,
                     'timestamp': program.timestamp,
                     'signature': signature
-                })
+                }
+                self.lineage_log.append(lineage_entry)
+                self._lineage_by_id[program.program_id] = lineage_entry
                 logger.debug(f"Logged lineage: program_id={program.program_id}, parent_ids={program.parent_ids}, generation={program.generation}, score={score}")
 
         except Exception as e:
@@ -1513,6 +1755,35 @@ class ProgramsDatabase:
         except Exception as e: 
             logger.error(f"Could not update best score: {e}")
 
+        self._record_checkpoint_change(("register", island_id, program, scores_per_test))
+
+    def _record_checkpoint_change(self, record: tuple):
+        """Records a change for the checkpoint log, once `periodic_checkpoint` has started it."""
+        if self._checkpoint_log is not None:
+            self._checkpoint_log.record(record)
+
+    @staticmethod
+    def _new_cluster(score: float, scores_per_test: ScoresPerTest) -> dict:
+        # 'lengths' holds len(str(program)) of every program, in step with 'programs', for sample_program
+        return {'score': score, 'scores_per_test': scores_per_test, 'programs': [], 'lengths': _GrowableArray(4)}
+
+    @staticmethod
+    def _add_program_to_cluster(cluster_data: dict, program: code_manipulation.Function) -> None:
+        cluster_data['programs'].append(program)
+        cluster_data['lengths'].append(len(str(program)))
+
+    @staticmethod
+    def _add_cluster(island: dict, signature: Signature, cluster_data: dict) -> None:
+        island['clusters'][signature] = cluster_data
+        island['signatures'].append(signature)
+        island['cluster_scores'].append(cluster_data['score'])
+
+    @staticmethod
+    def _clear_island_clusters(island: dict) -> None:
+        island['clusters'].clear()
+        island['signatures'].clear()
+        island['cluster_scores'].clear()
+
     async def reset_islands(self):
         """Reset the weakest half of islands with founders from the best islands.
 
@@ -1523,7 +1794,7 @@ class ProgramsDatabase:
         Lineage Tracking During Resets:
         --------------------------------
         Founder programs maintain evolutionary continuity across island boundaries.
-        When a program is copied as a founder to a reset island, it receives a new program_id
+        When a program is copied as a founder to a reset island, the copy receives a new program_id
         but its parent_ids contains the original program's program_id. This creates an
         evolutionary link showing the program was "migrated" from another island rather than
         evolved from a prompt.
@@ -1537,75 +1808,170 @@ class ProgramsDatabase:
         except Exception as e:
             logger.error(f"Could not remove all messages from the queue: {e}")
         try:
-            indices_sorted_by_score = np.argsort(self._best_score_per_island)
-            num_islands_to_reset = self._config.num_islands // 2
-            reset_islands_ids = indices_sorted_by_score[:num_islands_to_reset]
-            keep_islands_ids = indices_sorted_by_score[num_islands_to_reset:]
+            reset_plan = database_shards.select_islands_to_reset(self._best_score_per_island, self._config.num_islands // 2)
 
-            if len(reset_islands_ids) == 0:
+            if not reset_plan:
                 logger.warning("No islands to reset. Skipping reset.")
                 return
 
-            for island_id in reset_islands_ids:
+            for island_id, founder_island_id in reset_plan.items():
                 async with self._island_locks[island_id]:
-                    island = self._islands[island_id]
-                    island['clusters'].clear()
-                    island['version'] += 1
-                    island['num_programs'] = 0
-
-                    self._best_score_per_island[island_id] = -float('inf')
-                    founder_island_id = np.random.choice(keep_islands_ids)
                     founder = self._best_program_per_island[founder_island_id]
                     founder_scores = self._best_scores_per_test_per_island[founder_island_id]
-                    # Founder inherits from the original program
-                    founder_parent_ids = [founder.program_id] if founder.program_id is not None else []
-                    self._register_program_in_island(founder, island_id, founder_scores, None, founder_parent_ids)
-                await self.get_prompt()
+                    # Register a copy so the original keeps its program_id in the surviving island
+                    self._reset_island(island_id, dataclasses.replace(founder), founder_scores)
+            await self.get_prompts(len(reset_plan))
         except Exception as e:
             logger.error(f"Error during island reset: {e}")
 
+    def _reset_island(self, island_id: int, founder: code_manipulation.Function, founder_scores: ScoresPerTest):
+        """Clears an island, bumps its version and registers `founder` as its only program."""
+        self._clear_island(island_id)
+        # Founder inherits from the original program
+        founder_parent_ids = [founder.program_id] if founder.program_id is not None else []
+        self._register_program_in_island(founder, island_id, founder_scores, None, founder_parent_ids)
 
-    async def get_prompt(self) -> None:
+    def _clear_island(self, island_id: int):
+        """Removes all programs of an island and bumps its version (also when replaying the checkpoint log)."""
+        island = self._islands[island_id]
+        removed_program_ids = []
+        for cluster in island['clusters'].values():
+            for program in cluster['programs']:
+                self._programs_by_id.pop(program.program_id, None)
+                removed_program_ids.append(program.program_id)
+        self._prompt_cache.invalidate(removed_program_ids)
+        self._clear_island_clusters(island)
+        island['hashes'].clear()
+        island['version'] += 1
+        island['num_programs'] = 0
+
+        self._best_score_per_island[island_id] = -float('inf')
+        self._record_checkpoint_change(("reset", island_id))
+
+    async def process_command(self, data: dict):
+        """Handles a control message of the `DatabaseCoordinator` (see `database_shards`)."""
+        command = data["command"]
+        if command == "reset_islands":
+            await self.apply_island_resets(data["islands"])
+        elif command == "found_optimal_solution":
+            if not self.found_optimal_solution:
+                self.found_optimal_solution = True
+                self.prompts_since_optimal = 0
+        else:
+            logger.warning(f"Database shard {self.shard_id}: Unknown command '{command}'")
 
+    async def apply_island_resets(self, resets: list):
+        """Resets the islands of this shard chosen by the coordinator, with founders from any shard."""
+        self._ensure_locks_initialized()
+        for reset in resets:
+            island_id = reset["island_id"]
+            try:
+                async with self._island_locks[island_id]:
+                    founder = code_manipulation.Function.from_dict(reset["founder"])
+                    self._reset_island(island_id, founder, reset["scores_per_test"])
+            except Exception as e:
+                logger.error(f"Database shard {self.shard_id}: Error resetting island {island_id}: {e}")
+        logger.info(f"Database shard {self.shard_id}: Reset islands {[reset['island_id'] for reset in resets]}.")
+        # The coordinator purged the queues, so every shard restarts its share of the work in flight
+        await self.get_prompts(max(len(resets), 1))
+
+    def shard_report(self) -> dict:
+        """State of the islands of this shard, as needed by the `DatabaseCoordinator`."""
+        islands = []
+        for island_id in self._owned_island_ids:
+            best_program = self._best_program_per_island[island_id]
+            best_scores_per_test = self._best_scores_per_test_per_island[island_id]
+            islands.append({
+                "island_id": island_id,
+                "version": self._islands[island_id]['version'],
+                "num_programs": self._islands[island_id]['num_programs'],
+                "best_score": float(self._best_score_per_island[island_id]),
+                "best_program": best_program.to_dict() if best_program else None,
+                "best_scores_per_test": {str(key): value for key, value in best_scores_per_test.items()} if best_scores_per_test else None,
+            })
+        return {
+            "command": "shard_report",
+            "shard_id": self.shard_id,
+            "islands": islands,
+            "total_prompts": self.total_prompts,
+            "total_stored_programs": self.total_stored_programs,
+            "duplicates_discarded": self.duplicates_discarded,
+            "version_mismatch_discarded": self.version_mismatch_discarded,
+            "execution_failed": self.execution_failed,
+            "found_optimal_solution": self.found_optimal_solution,
+        }
+
+    async def periodic_shard_report(self, interval: float = 5.0):
+        """Publishes `shard_report()` to the coordinator queue every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.channel.default_exchange.publish(
+                    self.codec.message(self.shard_report()),
+                    routing_key=database_shards.COORDINATOR_QUEUE
+                )
+            except Exception as e:
+                logger.error(f"Database shard {self.shard_id}: Error publishing shard report: {e}")
+
+
+    def _prompt_allowed(self) -> bool:
+        """Whether another prompt may be published (prompt limit, programs after an optimal solution)."""
         if self.found_optimal_solution:
             logger.info(f"In self.found_optimal_solution: with it being equal to {self.found_optimal_solution:}")
             if self.prompts_since_optimal >= self.optimal_solution_programs:
                 logger.info(f"Found an optimal solution and processed {self.optimal_solution_programs} additional programs. Stopping further publishing.")
-                return  # Stop publishing once the additional limit is reached
+                return False  # Stop publishing once the additional limit is reached
             self.prompts_since_optimal += 1  # Track additional programs after the optimal solution
             logger.info(f"Functions processed since optimal: {self.prompts_since_optimal}")
 
         elif self.total_prompts >= self.prompt_limit:
             logger.info(f"Reached the limit of {self.prompt_limit} prompts. Stopping further publishing, but continue processing remaining queue messages.")
-            return  # Stop further publishing once the limit is reached
+            return False  # Stop further publishing once the limit is reached
+        return True
 
-        logger.debug(f"len(self._islands) {len(self._islands)}")
-        island_id = np.random.randint(len(self._islands))
-        logger.debug(f"Island id is {island_id}")
-        island = self._islands[island_id]
+    async def get_prompt(self) -> None:
+        await self.get_prompts(1)
 
-        code, flag_duplicate, version_generated, parent_ids = self._generate_prompt_for_island(island)
-        expected_version = island['version']
+    async def get_prompts(self, count: int) -> int:
+        """
+        Generates `count` prompts and publishes them to the samplers as one batch.
 
-        prompt = Prompt(code, version_generated, island_id, expected_version)
-        message_data = {
-            "prompt": prompt.serialize(),
-            "total_registered_programs": island['num_programs'],
-            "flag":flag_duplicate,
-            "parent_ids": parent_ids  # Include parent IDs for lineage tracking
-        }
+        The islands of all prompts are drawn at once; the cluster probabilities of an island are
+        computed once for all of its prompts, and its clusters are drawn for all of them in one
+        vectorized step (`_sample_cluster_indices`). The prompts are buffered in the publisher and
+        flushed together, so the batch costs one round of publisher confirms.
 
+        Returns:
+            int: number of prompts published
+        """
+        num_prompts = 0
+        while num_prompts < count and self._prompt_allowed():
+            num_prompts += 1
+        if num_prompts == 0:
+            return 0
+
+        island_ids, prompts_per_island = np.unique(
+            np.random.choice(self._owned_island_ids, size=num_prompts), return_counts=True)
         try:
-            serialized_message = json.dumps(message_data)
-            await self.channel.default_exchange.publish(
-                aio_pika.Message(body=serialized_message.encode()),
-                routing_key='sampler_queue'
-            )
-            logger.debug("Database: Successfully published prompt to sampler with total registered programs.")
+            for island_id, island_prompts in zip(island_ids.tolist(), prompts_per_island.tolist()):
+                island = self._islands[island_id]
+                logger.debug(f"Island id is {island_id}, generating {island_prompts} prompts")
+                for cluster_indices in self._sample_cluster_indices(island, island_prompts):
+                    sampled_programs, parent_ids = self._programs_from_clusters(island, cluster_indices)
+                    code, flag_duplicate, version_generated, parent_ids = self._prompt_for_programs(sampled_programs, parent_ids)
+                    prompt = Prompt(code, version_generated, island_id, island['version'])
+                    message_data = {
+                        "prompt": self.codec.prompt_field(prompt),
+                        "total_registered_programs": island['num_programs'],
+                        "flag": flag_duplicate,
+                        "parent_ids": parent_ids  # Include parent IDs for lineage tracking
+                    }
+                    await self.publisher.publish(self.codec.message(message_data), routing_key='sampler_queue')
+            await self.publisher.flush()
+            logger.debug(f"Database: Successfully published {num_prompts} prompts to the samplers.")
         except Exception as e:
-
             logger.error(f"Database: Error during prompt preparation or message sending: {e}")
-
+        return num_prompts
 
     def _generate_prompt_for_island(self, island, multiple=False) -> tuple[Optional[str], int, int, list[int]]:
         """Generate a prompt for an island.
@@ -1613,129 +1979,131 @@ class ProgramsDatabase:
         Returns:
             tuple: (prompt, flag_duplicate, version_generated, parent_ids)
         """
-        clusters = island['clusters']
-        signatures = list(clusters.keys())
+        sampled_programs, parent_ids = self._sample_programs_for_island(island)
+        return self._prompt_for_programs(sampled_programs, parent_ids)
+
+    def _prompt_for_programs(self, sampled_programs, parent_ids) -> tuple[Optional[str], int, int, list[int]]:
+        if not sampled_programs:
+            return None, False, 0, []
+        version_generated = len(sampled_programs)
+        # Prompts of registered programs are cached by their ids, in prompt order
+        cache_key = tuple(parent_ids) if len(parent_ids) == version_generated else None
+        cached = self._prompt_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            prompt, flag_duplicate = cached
+        else:
+            prompt, flag_duplicate = self._generate_prompt(sampled_programs)
+            if cache_key is not None and prompt is not None:
+                self._prompt_cache.put(cache_key, prompt, flag_duplicate)
+        if flag_duplicate:
+            self._record_duplicate_prompt(prompt)
+        return prompt, flag_duplicate, version_generated, parent_ids
+
+    def _record_duplicate_prompt(self, prompt: str):
+        """Counts a prompt whose two programs have the same hash value and writes it to a file."""
+        self.dublicate_prompts += 1
+        try:
+            with open("duplicate_prompt.txt", "a") as f:
+                f.write(prompt + "\n")
+            logger.info("Duplicate prompt written to 'duplicate_prompt.txt'.")
+        except Exception as e:
+            logger.error(f"Failed to write duplicate prompt to file: {e}")
+
+    def _cluster_probabilities(self, island) -> np.ndarray:
+        """Tempered softmax over the cached cluster scores of an island (uniform if it fails)."""
+        cluster_scores = island['cluster_scores'].values
+        period = self._config.cluster_sampling_temperature_period
+        temperature = self._config.cluster_sampling_temperature_init * (1 - (island['num_programs'] % period) / period)
+        try:
+            probabilities = _softmax(cluster_scores, temperature)
+            if np.all(np.isfinite(probabilities)):
+                # Lazy formatting: rendering thousands of probabilities costs more than sampling
+                logger.debug("Probabilities are %s", probabilities)
+                return probabilities
+            logger.error(f"Cannot compute softmax at temperature {temperature}: non-finite probabilities")
+        except Exception as e:
+            logger.error(f"Cannot compute softmax: {e}")
+        logger.warning("Using uniform sampling as fallback.")
+        return np.full(len(cluster_scores), 1.0 / len(cluster_scores))
+
+    def _sample_programs_for_island(self, island) -> tuple[list, list[int]]:
+        """Samples up to functions_per_prompt clusters of an island and one program from each.
+
+        Returns:
+            tuple: ([(program, scores_per_test), ...] in ascending cluster score, parent_ids)
+        """
+        return self._programs_from_clusters(island, self._sample_cluster_indices(island, 1)[0])
+
+    def _sample_cluster_indices(self, island, num_prompts: int) -> list[np.ndarray]:
+        """Draws the clusters of `num_prompts` prompts of an island, up to functions_per_prompt each.
+
+        Clusters are drawn by their score with the tempered softmax, leaving out clusters whose
+        probability is 1e-6 or less. Works on the island's cached score array: the probabilities
+        are computed once for all prompts, and the clusters of all prompts are drawn without
+        replacement in one step by taking the functions_per_prompt largest Gumbel-perturbed log
+        probabilities per prompt (the same distribution as successive draws without replacement).
+
+        Returns:
+            list: one array of cluster indices per prompt (empty arrays if the island has no clusters)
+        """
+        signatures = island['signatures']
         functions_per_prompt = self._config.functions_per_prompt
         if not signatures:
             logger.warning(f"No clusters found in island {island}. Skipping prompt generation.")
-            return None, False, 0, []
+            return [np.arange(0)] * num_prompts
+
+        probabilities = self._cluster_probabilities(island)
+        valid_indices = np.flatnonzero(probabilities > 1e-6)
+        if len(valid_indices) == 0:
+            # Only possible if every cluster falls below the threshold, e.g. millions of clusters
+            valid_indices = np.arange(len(signatures))
+        logger.debug(f"Length of valid sig: {len(valid_indices)}")
+
+        if len(valid_indices) <= functions_per_prompt:
+            if 1 < len(valid_indices) < functions_per_prompt:
+                logger.warning("Fewer valid clusters than functions_per_prompt; using all available clusters.")
+            return [valid_indices] * num_prompts
+
+        logger.debug("Sampling from multiple valid clusters.")
+        log_probabilities = np.log(probabilities[valid_indices])
+        keys = log_probabilities + np.random.gumbel(size=(num_prompts, len(valid_indices)))
+        top = np.argpartition(-keys, functions_per_prompt - 1, axis=1)[:, :functions_per_prompt]
+        return list(valid_indices[top])
+
+    def _programs_from_clusters(self, island, cluster_indices: np.ndarray) -> tuple[list, list[int]]:
+        """Picks one program from each of the given clusters of an island.
+
+        Returns:
+            tuple: ([(program, scores_per_test), ...] in ascending cluster score, parent_ids)
+        """
+        clusters = island['clusters']
+        signatures = island['signatures']
+        # Sort the sampled clusters by score, so the best program comes last in the prompt.
+        cluster_scores = island['cluster_scores'].values
+        cluster_indices = cluster_indices[np.argsort(cluster_scores[cluster_indices], kind='stable')]
 
-        def compute_valid_signatures_and_probabilities(signatures, exclude_signature=None):
-            """Helper function to compute valid signatures and probabilities."""
-            filtered_signatures = [s for s in signatures if s != exclude_signature] if exclude_signature else signatures
-            cluster_scores = np.array([clusters[s]['score'] for s in filtered_signatures])
-            period = self._config.cluster_sampling_temperature_period
-            temperature = self._config.cluster_sampling_temperature_init * (1 - (island['num_programs'] % period) / period)
-            while True:
-                try:
-                    probabilities = _softmax(cluster_scores, temperature)
-                    logger.debug(f"Probabilities are {probabilities}")
-                except Exception as e:
-                    logger.error(f"Cannot compute softmax: {e}")
-                    break
-
-                valid_indices = np.where(probabilities > 1e-6)[0]
-                valid_probabilities = probabilities[valid_indices]
-                valid_signatures = [filtered_signatures[i] for i in valid_indices]
-                logger.debug(f"Valid sig are {valid_signatures}")
-
-                if len(valid_signatures) > 0:
-                    return valid_signatures, valid_probabilities
-
-                # Reduce temperature if no valid signatures are found
-                temperature *= 0.9
-                if temperature < 1e-6:
-                    logger.warning("Temperature reduced below threshold. Falling back to uniform sampling.")
-                    break
-
-            # Fallback: uniform sampling
-            logger.warning("Using uniform sampling as fallback.")
-            valid_signatures = filtered_signatures
-            valid_probabilities = np.ones(len(filtered_signatures)) / len(filtered_signatures)
-            return valid_signatures, valid_probabilities
-
-        # Compute valid signatures and probabilities.
-        valid_signatures, valid_probabilities = compute_valid_signatures_and_probabilities(signatures)
         sampled_programs = []
-        sampled_signatures = set()
         parent_ids = []  # Track parent program IDs
-        logger.debug(f"Length of valid sig: {len(valid_signatures)}")
-
-        # If only one valid signature is available, sample from it once.
-        if len(valid_signatures) == 1:
-            selected_signature = valid_signatures[0]
-            cluster = clusters[selected_signature]
-            cluster_programs = cluster['programs']
-            logger.debug(f"Selected signature: {selected_signature} with programs {cluster_programs}")
-            sampled_signatures.add(selected_signature)
-            if len(cluster_programs) >= 1:
-                program = self.sample_program(cluster)
-                scores = cluster.get('scores_per_test', {})
-                sampled_programs.append((program, scores))
-                # Track parent ID
-                if program.program_id is not None:
-                    parent_ids.append(program.program_id)
-                version_generated = 1
-                prompt, flag = self._generate_prompt(sampled_programs)
-                return prompt, flag, version_generated, parent_ids
-            else:
-                logger.warning("Single valid cluster has no programs. Skipping prompt generation.")
-                return None, False, 0, []
-
-        # If there are multiple valid signatures:
-        # Determine the number of clusters to sample.
-        if len(valid_signatures) >= functions_per_prompt:
-            logger.debug("Sampling from multiple valid clusters.")
-            # Sample exactly functions_per_prompt clusters without replacement.
-            cluster_indices = np.random.choice(
-                len(valid_signatures),
-                size=functions_per_prompt,
-                p=valid_probabilities,
-                replace=False
-            )
-            sampled_signatures.update([valid_signatures[i] for i in cluster_indices])
-        else:
-            # If fewer than desired valid clusters are available, use all available ones.
-            logger.warning("Fewer valid clusters than functions_per_prompt; using all available clusters.")
-            sampled_signatures.update(valid_signatures)
-            # Optionally, you could recalculate probabilities excluding these and sample additional ones if desired.
-    
-        # Sample one program from each selected cluster.
-        for signature in sampled_signatures:
-            cluster = clusters[signature]
-            cluster_programs = cluster['programs']
-            if not cluster_programs:
-                logger.warning(f"Cluster {signature} has no programs. Skipping.")
+        for index in cluster_indices:
+            cluster = clusters[signatures[index]]
+            if not cluster['programs']:
+                logger.warning(f"Cluster {signatures[index]} has no programs. Skipping.")
                 continue
             program = self.sample_program(cluster)
-            scores = cluster.get('scores_per_test', {})
-            sampled_programs.append((program, scores))
+            sampled_programs.append((program, cluster.get('scores_per_test', {})))
             # Track parent ID
             if program.program_id is not None:
                 parent_ids.append(program.program_id)
-
-        # Sort sampled programs by the corresponding cluster's score.
-        sorted_programs = sorted(sampled_programs, key=lambda p: clusters[next(iter(sampled_signatures))]['score'])
-        version_generated = len(sorted_programs)
-        prompt, flag_duplicate = self._generate_prompt(sorted_programs)
-        return prompt, flag_duplicate, version_generated, parent_ids
+        return sampled_programs, parent_ids
 
     def _generate_prompt(self, implementations_with_scores: Sequence[tuple]) -> str:
-        logger.debug(f"Type of `implementations_with_scores`: {type(implementations_with_scores)}")
-
         implementations = [impl for impl, _ in implementations_with_scores]
         scores_list = [scores for _, scores in implementations_with_scores]
 
-        for i, implementation in enumerate(implementations):
-            logger.debug(f"Implementation {i}: Type: {type(implementation)}, Attributes: {dir(implementation)}")
-            logger.debug(f"Implementation {i}: Content: {implementation}")
-
-        implementations = copy.deepcopy(implementations)
-
+        # The sampled programs are rendered from cached parts, they are neither copied nor re-parsed
         versioned_functions = []
         for i, implementation in enumerate(implementations):
-            new_function_name = f'{self._function_to_evolve}_v{i}'
-            implementation.name = new_function_name
+            docstring = implementation.docstring
 
             # Add scores to the docstring of evaluated implementations
             if self.show_eval_scores and scores_list[i]:
@@ -1750,126 +2118,72 @@ class ProgramsDatabase:
                 if i >= 1:
                     # For i >= 1, use "Improved version" docstring
                     base_docstring = f'Improved version of `{self._function_to_evolve}_v{i - 1}`.'
-                    implementation.docstring = f'{base_docstring} {score_text}'
+                    docstring = f'{base_docstring} {score_text}'
                 else:
                     # For i == 0, append scores to existing docstring
-                    if implementation.docstring:
-                        implementation.docstring = f'{implementation.docstring.strip()} {score_text}'
+                    if docstring:
+                        docstring = f'{docstring.strip()} {score_text}'
                     else:
-                        implementation.docstring = score_text
+                        docstring = score_text
             elif i >= 1:
                 # No scores, but still update docstring for i >= 1
-                implementation.docstring = f'Improved version of `{self._function_to_evolve}_v{i - 1}`.'
+                docstring = f'Improved version of `{self._function_to_evolve}_v{i - 1}`.'
             try:
-                implementation_str = code_manipulation.rename_function_calls(
-                    str(implementation), self._function_to_evolve, new_function_name
-                )
-                versioned_functions.append(code_manipulation.text_to_function(implementation_str))
+                versioned_functions.append(self._renderer.render_function(implementation, i, docstring))
             except Exception as e:
                 logger.error(f"Error in converting text to function: {e}")
 
         next_version = len(implementations)
-        new_function_name = f'{self._function_to_evolve}_v{next_version}'
 
         try:
             # Create docstring for the template - just the basic "Improved version" text
             template_docstring = f'Improved version of `{self._function_to_evolve}_v{next_version - 1}`.'
-
-            header = dataclasses.replace(
-                implementations[-1],
-                name=new_function_name,
-                body='',
-                docstring=template_docstring
-            )
-            versioned_functions.append(header)
+            versioned_functions.append(
+                self._renderer.render_header(implementations[-1], next_version, template_docstring))
         except Exception as e:
             logger.error(f"Error in creating header: {e}")
 
-        if hasattr(self._template, 'preface'):
-            preface = getattr(self._template, 'preface', '')
-
-            # Remove all existing imports
-            import_pattern = r"(?m)^import .*|from .* import .*"
-            preface_cleaned = re.sub(import_pattern, "", preface).strip()
-
-            # Replace generic "q-ary" with actual alphabet size description
-            q_description = _get_q_description(self.q)
-            preface_cleaned = preface_cleaned.replace("q-ary", q_description)
-
-            # Define required imports
-            imports = ["import numpy as np"]
-            if self.include_nx:
-                imports.append("import networkx as nx")
-
-            # If the preface starts with a docstring, leave it intact
-            if preface_cleaned.startswith('"""'):
-                docstring_end = preface_cleaned.index('"""', 3) + 3
-                initial_docstring = preface_cleaned[:docstring_end]
-                remaining_preface = preface_cleaned[docstring_end:].strip()
-            else:
-                initial_docstring = ""
-                remaining_preface = preface_cleaned
-
-            # Construct the new preface with specified newline rules
-            sections = []
-            if initial_docstring:
-                sections.append(initial_docstring.strip())
-            if remaining_preface:
-                sections.append(remaining_preface.strip())
-            sections.extend(imports)
-            sections.append("")  # Add a blank line after imports
-
-            # Join sections, ensuring appropriate newlines
-            preface = "\n".join(filter(None, sections))+ "\n" + "\n"
-            self._template = dataclasses.replace(self._template, preface=preface)
-
         try:
             if self.eval_code:
-                # hashing logic in eval script is excluded for constructing prompt
-                spec_path = '/Funsearch/implementation/specifications_construct/without_hash.txt'
-                with open(spec_path, 'r') as file:
-                    specification = file.read()
-                template_no_hash= code_manipulation.text_to_program(specification)
-                # Use the first two functions from the template, followed by versioned functions
-                first_two_functions = template_no_hash.functions[:4]
-                new_functions_list = first_two_functions + versioned_functions
+                # Use the first functions of the specification without hash, followed by versioned functions
+                new_functions_list = self._eval_code_functions() + versioned_functions
             else:
                 # Use only versioned functions
                 new_functions_list = versioned_functions
 
-            prompt = dataclasses.replace(self._template, functions=new_functions_list)
+            prompt_str = self._renderer.render_prompt(getattr(self._template, 'preface', ''), new_functions_list)
 
-            prompt_str = str(prompt)
+            logger.debug("Final prompt after class removal: %s", prompt_str)
 
-            logger.debug(f"Final prompt after class removal: {prompt_str}")
-
-            # Write to a file if two programs have the same hash value
-            duplicate_prompt = False
-            if len(implementations) == 2 and implementations[0].hash_value == implementations[1].hash_value:
-                duplicate_prompt = True
-                self.dublicate_prompts += 1
-                try:
-                    with open("duplicate_prompt.txt", "a") as f:
-                        f.write(prompt_str)
-                    logger.info("Duplicate prompt written to 'duplicate_prompt.txt'.")
-                except Exception as e:
-                    logger.error(f"Failed to write duplicate prompt to file: {e}")
+            # Flagged if two programs have the same hash value (recorded by _prompt_for_programs)
+            duplicate_prompt = len(implementations) == 2 and implementations[0].hash_value == implementations[1].hash_value
 
             return prompt_str.rstrip('\n'), duplicate_prompt
         except Exception as e:
             logger.error(f"Error in replacing prompt: {e}")
             return None, False
 
+    def _eval_code_functions(self) -> list[str]:
+        """First functions of the specification without the hashing logic, read once (eval_code)."""
+        if self._eval_code_prefix is None:
+            # hashing logic in eval script is excluded for constructing prompt
+            spec_path = '/Funsearch/implementation/specifications_construct/without_hash.txt'
+            with open(spec_path, 'r') as file:
+                specification = file.read()
+            template_no_hash = code_manipulation.text_to_program(specification)
+            self._eval_code_prefix = [str(function) for function in template_no_hash.functions[:4]]
+        return self._eval_code_prefix
 
-    def function_body_exists(self, clusters, hash_value: int) -> bool:
-        assert hash_value is not None, "Error: No hash value computed! Check that hash value condition in the specification script is set to match start_n."
 
-        for cluster in clusters.values():
-            programs = cluster['programs']
-            for program in programs:
-                if program.hash_value == hash_value:
-                    return True
-        return False
+    def function_body_exists(self, island, hash_value: int) -> bool:
+        """Checks the island's hash index for a program with the same hash value.
+
+        The index (`island['hashes']`) is kept in sync by `_register_program_in_island`,
+        `_reset_island` and `_load_island_state`, so the lookup is O(1) instead of
+        scanning every program of every cluster.
+        """
+        assert hash_value is not None, "Error: No hash value computed! Check that hash value condition in the specification script is set to match start_n."
+        return hash_value in island['hashes']
 
     def _get_signature(self, scores_per_test):
         if all(isinstance(k, str) for k in scores_per_test.keys()):
@@ -1888,7 +2202,7 @@ class ProgramsDatabase:
         if not programs:
             raise ValueError("Cluster contains no programs to sample.")
 
-        lengths = np.array([len(str(program)) for program in programs])  # Program lengths
+        lengths = cluster_data['lengths'].values  # Program lengths, cached on registration
         if lengths.max() == lengths.min():
             probabilities = np.ones(len(programs)) / len(programs)  # Uniform sampling if all lengths are identical
         else:
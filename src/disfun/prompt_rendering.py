@@ -0,0 +1,257 @@
+"""Rendering of the prompts of the ProgramsDatabase.
+
+A prompt is the cleaned preface of the template followed by the sampled programs as versions
+`priority_v0, priority_v1, ...` (calls of `priority` renamed to the version) and the header of the
+next version. Each version is written as `text_to_function` reads it back from its text: args and
+return type normalized by `ast.unparse`, the docstring prefixed by two spaces, and the body cut to
+the lines from its first to its last statement.
+
+`PromptRenderer` produces that text without copying, tokenizing or parsing the programs per prompt:
+
+* The cleaned preface (imports replaced, `q-ary` described) is built once per template preface.
+* Each program is parsed and tokenized once, at its first prompt. The normalized args and return
+  type are cached with its body split at the calls of the evolved function
+  (`code_manipulation.split_at_function_calls`), so rendering a version joins the parts with its
+  name. The cache is keyed by (args, return type, body) and bounded (least recently used first).
+
+Programs whose text would not read back unchanged (a docstring with backslashes, quotes or
+unusual line breaks, a body that starts with a string or has top-level code) are rendered by
+renaming and parsing them, as before; so are all programs with `max_cached_functions=0`.
+
+`PromptCache` keeps whole rendered prompts by the ordered ids of their programs: with few
+clusters and a small `functions_per_prompt` the same programs are sampled together again and again.
+"""
+
+import ast
+import collections
+import dataclasses
+import logging
+import re
+from typing import Optional, Sequence
+
+from disfun import code_manipulation
+
+logger = logging.getLogger('main_logger')
+
+
+def clean_preface(preface: str, q_description: str, include_nx: bool = True) -> str:
+    """Template preface with its imports replaced by the prompt imports and `q-ary` described."""
+    # Remove all existing imports
+    import_pattern = r"(?m)^import .*|from .* import .*"
+    preface_cleaned = re.sub(import_pattern, "", preface).strip()
+
+    # Replace generic "q-ary" with actual alphabet size description
+    preface_cleaned = preface_cleaned.replace("q-ary", q_description)
+
+    # Define required imports
+    imports = ["import numpy as np"]
+    if include_nx:
+        imports.append("import networkx as nx")
+
+    # If the preface starts with a docstring, leave it intact
+    if preface_cleaned.startswith('"""'):
+        docstring_end = preface_cleaned.index('"""', 3) + 3
+        initial_docstring = preface_cleaned[:docstring_end]
+        remaining_preface = preface_cleaned[docstring_end:].strip()
+    else:
+        initial_docstring = ""
+        remaining_preface = preface_cleaned
+
+    # Construct the new preface with specified newline rules
+    sections = []
+    if initial_docstring:
+        sections.append(initial_docstring.strip())
+    if remaining_preface:
+        sections.append(remaining_preface.strip())
+    sections.extend(imports)
+    sections.append("")  # Add a blank line after imports
+
+    # Join sections, ensuring appropriate newlines
+    return "\n".join(filter(None, sections)) + "\n" + "\n"
+
+
+def _docstring_reads_back(docstring: Optional[str]) -> bool:
+    """Whether a docstring written between triple quotes parses back unchanged, on as many lines."""
+    if not docstring:
+        return True
+    return ('\\' not in docstring and '"""' not in docstring and not docstring.endswith('"')
+            and code_manipulation.CALL_PLACEHOLDER not in docstring and docstring.splitlines() == docstring.split('\n'))
+
+
+class PromptRenderer:
+    """Renders prompts from sampled programs with cached prefaces and tokenized programs."""
+
+    def __init__(self, function_to_evolve: str, q_description: str, include_nx: bool = True,
+                 max_cached_functions: int = 10_000):
+        self._function_to_evolve = function_to_evolve
+        self.q_description = q_description
+        self.include_nx = include_nx
+        self.max_cached_functions = max_cached_functions
+        self._prefaces = {}
+        self._functions = collections.OrderedDict()  # (args, return_type, body) -> parts or None
+        self.hits = 0
+        self.misses = 0
+        self.parsed_renders = 0
+
+    def preface(self, template_preface: str) -> str:
+        """Cleaned preface of a template, built at its first prompt."""
+        preface = self._prefaces.get(template_preface)
+        if preface is None:
+            preface = self._prefaces[template_preface] = clean_preface(
+                template_preface, self.q_description, self.include_nx)
+        return preface
+
+    def render_prompt(self, template_preface: str, functions: Sequence[str]) -> str:
+        """Prompt text of rendered functions, as `str()` of the template with these functions."""
+        preface = self.preface(template_preface)
+        prompt = f'{preface}\n' if preface else ''
+        return prompt + '\n'.join(functions)
+
+    def render_function(self, function: code_manipulation.Function, version: int,
+                        docstring: Optional[str]) -> str:
+        """
+        Text of `function` as version `version` of the evolved function with `docstring`: what
+        `text_to_function` returns for it once its calls of the evolved function are renamed.
+        Raises if the function cannot be parsed.
+        """
+        name = f'{self._function_to_evolve}_v{version}'
+        parts = self._function_parts(function) if _docstring_reads_back(docstring) else None
+        if parts is None or (docstring and not parts[3]):
+            return str(self.parse_function(function, name, docstring))
+        args, return_type, body_parts, _ = parts
+        return_type_str = f' -> {return_type}' if return_type else ''
+        docstring_str = f'    """  {docstring}"""' if docstring else ''
+        return f'def {name}({args}){return_type_str}:\n{docstring_str}\n{name.join(body_parts)}\n'
+
+    def render_header(self, function: code_manipulation.Function, version: int, docstring: str) -> str:
+        """Header of the version to be written, with the signature of `function` as sampled."""
+        return str(dataclasses.replace(function, name=f'{self._function_to_evolve}_v{version}',
+                                       body='', docstring=docstring))
+
+    def parse_function(self, function: code_manipulation.Function, name: str,
+                       docstring: Optional[str]) -> code_manipulation.Function:
+        """Renames `function` to `name` (and its calls of the evolved function) and parses it."""
+        self.parsed_renders += 1
+        implementation = dataclasses.replace(function, name=name, docstring=docstring)
+        implementation_str = code_manipulation.rename_function_calls(
+            str(implementation), self._function_to_evolve, name
+        )
+        return code_manipulation.text_to_function(implementation_str)
+
+    def _function_parts(self, function: code_manipulation.Function) -> Optional[tuple]:
+        if self.max_cached_functions <= 0:
+            return None
+        key = (function.args, function.return_type, function.body)
+        if key in self._functions:
+            self.hits += 1
+            self._functions.move_to_end(key)
+            return self._functions[key]
+        self.misses += 1
+        try:
+            parts = self._split_function(*key)
+        except Exception as e:
+            # Rendered by parsing, which logs the error if the program cannot be used
+            logger.debug(f"PromptRenderer: Cannot split program for rendering: {e}")
+            parts = None
+        self._functions[key] = parts
+        if len(self._functions) > self.max_cached_functions:
+            self._functions.popitem(last=False)
+        return parts
+
+    def _split_function(self, args: str, return_type: Optional[str], body: str) -> Optional[tuple]:
+        """
+        (args, return type, body parts, whether it parses with a docstring) of a program as
+        `text_to_function` reads back its renamed text, or None if the program has to be rendered
+        by parsing.
+        """
+        # Written without docstring (its line stays empty) under a name that is no call to rename
+        text = str(code_manipulation.Function(
+            name=f'{self._function_to_evolve}_v', args=args, body=body, return_type=return_type))
+        tree = ast.parse(text)
+        if len(tree.body) != 1 or not isinstance(tree.body[0], ast.FunctionDef):
+            return None
+        node = tree.body[0]
+        first = node.body[0]
+        if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+            # Read back as the docstring when the version has none
+            return None
+
+        # Body parts are cut into lines while joined by the placeholder of the calls
+        marker = code_manipulation.CALL_PLACEHOLDER
+        marked = marker.join(code_manipulation.split_at_function_calls(text, self._function_to_evolve))
+        lines = text.splitlines()
+        marked_lines = marked.splitlines()
+        body_start = first.lineno - 1
+        if len(marked_lines) != len(lines) or any(marker in line for line in marked_lines[:body_start]):
+            return None
+        body_parts = "\n".join(marked_lines[body_start:node.end_lineno]).split(marker)
+
+        # A docstring line is indented by four spaces, which e.g. a body indented by tabs contradicts
+        try:
+            ast.parse(str(code_manipulation.Function(
+                name=f'{self._function_to_evolve}_v', args=args, body=body, return_type=return_type, docstring='_')))
+            parses_with_docstring = True
+        except SyntaxError:
+            parses_with_docstring = False
+        return (ast.unparse(node.args), ast.unparse(node.returns) if node.returns else None,
+                tuple(body_parts), parses_with_docstring)
+
+    def stats(self) -> dict:
+        return {
+            "cached_functions": len(self._functions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "parsed_renders": self.parsed_renders,
+        }
+
+
+class PromptCache:
+    """
+    Rendered prompts keyed by the ordered ids of their sampled programs, least recently used
+    evicted first. A program never changes after registration and its id is never reused, so an
+    entry stays valid until its programs are removed (`invalidate`, on island resets).
+    `max_size=0` disables the cache.
+    """
+
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        self._prompts = collections.OrderedDict()  # program ids -> (prompt, flag_duplicate)
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def get(self, program_ids: tuple) -> Optional[tuple]:
+        entry = self._prompts.get(program_ids)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._prompts.move_to_end(program_ids)
+        return entry
+
+    def put(self, program_ids: tuple, prompt: str, flag_duplicate: bool):
+        if self.max_size <= 0:
+            return
+        self._prompts[program_ids] = (prompt, flag_duplicate)
+        if len(self._prompts) > self.max_size:
+            self._prompts.popitem(last=False)
+
+    def invalidate(self, program_ids):
+        """Drops the prompts that show any of `program_ids`."""
+        program_ids = set(program_ids)
+        stale = [key for key in self._prompts if not program_ids.isdisjoint(key)]
+        for key in stale:
+            del self._prompts[key]
+        self.invalidated += len(stale)
+
+    def clear(self):
+        self.invalidated += len(self._prompts)
+        self._prompts.clear()
+
+    def __len__(self):
+        return len(self._prompts)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,107 @@
+"""Client-side rate limiting for API samplers.
+
+Azure OpenAI deployments have a quota in requests per minute (RPM) and tokens per minute (TPM), and
+answer requests beyond it with HTTP 429. The quota is enforced over short windows (1 or 10 seconds)
+rather than over a full minute, so `RateLimiter` keeps a sampler below both limits with two token
+buckets that hold the quota of one `window` and refill continuously at the per-minute rate:
+
+* `acquire(tokens)` waits until one request and `tokens` tokens are available. The tokens of a
+  request are not known before it completes, so the caller passes an estimate (prompt plus
+  `max_tokens` per choice, which is also how the service counts them against the quota) and
+  corrects it with `settle(estimate, actual)` once the usage is known.
+* `pause(seconds)` blocks all acquisitions after a 429, so that the concurrent requests of the
+  sampler back off together instead of each of them hitting the limit again.
+
+`backoff_delay` gives the exponential backoff (with full jitter) between retries of a request,
+honoring the server's `retry-after` hint when there is one.
+
+A limit of None disables the corresponding bucket.
+"""
+
+import asyncio
+import random
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Bucket of `capacity` units that refills at `capacity` units per `period` seconds."""
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if they are). Amounts above capacity wait for a full bucket."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def give(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits shared by the concurrent requests of a sampler."""
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None,
+                 window: float = 10.0):
+        # Burst capacity is the quota of one window; the buckets refill at the per-minute rate
+        self.requests = TokenBucket(requests_per_minute * window / 60, window) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute * window / 60, window) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.wait_time = 0.0
+
+    async def acquire(self, tokens: int = 0):
+        """Waits until a request with an estimated `tokens` tokens fits into both limits, and takes it."""
+        start = time.monotonic()
+        # Requests acquire one at a time, in arrival order
+        async with self._lock:
+            while True:
+                delay = self.paused_until - time.monotonic()
+                if self.requests is not None:
+                    delay = max(delay, self.requests.delay(1))
+                if self.tokens is not None:
+                    delay = max(delay, self.tokens.delay(tokens))
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+        self.wait_time += time.monotonic() - start
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Returns unused tokens of an estimate to the bucket (or takes the excess)."""
+        if self.tokens is None:
+            return
+        if actual_tokens < estimated_tokens:
+            self.tokens.give(estimated_tokens - actual_tokens)
+        else:
+            self.tokens.take(actual_tokens - estimated_tokens)
+
+    def pause(self, seconds: float):
+        """Blocks acquisitions for `seconds` (e.g. after a 429)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def backoff_delay(attempt: int, base: float = 1.0, maximum: float = 60.0, retry_after: Optional[float] = None) -> float:
+    """Delay before retry `attempt` (0-based): full jitter over base * 2**attempt, at least `retry_after`."""
+    delay = random.uniform(0, min(maximum, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(maximum, retry_after))
+    return delay
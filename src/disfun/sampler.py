@@ -20,6 +20,13 @@ Differences from the original DeepMind FunSearch version
 * Implements placeholder to inferences LLM (StarCoder-2 15B).
 * Dynamic batching based on message load. Messages are collected for up to 10 milliseconds;
   if at least 10 prompts arrive within that window we batch 10, otherwise we batch the smaller number that arrived.
+* Inference runs on a dedicated thread behind a bounded queue (`inference_queue_size` batches).
+  While batch N generates, the event loop acks, parses and tokenizes batch N+1, publishes the
+  samples of batch N-1 and keeps the RabbitMQ heartbeats going.
+* With `generation_engine="continuous"` there are no fixed batches: prompts join a running
+  `ContinuousBatchingEngine` as soon as they arrive and rows free up, finished sequences leave the
+  batch at every step, and each prompt is published when its samples are done. Token counts are
+  then exact (no padding) and tokens/sec and the GPU-idle fraction are logged periodically.
 * Dynamically adjusts the sampling temperature based on how many programs
   have been stored. Encourages exploration early (higher temperature) and
   shifts toward exploitation (greedy decoding) after a configurable number
@@ -30,6 +37,22 @@ Differences from the original DeepMind FunSearch version
   to ensure accurate resource tracking.
 * CPU/GPU fallback: if CUDA is unavailable the model logs a warning
   and runs on CPU rather than crashing.
+* Batched generation: all `samples_per_prompt` samples of a batch are drawn in a single
+  `generate` call instead of one call per sample (`batched_generation`, default on). Each prompt
+  is prefilled once and its KV cache repeated for its samples, so `generate` only continues from
+  the last prompt token; greedy decoding runs once per prompt and repeats the result. Outputs are
+  grouped per prompt and token counts are reported exactly as with the per-sample loop.
+* Prefix caching: the KV state of the specification preface that all prompts start with is
+  computed once and reused across prompts and batches (`PrefixKVCache`, `prefix_caching`, default
+  on), so only the versioned functions of each prompt are prefilled.
+* Early stopping: each sequence ends as soon as the body of the evolved function is complete
+  (a line at column 0 after it, e.g. the next `def`), since the evaluator discards the rest
+  (`stop_at_function_end`, default on). Saved tokens are counted and logged.
+* Pluggable backends: `LLM_model` implements the `LLMBackend` interface, and `llm_backend="mock"`
+  replaces it with `MockBackend` (replayed or mutated function bodies after a fixed latency) to run
+  the pipeline without a GPU. The mock only supports the static engine.
+* Samples are published through a `process_utils.BufferedPublisher`, which sends them in batches
+  with one round of publisher confirms per batch and flushes the buffer when the sampler stops.
 * When a prompt is flagged as functionally identical to a previous one, all samples
   are logged to `duplicate_samples.txt` for manual inspection and debugging.
 """
@@ -40,19 +63,27 @@ import os
 import json
 import logging
 import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, StoppingCriteriaList
 import aio_pika
 import numpy as np
 
-from disfun import programs_database
+from disfun import message_codec, process_utils, programs_database
+from disfun.continuous_batching import ContinuousBatchingEngine, GenerationRequest
+from disfun.early_stopping import FunctionEndCriteria, TokenTexts
+from disfun.llm_backends import LLMBackend, create_backend
+from disfun.prefix_cache import PrefixKVCache, build_cache, move_padding_after_prefix, unpadded_sequences
 from disfun.profiling import async_time_execution
 
 logger = logging.getLogger('main_logger')
 
 
-class LLM_model:
+class LLM_model(LLMBackend):
     """Language model that generates continuation of provided source code."""
     
     def __init__(
@@ -64,15 +95,21 @@ class LLM_model:
             max_new_tokens,
             device="cuda",   # can be "cuda", None, "cpu", "cuda:0", etc.
             checkpoint="bigcode/starcoder2-15b",
+            batched_generation=True,
+            prefix_caching=True,
+            stop_at_function_end=True,
     ) -> None:
         self.gpu_time = 0.0
         self._samples_per_prompt = samples_per_prompt
+        self.batched_generation = batched_generation
         self.temperature = temperature
         self.top_p = top_p
         self.repetition_penalty = repetition_penalty
         self.max_new_tokens = max_new_tokens
         self.checkpoint = checkpoint
         self.previous_total_registered_programs = 0
+        # The tokenizer is used from the event loop (encoding) and the inference thread (decoding)
+        self.tokenizer_lock = threading.Lock()
 
         # Set cache directory and environment variable
         try:
@@ -154,6 +191,12 @@ class LLM_model:
             "repetition_penalty": self.repetition_penalty,
             "do_sample": True,
         }
+        # KV state of the specification preface, reused across prompts and batches
+        self.prefix_cache = PrefixKVCache(self.model) if prefix_caching else None
+        # Ends each sequence once the evolved function body is complete
+        self.token_texts = TokenTexts(self.tokenizer, self.tokenizer_lock) if stop_at_function_end else None
+        self.stopped_sequences = 0
+        self.saved_tokens = 0
 
     def adjust_temperature(self, total_registered_programs: int, temperature_period: int):
         if temperature_period is not None:
@@ -175,12 +218,46 @@ class LLM_model:
                 f"based on {total_registered_programs} registered programs."
             )
 
+    def encode_prompts(self, prompts: List[str]):
+        """
+        Tokenizes a batch of prompts, left-padded and on CPU.
+
+        Returns:
+            (inputs, input_token_counts) to be passed to `generate_samples`
+        """
+        with self.tokenizer_lock:
+            self.tokenizer.padding_side = 'left'
+            inputs = self.tokenizer(
+                prompts,
+                return_tensors="pt",
+                padding=True,
+                truncation=False
+            )
+        input_token_counts = [len(ids) for ids in inputs["input_ids"]]
+        return dict(inputs), input_token_counts
+
     def draw_batch_samples(
             self,
             prompts: List[str],
             total_registered_programs: int = 0,
             temperature_period: int = 10000
     ) -> List[List[str]]:
+        try:
+            # Tokenize once for the whole batch (on CPU by default)
+            inputs, input_token_counts = self.encode_prompts(prompts)
+        except Exception as e:
+            logger.error(f"Error during batch generation: {e}")
+            return [], [], []
+        return self.generate_samples(inputs, input_token_counts, total_registered_programs, temperature_period)
+
+    def generate_samples(
+            self,
+            inputs,
+            input_token_counts: List[int],
+            total_registered_programs: int = 0,
+            temperature_period: int = 10000
+    ) -> List[List[str]]:
+        """Generates samples_per_prompt samples for each prompt of a batch encoded by `encode_prompts`."""
         if temperature_period is not None:
             try:
                 self.adjust_temperature(total_registered_programs, temperature_period)
@@ -188,58 +265,35 @@ class LLM_model:
                 logger.error(f"Error adjusting temperature: {e}")
 
         try:
-            self.tokenizer.padding_side = 'left'
-            # Tokenize once for the whole batch (on CPU by default)
-            inputs = self.tokenizer(
-                prompts,
-                return_tensors="pt",
-                padding=True,
-                truncation=False
-            )
-
             inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
 
-            input_token_counts = [len(ids) for ids in inputs["input_ids"]]
-
-
             input_length = inputs["input_ids"].shape[1]
             logger.info(f"LLM: input dims {inputs['input_ids'].shape}")
 
-            all_samples = []
-            start_event = torch.cuda.Event(enable_timing=True)
-            end_event = torch.cuda.Event(enable_timing=True)
-            start_event.record()
-
-            all_output_token_counts = []
-
-            for _ in range(self._samples_per_prompt):
-                try:
-                    outputs = self.model.generate(
-                        **inputs,
-                        **self.generate_kwargs,
-                        pad_token_id=self.tokenizer.eos_token_id
-                    )
-                except Exception as e:
-                    logger.error(f"Generation failed: {e}")
-                    continue
-
-                logger.debug(f"LLM: output dims {outputs.shape}")
-                try:
-                    generated_tokens = outputs[:, input_length:]
-                    decoded_texts = self.tokenizer.batch_decode(
-                        generated_tokens,
-                        skip_special_tokens=True
-                    )
-                    all_samples.append(decoded_texts)
-                except Exception as e:
-                    logger.error(f"Decoding failed: {e}")
+            use_cuda_events = torch.cuda.is_available()
+            if use_cuda_events:
+                start_event = torch.cuda.Event(enable_timing=True)
+                end_event = torch.cuda.Event(enable_timing=True)
+                start_event.record()
+            else:
+                start_time = time.perf_counter()
 
-                all_output_token_counts.append([t.numel() for t in generated_tokens])        
+            saved_tokens = self.saved_tokens
+            if self.batched_generation:
+                all_samples, all_output_token_counts = self._generate_batched(inputs, input_length)
+            else:
+                all_samples, all_output_token_counts = self._generate_loop(inputs, input_length)
 
-            end_event.record()
-            torch.cuda.synchronize()
-            self.gpu_time = start_event.elapsed_time(end_event) / 1000.0
+            if use_cuda_events:
+                end_event.record()
+                torch.cuda.synchronize()
+                self.gpu_time = start_event.elapsed_time(end_event) / 1000.0
+            else:
+                self.gpu_time = time.perf_counter() - start_time
             logger.debug(f"GPU sampling time: {self.gpu_time:.2f} sec")
+            if self.saved_tokens > saved_tokens:
+                logger.info(f"LLM: early stop saved {self.saved_tokens - saved_tokens} tokens "
+                            f"(total {self.saved_tokens} tokens, {self.stopped_sequences} sequences)")
             # Transpose so outer index = prompt
             output_token_counts = list(map(list, zip(*all_output_token_counts)))
 
@@ -251,6 +305,174 @@ class LLM_model:
             logger.error(f"Error during batch generation: {e}")
             return [], [], []
 
+    def _generate_loop(self, inputs, input_length):
+        """
+        One `generate` call per sample over the whole batch.
+
+        Returns:
+            (all_samples, all_output_token_counts): one list per generate call with one entry per prompt
+        """
+        all_samples = []
+        all_output_token_counts = []
+
+        for _ in range(self._samples_per_prompt):
+            criteria = self._function_end_criteria()
+            try:
+                outputs = self.model.generate(
+                    **inputs,
+                    **self.generate_kwargs,
+                    **self._stopping_kwargs(criteria),
+                    pad_token_id=self.tokenizer.eos_token_id
+                )
+            except Exception as e:
+                logger.error(f"Generation failed: {e}")
+                continue
+            self._record_early_stop(criteria)
+
+            logger.debug(f"LLM: output dims {outputs.shape}")
+            try:
+                generated_tokens = outputs[:, input_length:]
+                with self.tokenizer_lock:
+                    decoded_texts = self.tokenizer.batch_decode(
+                        generated_tokens,
+                        skip_special_tokens=True
+                    )
+                all_samples.append(decoded_texts)
+            except Exception as e:
+                logger.error(f"Decoding failed: {e}")
+
+            all_output_token_counts.append([t.numel() for t in generated_tokens])
+
+        return all_samples, all_output_token_counts
+
+    def _prefill_prompts(self, inputs, k, prefix_length=0, prefix=None):
+        """
+        Runs the prompts once, without their last token, and returns the KV cache repeated k times
+        per prompt. `generate` continues from it with only the last prompt token left to process,
+        so the prompt of the k samples is encoded once instead of k times.
+
+        With a cached `prefix` (laid out by `move_padding_after_prefix`), only the columns after the
+        first `prefix_length` are run, on top of a copy of the prefix KV state.
+        """
+        input_ids, attention_mask = inputs["input_ids"], inputs["attention_mask"]
+        # Positions of the padded rows as `generate` computes them
+        position_ids = attention_mask.long().cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+        cache = build_cache(prefix, input_ids.shape[0]) if prefix is not None else DynamicCache()
+        if input_ids.shape[1] - 1 > prefix_length:
+            with torch.no_grad():
+                cache = self.model(
+                    input_ids=input_ids[:, prefix_length:-1],
+                    attention_mask=attention_mask[:, :-1],
+                    position_ids=position_ids[:, prefix_length:-1],
+                    past_key_values=cache,
+                    use_cache=True,
+                ).past_key_values
+        if k > 1:
+            cache.batch_repeat_interleave(k)
+        return cache
+
+    def _lookup_prefix(self, inputs):
+        """Cached prompt prefix for the batch: (inputs re-laid out around the prefix, prefix_length, prefix)."""
+        if self.prefix_cache is None:
+            return inputs, 0, None
+        try:
+            prefix_length, prefix = self.prefix_cache.lookup(
+                unpadded_sequences(inputs["input_ids"], inputs["attention_mask"]))
+        except Exception as e:
+            logger.error(f"Prefix cache lookup failed: {e}")
+            return inputs, 0, None
+        if prefix is None:
+            return inputs, 0, None
+        input_ids, attention_mask = move_padding_after_prefix(inputs["input_ids"], inputs["attention_mask"], prefix_length)
+        logger.debug(f"LLM: reusing cached prefix of {prefix_length} tokens")
+        return {**inputs, "input_ids": input_ids, "attention_mask": attention_mask}, prefix_length, prefix
+
+    def _generate_batched(self, inputs, input_length):
+        """
+        A single `generate` call for all samples of the batch. Returns the same layout as
+        `_generate_loop`.
+
+        With sampling, the prompts are prefilled once (`_prefill_prompts`) and each row is repeated
+        k = samples_per_prompt times, so generate samples k continuations per prompt from the shared
+        KV cache (as `num_return_sequences=k` would, without re-encoding the prompt k times).
+        Greedy decoding gives k identical samples, so it is run once and repeated. A prompt prefix
+        shared with earlier batches (the specification preface) is taken from `prefix_cache`
+        instead of being prefilled again.
+
+        Output rows are ordered prompt-major (row i * k + j is sample j of prompt i). In the loop,
+        sample j of every prompt comes from the same call and is padded to the longest row of that
+        call, so its token count is the longest generation among the j-th samples of all prompts.
+        The same count is reconstructed here from the unpadded row lengths.
+        """
+        k = self._samples_per_prompt
+        sampling = self.generate_kwargs.get("do_sample", True)
+        repeats = k if sampling else 1
+        criteria = self._function_end_criteria()
+        try:
+            inputs, prefix_length, prefix = self._lookup_prefix(inputs)
+            if input_length > 1 and (prefix is not None or repeats > 1):
+                cache = self._prefill_prompts(inputs, repeats, prefix_length, prefix)
+                outputs = self.model.generate(
+                    **{name: tensor.repeat_interleave(repeats, dim=0) for name, tensor in inputs.items()},
+                    **self.generate_kwargs,
+                    **self._stopping_kwargs(criteria),
+                    past_key_values=cache,
+                    pad_token_id=self.tokenizer.eos_token_id
+                )
+            else:
+                outputs = self.model.generate(
+                    **inputs,
+                    **self.generate_kwargs,
+                    **self._stopping_kwargs(criteria),
+                    pad_token_id=self.tokenizer.eos_token_id
+                )
+            outputs = outputs.repeat_interleave(k // repeats, dim=0)
+            self._record_early_stop(criteria, copies=k // repeats)
+        except Exception as e:
+            logger.error(f"Generation failed: {e}")
+            return [], []
+
+        logger.debug(f"LLM: output dims {outputs.shape}")
+        generated_tokens = outputs[:, input_length:]
+        num_prompts = generated_tokens.shape[0] // k
+
+        # Generated length of each row: up to and including the first EOS (padding is EOS as well)
+        is_eos = generated_tokens == self.tokenizer.eos_token_id
+        has_eos = is_eos.any(dim=1)
+        row_lengths = torch.full((generated_tokens.shape[0],), generated_tokens.shape[1], dtype=torch.long)
+        row_lengths[has_eos.cpu()] = is_eos[has_eos].int().argmax(dim=1).cpu() + 1
+        sample_lengths = row_lengths.view(num_prompts, k).max(dim=0).values.tolist()
+
+        try:
+            with self.tokenizer_lock:
+                decoded_texts = self.tokenizer.batch_decode(
+                    generated_tokens,
+                    skip_special_tokens=True
+                )
+        except Exception as e:
+            logger.error(f"Decoding failed: {e}")
+            return [], []
+
+        all_samples = [decoded_texts[j::k] for j in range(k)]
+        all_output_token_counts = [[sample_lengths[j]] * num_prompts for j in range(k)]
+        return all_samples, all_output_token_counts
+
+    def _function_end_criteria(self):
+        if self.token_texts is None:
+            return None
+        return FunctionEndCriteria(self.token_texts, self.generate_kwargs["max_new_tokens"])
+
+    @staticmethod
+    def _stopping_kwargs(criteria):
+        return {"stopping_criteria": StoppingCriteriaList([criteria])} if criteria is not None else {}
+
+    def _record_early_stop(self, criteria, copies=1):
+        """Adds the sequences ended by `criteria` and the tokens they did not generate to the totals."""
+        if criteria is not None:
+            self.stopped_sequences += criteria.stopped_sequences * copies
+            self.saved_tokens += criteria.saved_tokens * copies
+
     def cleanup(self):
         """Release GPU memory and clean up model resources."""
         try:
@@ -268,33 +490,56 @@ class LLM_model:
 
 class Sampler:
     """Node that samples program continuations and sends them for analysis."""
-    def __init__(self, connection, channel, sampler_queue, evaluator_queue, config, device):
+    def __init__(self, connection, channel, sampler_queue, evaluator_queue, config, device, codec=None, publisher=None):
         self.device = device
         self.connection = connection
         self.channel = channel
         self.sampler_queue = sampler_queue
         self.evaluator_queue = evaluator_queue
+        self.codec = codec or message_codec.MessageCodec()
+        self.publisher = publisher or process_utils.BufferedPublisher(channel)
         self._config = config
         self.temperature_period = self._config.temperature_period
         self.samples_per_prompt = self._config.samples_per_prompt
         self.samples_per_batch = self._config.prompts_per_batch
+        self.inference_queue_size = max(1, getattr(self._config, 'inference_queue_size', 1))
+        self.generation_engine = getattr(self._config, 'generation_engine', 'static')
+        self.max_active_sequences = max(self.samples_per_prompt, getattr(self._config, 'max_active_sequences', 20))
+        if self.generation_engine not in ("static", "continuous"):
+            logger.warning(f"Unknown generation_engine '{self.generation_engine}', using 'static'.")
+            self.generation_engine = "static"
+        # Generation runs on this thread so the event loop keeps acking, prefetching and publishing
+        self.inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sampler_inference")
 
         try:
-            self._llm = LLM_model(
+            self._llm = create_backend(self._config, lambda: LLM_model(
                 samples_per_prompt=self.samples_per_prompt,
                 temperature=self._config.temperature,
                 top_p=self._config.top_p,
                 repetition_penalty=self._config.repetition_penalty,
                 max_new_tokens=self._config.max_new_tokens,
                 device=self.device,   # Could be "cuda", None, "cpu", or "cuda:0"
-                checkpoint="bigcode/starcoder2-15b"
-            )
+                checkpoint="bigcode/starcoder2-15b",
+                batched_generation=getattr(self._config, 'batched_generation', True),
+                prefix_caching=getattr(self._config, 'prefix_caching', True),
+                stop_at_function_end=getattr(self._config, 'stop_at_function_end', True),
+            ))
         except Exception as e:
             logger.error(f"Error initializing LLM: {e}")
             # Optionally raise
+        if self.generation_engine == "continuous" and not isinstance(getattr(self, '_llm', None), LLM_model):
+            # The engine decodes with the model directly
+            logger.warning("generation_engine 'continuous' needs the local model, using 'static'.")
+            self.generation_engine = "static"
 
     async def consume_and_process(self) -> None:
-        from disfun import process_utils
+        if self.generation_engine == "continuous":
+            await self._consume_and_process_continuous()
+            return
+
+        # Batches that are parsed and tokenized wait here while the previous batch generates
+        inference_queue = asyncio.Queue(maxsize=self.inference_queue_size)
+        inference_task = asyncio.create_task(self._inference_loop(inference_queue))
 
         async def _consume_loop():
             """Inner consume loop - will be wrapped with reconnection logic."""
@@ -313,33 +558,207 @@ class Sampler:
                     current_time = asyncio.get_event_loop().time()
                     # If we hit batch size or time threshold, process the batch
                     if (len(batch) >= self.samples_per_batch or (current_time - batch_start_time) > batch_timeout):
-                        await self.process_batch_s(batch)
+                        prepared = await self.prepare_batch(batch)
+                        if prepared is not None:
+                            # Blocks while the inference queue is full
+                            await inference_queue.put(prepared)
                         batch = []
                         batch_start_time = asyncio.get_event_loop().time()
 
         # Wrap consume loop with automatic reconnection
-        await process_utils.with_reconnection(
-            _consume_loop,
-            logger,
-            component_name=f"Sampler on device {self.device}"
+        try:
+            await process_utils.with_reconnection(
+                _consume_loop,
+                logger,
+                component_name=f"Sampler on device {self.device}"
+            )
+        finally:
+            inference_task.cancel()
+            await asyncio.gather(inference_task, return_exceptions=True)
+            await self._close_publisher()
+
+    async def _inference_loop(self, inference_queue: asyncio.Queue):
+        """
+        Generates the prepared batches one at a time on the inference thread. Publishing of a
+        batch runs as a separate task, so it overlaps with the generation of the next batch.
+        """
+        loop = asyncio.get_running_loop()
+        publishing = set()
+        try:
+            while True:
+                prepared = await inference_queue.get()
+                try:
+                    samples_list, input_token_counts, output_token_counts, gpu_time = await loop.run_in_executor(
+                        self.inference_executor, self._generate, prepared)
+                except Exception as e:
+                    logger.error(f"LLM sampling failed: {e}")
+                    continue
+
+                task = asyncio.create_task(self.publish_samples(
+                    samples_list, input_token_counts, output_token_counts, gpu_time,
+                    prepared["metadata"], prepared["flags"]))
+                publishing.add(task)
+                task.add_done_callback(publishing.discard)
+        finally:
+            if publishing:
+                await asyncio.gather(*publishing, return_exceptions=True)
+
+    async def _consume_and_process_continuous(self) -> None:
+        """
+        Consume loop of `generation_engine="continuous"`: every message is tokenized and handed to a
+        ContinuousBatchingEngine on the inference thread as soon as it arrives, and the samples of a
+        prompt are published as soon as all of them are finished.
+        """
+        loop = asyncio.get_running_loop()
+        engine = ContinuousBatchingEngine(
+            self._llm.model,
+            self._llm.tokenizer.eos_token_id,
+            max_batch_size=self.max_active_sequences,
+            max_new_tokens=self._llm.max_new_tokens,
+            prefix_cache=self._llm.prefix_cache,
+            token_texts=self._llm.token_texts,
         )
+        inbox = queue.Queue()
+        stop = threading.Event()
+        # Prompts in the engine (running or waiting); the rest stays in the broker
+        slots = asyncio.Semaphore(self.max_active_sequences // self.samples_per_prompt + self.samples_per_batch)
+        publishing = set()
+
+        def on_finished(prepared, samples, output_token_counts, gpu_time):
+            slots.release()
+            task = asyncio.create_task(self.publish_samples(
+                [samples], prepared["input_token_counts"], [output_token_counts], gpu_time,
+                prepared["metadata"], prepared["flags"]))
+            publishing.add(task)
+            task.add_done_callback(publishing.discard)
+
+        def on_dropped(prepared):
+            # The message is already acknowledged; the prompt is lost as with a failed static batch
+            slots.release()
+
+        engine_future = loop.run_in_executor(
+            self.inference_executor, self._run_engine, engine, inbox, stop, loop, on_finished, on_dropped)
+
+        async def _consume_loop():
+            """Inner consume loop - will be wrapped with reconnection logic."""
+            await self.channel.set_qos(prefetch_count=10)
+            logger.info(f"Sampler on device {self.device}: Starting continuous batching consumer...")
+            async with self.sampler_queue.iterator() as stream:
+                async for message in stream:
+                    await slots.acquire()
+                    prepared = await self.prepare_batch([message])
+                    if prepared is None:
+                        slots.release()
+                        continue
+                    inbox.put(prepared)
 
-    async def process_batch_s(self, batch: List[aio_pika.IncomingMessage]):
+        try:
+            await process_utils.with_reconnection(
+                _consume_loop,
+                logger,
+                component_name=f"Sampler on device {self.device}"
+            )
+        finally:
+            stop.set()
+            await asyncio.gather(engine_future, return_exceptions=True)
+            if publishing:
+                await asyncio.gather(*publishing, return_exceptions=True)
+            await self._close_publisher()
+
+    async def _close_publisher(self):
+        """Sends the samples still buffered in the publisher before the channel closes."""
+        try:
+            await self.publisher.close()
+            logger.info(f"Sampler on device {self.device}: publisher {self.publisher.stats()}")
+        except Exception as e:
+            logger.error(f"Sampler on device {self.device}: Error flushing publisher: {e}")
+
+    def _run_engine(self, engine, inbox, stop, loop, on_finished, on_dropped):
+        """
+        Runs on the inference thread: admits new prompts, steps the engine and hands back finished
+        prompts. Prompts whose generation failed are handed to `on_dropped`.
+        """
+        last_report = time.perf_counter()
+        while not stop.is_set():
+            try:
+                # Block briefly only when there is nothing to decode
+                prepared = inbox.get(timeout=0.1) if not engine.has_work() else inbox.get_nowait()
+                while True:
+                    try:
+                        if self.temperature_period is not None:
+                            self._llm.adjust_temperature(prepared["total_registered_programs"], self.temperature_period)
+                        engine.add_request(GenerationRequest(
+                            request_id=id(prepared),
+                            input_ids=prepared["inputs"]["input_ids"][0].tolist(),
+                            num_samples=self.samples_per_prompt,
+                            generate_kwargs=self._llm.generate_kwargs,
+                            payload=prepared,
+                        ))
+                    except Exception as e:
+                        logger.error(f"Sampler on device {self.device}: Dropping prompt that could not be admitted: {e}")
+                        loop.call_soon_threadsafe(on_dropped, prepared)
+                    prepared = inbox.get_nowait()
+            except queue.Empty:
+                pass
+
+            try:
+                finished = engine.step()
+            except Exception as e:
+                logger.error(f"Continuous batching step failed: {e}")
+                finished = engine.abort(e)
+
+            for request in finished:
+                if request.error is not None:
+                    logger.error(f"Sampler on device {self.device}: Dropping prompt after failed generation: {request.error}")
+                    loop.call_soon_threadsafe(on_dropped, request.payload)
+                    continue
+                with self._llm.tokenizer_lock:
+                    samples = self._llm.tokenizer.batch_decode(request.samples, skip_special_tokens=True)
+                output_token_counts = [len(sample) for sample in request.samples]
+                loop.call_soon_threadsafe(on_finished, request.payload, samples, output_token_counts, request.gpu_time)
+
+            if time.perf_counter() - last_report > 60:
+                stats = engine.stats()
+                logger.info(
+                    f"Sampler on device {self.device}: {stats['tokens_per_sec']:.1f} tokens/sec, "
+                    f"GPU idle {stats['gpu_idle_fraction']:.1%}, {stats['active_sequences']} active sequences, "
+                    f"{stats['waiting_requests']} waiting prompts, early stop saved {stats['saved_tokens']} tokens"
+                )
+                if self._llm.prefix_cache is not None:
+                    logger.info(f"Sampler on device {self.device}: prefix cache {self._llm.prefix_cache.stats()}")
+                last_report = time.perf_counter()
+
+    def _generate(self, prepared):
+        """Runs on the inference thread. Returns the samples, token counts and GPU time of a batch."""
+        samples_list, input_token_counts, output_token_counts = self._llm.generate_samples(
+            prepared["inputs"], prepared["input_token_counts"],
+            prepared["total_registered_programs"], self.temperature_period)
+        return samples_list, input_token_counts, output_token_counts, self._llm.gpu_time
+
+    async def prepare_batch(self, batch: List[aio_pika.IncomingMessage]):
+        """
+        Parses and acknowledges the messages of a batch and tokenizes their prompts.
+
+        Returns:
+            dict with the encoded inputs, token counts, metadata and flags, or None if the batch
+            has no valid prompts
+        """
         prompts = []
         metadata = []
         flags = []
+        total_registered_programs = 0
         for message in batch:
             try:
                 async with message.process():
-                    data = json.loads(message.body.decode())
+                    data = self.codec.decode(message)
                     prompt_data = data["prompt"]
                     total_registered_programs = data.get("total_registered_programs", 0)
                     flag = data.get("flag", False) # sampler gets from database a flag if prompt has few shot examples thar are functionally identically
-                    flags.append(flag)
                     prompt = programs_database.Prompt.deserialize(prompt_data)
 
                     if prompt.code is not None:
                         prompts.append(prompt.code)
+                        flags.append(flag)
                         metadata.append({
                             "island_id": prompt.island_id,
                             "version_generated": prompt.version_generated,
@@ -356,16 +775,24 @@ class Sampler:
 
         if not prompts:
             logger.warning("No valid prompts in batch; skipping processing.")
-            return
+            return None
 
-        # Get the completions from the LLM
         try:
-            samples_list, input_token_counts, output_token_counts = self._llm.draw_batch_samples(prompts, total_registered_programs, self.temperature_period)
-            gpu_time = self._llm.gpu_time
+            inputs, input_token_counts = self._llm.encode_prompts(prompts)
         except Exception as e:
-            logger.error(f"LLM sampling failed: {e}")
-            return
+            logger.error(f"Error tokenizing batch: {e}")
+            return None
+
+        return {
+            "inputs": inputs,
+            "input_token_counts": input_token_counts,
+            "total_registered_programs": total_registered_programs,
+            "metadata": metadata,
+            "flags": flags,
+        }
 
+    async def publish_samples(self, samples_list, input_token_counts, output_token_counts, gpu_time, metadata, flags):
+        """Publishes the samples of a generated batch to the evaluator queue."""
         # Calculate total samples generated in this batch to properly distribute GPU time
         total_samples = sum(len(samples) for samples in samples_list)
         gpu_time_per_sample = gpu_time / total_samples if total_samples > 0 else 0.0
@@ -397,13 +824,8 @@ class Sampler:
                     "output_tokens":      output_token_counts[prompt_idx][sample_idx],
                     "parent_ids":         meta.get("parent_ids", []),  # Pass parent IDs for lineage tracking
                 }
-                serialized_message = json.dumps(message_data)
-
                 try:
-                    await self.channel.default_exchange.publish(
-                        aio_pika.Message(body=serialized_message.encode()),
-                        routing_key="evaluator_queue",
-                    )
+                    await self.publisher.publish(self.codec.message(message_data), routing_key="evaluator_queue")
                     logger.debug("Published sample to evaluator_queue.")
                 except Exception as e:
                     logger.error(f"Error publishing sample: {e}")
@@ -412,6 +834,7 @@ class Sampler:
         """Release LLM resources and GPU memory."""
         import gc
         try:
+            self.inference_executor.shutdown(wait=True)
             if hasattr(self, '_llm'):
                 self._llm.cleanup()
                 del self._llm
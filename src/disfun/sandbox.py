@@ -10,11 +10,21 @@ import cloudpickle
 import warnings
 import hashlib
 import psutil  
+import pickle
+import select
+import signal
+
+from disfun.container import container_main
 
 
 # Define the main container path
 CONTAINER_MAIN = (pathlib.Path(__file__).parent / "container" / "container_main.py").absolute()
 
+# Warm workers of the current process, keyed by (python executable, graph cache size). Sandbox objects are
+# pickled into every executor task, so the workers must live at module level to survive
+# between calls made by the same executor process.
+_warm_workers = {}
+
 def ensure_dir_exists(path: pathlib.Path) -> pathlib.Path:
     """Ensure the directory exists."""
     if not path.exists():
@@ -38,6 +48,11 @@ def cleanup_orphaned_sandbox_processes(logger=None):
 
                 # Check if this is a container_main.py process
                 if 'container_main.py' in ' '.join(cmdline):
+                    # Warm workers are long-lived by design; only kill them once their owner is gone
+                    if '--worker' in cmdline:
+                        ppid = proc.ppid()
+                        if ppid > 1 and psutil.pid_exists(ppid):
+                            continue
                     # Check if it's been running for more than 5 minutes (likely orphaned)
                     uptime = time.time() - proc.info['create_time']
                     if uptime > 300:  # 5 minutes
@@ -189,7 +204,7 @@ class ExternalProcessSandbox(DummySandbox):
             - The function result,
             - A boolean indicating success,
             - CPU time measured in the sandbox,
-            - Path to the output directory,
+            - Path to the call's data directory (safe to delete once the result is read),
             - Path to the input file,
             - Path to the error file.
         """
@@ -214,13 +229,149 @@ class ExternalProcessSandbox(DummySandbox):
 
             retcode = self._exec(call_data_folder, input_file, error_file)
             if not retcode:
-                return None, False, 0.0, self.output_path, input_file, error_file
+                return None, False, 0.0, call_data_folder, input_file, error_file
 
             output_file = call_data_folder / f"output.pickle"
             with open(output_file, "rb") as f:
                 result_data = cloudpickle.load(f)
                 result = result_data.get("result", None)
                 cpu_time = result_data.get("cpu_time", 0.0)
-                return result, True, cpu_time, self.output_path, input_file, error_file
+                return result, True, cpu_time, call_data_folder, input_file, error_file
         except Exception as e:
-            return None, False, 0.0, self.output_path, input_file, error_file
+            return None, False, 0.0, call_data_folder, input_file, error_file
+
+
+def _kill_process_group(process: subprocess.Popen):
+    """Kills `process` together with every process it spawned in its session."""
+    try:
+        os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass  # Process already dead
+    try:
+        process.kill()  # Fallback
+        process.wait(timeout=1)
+    except Exception:
+        pass
+
+
+class _WarmWorker:
+    """A long-lived `container_main.py --worker` process in its own process group.
+
+    Requests and responses are length-prefixed pickles exchanged over a dedicated pair of pipes,
+    so output printed by the evaluated code cannot corrupt the protocol.
+    """
+    def __init__(self, python_path: str, graph_cache_mb: int = 0):
+        request_r, self.request_w = os.pipe()
+        self.response_r, response_w = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                [python_path, str(CONTAINER_MAIN), "--worker", str(request_r), str(response_w), str(graph_cache_mb)],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                cwd=os.getcwd(),
+                pass_fds=(request_r, response_w),
+                start_new_session=True  # Creates new process group
+            )
+        finally:
+            os.close(request_r)
+            os.close(response_w)
+        self.calls = 0
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def call(self, request: bytes, timeout_secs: float):
+        """Sends one request and waits for its response.
+
+        Returns the unpickled response, or None if the worker timed out or died. In both cases the
+        worker is unusable afterwards and must be closed.
+        """
+        self.calls += 1
+        try:
+            container_main.write_frame(self.request_w, request)
+            readable, _, _ = select.select([self.response_r], [], [], timeout_secs)
+            if not readable:
+                return None
+            response = container_main.read_frame(self.response_r)
+        except OSError:
+            return None  # Broken pipe: the worker crashed
+        if response is None:
+            return None
+        return pickle.loads(response)
+
+    def close(self):
+        _kill_process_group(self.process)
+        for fd in (self.request_w, self.response_r):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class WarmProcessSandbox(ExternalProcessSandbox):
+    """Sandbox that executes the code in a persistent, pre-imported Python worker process.
+
+    Keeps the isolation of `ExternalProcessSandbox` (separate interpreter, own process group,
+    per-call timeout) but reuses the interpreter between calls, so a call does not pay for
+    interpreter startup and imports of numpy/networkx/lmdb. A worker is killed together with its
+    process group on timeout, replaced after a crash, and recycled after `max_calls_per_worker`
+    calls to bound state leaking from evaluated code.
+
+    With `graph_cache_mb` > 0 each worker keeps up to that many MB of decoded graphs
+    (see `container/graph_cache.py`), so `load_graph` decodes a graph once per worker.
+    """
+    def __init__(self, base_path: pathlib.Path, timeout_secs: int = 30, python_path: str = "python", local_id=None,
+                 max_calls_per_worker: int = 100, graph_cache_mb: int = 0):
+        super(WarmProcessSandbox, self).__init__(base_path, timeout_secs, python_path, local_id)
+        self.max_calls_per_worker = max(1, max_calls_per_worker)
+        self.graph_cache_mb = max(0, graph_cache_mb)
+
+    def _get_worker(self) -> _WarmWorker:
+        key = (self.python_path, self.graph_cache_mb)
+        worker = _warm_workers.get(key)
+        if worker is not None and (not worker.alive() or worker.calls >= self.max_calls_per_worker):
+            worker.close()
+            worker = None
+        if worker is None:
+            worker = _warm_workers[key] = _WarmWorker(self.python_path, self.graph_cache_mb)
+        return worker
+
+    def run(
+        self,
+        program: str,
+        function_to_run: str,
+        test_input,
+        timeout_seconds: int,
+        count: int,
+    ) -> tuple[Any, bool, pathlib.Path, pathlib.Path, pathlib.Path, pathlib.Path]:
+        """
+        Executes the function in a warm worker.
+        Returns the same tuple as `ExternalProcessSandbox.run`. Programs and inputs are sent over
+        the pipe, so no call directory or input file is written and both paths are None.
+        """
+        error_file = self.output_path / f"stderr_{count}.log"
+        try:
+            namespace = DummySandbox.compile_code(program)
+            request = pickle.dumps({
+                "prog": cloudpickle.dumps(namespace[function_to_run]),
+                "input": cloudpickle.dumps(test_input),
+                "error_file": str(error_file.absolute()),
+            })
+        except Exception:
+            return None, False, 0.0, None, None, error_file
+
+        worker = self._get_worker()
+        try:
+            response = worker.call(request, self.timeout_secs)
+        except Exception:
+            response = None
+        if response is None:
+            # Timed out or crashed: kill the whole process group and start fresh next call
+            worker.close()
+            _warm_workers.pop((self.python_path, self.graph_cache_mb), None)
+            return None, False, 0.0, None, None, error_file
+
+        if not response.get("ok"):
+            return None, False, 0.0, None, None, error_file
+        return response.get("result"), True, response.get("cpu_time", 0.0), None, None, error_file
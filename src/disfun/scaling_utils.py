@@ -216,8 +216,12 @@ class ResourceManager:
                                sampler_processes=None, sampler_entry_function=None, evaluator_entry_function=None,
                                config_path=None, log_dir=None, template=None, inputs=None, target_signatures=None,
                                sandbox_base_path=None, max_evaluators=10000, min_evaluators=1,
-                               max_samplers=1000, min_samplers=1, check_interval=120, log_filename=None):
-        """Scales evaluator and sampler processes dynamically based on queue sizes and system resources."""
+                               max_samplers=1000, min_samplers=1, check_interval=120, log_filename=None,
+                               transport=None):
+        """
+        Scales evaluator and sampler processes dynamically based on queue sizes and system resources.
+        `transport` (a LocalTransport, or None for RabbitMQ) is passed to the started processes.
+        """
         self.resource_logger.info("Starting scaling loop")
         evaluator_processes = evaluator_processes or []
         sampler_processes = sampler_processes or []
@@ -236,7 +240,7 @@ class ResourceManager:
                         evaluator_threshold = self.scaling_config.evaluator_scale_up_threshold if self.scaling_config else 10
                         if evaluator_message_count > evaluator_threshold and len(evaluator_processes) < max_evaluators and can_scale_eval:
                             self.resource_logger.info(f"Can scale evaluators with messages in queue {evaluator_message_count}")
-                            self.start_evaluator_process(evaluator_entry_function, config_path, template, inputs, target_signatures, log_dir, sandbox_base_path, evaluator_processes, "Evaluator", log_filename)
+                            self.start_evaluator_process(evaluator_entry_function, config_path, template, inputs, target_signatures, log_dir, sandbox_base_path, evaluator_processes, "Evaluator", log_filename, transport=transport)
                             evaluator_scaled = True
                         elif evaluator_message_count == 0 and len(evaluator_processes) > min_evaluators:
                             self.resource_logger.info(f"Zero messages in the queue and not last Evaluator, terminating ...")
@@ -253,7 +257,7 @@ class ResourceManager:
                         sampler_threshold = self.scaling_config.sampler_scale_up_threshold if self.scaling_config else 50
                         if sampler_message_count > sampler_threshold and len(sampler_processes) < max_samplers and assignment and await self.has_enough_system_memory():
                             self.resource_logger.info(f"Can scale samplers with messages in queue  {sampler_message_count}")
-                            started = self.start_sampler_process(sampler_entry_function, config_path, log_dir, sampler_processes, "Sampler", assignment=assignment, log_filename=log_filename)
+                            started = self.start_sampler_process(sampler_entry_function, config_path, log_dir, sampler_processes, "Sampler", assignment=assignment, log_filename=log_filename, transport=transport)
                             if not started:
                                 self.resource_logger.info("No available GPU found. Skipping sampler scale-up.")
                             sampler_scaled = True
@@ -275,7 +279,7 @@ class ResourceManager:
             self.resource_logger.info("Scaling loop cancelled, stopping gracefully...")
             raise  # Re-raise to properly propagate cancellation
 
-    def start_evaluator_process(self, entry_function, config_path, template, inputs, target_signatures, log_dir, sandbox_base_path, processes, process_name, log_filename):
+    def start_evaluator_process(self, entry_function, config_path, template, inputs, target_signatures, log_dir, sandbox_base_path, processes, process_name, log_filename, transport=None):
         """Starts a new evaluator process using 'fork' multiprocessing context.
 
         Uses fork because evaluators don't load ML models and only execute functions
@@ -285,6 +289,7 @@ class ResourceManager:
         proc = ctx.Process(
             target=entry_function,
             args=(config_path, template, inputs, target_signatures, log_dir, sandbox_base_path, log_filename),
+            kwargs={"transport": transport},
             name=f"{process_name}-{len(processes)}"
         )
         proc.start()
@@ -359,7 +364,7 @@ class ResourceManager:
         return (avg_cpu_usage < cpu_usage_threshold) and (normalized_load < normalized_load_threshold)
 
 
-    def start_sampler_process(self, entry_function, config_path, log_dir, processes, process_name, assignment, log_filename=None):
+    def start_sampler_process(self, entry_function, config_path, log_dir, processes, process_name, assignment, log_filename=None, transport=None):
         """Starts a new sampler process using 'spawn' multiprocessing context.
 
         Uses spawn to avoid fork+threading deadlocks when loading ML models (StarCoder2/GPT).
@@ -370,6 +375,7 @@ class ResourceManager:
             proc = ctx.Process(
                 target=entry_function,
                 args=(config_path, None, log_dir, log_filename),  # No GPU device
+                kwargs={"transport": transport},
                 name=f"{process_name}-{len(processes)}"
             )
             proc.start()
@@ -383,6 +389,7 @@ class ResourceManager:
             proc = ctx.Process(
                 target=entry_function,
                 args=(config_path, container_device, log_dir, log_filename),
+                kwargs={"transport": transport},
                 name=f"{process_name}-{len(processes)}"
             )
             proc.start()
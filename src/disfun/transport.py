@@ -0,0 +1,263 @@
+"""Message transports between the ProgramsDatabase, samplers and evaluators.
+
+The components talk to their queues through the part of the aio_pika API they use (a connection
+with `channel()`, `channel.declare_queue`, `channel.set_qos`, `channel.default_exchange.publish`,
+`queue.iterator()` and `message.process()`). A transport hands out such connections:
+
+* `AMQPTransport`: RabbitMQ through aio_pika, as before (`transport="amqp"`, the default). Needed
+  when samplers or evaluators run on other nodes (attach_samplers.py, attach_evaluators.py).
+* `LocalTransport`: for single-node runs without a broker (`transport="local"`). Each queue is a
+  `multiprocessing.Queue` created by the main process and passed to the sampler and evaluator
+  processes it starts, so a message crosses one pipe instead of two network hops through RabbitMQ.
+
+Both implement `connect()` and `declare_queue(channel, name)`. `LocalTransport` keeps the
+semantics the components rely on: every consumer gets at most `prefetch_count` unacknowledged
+messages, `declaration_result` reports the depth and consumers of a queue (for dynamic scaling),
+and messages fetched by a consumer that stops before handing them out are put back. There are no
+redeliveries: a message is gone once it is handed out, as with auto-ack. `local_broker.LocalBroker`
+implements the same interface within one event loop (benchmarks).
+"""
+
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import queue as queue_module
+import threading
+from types import SimpleNamespace
+
+from disfun import database_shards, process_utils
+
+logger = logging.getLogger('main_logger')
+
+QUEUE_NAMES = ("database_queue", "sampler_queue", "evaluator_queue")
+
+
+class AMQPTransport:
+    """RabbitMQ connections built from the `rabbitmq` section of the config."""
+
+    is_local = False
+
+    def __init__(self, config):
+        self.config = config
+
+    async def connect(self, timeout=300):
+        return await process_utils.create_rabbitmq_connection(self.config, timeout=timeout)
+
+    async def declare_queue(self, channel, queue_name: str):
+        return await process_utils.declare_standard_queue(channel, queue_name)
+
+
+class LocalTransport:
+    """
+    Queues shared by the processes of one node. Create it in the main process before starting the
+    samplers and evaluators and pass it to them as a `Process` argument.
+    """
+
+    is_local = True
+
+    def __init__(self, queue_names=QUEUE_NAMES, poll_interval: float = 0.1):
+        ctx = multiprocessing.get_context('spawn')
+        self.poll_interval = poll_interval
+        self._queues = {name: ctx.Queue() for name in queue_names}
+        self._consumers = {name: ctx.Value('i', 0) for name in queue_names}
+
+    async def connect(self, timeout=300):
+        return LocalTransportConnection(self)
+
+    async def declare_queue(self, channel, queue_name: str):
+        return await channel.declare_queue(queue_name)
+
+    def _queue(self, name: str):
+        if name not in self._queues:
+            raise KeyError(f"LocalTransport has no queue '{name}' (queues: {', '.join(self._queues)})")
+        return self._queues[name], self._consumers[name]
+
+
+def create_transport(config):
+    """Transport selected by `config.transport` ("amqp" or "local")."""
+    name = getattr(config, 'transport', 'amqp')
+    if name == 'local':
+        logger.info("Using the local transport: queues are shared between processes, no RabbitMQ.")
+        # With num_pdb > 1 every database shard has its own queue, next to the coordinator queue
+        queue_names = ("sampler_queue", "evaluator_queue") + database_shards.database_queue_names(getattr(config, 'num_pdb', 1))
+        return LocalTransport(queue_names=queue_names)
+    if name != 'amqp':
+        logger.warning(f"Unknown transport '{name}', using 'amqp'.")
+    return AMQPTransport(config)
+
+
+class LocalTransportMessage:
+    """Message received from a `LocalTransport` queue (`aio_pika.IncomingMessage`)."""
+
+    def __init__(self, item, consumer: "_LocalTransportConsumer"):
+        self.body, self.content_type, self.content_encoding, headers = item
+        self.headers = headers or {}
+        self._consumer = consumer
+        self._settled = False
+
+    def ack(self):
+        if not self._settled:
+            self._settled = True
+            self._consumer.release()
+
+    @contextlib.asynccontextmanager
+    async def process(self):
+        """Acknowledges the message when the block exits."""
+        try:
+            yield self
+        finally:
+            self.ack()
+
+
+class _LocalTransportConsumer:
+    def __init__(self, mp_queue, prefetch_count: int, poll_interval: float):
+        self._mp_queue = mp_queue
+        self._poll_interval = poll_interval
+        self._slots = asyncio.Semaphore(prefetch_count) if prefetch_count else None
+        self._closed = threading.Event()
+
+    def release(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    def _get(self):
+        """Runs on an executor thread; returns the next item, or None once the consumer is closed."""
+        while not self._closed.is_set():
+            try:
+                item = self._mp_queue.get(timeout=self._poll_interval)
+            except queue_module.Empty:
+                continue
+            if self._closed.is_set():
+                self._mp_queue.put(item)
+                return None
+            return item
+        return None
+
+    def _requeue(self, future):
+        if not future.cancelled() and future.exception() is None and future.result() is not None:
+            self._mp_queue.put(future.result())
+
+    def close(self):
+        self._closed.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> LocalTransportMessage:
+        if self._slots is not None:
+            await self._slots.acquire()
+        if self._closed.is_set():
+            self.release()
+            raise StopAsyncIteration
+        try:
+            # Messages already waiting are taken without a round trip through the executor
+            return LocalTransportMessage(self._mp_queue.get_nowait(), self)
+        except queue_module.Empty:
+            pass
+        future = asyncio.get_running_loop().run_in_executor(None, self._get)
+        try:
+            item = await asyncio.shield(future)
+        except BaseException:
+            # The fetch keeps running on its thread; a message it still gets goes back to the queue
+            self._closed.set()
+            future.add_done_callback(self._requeue)
+            self.release()
+            raise
+        if item is None:
+            self.release()
+            raise StopAsyncIteration
+        return LocalTransportMessage(item, self)
+
+
+class LocalTransportQueue:
+    """Queue of a `LocalTransport` (`aio_pika.Queue`)."""
+
+    def __init__(self, name: str, channel: "LocalTransportChannel"):
+        self.name = name
+        self.channel = channel
+        self._mp_queue, self._consumers = channel._transport._queue(name)
+
+    @property
+    def declaration_result(self):
+        return SimpleNamespace(message_count=self._mp_queue.qsize(), consumer_count=self._consumers.value)
+
+    @contextlib.asynccontextmanager
+    async def iterator(self):
+        consumer = _LocalTransportConsumer(self._mp_queue, self.channel.prefetch_count,
+                                           self.channel._transport.poll_interval)
+        with self._consumers.get_lock():
+            self._consumers.value += 1
+        try:
+            yield consumer
+        finally:
+            consumer.close()
+            with self._consumers.get_lock():
+                self._consumers.value -= 1
+
+    async def purge(self):
+        purged = 0
+        while True:
+            try:
+                self._mp_queue.get_nowait()
+            except queue_module.Empty:
+                return purged
+            purged += 1
+
+    async def delete(self, if_unused=False, if_empty=False):
+        await self.purge()
+
+
+class _LocalTransportExchange:
+    def __init__(self, transport: LocalTransport):
+        self._transport = transport
+
+    async def publish(self, message, routing_key: str):
+        mp_queue, _ = self._transport._queue(routing_key)
+        mp_queue.put((bytes(message.body), getattr(message, "content_type", None),
+                      getattr(message, "content_encoding", None), dict(getattr(message, "headers", None) or {})))
+
+
+class LocalTransportChannel:
+    """Channel of a `LocalTransport` connection (`aio_pika.Channel`)."""
+
+    def __init__(self, transport: LocalTransport):
+        self._transport = transport
+        self.default_exchange = _LocalTransportExchange(transport)
+        self.prefetch_count = 0
+        self.is_closed = False
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    async def declare_queue(self, name: str, **kwargs) -> LocalTransportQueue:
+        return LocalTransportQueue(name, self)
+
+    async def close(self):
+        self.is_closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class LocalTransportConnection:
+    """Connection to a `LocalTransport` (`aio_pika.RobustConnection`)."""
+
+    def __init__(self, transport: LocalTransport):
+        self._transport = transport
+        self.is_closed = False
+
+    async def channel(self, **kwargs) -> LocalTransportChannel:
+        return LocalTransportChannel(self._transport)
+
+    async def close(self):
+        self.is_closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
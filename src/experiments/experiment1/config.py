@@ -34,12 +34,22 @@ class RabbitMQConfig:
       username: Username for authentication with the RabbitMQ server.
       password: Password for authentication with the RabbitMQ server.
       vhost: Virtual host for isolation between experiments. Use '' for default vhost.
+      message_codec: Encoding of published messages, 'json' or 'msgpack' (requires msgpack). Messages of any format are decoded.
+      message_compression: Compression of published messages, None, 'zstd' (requires zstandard) or 'zlib'.
+      compression_min_bytes: Messages smaller than this many bytes are not compressed.
+      publish_batch_size: Samples, results and prompts are published in batches of up to this many messages (1 publishes each message immediately).
+      publish_max_delay: Seconds a buffered message waits for its batch to fill before it is published.
     """
     host: str = 'rabbitmq' #localhost or rabbitmq for docker or node IP address
     port: int = 5672
     username: str = 'guest'
     password: str = 'guest'
     vhost: str = 'experiment1'  # Use '' for default vhost, or 'exp1', 'exp2', etc. for isolated experiments 
+    message_codec: str = 'json'  # Switch only once all workers decode the new format
+    message_compression: str = None
+    compression_min_bytes: int = 512
+    publish_batch_size: int = 100
+    publish_max_delay: float = 0.02
     
 
 @dataclasses.dataclass(frozen=True)
@@ -56,6 +66,10 @@ class ProgramsDatabaseConfig:
     prompts_per_batch: Batch size for processing prompts received from the database_queue
     no_deduplication: Disable deduplication (default: False, set True to disable).
     save_lineage: Save evolutionary lineage HTML files and track lineage metrics (default: False).
+    shard_report_interval: Seconds between the island reports of each database shard to the coordinator when num_pdb > 1 (default: 5.0).
+    prompt_cache_size: Number of rendered prompts kept, keyed by the ids of the programs they show, so that repeated combinations are not rendered again; 0 disables the cache (default: 10000).
+    checkpoint_interval: Seconds between appends of the registered programs and island resets to the checkpoint log (default: 10.0).
+    snapshot_interval: Seconds between full checkpoint snapshots, each starting a new checkpoint log (default: 3600).
   """
   functions_per_prompt: int = 2
   num_islands: int = 10
@@ -66,6 +80,10 @@ class ProgramsDatabaseConfig:
   prompts_per_batch= 10
   no_deduplication: bool = False
   save_lineage: bool = False
+  shard_report_interval: float = 5.0
+  prompt_cache_size: int = 10_000
+  checkpoint_interval: float = 10.0
+  snapshot_interval: float = 3600
 
 
 @dataclasses.dataclass(frozen=True)
@@ -81,6 +99,20 @@ class SamplerConfig:
     top_p: Determines the range of likely tokens the model samples from, keeping only the most probable ones.
     repetition_penalty: Penalizes repetitive text; values >1 discourage repetition, while 1 disables it.
     gpt: Enable GPT mode (default: False). When enabled, GPU device assignment is disabled.
+    batched_generation: Draw all samples_per_prompt samples of a batch in one generate call that encodes each prompt once, instead of one call per sample (default: True).
+    inference_queue_size: Number of tokenized batches that wait for the inference thread while the current batch generates (default: 1).
+    generation_engine: "static" generates fixed batches of prompts, "continuous" admits prompts into a running batch as sequences finish (default: "static").
+    max_active_sequences: Maximum number of sequences decoded together by the continuous engine (default: 20).
+    prefix_caching: Compute the KV cache of the prompt preface shared by all prompts once and reuse it across batches (default: True).
+    stop_at_function_end: End each sample once the body of the evolved function is complete, since the evaluator discards the rest (default: True).
+    gpt_max_concurrent_requests: Number of Azure OpenAI requests a GPT sampler keeps in flight (default: 8).
+    gpt_requests_per_minute: Requests-per-minute quota of the deployment, enforced client-side per sampler. If None, not limited (default: None).
+    gpt_tokens_per_minute: Tokens-per-minute quota of the deployment, enforced client-side per sampler. If None, not limited (default: None).
+    gpt_max_retries: Retries of a request rejected with 429, with exponential backoff (default: 6).
+    llm_backend: "default" for the local model (or Azure OpenAI with gpt), "mock" for a deterministic mock that replays or mutates the function bodies of the prompt without a GPU (default: "default").
+    mock_latency: Seconds the mock backend takes per batch, or per prompt in GPT mode (default: 0.5).
+    mock_mutation_rate: Fraction of mock samples with one constant or operator changed instead of replayed unchanged (default: 0.5).
+    mock_seed: Seed of the mock backend (default: 0).
   """
   prompts_per_batch= 10
   samples_per_prompt: int = 2
@@ -90,6 +122,20 @@ class SamplerConfig:
   top_p: float =  0.7777777777777778 
   repetition_penalty: float = 1.222222
   gpt: bool = False   
+  batched_generation: bool = True
+  inference_queue_size: int = 1
+  generation_engine: str = "static"
+  max_active_sequences: int = 20
+  prefix_caching: bool = True
+  stop_at_function_end: bool = True
+  gpt_max_concurrent_requests: int = 8
+  gpt_requests_per_minute: int = None
+  gpt_tokens_per_minute: int = None
+  gpt_max_retries: int = 6
+  llm_backend: str = "default"
+  mock_latency: float = 0.5
+  mock_mutation_rate: float = 0.5
+  mock_seed: int = 0
   
 def get_spec_path() -> str:
     """
@@ -102,6 +148,7 @@ def get_spec_path() -> str:
        - For GPT:        "Deletions/gpt/load_graph/baseline.txt"
        - Constructs on-the-fly: Use "construct_graph" instead of "load_graph"
        - Graph files: graph_s{s}_n{n}.lmdb
+       - CSR graphs (StarCoder2): "Deletions/StarCoder2/load_graph_csr/baseline.txt", graph files graph_d_s{s}_n{n}_q{q}.csr
 
     2. IDS codes (sequences that can survive insertions/deletions/substitutions):
        - For StarCoder2: "IDS/StarCoder2/load_graph/baseline.txt"
@@ -143,6 +190,14 @@ class EvaluatorConfig:
         mode: Mode for score reduction. Available options: 'last', 'average', 'weighted'.
         timeout: Timeout in seconds for the sandbox.
         max_workers: Number of parallel CPU processes per evaluator for evaluating functions on different inputs (default: 2).
+        max_samples_in_flight: Number of LLM samples an evaluator evaluates concurrently (default: 2).
+                               Keeps the `max_workers` processes busy while earlier samples are still finishing.
+        sandbox_mode: How test inputs are executed (default: "subprocess").
+                      - "subprocess": a fresh Python interpreter per test input.
+                      - "warm": persistent pre-imported worker interpreters, one per `max_workers` process.
+        warm_worker_max_calls: Calls after which a warm worker is replaced by a fresh one (default: 100).
+        graph_cache_mb: Memory budget in MB of decoded graphs each warm worker keeps between calls,
+                        least recently used graphs are evicted first (default: 512, 0 disables). Only used with sandbox_mode="warm".
         eval_code: Include evaluation script in prompt. (default: False, set True to enable).
         include_nx: Include the nx package in the prompt (default: True, set False to disable).
         spec_path: Path to the specification file used in the experiment.
@@ -155,6 +210,10 @@ class EvaluatorConfig:
     mode: str = "last"
     timeout: int = 90
     max_workers: int = 2
+    max_samples_in_flight: int = 2
+    sandbox_mode: str = "subprocess"
+    warm_worker_max_calls: int = 100
+    graph_cache_mb: int = 512
     eval_code: bool = False
     include_nx: bool = True
     spec_path: str = dataclasses.field(default_factory=get_spec_path)
@@ -303,7 +362,8 @@ class Config:
     termination: Configuration for experiment termination conditions.
     num_samplers: Number of independent Samplers in the experiment.
     num_evaluators: Number of independent program Evaluators in the experiment.
-    num_pdb: Number of independent program databases. Currently supports only one, but this does not create a bottleneck.
+    num_pdb: Number of database shards the islands are partitioned across (shard 0 in the main process, the others in their own processes). Island resets and the global best score are handled by a coordinator in the main process.
+    transport: 'amqp' to exchange messages through RabbitMQ, 'local' for single-node runs without a broker (multiprocessing queues).
   """
   programs_database: ProgramsDatabaseConfig = dataclasses.field(default_factory=ProgramsDatabaseConfig)
   rabbitmq: RabbitMQConfig = dataclasses.field(default_factory=RabbitMQConfig)
@@ -317,6 +377,7 @@ class Config:
   num_samplers: int = 1
   num_evaluators: int = 1
   num_pdb: int = 1
+  transport: str = 'amqp'
 
 
 